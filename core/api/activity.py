@@ -0,0 +1,66 @@
+"""
+Daily writing-activity rollups.
+
+Every content save adds its word changes to the WritingActivity row of
+(owner, document, day). Active time grows by the gap since the previous
+save when that gap is shorter than ACTIVITY_IDLE_GAP seconds; a save after
+a longer pause counts as ACTIVITY_SAVE_CREDIT seconds of writing.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import WritingActivity
+from .textstats import patched_word_changes, word_changes
+
+TOTAL_FIELDS = ('words_added', 'words_removed', 'saves', 'active_seconds')
+
+
+def active_seconds(previous_save, now):
+    gap = (now - previous_save).total_seconds()
+    if 0 <= gap <= getattr(settings, 'ACTIVITY_IDLE_GAP', 300):
+        return int(gap)
+    return getattr(settings, 'ACTIVITY_SAVE_CREDIT', 60)
+
+
+def record_activity(document, old_content, new_content, now=None, edits=None):
+    """Add one save of `document` to today's rollup; `edits` skips the full-text comparison."""
+    if edits is not None:
+        added, removed = patched_word_changes(old_content, edits)
+    else:
+        added, removed = word_changes(old_content, new_content)
+    now = now or timezone.now()
+    with transaction.atomic():
+        row, created = WritingActivity.objects.select_for_update().get_or_create(
+            user_id=document.project.owner_id,
+            document=document,
+            day=timezone.localdate(now),
+            defaults={
+                'words_added': added,
+                'words_removed': removed,
+                'saves': 1,
+                'active_seconds': getattr(settings, 'ACTIVITY_SAVE_CREDIT', 60),
+                'last_saved_at': now,
+            },
+        )
+        if not created:
+            WritingActivity.objects.filter(pk=row.pk).update(
+                words_added=F('words_added') + added,
+                words_removed=F('words_removed') + removed,
+                saves=F('saves') + 1,
+                active_seconds=F('active_seconds') + active_seconds(row.last_saved_at, now),
+                last_saved_at=now,
+            )
+
+
+def timeline(user, date_from, date_to, document_id=None):
+    """Per-day totals for `user` between two dates, both inclusive."""
+    rows = WritingActivity.objects.filter(user=user, day__gte=date_from, day__lte=date_to)
+    if document_id is not None:
+        rows = rows.filter(document_id=document_id)
+    return list(
+        rows.values('day')
+        .annotate(**{field: Sum(field) for field in TOTAL_FIELDS})
+        .order_by('day')
+    )
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Project, Document, History
+from .models import User, Project, Document, History, WritingActivity
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
@@ -39,4 +39,10 @@ class HistoryAdmin(admin.ModelAdmin):
     list_display = ('document', 'timestamp')
     list_filter = ('timestamp',)
     search_fields = ('document__project__title', 'content_snapshot')
-    raw_id_fields = ('document',)
\ No newline at end of file
+    raw_id_fields = ('document',)
+
+@admin.register(WritingActivity)
+class WritingActivityAdmin(admin.ModelAdmin):
+    list_display = ('user', 'document', 'day', 'words_added', 'words_removed', 'saves')
+    list_filter = ('day',)
+    raw_id_fields = ('user', 'document')
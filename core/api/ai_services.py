@@ -1,31 +1,266 @@
-from django.urls import path, include
-from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from . import views
-
-router = DefaultRouter()
-router.register(r'projects', views.ProjectViewSet, basename='project')
-router.register(r'documents', views.DocumentViewSet, basename='document')
-
-urlpatterns = [
-    # Auth
-    path('auth/register/', views.RegisterView.as_view(), name='register'),
-    path('auth/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-    
-    # User
-    path('user/profile/', views.UserProfileView.as_view(), name='user-profile'),
-    path('analytics/', views.AnalyticsView.as_view(), name='analytics'),
-    
-    # AI Endpoints
-    path('ai/summarize/', views.AISummarizeView.as_view(), name='ai-summarize'),
-    path('ai/rewrite/', views.AIRewriteView.as_view(), name='ai-rewrite'),
-    path('ai/ideas/', views.AIIdeasView.as_view(), name='ai-ideas'),
-    
-    # History
-    path('documents/<int:document_id>/history/', views.HistoryViewSet.as_view({'get': 'list'}), name='document-history'),
-    path('documents/<int:document_id>/history/recent/', views.HistoryViewSet.as_view({'get': 'recent'}), name='recent-history'),
-    
-    # Include router URLs
-    path('', include(router.urls)),
-]
\ No newline at end of file
+"""
+AI writing assistance: summaries, rewrites and ideas for document text.
+
+Views call summarize(), rewrite() and ideas(), which go through one
+AIService built from settings:
+
+- The provider is the class named by AI_PROVIDER, constructed with
+  AI_PROVIDER_OPTIONS. A provider implements run_batch(operation,
+  contents, params) and returns one result per content, so a remote
+  model can take a whole batch in one call. LocalProvider is a
+  deterministic stand-in that needs no network, used by default and in
+  tests.
+- Results are cached in-process by (provider, operation, SHA-256 of the
+  content, params), up to AI_CACHE_SIZE entries for AI_CACHE_TTL seconds.
+- Cache misses that arrive within AI_BATCH_WINDOW seconds of each other
+  with the same operation and params are sent to the provider as one
+  batch of up to AI_BATCH_SIZE distinct contents. The first request of a
+  batch makes the call and the others wait for its results.
+- At most AI_MAX_CONCURRENCY provider calls run at once, and at most
+  AI_MAX_PENDING requests wait for a result. A request beyond that, or one
+  whose batch waits longer than AI_QUEUE_TIMEOUT for a call slot, fails
+  with AIUnavailable right away, instead of holding a worker that the
+  rest of the API needs.
+"""
+import hashlib
+import json
+import re
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import summarizer
+from .caching import TTLCache
+
+OPERATIONS = ('summarize', 'rewrite', 'ideas')
+REWRITE_STYLES = ('concise', 'formal', 'casual')
+
+
+class AIError(Exception):
+    pass
+
+
+class AIUnavailable(AIError):
+    """Too many AI requests are in flight; the client should retry later."""
+
+
+class AIProvider:
+    """Interface of AI backends."""
+
+    name = 'provider'
+
+    def run_batch(self, operation, contents, params):
+        """Return one result per item of `contents`, all with the same `params`."""
+        raise NotImplementedError
+
+
+_FILLER_RE = re.compile(
+    r'\s*\b(?:very|really|just|actually|basically|quite|simply|literally|totally|definitely)\b(?=\s)',
+    re.IGNORECASE,
+)
+_CONTRACTIONS = [
+    ("can't", 'cannot'), ("won't", 'will not'), ("shan't", 'shall not'), ("i'm", 'I am'), ("it's", 'it is'),
+    ("that's", 'that is'), ("let's", 'let us'),
+]
+_CONTRACTED_ENDINGS = [("n't", ' not'), ("'re", ' are'), ("'ve", ' have'), ("'ll", ' will'), ("'d", ' would')]
+_EXPANSIONS = [
+    ('cannot', "can't"), ('will not', "won't"), ('do not', "don't"), ('does not', "doesn't"),
+    ('did not', "didn't"), ('is not', "isn't"), ('are not', "aren't"), ('I am', "I'm"), ('it is', "it's"),
+    ('that is', "that's"), ('we are', "we're"), ('they are', "they're"), ('you are', "you're"),
+]
+_IDEA_TEMPLATES = (
+    'Expand on {0}.',
+    'Add a concrete example of {0}.',
+    'Explain why {0} matters to the reader.',
+    'Compare {0} with {1}.',
+    'Open with a question about {0}.',
+    'Summarise what is known about {0} so far.',
+)
+
+
+def keywords(text):
+    """Content words of `text`, most frequent first (ties alphabetically)."""
+    counts = Counter(summarizer.words(text or ''))
+    return [word for word, _ in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+
+
+def _replace_phrases(text, pairs, endings=False):
+    """Replace whole words (or, with `endings`, word endings), keeping an initial capital."""
+    for old, new in pairs:
+        start = r'(?<=\w)' if endings else r"(?<![\w'])"
+        pattern = re.compile(rf"{start}{re.escape(old)}(?![\w'])", re.IGNORECASE)
+
+        def keep_case(match, new=new):
+            found = match.group()
+            return new[0].upper() + new[1:] if found[0].isupper() and new[0].isalpha() else new
+        text = pattern.sub(keep_case, text)
+    return text
+
+
+class LocalProvider(AIProvider):
+    """
+    Deterministic provider that runs in-process: TextRank summaries (see
+    summarizer.py), rule-based rewrites and keyword-based ideas. The same
+    input always gives the same output.
+    """
+
+    name = 'local'
+
+    def run_batch(self, operation, contents, params):
+        method = getattr(self, operation)
+        return [method(content, **params) for content in contents]
+
+    def summarize(self, content, max_sentences=3):
+        return summarizer.summarize(content, max_sentences)
+
+    def rewrite(self, content, style='concise'):
+        if style == 'formal':
+            return _replace_phrases(_replace_phrases(content, _CONTRACTIONS), _CONTRACTED_ENDINGS, endings=True)
+        if style == 'casual':
+            return _replace_phrases(content, _EXPANSIONS)
+        return re.sub(r'[ \t]{2,}', ' ', _FILLER_RE.sub('', content))
+
+    def ideas(self, content, count=5):
+        words = keywords(content) or ['the topic']
+        result = []
+        for index in range(count):
+            template = _IDEA_TEMPLATES[index % len(_IDEA_TEMPLATES)]
+            first = words[index % len(words)]
+            second = words[(index + 1) % len(words)] if len(words) > 1 else 'a related idea'
+            result.append(template.format(first, second))
+        return result
+
+
+class _Batch:
+    def __init__(self):
+        self.contents = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Groups concurrent calls with the same key into one call of
+    `run(key, contents)`, waiting at most `window` seconds for a batch to
+    fill up to `max_size` distinct contents.
+    """
+
+    def __init__(self, run, max_size, window):
+        self.run = run
+        self.max_size = max_size
+        self.window = window
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, content):
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch()
+            if content not in batch.contents:
+                batch.contents.append(content)
+            index = batch.contents.index(content)
+            if len(batch.contents) >= self.max_size:
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+            try:
+                batch.results = self.run(key, batch.contents)
+            except Exception as exc:
+                batch.error = exc
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+
+class AIService:
+    def __init__(self, provider, cache_size=1024, cache_ttl=3600, batch_size=16, batch_window=0.01,
+                 max_concurrency=2, max_pending=32, queue_timeout=5.0):
+        self.provider = provider
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.batcher = MicroBatcher(self._call, batch_size, batch_window)
+        self.calls = threading.BoundedSemaphore(max_concurrency)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.queue_timeout = queue_timeout
+
+    def run(self, operation, content, **params):
+        if operation not in OPERATIONS:
+            raise AIError(f'Unknown AI operation: {operation}')
+        frozen = json.dumps(params, sort_keys=True)
+        key = (self.provider.name, operation, hashlib.sha256(content.encode()).hexdigest(), frozen)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        if not self.pending.acquire(blocking=False):
+            raise AIUnavailable('Too many AI requests are in progress.')
+        try:
+            result = self.batcher.submit((operation, frozen), content)
+        finally:
+            self.pending.release()
+        self.cache.set(key, result)
+        return result
+
+    def _call(self, key, contents):
+        operation, frozen = key
+        if not self.calls.acquire(timeout=self.queue_timeout):
+            raise AIUnavailable('The AI provider is busy.')
+        try:
+            results = self.provider.run_batch(operation, contents, json.loads(frozen))
+        finally:
+            self.calls.release()
+        if len(results) != len(contents):
+            raise AIError(f'{self.provider.name} returned {len(results)} results for {len(contents)} inputs.')
+        return results
+
+
+_service = None
+_service_key = None
+_service_lock = threading.Lock()
+
+_SERVICE_SETTINGS = {
+    'cache_size': 'AI_CACHE_SIZE',
+    'cache_ttl': 'AI_CACHE_TTL',
+    'batch_size': 'AI_BATCH_SIZE',
+    'batch_window': 'AI_BATCH_WINDOW',
+    'max_concurrency': 'AI_MAX_CONCURRENCY',
+    'max_pending': 'AI_MAX_PENDING',
+    'queue_timeout': 'AI_QUEUE_TIMEOUT',
+}
+
+
+def get_service():
+    """The AIService for the current settings, built once per process (and again if they change)."""
+    global _service, _service_key
+    options = {name: getattr(settings, setting) for name, setting in _SERVICE_SETTINGS.items()}
+    key = (settings.AI_PROVIDER, json.dumps(settings.AI_PROVIDER_OPTIONS, sort_keys=True), *options.values())
+    with _service_lock:
+        if _service is None or _service_key != key:
+            provider = import_string(settings.AI_PROVIDER)(**settings.AI_PROVIDER_OPTIONS)
+            _service, _service_key = AIService(provider, **options), key
+        return _service
+
+
+def summarize(content, max_sentences=3):
+    return get_service().run('summarize', content, max_sentences=max_sentences)
+
+
+def rewrite(content, style='concise'):
+    return get_service().run('rewrite', content, style=style)
+
+
+def ideas(content, count=5):
+    return get_service().run('ideas', content, count=count)
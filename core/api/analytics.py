@@ -0,0 +1,115 @@
+"""
+Per-user dashboard analytics.
+
+Totals come from one aggregate query over the stored document counts, so
+no document text is loaded. The full payload is cached per user under a
+key that includes a per-user version number; writes to the user's
+projects, documents or history bump the version (see signals.py), which
+makes every older entry unreachable without having to find and delete it.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+
+from .models import AttachmentText, History, Project
+
+
+def _version_key(user_id):
+    return f'analytics:version:{user_id}'
+
+
+def cache_version(user_id):
+    # A fresh version starts from the clock rather than 1, so a version key
+    # evicted from the cache can never bring an old entry back to life.
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(user_id):
+    """Drop the cached analytics of a user once the current transaction commits."""
+    def bump():
+        try:
+            cache.incr(_version_key(user_id))
+        except ValueError:
+            cache.add(_version_key(user_id), time.time_ns(), None)
+    transaction.on_commit(bump)
+
+
+def invalidate_document(document):
+    # Loads the project at most once per document instance.
+    invalidate(document.project.owner_id)
+
+
+def invalidate_document_id(document_id):
+    owner_id = Project.objects.filter(document__id=document_id).values_list('owner_id', flat=True).first()
+    if owner_id is not None:
+        invalidate(owner_id)
+
+
+def totals(user):
+    """All dashboard counters for `user` in a single query."""
+    # Counted per document through the (document, timestamp) index; joining
+    # history into the outer query would multiply the word sums.
+    history = (
+        History.objects.filter(document__project=OuterRef('pk'))
+        .order_by().values('document').annotate(total=Count('id')).values('total')
+    )
+    # Likewise for the text extracted from attachments.
+    attachments = AttachmentText.objects.filter(document_file__document__project=OuterRef('pk')).order_by().values(
+        'document_file__document'
+    )
+    totals = Project.objects.filter(owner=user).aggregate(
+        total_projects=Count('id'),
+        total_documents=Count('document'),
+        total_history_versions=Sum(Subquery(history, output_field=IntegerField())),
+        total_words=Sum('document__word_count'),
+        total_characters=Sum('document__char_count'),
+        total_attachment_words=Sum(Subquery(
+            attachments.annotate(total=Sum('word_count')).values('total'), output_field=IntegerField()
+        )),
+        total_attachment_characters=Sum(Subquery(
+            attachments.annotate(total=Sum('char_count')).values('total'), output_field=IntegerField()
+        )),
+    )
+    return {name: value or 0 for name, value in totals.items()}
+
+
+def compute(user):
+    from .serializers import HistoryListSerializer, ProjectSerializer
+
+    recent_projects = (
+        Project.objects.filter(owner=user)
+        .select_related('owner', 'document')
+        .defer('document__content')
+        .order_by('-created_at')[:5]
+    )
+    recent_history = History.objects.filter(
+        document__project__owner=user
+    ).defer('content_snapshot', 'delta').order_by('-timestamp')[:10]
+
+    return {
+        'user': {
+            'email': user.email,
+            'username': user.username,
+            'joined': user.created_at
+        },
+        'stats': totals(user),
+        'recent_projects': ProjectSerializer(recent_projects, many=True).data,
+        'recent_activity': HistoryListSerializer(recent_history, many=True).data
+    }
+
+
+def get_analytics(user):
+    key = f'analytics:{user.pk}:{cache_version(user.pk)}'
+    data = cache.get(key)
+    if data is None:
+        data = compute(user)
+        cache.set(key, data, getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 300))
+    return data
@@ -0,0 +1,173 @@
+"""
+Background text extraction for DocumentFile attachments.
+
+Every new DocumentFile is submitted once its transaction commits (see
+signals.py). Extraction runs in a pool of ATTACHMENT_TEXT_WORKERS
+processes (extraction.py is Django-free for that reason), off the request
+path; with ATTACHMENT_TEXT_WORKERS = 0 it runs inline. The text, capped
+at ATTACHMENT_TEXT_MAX_CHARS, is stored in an AttachmentText row, which
+the search index picks up through its triggers, with the same counts
+textstats.py keeps for Document.content.
+
+Text is keyed by the SHA-256 of the file. A file whose hash has not
+changed since it was last extracted is skipped, and a blob already
+extracted for another DocumentFile has its text copied rather than read
+again. Files without a blob are hashed in the worker before anything is
+extracted.
+"""
+import datetime
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.utils import timezone
+
+from . import analytics, extraction
+from .models import AttachmentText
+from .textstats import STAT_FIELDS, text_stats
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_futures = {}  # AttachmentText id -> Future, for files this process is extracting
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Workers only import extraction.py; see export_jobs.get_executor().
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.ATTACHMENT_TEXT_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+
+def _discard_executor(executor):
+    """Forget a pool broken by a dying worker, so that the next submit starts a new one."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(*args):
+    """See export_jobs._submit()."""
+    executor = get_executor()
+    try:
+        return executor, executor.submit(*args)
+    except BrokenProcessPool:
+        _discard_executor(executor)
+    executor = get_executor()
+    return executor, executor.submit(*args)
+
+
+def submit(document_file):
+    """Extract the text of `document_file` unless it is current; returns its AttachmentText."""
+    sha256 = document_file.blob.sha256 if document_file.blob_id else ''
+    row, created = AttachmentText.objects.get_or_create(document_file=document_file)
+    if not created and not _needs_extraction(row, sha256):
+        return row
+
+    kind = extraction.kind(document_file.filename, document_file.content_type)
+    if kind is None:
+        _store(row.id, sha256, AttachmentText.UNSUPPORTED, '')
+        return row
+    if sha256 and _copy(row.id, sha256):
+        return row
+    if not created and row.status != AttachmentText.QUEUED:
+        AttachmentText.objects.filter(id=row.id).update(status=AttachmentText.QUEUED, error='')
+
+    args = (
+        default_storage.path(document_file.file.name), kind, settings.ATTACHMENT_TEXT_MAX_CHARS,
+        sha256, row.sha256 if row.status == AttachmentText.DONE else '',
+    )
+    if not settings.ATTACHMENT_TEXT_WORKERS:
+        try:
+            result = extraction.extract_file(*args)
+        except Exception as exc:
+            _fail(row.id, exc)
+        else:
+            _finish(row.id, *result)
+    else:
+        # This runs after the upload has committed, so a failure is
+        # recorded on the row rather than raised.
+        try:
+            executor, future = _submit(extraction.extract_file, *args)
+        except Exception as exc:
+            _fail(row.id, exc)
+        else:
+            _futures[row.id] = future
+            future.add_done_callback(partial(_done, row.id, executor))
+    return row
+
+
+def _needs_extraction(row, sha256):
+    if row.status in (AttachmentText.DONE, AttachmentText.UNSUPPORTED):
+        # Without a blob the hash is only known once the worker has read
+        # the file, which then skips the extraction if it is unchanged.
+        return not sha256 or sha256 != row.sha256
+    if row.status == AttachmentText.FAILED:
+        return True
+    timeout = datetime.timedelta(seconds=settings.ATTACHMENT_TEXT_TIMEOUT)
+    return row.id not in _futures and row.updated_at < timezone.now() - timeout
+
+
+def _copy(row_id, sha256):
+    """Reuse the text already extracted from the same bytes, if any."""
+    donor = AttachmentText.objects.filter(sha256=sha256, status=AttachmentText.DONE).exclude(id=row_id).values(
+        'text', *STAT_FIELDS
+    ).first()
+    if donor is None:
+        return False
+    _store(row_id, sha256, AttachmentText.DONE, **donor)
+    return True
+
+
+def _done(row_id, executor, future):
+    # Runs on the pool's management thread, which has its own connections.
+    try:
+        try:
+            result = future.result()
+        except Exception as exc:
+            if isinstance(exc, BrokenProcessPool):
+                _discard_executor(executor)
+            _fail(row_id, exc)
+        else:
+            _finish(row_id, *result)
+    finally:
+        _futures.pop(row_id, None)
+        connections.close_all()
+
+
+def _finish(row_id, sha256, text):
+    if text is None:
+        # Unchanged since the last extraction.
+        AttachmentText.objects.filter(id=row_id).update(status=AttachmentText.DONE, updated_at=timezone.now())
+        return
+    _store(row_id, sha256, AttachmentText.DONE, text, **text_stats(text))
+
+
+def _store(row_id, sha256, status, text, **stats):
+    AttachmentText.objects.filter(id=row_id).update(
+        sha256=sha256, status=status, text=text, error='', updated_at=timezone.now(),
+        **{field: stats.get(field, 0) for field in STAT_FIELDS},
+    )
+    document_id = AttachmentText.objects.filter(id=row_id).values_list('document_file__document_id', flat=True).first()
+    if document_id is not None:
+        analytics.invalidate_document_id(document_id)
+
+
+def _fail(row_id, exc):
+    logger.exception('Text extraction for attachment text %s failed', row_id, exc_info=exc)
+    AttachmentText.objects.filter(id=row_id).update(
+        status=AttachmentText.FAILED, error=str(exc)[:500], updated_at=timezone.now()
+    )
@@ -0,0 +1,136 @@
+"""
+Attachment downloads.
+
+A download is one query, which checks ownership and returns everything the
+response needs, followed by handing the file to whatever can send it
+without Python reading it:
+
+- ATTACHMENT_SENDFILE = 'x-accel-redirect' (nginx) or 'x-sendfile'
+  (Apache, lighttpd): an empty response whose header tells the proxy
+  which file to send; the proxy also serves any Range.
+- otherwise a FileResponse over the requested byte range, which WSGI
+  servers with a sendfile-capable wsgi.file_wrapper (gunicorn, uWSGI)
+  send with os.sendfile(). They stop at Content-Length, so a range needs
+  only a seek. ASGI has no such path; there the range is streamed in
+  FileResponse.block_size reads, and offloading to the proxy is the way
+  to avoid them.
+
+ETags are the blob's SHA-256 when there is one, so a file uploaded twice
+is cached once by clients too. If-Range accepts the ETag or the exact
+Last-Modified date.
+"""
+import mimetypes
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date
+
+from .archive import streaming_content
+from .exporting import RangeNotSatisfiable, parse_range
+
+
+class FileRange:
+    """
+    Bytes [start, stop) of an open file, as a file-like object. It keeps
+    fileno() and the file position, which is all a sendfile() file wrapper
+    uses; reads stop at `stop` for everything else.
+    """
+
+    def __init__(self, file, start, stop):
+        file.seek(start)
+        self.file = file
+        self.remaining = stop - start
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def file_etag(file):
+    """`file` is a values() row of DocumentFile."""
+    if file['blob__sha256']:
+        return f'"{file["blob__sha256"]}"'
+    return f'"file-{file["id"]}-{file["size"]}-{int(file["uploaded_at"].timestamp())}"'
+
+
+def _range_applies(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    return if_range is None or if_range in (etag, http_date(last_modified.timestamp()))
+
+
+def _headers(response, file, etag):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(file['uploaded_at'].timestamp())
+    response['Content-Disposition'] = content_disposition_header(True, file['filename'])
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def download_response(request, file):
+    """The response for a download of `file`, a values() row of DocumentFile."""
+    etag = file_etag(file)
+    last_modified = file['uploaded_at']
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified.timestamp())
+    if not_modified is not None:
+        return not_modified
+
+    content_type = (
+        file['content_type'] or mimetypes.guess_type(file['filename'])[0] or 'application/octet-stream'
+    )
+    mode = getattr(settings, 'ATTACHMENT_SENDFILE', None)
+    if mode == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(settings.ATTACHMENT_ACCEL_PREFIX.rstrip('/') + '/' + file['file'])
+        return _headers(response, file, etag)
+    path = default_storage.path(file['file'])
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return _headers(response, file, etag)
+
+    length = os.path.getsize(path)
+    start, stop, status = 0, length, 200
+    if _range_applies(request, etag, last_modified):
+        try:
+            requested = parse_range(request.META.get('HTTP_RANGE'), length)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{length}'
+            return response
+        if requested is not None:
+            (start, stop), status = requested, 206
+
+    body = FileRange(open(path, 'rb'), start, stop)
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            streaming_content(request, _read_blocks(body, FileResponse.block_size)), content_type=content_type
+        )
+    else:
+        response = FileResponse(body, content_type=content_type)
+    response.status_code = status
+    response['Content-Length'] = str(stop - start)
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{stop - 1}/{length}'
+    return _headers(response, file, etag)
+
+
+def _read_blocks(body, block_size):
+    try:
+        while data := body.read(block_size):
+            yield data
+    finally:
+        body.close()
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Small thread-safe in-process LRU cache."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SizedLRUCache(LRUCache):
+    """Thread-safe in-process LRU cache bounded by the total len() of its values."""
+
+    def __init__(self, maxbytes):
+        super().__init__(maxsize=None)
+        self.maxbytes = maxbytes
+        self.size = 0
+
+    def set(self, key, value):
+        if len(value) > self.maxbytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._data[key] = value
+            self.size += len(value)
+            while self.size > self.maxbytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+_MISSING = object()
+
+
+class TTLCache(LRUCache):
+    """Thread-safe in-process LRU cache whose entries also expire `ttl` seconds after they are set."""
+
+    def __init__(self, maxsize=128, ttl=300, clock=time.monotonic):
+        super().__init__(maxsize=maxsize)
+        self.ttl = ttl
+        self.clock = clock
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires <= self.clock():
+            with self._lock:
+                if self._data.get(key) is entry:
+                    del self._data[key]
+            return default
+        return value
+
+    def set(self, key, value):
+        super().set(key, (self.clock() + self.ttl, value))
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
@@ -0,0 +1,192 @@
+"""
+In-process state for collaborative editing sessions.
+
+Every document with connected editors has one DocumentSession holding the
+authoritative text, its version and a log of recent operations. Incoming
+edits based on an older version are transformed against the log before
+being applied. The session writes to the database every
+COLLAB_FLUSH_INTERVAL seconds (and when the last editor leaves) instead of
+on every keystroke. If the document was saved by other means in the
+meantime, the edits made since the last flush are transformed over that
+change and all editors are resynced to the merged text.
+
+Sessions live in the memory of one ASGI process, so all editors of a
+document must be routed to the same process.
+"""
+import asyncio
+import logging
+from collections import deque
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from .diffing import WORD_RE, diff_sequences
+from .models import Document
+from .textops import (
+    OperationError, apply_components, components_to_edits, edits_to_components, transform,
+)
+from .versioning import commit_content
+
+logger = logging.getLogger(__name__)
+
+_sessions = {}
+
+
+class StaleVersion(Exception):
+    """The client is too far behind the operation log and must resync."""
+
+
+class DocumentSession:
+    def __init__(self, document_id, content, version):
+        self.document_id = document_id
+        self.content = content
+        self.version = version
+        self.persisted_version = version
+        self.persisted_content = content
+        # (operation, length of the text it applied to) for recent versions.
+        self.log = deque(maxlen=getattr(settings, 'COLLAB_LOG_SIZE', 500))
+        self.lock = asyncio.Lock()
+        self.editors = 0
+        self.flush_task = None
+
+    @property
+    def dirty(self):
+        return self.version != self.persisted_version
+
+    def apply(self, base_version, edits):
+        """
+        Apply edits made against `base_version`, transforming them over any
+        operations the client had not seen yet. Returns the new version and
+        the edits as applied to the current text.
+        """
+        earliest = self.version - len(self.log)
+        if base_version > self.version:
+            raise OperationError('base_version is ahead of the document.')
+        if base_version < earliest:
+            raise StaleVersion()
+
+        concurrent = list(self.log)[base_version - earliest:]
+        length = concurrent[0][1] if concurrent else len(self.content)
+        op = edits_to_components(edits, length)
+        for other, _ in concurrent:
+            op, _ = transform(op, other)
+
+        length = len(self.content)
+        self.content = apply_components(self.content, op)
+        self.log.append((op, length))
+        self.version += 1
+        return self.version, components_to_edits(op)
+
+    def reset(self, content, version):
+        self.content = self.persisted_content = content
+        self.version = self.persisted_version = version
+        self.log.clear()
+
+    def rebase(self, content, version):
+        """
+        Move onto `content` saved elsewhere at `version`, keeping the edits
+        made since the last flush by transforming them over that change.
+        """
+        ours = _operation(self.persisted_content, self.content)
+        theirs = _operation(self.persisted_content, content)
+        ours, _ = transform(ours, theirs)
+        self.reset(content, version)
+        merged = apply_components(content, ours)
+        if merged != content:
+            self.content = merged
+            self.version += 1
+
+    async def flush(self):
+        """Persist the current text; returns False if the database had moved on."""
+        if not self.dirty:
+            return True
+        content, version = self.content, self.version
+        saved, current = await _persist(self.document_id, content, self.persisted_version, version)
+        if saved:
+            self.persisted_version = version
+            self.persisted_content = content
+            return True
+        logger.warning('Document %s was saved outside the editing session; rebasing.', self.document_id)
+        self.rebase(*current)
+        return False
+
+
+def _operation(old, new):
+    """
+    The component operation turning `old` into `new`, from a line diff
+    with changed lines refined into words, as in diffing.diff_ops.
+    """
+    edits = []
+    max_edits = getattr(settings, 'DIFF_MAX_EDITS', None)
+
+    def diff(a, b, offset, refine):
+        opcodes, _ = diff_sequences(a, b, max_edits)
+        for tag, i1, i2, j1, j2 in opcodes:
+            removed, inserted = ''.join(a[i1:i2]), ''.join(b[j1:j2])
+            if tag == 'replace' and refine:
+                diff(WORD_RE.findall(removed), WORD_RE.findall(inserted), offset, False)
+            elif tag != 'equal':
+                edits.append({'offset': offset, 'delete': len(removed), 'insert': inserted})
+            offset += len(inserted)
+
+    diff(old.splitlines(keepends=True), new.splitlines(keepends=True), 0, True)
+    return edits_to_components(edits, len(old))
+
+
+@database_sync_to_async
+def _load(document_id):
+    return Document.objects.values_list('content', 'version').get(pk=document_id)
+
+
+@database_sync_to_async
+def _persist(document_id, content, base_version, version):
+    document = Document.objects.get(pk=document_id)
+    if document.version == base_version and commit_content(document, content, version):
+        return True, None
+    document.refresh_from_db(fields=['content', 'version'])
+    return False, (document.content, document.version)
+
+
+async def join(document_id, on_resync):
+    session = _sessions.get(document_id)
+    if session is None:
+        content, version = await _load(document_id)
+        # Another editor may have loaded the document while we waited.
+        session = _sessions.get(document_id)
+        if session is None:
+            session = _sessions[document_id] = DocumentSession(document_id, content, version)
+            session.flush_task = asyncio.create_task(_flush_periodically(session, on_resync))
+    session.editors += 1
+    return session
+
+
+async def leave(session):
+    session.editors -= 1
+    if session.editors > 0:
+        return
+    async with session.lock:
+        if not await session.flush():
+            # Save the editors' work rebased onto the newer text.
+            await session.flush()
+        # Keep the session registered until it is saved, and keep it alive
+        # if somebody joined while we were writing.
+        if session.editors > 0:
+            return
+        if _sessions.get(session.document_id) is session:
+            del _sessions[session.document_id]
+        if session.flush_task:
+            session.flush_task.cancel()
+
+
+async def _flush_periodically(session, on_resync):
+    interval = getattr(settings, 'COLLAB_FLUSH_INTERVAL', 5)
+    while True:
+        await asyncio.sleep(interval)
+        async with session.lock:
+            try:
+                saved = await session.flush()
+            except Exception:
+                logger.exception('Could not save document %s.', session.document_id)
+                continue
+            if not saved:
+                await on_resync(session)
@@ -0,0 +1,111 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import collab
+from .models import Document
+from .textops import OperationError, validate_ops
+
+
+def group_name(document_id):
+    return f'document-{document_id}'
+
+
+async def broadcast_resync(session):
+    await get_channel_layer().group_send(group_name(session.document_id), {
+        'type': 'document.resync',
+        'content': session.content,
+        'version': session.version,
+    })
+
+
+@database_sync_to_async
+def can_edit(user, document_id):
+    return Document.objects.filter(pk=document_id, project__owner=user).exists()
+
+
+class DocumentConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Collaborative editing of one document.
+
+    Client messages:
+        {"type": "ops", "base_version": 7, "ops": [...edits], "ref": "any"}
+    Server messages:
+        {"type": "init" | "resync", "version": 7, "content": "..."}
+        {"type": "ack", "version": 8, "ref": "any"}    your ops were applied
+        {"type": "ops", "version": 8, "ops": [...]}    somebody else's ops
+        {"type": "error", "error": "..."}
+    Edits use the same format as the document PATCH endpoint. Acks and ops
+    are delivered in version order.
+    """
+    session = None
+
+    async def connect(self):
+        user = self.scope.get('user')
+        self.document_id = self.scope['url_route']['kwargs']['document_id']
+        if not user or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        if not await can_edit(user, self.document_id):
+            await self.close(code=4403)
+            return
+
+        self.group = group_name(self.document_id)
+        self.session = await collab.join(self.document_id, broadcast_resync)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+        await self.send_json({
+            'type': 'init',
+            'version': self.session.version,
+            'content': self.session.content,
+        })
+
+    async def disconnect(self, code):
+        if self.session is None:
+            return
+        await self.channel_layer.group_discard(self.group, self.channel_name)
+        await collab.leave(self.session)
+        self.session = None
+
+    async def receive_json(self, content, **kwargs):
+        if content.get('type') != 'ops':
+            await self.send_json({'type': 'error', 'error': 'Unknown message type.'})
+            return
+        base_version = content.get('base_version')
+        try:
+            if not isinstance(base_version, int) or isinstance(base_version, bool):
+                raise OperationError('base_version must be an integer.')
+            edits = validate_ops(content.get('ops'), getattr(settings, 'DOCUMENT_PATCH_MAX_OPS', None))
+        except OperationError as exc:
+            await self.send_json({'type': 'error', 'error': str(exc), 'ref': content.get('ref')})
+            return
+
+        session = self.session
+        async with session.lock:
+            try:
+                version, applied = session.apply(base_version, edits)
+            except collab.StaleVersion:
+                await self.send_json({'type': 'resync', 'version': session.version, 'content': session.content})
+                return
+            except OperationError as exc:
+                await self.send_json({'type': 'error', 'error': str(exc), 'ref': content.get('ref')})
+                return
+            # Sent while holding the lock so every editor sees versions in order;
+            # the sender's copy comes back through its own channel as the ack.
+            await self.channel_layer.group_send(self.group, {
+                'type': 'document.ops',
+                'version': version,
+                'ops': applied,
+                'sender': self.channel_name,
+                'ref': content.get('ref'),
+            })
+
+    async def document_ops(self, event):
+        if event['sender'] == self.channel_name:
+            await self.send_json({'type': 'ack', 'version': event['version'], 'ref': event['ref']})
+        else:
+            await self.send_json({'type': 'ops', 'version': event['version'], 'ops': event['ops']})
+
+    async def document_resync(self, event):
+        await self.send_json({'type': 'resync', 'version': event['version'], 'content': event['content']})
@@ -0,0 +1,270 @@
+import hashlib
+import re
+
+from django.conf import settings
+
+from .caching import LRUCache
+
+WORD_RE = re.compile(r'\s+|\w+|[^\w\s]')
+
+_cache = LRUCache(maxsize=getattr(settings, 'DIFF_CACHE_SIZE', 256))
+
+
+def _intern(a, b):
+    """Map tokens to ints so the inner loop compares small integers."""
+    table = {}
+    return (
+        [table.setdefault(token, len(table)) for token in a],
+        [table.setdefault(token, len(table)) for token in b],
+    )
+
+
+def myers(a, b, max_edits=None):
+    """
+    Myers' O(ND) diff of two token sequences.
+
+    Returns difflib-style opcodes, or None when the sequences differ by more
+    than `max_edits` insertions and deletions so callers can fall back to a
+    coarse result instead of paying for the full search.
+    """
+    a, b = _intern(a, b)
+    n, m = len(a), len(b)
+    limit = n + m if max_edits is None else min(n + m, max_edits)
+    offset = limit + 1
+    v = [0] * (2 * limit + 3)
+    trace = []
+    for d in range(limit + 1):
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+    return None
+
+
+def _backtrack(trace, n, m):
+    # Walk the saved frontiers backwards, emitting one edit per step.
+    x, y = n, m
+    edits = []
+    for d in range(len(trace) - 1, -1, -1):
+        frontier = trace[d]
+        k = x - y
+
+        def at(diag):
+            return frontier[diag + d + 1]
+
+        if d == 0:
+            prev_k = 0
+            prev_x = 0
+        elif k == -d or (k != d and at(k - 1) < at(k + 1)):
+            prev_k = k + 1
+            prev_x = at(prev_k)
+        else:
+            prev_k = k - 1
+            prev_x = at(prev_k)
+        prev_y = prev_x - prev_k
+
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            edits.append(('equal', x, y))
+        if d > 0:
+            if x == prev_x:
+                edits.append(('insert', x, prev_y))
+            else:
+                edits.append(('delete', prev_x, y))
+        x, y = prev_x, prev_y
+    edits.reverse()
+    return _to_opcodes(edits)
+
+
+def _to_opcodes(edits):
+    opcodes = []
+    for tag, i, j in edits:
+        di = 0 if tag == 'insert' else 1
+        dj = 0 if tag == 'delete' else 1
+        if tag != 'equal' and opcodes and opcodes[-1][0] in ('insert', 'delete', 'replace'):
+            last = opcodes[-1]
+            if last[2] == i and last[4] == j:
+                new_tag = last[0] if last[0] == tag else 'replace'
+                opcodes[-1] = (new_tag, last[1], i + di, last[3], j + dj)
+                continue
+        if tag == 'equal' and opcodes and opcodes[-1][0] == 'equal':
+            last = opcodes[-1]
+            opcodes[-1] = ('equal', last[1], i + 1, last[3], j + 1)
+            continue
+        opcodes.append((tag, i, i + di, j, j + dj))
+    return opcodes
+
+
+def diff_sequences(a, b, max_edits=None):
+    """
+    Diff two token lists, trimming the common head and tail first.
+
+    Returns (opcodes, complete). When the middle section exceeds
+    `max_edits` it is reported as a single replace and complete is False.
+    """
+    head = 0
+    limit = min(len(a), len(b))
+    while head < limit and a[head] == b[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and a[-1 - tail] == b[-1 - tail]:
+        tail += 1
+
+    a_end, b_end = len(a) - tail, len(b) - tail
+    middle = myers(a[head:a_end], b[head:b_end], max_edits)
+    complete = middle is not None
+    if middle is None:
+        middle = [('replace', 0, a_end - head, 0, b_end - head)]
+
+    opcodes = []
+    if head:
+        opcodes.append(('equal', 0, head, 0, head))
+    for tag, i1, i2, j1, j2 in middle:
+        opcodes.append((tag, i1 + head, i2 + head, j1 + head, j2 + head))
+    if tail:
+        opcodes.append(('equal', a_end, len(a), b_end, len(b)))
+    return opcodes, complete
+
+
+def diff_ops(old, new, max_edits=None, max_refine_lines=200):
+    """
+    Compact JSON diff: a list of ['=', line_count], ['-', lines],
+    ['+', lines] and ['~', word_ops] entries. Replaced blocks of at most
+    `max_refine_lines` lines are refined into word-level ['=', text],
+    ['-', text] and ['+', text] pairs.
+    """
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    opcodes, complete = diff_sequences(a, b, max_edits)
+    ops = []
+    stats = {'added': 0, 'removed': 0}
+    for tag, i1, i2, j1, j2 in opcodes:
+        stats['removed'] += i2 - i1 if tag != 'equal' else 0
+        stats['added'] += j2 - j1 if tag != 'equal' else 0
+        if tag == 'equal':
+            ops.append(['=', i2 - i1])
+        elif tag == 'replace' and max(i2 - i1, j2 - j1) <= max_refine_lines:
+            ops.append(['~', diff_words(''.join(a[i1:i2]), ''.join(b[j1:j2]), max_edits)])
+        else:
+            if i2 > i1:
+                ops.append(['-', a[i1:i2]])
+            if j2 > j1:
+                ops.append(['+', b[j1:j2]])
+    return {'ops': ops, 'stats': stats, 'complete': complete}
+
+
+def diff_words(old, new, max_edits=None):
+    a = WORD_RE.findall(old)
+    b = WORD_RE.findall(new)
+    opcodes, _ = diff_sequences(a, b, max_edits)
+    ops = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            ops.append(['=', ''.join(a[i1:i2])])
+            continue
+        if i2 > i1:
+            ops.append(['-', ''.join(a[i1:i2])])
+        if j2 > j1:
+            ops.append(['+', ''.join(b[j1:j2])])
+    return ops
+
+
+def unified_diff(old, new, fromfile='a', tofile='b', context=3, max_edits=None):
+    """Render a unified diff from the Myers opcodes."""
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    opcodes, complete = diff_sequences(a, b, max_edits)
+    lines = []
+    for group in _grouped(opcodes, context):
+        if not lines:
+            lines.append(f'--- {fromfile}\n')
+            lines.append(f'+++ {tofile}\n')
+        first, last = group[0], group[-1]
+        lines.append(
+            f'@@ -{_range(first[1], last[2])} +{_range(first[3], last[4])} @@\n'
+        )
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                lines.extend(' ' + _eol(line) for line in a[i1:i2])
+                continue
+            lines.extend('-' + _eol(line) for line in a[i1:i2])
+            lines.extend('+' + _eol(line) for line in b[j1:j2])
+    return ''.join(lines), complete
+
+
+def _eol(line):
+    return line if line.endswith('\n') else line + '\n\\ No newline at end of file\n'
+
+
+def _range(start, stop):
+    length = stop - start
+    if length == 1:
+        return str(start + 1)
+    if not length:
+        start -= 1
+    return f'{start + 1},{length}'
+
+
+def _grouped(opcodes, n):
+    # Same hunk grouping as difflib.SequenceMatcher.get_grouped_opcodes.
+    if not opcodes or (len(opcodes) == 1 and opcodes[0][0] == 'equal'):
+        return
+    codes = list(opcodes)
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > 2 * n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def compare_versions(old, new, old_hash, new_hash, output='json', context=3):
+    """
+    Diff two versions, memoised by the pair of content hashes.
+
+    `old` and `new` may be callables so the texts are only rebuilt on a
+    cache miss. A missing hash (rows not written by record_snapshot may
+    have none) is computed from the text, so that it cannot share a cache
+    entry with another version.
+    """
+    max_edits = getattr(settings, 'DIFF_MAX_EDITS', 1000)
+    if not old_hash or not new_hash:
+        old = old() if callable(old) else old
+        new = new() if callable(new) else new
+        old_hash = old_hash or hashlib.sha256(old.encode()).hexdigest()
+        new_hash = new_hash or hashlib.sha256(new.encode()).hexdigest()
+    key = (old_hash, new_hash, output, context)
+    result = _cache.get(key)
+    if result is None:
+        old = old() if callable(old) else old
+        new = new() if callable(new) else new
+        if output == 'unified':
+            text, complete = unified_diff(
+                old, new, fromfile=old_hash[:12], tofile=new_hash[:12],
+                context=context, max_edits=max_edits,
+            )
+            result = {'diff': text, 'complete': complete}
+        else:
+            result = diff_ops(old, new, max_edits=max_edits)
+        _cache.set(key, result)
+    return result
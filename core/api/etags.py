@@ -0,0 +1,101 @@
+"""
+ETag functions for django.views.decorators.http.condition.
+
+Each function takes the view arguments, runs at most one small query and
+returns None when the object is missing so the view can produce its usual
+404. Single objects get strong ETags built from their version data;
+collections get weak ETags that also cover the query string.
+"""
+import hashlib
+
+from django.db.models import Count, Max, Sum
+
+from .exporting import FORMATS, content_coding
+from .models import Document, History, Project
+
+
+def _digest(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()[:32]
+
+
+def document_tag(document_id, version, last_modified):
+    return f'"d{document_id}-{version}-{last_modified.timestamp():.6f}"'
+
+
+def document_etag(document):
+    return document_tag(document.id, document.version, document.last_modified)
+
+
+def project_list_etag(request, *args, **kwargs):
+    summary = Project.objects.filter(owner=request.user).aggregate(
+        count=Count('id'),
+        last_id=Max('id'),
+        updated=Max('updated_at'),
+        modified=Max('document__last_modified'),
+        versions=Sum('document__version'),
+    )
+    return 'W/"%s"' % _digest(request.user.pk, request.get_full_path(), *summary.values())
+
+
+def project_etag(request, pk=None, *args, **kwargs):
+    row = Project.objects.filter(pk=pk, owner=request.user).values(
+        'id', 'updated_at', 'document__id', 'document__version', 'document__last_modified'
+    ).first()
+    if row is None:
+        return None
+    return '"%s"' % _digest(*row.values())
+
+
+def project_document_etag(request, pk=None, *args, **kwargs):
+    row = Document.objects.filter(project_id=pk, project__owner=request.user).values(
+        'id', 'version', 'last_modified'
+    ).first()
+    if row is None:
+        return None
+    return document_tag(row['id'], row['version'], row['last_modified'])
+
+
+def document_detail_etag(request, pk=None, *args, **kwargs):
+    row = Document.objects.filter(pk=pk, project__owner=request.user).values(
+        'id', 'version', 'last_modified'
+    ).first()
+    if row is None:
+        return None
+    return document_tag(row['id'], row['version'], row['last_modified'])
+
+
+def history_list_etag(request, document_id=None, *args, **kwargs):
+    summary = History.objects.filter(
+        document_id=document_id, document__project__owner=request.user
+    ).aggregate(count=Count('id'), last_id=Max('id'))
+    if not summary['count']:
+        # Let the view tell an empty timeline apart from a foreign document.
+        return None
+    return 'W/"%s"' % _digest(document_id, request.get_full_path(), *summary.values())
+
+
+def history_etag(request, document_id=None, pk=None, *args, **kwargs):
+    row = History.objects.filter(
+        pk=pk, document_id=document_id, document__project__owner=request.user
+    ).values('id', 'content_hash').first()
+    if row is None:
+        return None
+    return f'"h{row["id"]}-{row["content_hash"][:16]}"'
+
+
+def export_tag(document_id, version, last_modified, format, coding):
+    # Each format and content coding is its own representation.
+    return document_tag(document_id, version, last_modified)[:-1] + f'-{format}-{coding}"'
+
+
+def export_etag(request, document_id=None, *args, **kwargs):
+    format = request.GET.get('format', 'txt')
+    if format not in FORMATS:
+        return None
+    row = Document.objects.filter(pk=document_id, project__owner=request.user).values(
+        'id', 'version', 'last_modified', 'char_count'
+    ).first()
+    if row is None:
+        return None
+    coding = content_coding(request, row['char_count'])
+    return export_tag(row['id'], row['version'], row['last_modified'], format, coding)
@@ -0,0 +1,160 @@
+"""
+Asynchronous document exports.
+
+Submitting an export finds or creates the ExportJob for the document's
+current text and the format, so repeated requests for unchanged text
+share one job. Rendering runs in a pool of EXPORT_WORKERS processes
+(rendering.py is Django-free for that reason), which caps how many
+exports render at once however many are requested; the rest wait in the
+pool's queue. Output files are named by content hash under EXPORT_ROOT,
+so the same text in the same format is only rendered once, even for
+different documents. With EXPORT_WORKERS = 0 jobs render inline.
+
+A job stays queued while it renders. One left queued for longer than
+EXPORT_JOB_TIMEOUT by a process that has since gone away is started
+again by the next submit. If a worker dies, the pool is replaced and the
+jobs it was rendering fail, to be started again by the next submit.
+"""
+import datetime
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from . import rendering
+from .models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+# format -> (content type, file extension)
+FORMATS = {
+    'pdf': ('application/pdf', 'pdf'),
+    'html': ('text/html; charset=utf-8', 'html'),
+    'md': ('text/markdown; charset=utf-8', 'md'),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+_futures = {}  # job id -> Future, for jobs this process is rendering
+
+
+def output_path(content_hash, format):
+    return os.path.join(settings.EXPORT_ROOT, content_hash[:2], f'{content_hash}.{format}')
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Workers only import rendering.py, so they are spawned rather
+            # than forked from a process that may hold threads and sockets.
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.EXPORT_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+
+def _discard_executor(executor):
+    """Forget a pool broken by a dying worker, so that the next submit starts a new one."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(*args):
+    """Submit to the pool, starting a new one if a worker died; returns (pool, future)."""
+    executor = get_executor()
+    try:
+        return executor, executor.submit(*args)
+    except BrokenProcessPool:
+        _discard_executor(executor)
+    executor = get_executor()
+    return executor, executor.submit(*args)
+
+
+def submit(document, format):
+    """Return the ExportJob for `document`'s current text in `format`, starting it if needed."""
+    content = document.content
+    content_hash = hashlib.sha256(content.encode()).hexdigest()
+    job, created = ExportJob.objects.get_or_create(document=document, content_hash=content_hash, format=format)
+    if not created and not _needs_restart(job):
+        return job
+    if not created:
+        job.status, job.error, job.size, job.finished_at = ExportJob.QUEUED, '', None, None
+        job.save(update_fields=['status', 'error', 'size', 'finished_at', 'updated_at'])
+    if _start(job, content):
+        job.refresh_from_db(fields=['status', 'size', 'error', 'finished_at', 'updated_at'])
+    return job
+
+
+def _needs_restart(job):
+    if job.status == ExportJob.FAILED:
+        return True
+    if job.status == ExportJob.DONE:
+        return not os.path.exists(output_path(job.content_hash, job.format))
+    timeout = datetime.timedelta(seconds=settings.EXPORT_JOB_TIMEOUT)
+    return job.id not in _futures and job.updated_at < timezone.now() - timeout
+
+
+def _start(job, content):
+    """Render `job`, returning True if it already finished."""
+    path = output_path(job.content_hash, job.format)
+    if os.path.exists(path):
+        # Rendered before, for this or another document with the same text.
+        _finish(job.id, os.path.getsize(path))
+        return True
+    if not settings.EXPORT_WORKERS:
+        try:
+            size = rendering.write(content, job.format, path)
+        except Exception as exc:
+            _fail(job.id, exc)
+        else:
+            _finish(job.id, size)
+        return True
+    try:
+        executor, future = _submit(rendering.write, content, job.format, path)
+    except Exception as exc:
+        _fail(job.id, exc)
+        return True
+    _futures[job.id] = future
+    future.add_done_callback(partial(_done, job.id, executor))
+    return False
+
+
+def _done(job_id, executor, future):
+    # Runs on the pool's management thread, which has its own connections.
+    try:
+        try:
+            size = future.result()
+        except Exception as exc:
+            if isinstance(exc, BrokenProcessPool):
+                _discard_executor(executor)
+            _fail(job_id, exc)
+        else:
+            _finish(job_id, size)
+    finally:
+        _futures.pop(job_id, None)
+        connections.close_all()
+
+
+def _finish(job_id, size):
+    ExportJob.objects.filter(id=job_id).update(
+        status=ExportJob.DONE, size=size, error='', finished_at=timezone.now(), updated_at=timezone.now()
+    )
+
+
+def _fail(job_id, exc):
+    logger.exception('Export job %s failed', job_id, exc_info=exc)
+    ExportJob.objects.filter(id=job_id).update(
+        status=ExportJob.FAILED, error=str(exc)[:500], finished_at=timezone.now(), updated_at=timezone.now()
+    )
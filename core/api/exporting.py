@@ -0,0 +1,144 @@
+"""
+Document export bodies and the byte-range responses that serve them.
+
+Rendering is the expensive part of an export: Markdown to HTML (done
+block by block by preview.py, which caches each block), and gzip when the
+client accepts it. Whole bodies are cached in-process too, keyed by
+the SHA-256 of the document text, in a cache bounded by total bytes
+(EXPORT_CACHE_BYTES). Unchanged documents are therefore rendered once,
+however often they are downloaded. Bodies are streamed in
+EXPORT_CHUNK_SIZE pieces and honour single byte ranges. A range applies
+to the encoded representation, so a resumed gzip download gets more of
+the same gzip stream.
+"""
+import gzip
+import hashlib
+import re
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import content_disposition_header
+
+from .caching import SizedLRUCache
+from .preview import render_html
+
+# format -> (content type, file extension)
+FORMATS = {
+    'txt': ('text/plain; charset=utf-8', 'txt'),
+    'html': ('text/html; charset=utf-8', 'html'),
+}
+
+_cache = SizedLRUCache(maxbytes=getattr(settings, 'EXPORT_CACHE_BYTES', 64 * 1024 * 1024))
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def accepts_gzip(request):
+    """True if the Accept-Encoding header allows gzip (explicitly or via *)."""
+    accepted = {}
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+    return accepted.get('gzip', accepted.get('*', 0)) > 0
+
+
+def content_coding(request, size):
+    """The Content-Encoding to serve a body of about `size` bytes with."""
+    if size >= getattr(settings, 'EXPORT_GZIP_MIN_SIZE', 1024) and accepts_gzip(request):
+        return 'gzip'
+    return 'identity'
+
+
+def render(content, format, coding='identity'):
+    """Return the export body of `content` as bytes, rendering and compressing at most once."""
+    if format == 'txt' and coding == 'identity':
+        # Encoding is as cheap as hashing, so there is nothing to cache.
+        return content.encode()
+
+    content_hash = hashlib.sha256(content.encode()).hexdigest()
+    key = (content_hash, format, coding)
+    body = _cache.get(key)
+    if body is not None:
+        return body
+
+    if coding == 'identity':
+        body = render_html(content).encode()
+    else:
+        body = gzip.compress(render(content, format), compresslevel=6, mtime=0)
+    _cache.set(key, body)
+    return body
+
+
+def parse_range(header, length):
+    """
+    Return (start, stop) for a single "bytes=" range of a `length`-byte
+    body, or None when the header should be ignored and the whole body sent
+    (absent, malformed or multi-range). Raises RangeNotSatisfiable when no
+    byte of the range exists.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, stop = max(0, length - int(last)), length
+    else:
+        start = int(first)
+        stop = min(length, int(last) + 1) if last else length
+        if last and int(last) < start:
+            return None
+    if start >= length or stop <= start:
+        raise RangeNotSatisfiable
+    return start, stop
+
+
+def _chunks(body, start, stop):
+    chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 64 * 1024)
+    view = memoryview(body)
+    for offset in range(start, stop, chunk_size):
+        yield bytes(view[offset:min(offset + chunk_size, stop)])
+
+
+def export_response(request, body, content_type, filename, coding, etag):
+    """
+    Stream `body`, or the byte range the request asks for. If-Range only
+    allows the range when it names the current `etag`.
+    """
+    length = len(body)
+    start, stop, status = 0, length, 200
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None or if_range == etag:
+        try:
+            requested = parse_range(request.META.get('HTTP_RANGE'), length)
+        except RangeNotSatisfiable:
+            response = StreamingHttpResponse([], status=416)
+            response['Content-Range'] = f'bytes */{length}'
+            return response
+        if requested is not None:
+            (start, stop), status = requested, 206
+
+    response = StreamingHttpResponse(_chunks(body, start, stop), status=status, content_type=content_type)
+    response['Content-Length'] = str(stop - start)
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Accept-Ranges'] = 'bytes'
+    patch_vary_headers(response, ['Accept-Encoding'])
+    if coding != 'identity':
+        response['Content-Encoding'] = coding
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{stop - 1}/{length}'
+    return response
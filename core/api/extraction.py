@@ -0,0 +1,361 @@
+"""
+Plain text from attachments, for search and statistics.
+
+Nothing here imports Django, so extraction runs in the worker processes of
+attachment_index.py, as rendering.py does for export jobs. Files are read
+in READ_SIZE pieces and the output stops at `max_chars`, so memory use is
+bounded whatever the size of the file:
+
+- text and Markdown are decoded incrementally as UTF-8 and kept as
+  written, the way Document.content is indexed;
+- HTML is fed to html.parser piece by piece, keeping the text outside
+  script and style elements, with line breaks at block elements;
+- PDF files are scanned for content streams, which are inflated with a
+  streaming zlib decompressor and read for their text-showing operators.
+  This covers text in simple (single-byte) fonts, such as the PDFs
+  rendering.py writes; glyphs of embedded CID fonts cannot be mapped back
+  to characters without parsing the fonts, and come out as noise.
+"""
+import codecs
+import hashlib
+import os
+import re
+import zlib
+from html.parser import HTMLParser
+
+READ_SIZE = 1024 * 1024
+
+# MIME type or file extension -> extractor.
+KINDS = {
+    'text/plain': 'text',
+    'text/markdown': 'text',
+    'text/x-markdown': 'text',
+    'text/html': 'html',
+    'application/xhtml+xml': 'html',
+    'application/pdf': 'pdf',
+}
+EXTENSIONS = {
+    '.txt': 'text',
+    '.text': 'text',
+    '.md': 'text',
+    '.markdown': 'text',
+    '.html': 'html',
+    '.htm': 'html',
+    '.pdf': 'pdf',
+}
+
+
+def kind(filename, content_type=''):
+    """The extractor for a file, or None when its text cannot be extracted."""
+    content_type = content_type.split(';')[0].strip().lower()
+    return KINDS.get(content_type) or EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+class _Output:
+    """Collects extracted text up to `max_chars` characters."""
+
+    def __init__(self, max_chars):
+        self.parts = []
+        self.remaining = max_chars
+
+    @property
+    def full(self):
+        return self.remaining <= 0
+
+    def write(self, text):
+        if text and self.remaining > 0:
+            text = text[:self.remaining]
+            self.parts.append(text)
+            self.remaining -= len(text)
+
+    def text(self):
+        return ''.join(self.parts)
+
+
+def _text(file, out):
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    while not out.full and (data := file.read(READ_SIZE)):
+        out.write(decoder.decode(data))
+    out.write(decoder.decode(b'', final=True))
+
+
+class _HTMLText(HTMLParser):
+    SKIP = {'script', 'style', 'template', 'head'}
+    BLOCKS = {
+        'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption', 'figure',
+        'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre',
+        'section', 'table', 'td', 'th', 'title', 'tr', 'ul',
+    }
+
+    def __init__(self, out):
+        super().__init__(convert_charrefs=True)
+        self.out = out
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif tag in self.BLOCKS:
+            self.out.write('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCKS:
+            self.out.write('\n')
+
+    def handle_data(self, data):
+        if not self.skipping:
+            # Source line breaks inside a paragraph are just spaces.
+            self.out.write(' '.join(data.split('\n')))
+
+
+_SPACES_RE = re.compile(r'[ \t\r\f\v]+')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*')
+
+
+def _html(file, out):
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    parser = _HTMLText(out)
+    while not out.full and (data := file.read(READ_SIZE)):
+        parser.feed(decoder.decode(data))
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    # Whitespace is tidied once, on the bounded output.
+    lines = (_SPACES_RE.sub(' ', line).strip() for line in out.text().split('\n'))
+    out.parts = [_BLANK_LINES_RE.sub('\n\n', '\n'.join(lines)).strip()]
+
+
+# `stream` keywords, and the dictionaries in front of them.
+_STREAM_RE = re.compile(rb'(?<!end)stream\r?\n')
+_DICT_WINDOW = 4096
+_LENGTH_RE = re.compile(rb'/Length\s+(\d+)(?!\s+\d+\s+R)')
+# Content streams have no /Type or /Subtype, except for form XObjects.
+_NOT_CONTENT_RE = re.compile(rb'/Type\b|/Subtype\s*/(?!Form\b)|/Length[123]\b')
+_ENDSTREAM = b'endstream'
+
+_TOKEN_RE = re.compile(
+    rb'\((?:\\.|[^\\()]|\((?:\\.|[^\\()])*\))*\)'   # literal string, one level of nesting
+    rb'|<[0-9A-Fa-f\s]*>'                             # hex string
+    rb'|[\[\]]'
+    rb'|/[^\s/\[\]()<>{}%]*'                          # name
+    rb'|[-+]?(?:\d+\.?\d*|\.\d+)'                     # number
+    rb"|[A-Za-z'\"*]+",                               # operator
+    re.DOTALL,
+)
+_ESCAPE_RE = re.compile(rb'\\([0-7]{1,3}|\r\n|.)', re.DOTALL)
+_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+# TJ adjustments beyond this (thousandths of an em) are gaps between words.
+_WORD_GAP = 200
+# Content held back waiting for an ET is read anyway past this size.
+_CARRY_LIMIT = 1024 * 1024
+
+
+def _unescape(match):
+    escaped = match.group(1)
+    if escaped[:1].isdigit():
+        return bytes([int(escaped, 8) & 0xFF])
+    if escaped in (b'\n', b'\r', b'\r\n'):
+        return b''
+    return _ESCAPES.get(escaped, escaped)
+
+
+def _string(token):
+    if token[:1] == b'(':
+        data = _ESCAPE_RE.sub(_unescape, token[1:-1])
+    else:
+        hex_digits = re.sub(rb'\s', b'', token[1:-1])
+        data = bytes.fromhex((hex_digits + b'0' * (len(hex_digits) % 2)).decode())
+    if data.startswith(b'\xfe\xff'):
+        return data[2:].decode('utf-16-be', errors='replace')
+    return data.decode('cp1252', errors='replace')
+
+
+class _ContentText:
+    """Reads text operators from a content stream fed in pieces."""
+
+    def __init__(self, out):
+        self.out = out
+        self.buffer = b''
+        self.pending_break = False
+
+    def feed(self, data):
+        self.buffer += data
+        # Text operators only appear between BT and ET, so everything up to
+        # the last ET can be read now.
+        end = self.buffer.rfind(b'ET')
+        if end >= 0:
+            self._read(self.buffer[:end + 2])
+            self.buffer = self.buffer[end + 2:]
+        elif len(self.buffer) > _CARRY_LIMIT:
+            self._read(self.buffer)
+            self.buffer = b''
+
+    def close(self):
+        self._read(self.buffer)
+        self.buffer = b''
+        self.pending_break = True
+
+    def _emit(self, text):
+        if not text:
+            return
+        if self.pending_break:
+            self.out.write('\n')
+            self.pending_break = False
+        self.out.write(text)
+
+    def _read(self, content):
+        operands, array = [], None
+        for token in _TOKEN_RE.findall(content):
+            first = token[:1]
+            if first in b'(<':
+                (array if array is not None else operands).append(_string(token))
+            elif token == b'[':
+                array = []
+            elif token == b']':
+                operands.append(array or [])
+                array = None
+            elif first in b'/+-.' or first.isdigit():
+                if array is not None and first != b'/':
+                    array.append(float(token))
+                else:
+                    operands.append(token)
+            else:
+                self._operator(token, operands)
+                operands = []
+
+    def _operator(self, operator, operands):
+        if operator in (b"'", b'"'):
+            self.pending_break = True
+        if operator in (b'Tj', b"'", b'"'):
+            strings = [operand for operand in operands if isinstance(operand, str)]
+            self._emit(strings[-1] if strings else '')
+        elif operator == b'TJ' and operands and isinstance(operands[-1], list):
+            self._emit(''.join(
+                part if isinstance(part, str) else (' ' if part < -_WORD_GAP else '')
+                for part in operands[-1]
+            ))
+        elif operator in (b'T*', b'Tm', b'BT'):
+            self.pending_break = True
+        elif operator in (b'Td', b'TD') and len(operands) >= 2:
+            try:
+                moves_down = float(operands[-1]) != 0
+            except ValueError:
+                moves_down = True
+            if moves_down:
+                self.pending_break = True
+            else:
+                self._emit(' ')
+
+
+class _PdfScanner:
+    """Finds content streams in a PDF fed in pieces and reads their text."""
+
+    def __init__(self, out):
+        self.out = out
+        self.buffer = b''
+        self.stream = None       # (_ContentText, decompressor or None) while inside a wanted stream
+        self.in_stream = False
+        self.remaining = None    # bytes left in a stream of known /Length
+
+    def feed(self, data):
+        self.buffer += data
+        while not self.out.full:
+            if self.in_stream:
+                if not self._stream_data():
+                    return
+            elif not self._find_stream():
+                return
+
+    def _find_stream(self):
+        match = _STREAM_RE.search(self.buffer)
+        if match is None:
+            self.buffer = self.buffer[-_DICT_WINDOW:]
+            return False
+        dictionary = self.buffer[max(0, match.start() - _DICT_WINDOW):match.start()]
+        dictionary = dictionary[dictionary.rfind(b'obj') + 3:]
+        length = _LENGTH_RE.search(dictionary)
+        self.remaining = int(length.group(1)) if length else None
+        self.in_stream = True
+        if _NOT_CONTENT_RE.search(dictionary) or (b'/Filter' in dictionary and b'/FlateDecode' not in dictionary):
+            self.stream = None
+        else:
+            decompressor = zlib.decompressobj() if b'/FlateDecode' in dictionary else None
+            self.stream = (_ContentText(self.out), decompressor)
+        self.buffer = self.buffer[match.end():]
+        return True
+
+    def _stream_data(self):
+        """Pass on stream data; returns True once the stream has ended."""
+        if self.remaining is not None:
+            data, self.buffer = self.buffer[:self.remaining], self.buffer[self.remaining:]
+            self.remaining -= len(data)
+            ended = not self.remaining
+        else:
+            end = self.buffer.find(_ENDSTREAM)
+            ended = end >= 0
+            if not ended:
+                # Keep enough to recognise a keyword split between pieces.
+                end = max(0, len(self.buffer) - len(_ENDSTREAM))
+            data, self.buffer = self.buffer[:end], self.buffer[end:]
+        self._content(data)
+        if ended:
+            if self.stream is not None:
+                self.stream[0].close()
+            self.stream, self.in_stream, self.remaining = None, False, None
+        return ended
+
+    def _content(self, data):
+        if self.stream is None or not data:
+            return
+        text, decompressor = self.stream
+        if decompressor is None:
+            text.feed(data)
+            return
+        try:
+            # Inflated in bounded pieces, however well the data compresses.
+            while data and not self.out.full:
+                text.feed(decompressor.decompress(data, READ_SIZE))
+                data = decompressor.unconsumed_tail
+        except zlib.error:
+            self.stream = None
+
+
+def _pdf(file, out):
+    scanner = _PdfScanner(out)
+    while not out.full and (data := file.read(READ_SIZE)):
+        scanner.feed(data)
+    if scanner.stream is not None:
+        scanner.stream[0].close()
+    out.parts = [out.text().strip()]
+
+
+_EXTRACTORS = {'text': _text, 'html': _html, 'pdf': _pdf}
+
+
+def extract(path, kind, max_chars):
+    """The plain text of the file at `path`, at most `max_chars` characters."""
+    out = _Output(max_chars)
+    with open(path, 'rb') as file:
+        _EXTRACTORS[kind](file, out)
+    return out.text()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while data := file.read(READ_SIZE):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def extract_file(path, kind, max_chars, sha256='', previous_sha256=''):
+    """
+    Return (sha256, text) for the file at `path`. `sha256` is computed if
+    not given; when it equals `previous_sha256` the file has not changed
+    and text is None.
+    """
+    sha256 = sha256 or file_sha256(path)
+    if sha256 == previous_sha256:
+        return sha256, None
+    return sha256, extract(path, kind, max_chars)
@@ -0,0 +1,114 @@
+"""
+Passage index over document history, for searching text that has since
+been deleted.
+
+A passage is a distinct non-blank line of a document (markdown paragraphs
+are single lines). Each one is stored once per document however many
+snapshots contain it, together with the runs of consecutive snapshots it
+appeared in. A new snapshot therefore only writes the lines it added and
+closes the runs of the lines it dropped, and the index grows with unique
+text and edits rather than with the number of versions.
+
+History rows are never edited after they are written; compaction deletes
+some of them, after which the document is reindexed from scratch.
+"""
+import hashlib
+
+from django.db import transaction
+
+from .models import History, Passage, PassageSpan
+
+
+def passages(text):
+    return {line.strip() for line in (text or '').splitlines()} - {''}
+
+
+def passage_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def index_snapshot(row, content, previous=None, previous_content=None):
+    """Record the passages of a new History `row` that follows `previous`."""
+    lines = passages(content)
+    old_lines = passages(previous_content) if previous is not None else set()
+    added, removed = lines - old_lines, old_lines - lines
+    if not added and not removed:
+        return
+
+    with transaction.atomic():
+        if removed:
+            PassageSpan.objects.filter(
+                passage__document_id=row.document_id,
+                passage__text_hash__in=[passage_hash(text) for text in removed],
+                last__isnull=True,
+            ).update(last=previous)
+        if added:
+            hashes = {passage_hash(text): text for text in added}
+            known = dict(
+                Passage.objects.filter(document_id=row.document_id, text_hash__in=hashes)
+                .values_list('text_hash', 'id')
+            )
+            created = Passage.objects.bulk_create([
+                Passage(document_id=row.document_id, text=text, text_hash=text_hash)
+                for text_hash, text in hashes.items() if text_hash not in known
+            ])
+            passage_ids = [*known.values(), *(passage.id for passage in created)]
+            PassageSpan.objects.bulk_create([
+                PassageSpan(passage_id=passage_id, first=row) for passage_id in passage_ids
+            ])
+
+
+def reindex_document(document_id, batch_size=1000):
+    """
+    Rebuild the passages of one document by replaying its history once,
+    in id order. Returns the number of distinct passages.
+    """
+    from .versioning import apply_delta
+
+    with transaction.atomic():
+        Passage.objects.filter(document_id=document_id).delete()
+
+        known = {}       # text -> Passage
+        open_runs = {}   # text -> id of the first History row of its run
+        spans = []
+        content = ''
+        lines = set()
+        previous_id = None
+        rows = (
+            History.objects.filter(document_id=document_id).order_by('id')
+            .only('id', 'is_keyframe', 'content_snapshot', 'delta')
+        )
+        for row in rows.iterator(chunk_size=batch_size):
+            content = row.content_snapshot if row.is_keyframe else apply_delta(content, row.delta)
+            new_lines = passages(content)
+            for text in lines - new_lines:
+                spans.append((text, open_runs.pop(text), previous_id))
+            for text in new_lines - lines:
+                if text not in known:
+                    known[text] = Passage(document_id=document_id, text=text, text_hash=passage_hash(text))
+                open_runs[text] = row.id
+            lines, previous_id = new_lines, row.id
+        spans.extend((text, first_id, None) for text, first_id in open_runs.items())
+
+        Passage.objects.bulk_create(known.values(), batch_size=batch_size)
+        PassageSpan.objects.bulk_create([
+            PassageSpan(passage=known[text], first_id=first_id, last_id=last_id)
+            for text, first_id, last_id in spans
+        ], batch_size=batch_size)
+    return len(known)
+
+
+def version_ranges(passage_ids):
+    """Map passage id -> [{'first': {...}, 'last': {...} or None}, ...], oldest first."""
+    ranges = {}
+    spans = (
+        PassageSpan.objects.filter(passage_id__in=passage_ids)
+        .values_list('passage_id', 'first_id', 'first__timestamp', 'last_id', 'last__timestamp')
+        .order_by('first_id')
+    )
+    for passage_id, first_id, first_timestamp, last_id, last_timestamp in spans:
+        ranges.setdefault(passage_id, []).append({
+            'first': {'id': first_id, 'timestamp': first_timestamp},
+            'last': {'id': last_id, 'timestamp': last_timestamp} if last_id else None,
+        })
+    return ranges
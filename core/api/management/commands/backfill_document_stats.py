@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Document
+from api.textstats import STAT_FIELDS, document_stats, text_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored word, character and line counts of every document.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Documents updated per transaction (default: 500).',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        checked = updated = 0
+        while True:
+            # Keyset batches, so no cursor stays open while we write.
+            batch = list(
+                Document.objects.filter(id__gt=last_id).order_by('id').only('id', 'content', *STAT_FIELDS)[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            stale = []
+            for document in batch:
+                stats = text_stats(document.content)
+                if stats != document_stats(document):
+                    for field, value in stats.items():
+                        setattr(document, field, value)
+                    stale.append(document)
+            with transaction.atomic():
+                Document.objects.bulk_update(stale, STAT_FIELDS)
+            checked += len(batch)
+            updated += len(stale)
+
+        self.stdout.write(self.style.SUCCESS(f'{updated} of {checked} documents updated.'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import History
+from api.versioning import compact_history, retention_keep_ids
+
+
+class Command(BaseCommand):
+    help = 'Thin out old version history according to HISTORY_RETENTION.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--document', type=int, help='Only compact this document.')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='History rows processed per transaction (default: 500).',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report how many rows would be removed without deleting anything.',
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        document_ids = History.objects.order_by('document_id').values_list('document_id', flat=True).distinct()
+        if options['document']:
+            document_ids = document_ids.filter(document_id=options['document'])
+
+        total = 0
+        for document_id in list(document_ids):
+            keep_ids = retention_keep_ids(document_id, now)
+            if options['dry_run']:
+                removed = History.objects.filter(document_id=document_id).count() - len(keep_ids)
+            else:
+                removed = compact_history(document_id, keep_ids, options['batch_size'])
+            if removed:
+                self.stdout.write(f'Document {document_id}: {removed} snapshots removed')
+            total += removed
+
+        verb = 'would be removed' if options['dry_run'] else 'removed'
+        self.stdout.write(self.style.SUCCESS(f'{total} snapshots {verb}.'))
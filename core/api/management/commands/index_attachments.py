@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api import attachment_index
+from api.models import AttachmentText, DocumentFile
+
+
+class Command(BaseCommand):
+    help = (
+        'Extract the text of attachments for search and statistics. Files whose hash has not '
+        'changed since their last extraction are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--failed', action='store_true',
+            help='Only retry attachments whose extraction failed.',
+        )
+
+    def handle(self, *args, **options):
+        files = DocumentFile.objects.select_related('blob').order_by('id')
+        if options['failed']:
+            files = files.filter(text__status=AttachmentText.FAILED)
+        total = 0
+        for document_file in files.iterator():
+            attachment_index.submit(document_file)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f'{total} attachments submitted for text extraction.'))
@@ -0,0 +1,30 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Delete upload sessions idle for longer than UPLOAD_SESSION_TTL, with their partial files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report how many sessions would be removed without deleting anything.',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+        sessions = UploadSession.objects.filter(updated_at__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{sessions.count()} upload sessions would be removed.'))
+            return
+        # Deleted one by one so the post_delete signal removes each part file.
+        total = 0
+        for session in sessions.iterator():
+            session.delete()
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f'{total} upload sessions removed.'))
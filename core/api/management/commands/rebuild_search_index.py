@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api import search
+from api.history_index import reindex_document
+from api.models import Document
+
+
+class Command(BaseCommand):
+    help = (
+        'Reinstall the full-text search indexes and their triggers where missing, '
+        'then reindex every project, document, attachment and history passage.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--skip-history', action='store_true',
+            help='Leave the history passages alone and only reindex current text.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            search.rebuild(connection, ['documents', 'attachments'])
+        self.stdout.write(f'Current text and attachments reindexed ({connection.vendor}).')
+        if options['skip_history']:
+            return
+
+        passages = 0
+        document_ids = Document.objects.order_by('id').values_list('id', flat=True)
+        # One transaction per document, as in compact_history.
+        for document_id in document_ids.iterator():
+            passages += reindex_document(document_id)
+        with transaction.atomic():
+            search.rebuild(connection, ['history'])
+        self.stdout.write(self.style.SUCCESS(f'History reindexed: {passages} distinct passages.'))
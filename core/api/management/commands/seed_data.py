@@ -0,0 +1,154 @@
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import Document, History, Project, User, WritingActivity
+from api.textstats import text_stats, word_changes
+from api.versioning import encode_snapshot, summarize_snapshot
+
+WORDS = (
+    'the quick brown fox jumps over lazy dog document editor version history '
+    'draft chapter section paragraph revision outline summary research notes '
+    'analysis result method figure table appendix reference citation idea '
+    'argument evidence conclusion introduction background context question'
+).split()
+
+
+def make_text(rng, size):
+    """Markdown-ish prose of roughly `size` characters."""
+    parts = []
+    total = 0
+    while total < size:
+        if rng.random() < 0.05:
+            line = '## ' + ' '.join(rng.choice(WORDS) for _ in range(4)).title()
+        else:
+            line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))) + '.'
+        parts.append(line + '\n')
+        if rng.random() < 0.2:
+            parts.append('\n')
+        total += len(line) + 1
+    return ''.join(parts)
+
+
+def edit_text(rng, text, edits=None):
+    """An autosave-sized change: `edits` (by default 1-3) word insertions or short deletions."""
+    for _ in range(rng.randint(1, 3) if edits is None else edits):
+        position = rng.randrange(len(text) + 1)
+        if rng.random() < 0.7:
+            words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12)))
+            text = text[:position] + words + ' ' + text[position:]
+        else:
+            text = text[:position] + text[position + rng.randint(1, 60):]
+    return text
+
+
+class Command(BaseCommand):
+    help = 'Create synthetic users, projects, documents and history for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Users to create (default: 10).')
+        parser.add_argument('--projects', type=int, default=10, help='Projects per user (default: 10).')
+        parser.add_argument('--size', type=int, default=5000, help='Approximate document size in characters (default: 5000).')
+        parser.add_argument('--history', type=int, default=20, help='History versions per document (default: 20).')
+        parser.add_argument('--days', type=int, default=30, help='Spread the history over this many days (default: 30).')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data sets.')
+        parser.add_argument('--prefix', default='seed', help='Username prefix; emails are <prefix><n>@example.com.')
+        parser.add_argument('--password', default='seed-pass-123', help='Password of every created user.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows per bulk insert (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Users named {prefix}* already exist; pass another --prefix.')
+
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        now = timezone.now()
+        # Hashing is deliberately slow, so every user shares one hash.
+        password = make_password(options['password'])
+
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(email=f'{prefix}{n}@example.com', username=f'{prefix}{n}', password=password)
+                for n in range(options['users'])
+            ], batch_size=batch_size)
+
+            for user in users:
+                self.seed_user(user, rng, now, options)
+
+        total_projects = len(users) * options['projects']
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(users)} users, {total_projects} projects and '
+            f'{total_projects * options["history"]} history versions.'
+        ))
+
+    def seed_user(self, user, rng, now, options):
+        batch_size = options['batch_size']
+        span = timedelta(days=options['days'])
+        projects = Project.objects.bulk_create([
+            Project(
+                owner=user,
+                title=f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {n}',
+                description=' '.join(rng.choice(WORDS) for _ in range(12)),
+                created_at=now - span * rng.random(),
+            )
+            for n in range(options['projects'])
+        ], batch_size=batch_size)
+
+        documents = []
+        history = []
+        activity = {}
+        for project in projects:
+            content = make_text(rng, options['size'])
+            saved_at = project.created_at
+            step = (now - saved_at) / (options['history'] + 1)
+            document = Document(project=project, version=options['history'])
+            previous = None
+            for _ in range(options['history']):
+                row = History(
+                    document=document, timestamp=saved_at,
+                    **encode_snapshot(content, previous, previous and previous.text),
+                    **summarize_snapshot(content),
+                )
+                row.text = content
+                history.append(row)
+                previous = row
+
+                new_content = edit_text(rng, content)
+                saved_at += step
+                added, removed = word_changes(content, new_content)
+                day = activity.setdefault((project.id, timezone.localdate(saved_at)), [0, 0, 0, saved_at])
+                day[0] += added
+                day[1] += removed
+                day[2] += 1
+                day[3] = saved_at
+                content = new_content
+
+            document.content = content
+            document.last_modified = saved_at
+            for field, value in text_stats(content).items():
+                setattr(document, field, value)
+            documents.append(document)
+
+        # bulk_create skips Document.save(), which is why the counts are set above.
+        Document.objects.bulk_create(documents, batch_size=batch_size)
+        History.objects.bulk_create(history, batch_size=batch_size)
+
+        by_project = {document.project_id: document for document in documents}
+        credit = getattr(settings, 'ACTIVITY_SAVE_CREDIT', 60)
+        WritingActivity.objects.bulk_create([
+            WritingActivity(
+                user=user, document=by_project[project_id], day=day,
+                words_added=added, words_removed=removed, saves=saves,
+                active_seconds=saves * credit, last_saved_at=last_saved_at,
+            )
+            for (project_id, day), (added, removed, saves, last_saved_at) in activity.items()
+        ], batch_size=batch_size)
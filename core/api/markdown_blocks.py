@@ -0,0 +1,250 @@
+"""
+Markdown rendered block by block, with the same HTML as markdown.markdown.
+
+A document is split into top-level blocks at blank lines, keeping fenced
+code, lists, blockquotes, raw HTML blocks and indented continuations
+whole, so that rendering the blocks one by one gives the same HTML as
+rendering the document at once. Whether a chunk continues the block
+before it depends on the last element Markdown makes of that block,
+which follows Python-Markdown's own block rules: a heading, rule or
+reference definition ends a list or blockquote on any line, and raw HTML
+starts at a block-level tag on any line. Every block is rendered with
+the document's link reference definitions, which any block may use.
+
+Nothing here imports Django, so export workers (rendering.py) produce the
+same HTML as the cached previews and downloads (preview.py).
+"""
+import re
+import threading
+
+import markdown
+
+_local = threading.local()
+
+_BLANK_LINES_RE = re.compile(r'(\n(?:[ \t]*\n)+)')
+_FENCE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})', re.MULTILINE)
+# Python-Markdown's own block patterns (markdown/blockprocessors.py), for
+# telling what the last top-level element of a block is. Each starts with
+# the newline before its line, and is used on text with a newline put in
+# front, so that searches skip straight from one line start to the next.
+_LIST_ITEM_RE = re.compile(r'\n {0,3}(?:[*+-]|\d+\.) +')
+_QUOTE_RE = re.compile(r'\n {0,3}>')
+_HASH_HEADING_RE = re.compile(r'\n#{1,6}(?:\\.|[^\\])*?#*(?=\n|$)')
+_SETEXT_HEADING_RE = re.compile(r'\n.*\n[=-]+ *(?=\n|$)')
+_UNDERLINE_RE = re.compile(r'\n[=-]+ *$')
+_RULE_RE = re.compile(
+    r'\n {0,3}(?=(?P<rule>(?:-+ {0,2}){3,}|(?:_+ {0,2}){3,}|(?:\*+ {0,2}){3,}))(?P=rule) *(?=\n|$)'
+)
+_CODE_RE = re.compile(r'(?:\n(?: {4}.*| *(?=\n|$)))+')
+_DEFINITION_RE = re.compile(
+    r'\n {0,3}\[([^\[\]]*)\]: *\n? *([^\s]+) *(?:\n *)?((["\'])(.*)\4 *|\((.*)\) *)?(?=\n|$)'
+)
+# A line that may start something other than a paragraph: anything
+# indented or starting with a marker.
+_MARKUP_RE = re.compile(r'\n {0,4}[-#>\[<=*+_\d\t ]')
+# Raw HTML blocks start at a block-level tag or a comment at the start of
+# any line, and run to the matching closing tag, across blank lines.
+_HTML_START_RE = re.compile(r'^ {0,3}<(?:([a-zA-Z][a-zA-Z0-9]*)(?=[\s/>])|!--)', re.MULTILINE)
+_HTML_BLOCK_TAGS = frozenset(markdown.Markdown().block_level_elements)
+
+
+def _raw_html(chunk, html):
+    """
+    Follow the raw HTML blocks of `chunk`, given the block left open by
+    earlier chunks as [tag, depth] ('--' for a comment) or None. Return the
+    block open at the end of the chunk and the text outside raw HTML, as
+    the pieces before, between and after the raw blocks.
+    """
+    outside, position, start = [], 0, 0
+    while True:
+        if html is None:
+            match = '<' in chunk and _HTML_START_RE.search(chunk, position)
+            if not match:
+                outside.append(chunk[start:])
+                return None, outside
+            position = match.end()
+            tag = (match.group(1) or '--').lower()
+            end = chunk.find('>', position) + 1
+            if tag != '--' and (tag not in _HTML_BLOCK_TAGS or not end):
+                continue
+            outside.append(chunk[start:match.start()])
+            if tag == 'hr' or (tag != '--' and chunk[end - 2] == '/'):
+                # Empty tags are raw blocks of their own.
+                position = start = end
+                continue
+            html = [tag, 1]
+        if html[0] == '--':
+            close = chunk.find('-->', position)
+            if close < 0:
+                return html, outside
+            html, position = None, close + 3
+        else:
+            for match in re.finditer(rf'<(/?){html[0]}(?=[\s/>])', chunk[position:], re.IGNORECASE):
+                html[1] += -1 if match.group(1) else 1
+                if not html[1]:
+                    position = chunk.find('>', position + match.end()) + 1 or len(chunk)
+                    html = None
+                    break
+            else:
+                return html, outside
+        start = position
+
+
+def _leading_kind(chunk):
+    """
+    'list' or 'quote' if the first element of `chunk` would join a list or
+    blockquote before it, and '' if it may join anything: an indented
+    chunk continues a list item or code block, and reference definitions
+    add no element, so what follows them may continue the one before.
+    """
+    text = '\n' + chunk
+    match = _DEFINITION_RE.match(text)
+    while match:
+        text = '\n' + text[match.end():].lstrip('\n')
+        match = _DEFINITION_RE.match(text)
+    if not text.strip() or text.expandtabs(4).startswith('\n    '):
+        return ''
+    if _LIST_ITEM_RE.match(text):
+        return 'list'
+    if _QUOTE_RE.match(text):
+        return 'quote'
+    return None
+
+
+def _last_kind(text, last):
+    """
+    The kind of the last top-level element Markdown makes of `text` when it
+    follows an element of kind `last`: 'list', 'quote' or None for anything
+    else. The block processors are tried in Markdown's order; headings,
+    rules and reference definitions split a block wherever they are, and
+    whatever follows them starts again.
+    """
+    text = text.expandtabs(4)
+    while text.strip():
+        text = '\n' + text.lstrip('\n')
+        if text.startswith('\n    '):
+            if last == 'list':
+                return 'list'
+            text, last = text[_CODE_RE.match(text).end():], None
+            continue
+        match = _HASH_HEADING_RE.search(text) or _SETEXT_HEADING_RE.match(text) or _RULE_RE.search(text)
+        if match:
+            text, last = text[match.end():], None
+            continue
+        if _LIST_ITEM_RE.match(text):
+            return 'list'
+        if _QUOTE_RE.search(text):
+            return 'quote'
+        match = _DEFINITION_RE.search(text)
+        if match is None:
+            return None
+        if text[:match.start()].strip():
+            last = None
+        text = text[match.end():]
+    return last
+
+
+def _definitions(text):
+    """The reference definitions of `text`, leaving out those a setext underline makes headings."""
+    text = '\n' + text
+    found = []
+    for match in _DEFINITION_RE.finditer(text):
+        before = '\n' + text[:match.start()].rstrip('\n').rsplit('\n', 1)[-1]
+        underlined = _SETEXT_HEADING_RE.match(text, match.start()) and (
+            not before.strip()
+            or any(pattern.match(before) for pattern in (_HASH_HEADING_RE, _RULE_RE, _UNDERLINE_RE))
+        )
+        if not underlined:
+            found.append(match.group()[1:])
+    return found
+
+
+def split_blocks(text):
+    """Return (blocks, reference definitions) of a Markdown document."""
+    blocks, definitions = [], []
+    current = ''
+    fence = None
+    html = None      # [tag, depth] while inside a raw HTML block
+    last = None      # the kind of the last element of `current`
+    # Paragraph-sized chunks, split at runs of blank lines; the runs are
+    # kept so blocks merged across them keep their exact text.
+    pieces = _BLANK_LINES_RE.split(text.strip('\n'))
+    for index in range(0, len(pieces), 2):
+        chunk = pieces[index]
+        separator = pieces[index - 1] if index else ''
+        # List items continue a (loose) list and blockquotes the blockquote
+        # before them; see _leading_kind for the rest. Most chunks are plain
+        # paragraphs, which need none of this.
+        plain = not _MARKUP_RE.search('\n' + chunk)
+        continues = fence or html
+        if not continues and not plain:
+            kind = _leading_kind(chunk)
+            continues = kind == '' or (kind is not None and kind == last)
+        if current and not continues:
+            blocks.append(current)
+            current = chunk
+            last = None
+        else:
+            current += separator + chunk
+        if plain and not html:
+            outside = [chunk]
+            last = None
+        else:
+            opened = html
+            html, outside = _raw_html(chunk, html)
+            if html is None:
+                last = _last_kind(outside[-1], last if opened is None and len(outside) == 1 else None)
+        # The substring tests skip the regexes for the common chunk.
+        if '``' in chunk or '~~' in chunk:
+            for match in _FENCE_RE.finditer(chunk):
+                marker = match.group(1)
+                if fence is None:
+                    fence = marker
+                elif marker.startswith(fence) and not chunk[match.end():].split('\n', 1)[0].strip():
+                    fence = None
+        for piece in outside:
+            if ']:' in piece:
+                definitions.extend(_definitions(piece))
+    if current:
+        blocks.append(current)
+    return blocks, '\n'.join(definitions)
+
+
+def _converter():
+    # Building a Markdown instance costs more than converting a small
+    # block, so each thread keeps one and resets it between blocks.
+    if not hasattr(_local, 'markdown'):
+        _local.markdown = markdown.Markdown()
+    return _local.markdown
+
+
+def render_block(source):
+    """
+    The HTML of one block source (see block_sources). Markdown leaves a
+    blank line after raw HTML that ends a block, which a block rendered
+    alone loses to the final strip, so the HTML then keeps a trailing
+    newline for join_html to put back.
+    """
+    converter = _converter().reset()
+    html = converter.convert(source)
+    if any(raw.endswith('\n') and html.endswith(raw[:-1]) for raw in converter.htmlStash.rawHtmlBlocks):
+        html += '\n'
+    return html
+
+
+def block_sources(text):
+    """The Markdown source of each block of `text`, with the document's reference definitions in front."""
+    blocks, definitions = split_blocks(text)
+    # In front, so that raw HTML left open at the end of a block cannot swallow them.
+    context = f'{definitions}\n\n' if definitions else ''
+    return [context + block for block in blocks]
+
+
+def join_html(parts):
+    """The HTML of a document from the render_block HTML of its blocks, in order."""
+    return '\n'.join(html for html in parts if html).rstrip('\n')
+
+
+def render_html(text):
+    """The HTML of a whole document, rendered block by block."""
+    return join_html(render_block(source) for source in block_sources(text))
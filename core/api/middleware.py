@@ -3,6 +3,7 @@ import traceback
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import exception_handler
+from rest_framework.exceptions import AuthenticationFailed
 from django.http import JsonResponse
 
 logger = logging.getLogger(__name__)
@@ -39,4 +40,33 @@ def custom_exception_handler(exc, context):
             'data': response.data
         }
     
-    return response
\ No newline at end of file
+    return response
+
+class JWTAuthMiddleware:
+    """
+    Channels middleware that authenticates WebSocket connections from a
+    `?token=<access token>` query parameter.
+    """
+    def __init__(self, inner):
+        self.inner = inner
+    
+    async def __call__(self, scope, receive, send):
+        from urllib.parse import parse_qs
+        token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+        scope = dict(scope, user=await get_user_for_token(token))
+        return await self.inner(scope, receive, send)
+
+async def get_user_for_token(token):
+    from channels.db import database_sync_to_async
+    from django.contrib.auth.models import AnonymousUser
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+    
+    if not token:
+        return AnonymousUser()
+    authentication = JWTAuthentication()
+    try:
+        validated = authentication.get_validated_token(token)
+        return await database_sync_to_async(authentication.get_user)(validated)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return AnonymousUser()
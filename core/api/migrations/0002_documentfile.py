@@ -0,0 +1,24 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='documents/%Y/%m/%d/')),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='api.document')),
+            ],
+        ),
+    ]
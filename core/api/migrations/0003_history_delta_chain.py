@@ -0,0 +1,129 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:54
+
+import difflib
+import json
+
+from django.conf import settings
+from django.db import migrations, models
+
+# The encoding as it was when this migration was written, copied from
+# api/versioning.py so that later changes there cannot change what it does.
+DEFAULT_KEYFRAME_INTERVAL = 20
+
+
+def make_delta(old, new):
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    head = 0
+    limit = min(len(a), len(b))
+    while head < limit and a[head] == b[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and a[-1 - tail] == b[-1 - tail]:
+        tail += 1
+
+    ops = []
+    if head:
+        ops.append(head)
+    a_mid = a[head:len(a) - tail]
+    b_mid = b[head:len(b) - tail]
+    matcher = difflib.SequenceMatcher(None, a_mid, b_mid, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append(''.join(b_mid[j1:j2]))
+    if tail:
+        ops.append(tail)
+    return json.dumps(ops, separators=(',', ':'))
+
+
+def apply_delta(old, delta):
+    lines = old.splitlines(keepends=True)
+    pos = 0
+    out = []
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.extend(lines[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return ''.join(out)
+
+
+def encode_snapshot(content, previous, previous_content):
+    interval = max(1, getattr(settings, 'HISTORY_KEYFRAME_INTERVAL', DEFAULT_KEYFRAME_INTERVAL))
+    if previous is not None and previous.chain_depth + 1 < interval:
+        delta = make_delta(previous_content, content)
+        if len(delta) < len(content):
+            return {'content_snapshot': '', 'delta': delta, 'is_keyframe': False,
+                    'chain_depth': previous.chain_depth + 1}
+    return {'content_snapshot': content, 'delta': '', 'is_keyframe': True, 'chain_depth': 0}
+
+
+def encode_existing_history(apps, schema_editor):
+    History = apps.get_model('api', 'History')
+    # Without order_by('document_id'), the default -timestamp ordering would
+    # make distinct() return each document once per row.
+    document_ids = list(History.objects.order_by('document_id').values_list('document_id', flat=True).distinct())
+    for document_id in document_ids:
+        previous = previous_content = None
+        for row in History.objects.filter(document_id=document_id).order_by('id'):
+            content = row.content_snapshot
+            for field, value in encode_snapshot(content, previous, previous_content).items():
+                setattr(row, field, value)
+            row.save(update_fields=['content_snapshot', 'delta', 'is_keyframe', 'chain_depth'])
+            previous, previous_content = row, content
+
+
+def decode_history(apps, schema_editor):
+    History = apps.get_model('api', 'History')
+    document_ids = list(History.objects.order_by('document_id').values_list('document_id', flat=True).distinct())
+    for document_id in document_ids:
+        content = ''
+        for row in History.objects.filter(document_id=document_id).order_by('id'):
+            if row.is_keyframe:
+                content = row.content_snapshot
+                continue
+            content = apply_delta(content, row.delta)
+            row.content_snapshot = content
+            row.delta = ''
+            row.is_keyframe = True
+            row.chain_depth = 0
+            row.save(update_fields=['content_snapshot', 'delta', 'is_keyframe', 'chain_depth'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_documentfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='chain_depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='delta',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='is_keyframe',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='history',
+            name='content_snapshot',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(encode_existing_history, decode_history),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.0.6 on 2026-10-18 17:57
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+# Copied from api/versioning.py as it was when this migration was written.
+def apply_delta(old, delta):
+    lines = old.splitlines(keepends=True)
+    pos = 0
+    out = []
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.extend(lines[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return ''.join(out)
+
+
+def summarize_snapshot(content):
+    preview = content[:100]
+    if len(content) > 100:
+        preview += '...'
+    return {
+        'preview': preview,
+        'size': len(content),
+        'content_hash': hashlib.sha256(content.encode()).hexdigest(),
+    }
+
+
+def summarize_existing_history(apps, schema_editor):
+    History = apps.get_model('api', 'History')
+    document_ids = list(History.objects.order_by('document_id').values_list('document_id', flat=True).distinct())
+    for document_id in document_ids:
+        content = ''
+        for row in History.objects.filter(document_id=document_id).order_by('id'):
+            content = row.content_snapshot if row.is_keyframe else apply_delta(content, row.delta)
+            for field, value in summarize_snapshot(content).items():
+                setattr(row, field, value)
+            row.save(update_fields=['preview', 'size', 'content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_history_delta_chain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='preview',
+            field=models.CharField(blank=True, max_length=103),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['document', 'timestamp'], name='api_history_doc_ts_idx'),
+        ),
+        migrations.RunPython(summarize_existing_history, migrations.RunPython.noop),
+    ]
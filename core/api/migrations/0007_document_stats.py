@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_project_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='char_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
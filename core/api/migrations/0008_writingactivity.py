@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_document_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WritingActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('words_added', models.PositiveIntegerField(default=0)),
+                ('words_removed', models.PositiveIntegerField(default=0)),
+                ('saves', models.PositiveIntegerField(default=0)),
+                ('active_seconds', models.PositiveIntegerField(default=0)),
+                ('last_saved_at', models.DateTimeField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='writing_activity', to='api.document')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='writing_activity', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Writing activity',
+                'indexes': [models.Index(fields=['user', 'day'], name='api_activity_user_day_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='writingactivity',
+            constraint=models.UniqueConstraint(fields=('user', 'document', 'day'), name='api_activity_user_doc_day_uniq'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_writingactivity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['owner', 'created_at'], name='api_project_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['owner', 'title'], name='api_project_owner_title_idx'),
+        ),
+    ]
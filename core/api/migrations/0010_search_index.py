@@ -0,0 +1,188 @@
+from django.db import migrations
+
+
+# The full-text index DDL as api.search had it when this migration was
+# written, so that later changes to search.py do not change what it does.
+INSTALL_SQL = {
+    'sqlite': [
+        """
+        CREATE VIEW IF NOT EXISTS api_search_source AS
+        SELECT p.id AS project_id, p.title AS title, p.description AS description, d.content AS content
+        FROM api_project p LEFT JOIN api_document d ON d.project_id = p.id
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS api_search_fts USING fts5(
+            title, description, content,
+            content='api_search_source', content_rowid='project_id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_project_insert AFTER INSERT ON api_project BEGIN
+            INSERT INTO api_search_fts (rowid, title, description, content)
+            VALUES (new.id, new.title, new.description, NULL);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_project_update AFTER UPDATE OF title, description ON api_project
+        WHEN old.title IS NOT new.title OR old.description IS NOT new.description BEGIN
+            INSERT INTO api_search_fts (api_search_fts, rowid, title, description, content)
+            VALUES ('delete', old.id, old.title, old.description,
+                    (SELECT content FROM api_document WHERE project_id = old.id));
+            INSERT INTO api_search_fts (rowid, title, description, content)
+            VALUES (new.id, new.title, new.description,
+                    (SELECT content FROM api_document WHERE project_id = new.id));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_project_delete AFTER DELETE ON api_project BEGIN
+            INSERT INTO api_search_fts (api_search_fts, rowid, title, description, content)
+            VALUES ('delete', old.id, old.title, old.description,
+                    (SELECT content FROM api_document WHERE project_id = old.id));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_document_insert AFTER INSERT ON api_document BEGIN
+            INSERT INTO api_search_fts (api_search_fts, rowid, title, description, content)
+            SELECT 'delete', id, title, description, NULL FROM api_project WHERE id = new.project_id;
+            INSERT INTO api_search_fts (rowid, title, description, content)
+            SELECT id, title, description, new.content FROM api_project WHERE id = new.project_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_document_update AFTER UPDATE OF content ON api_document
+        WHEN old.content IS NOT new.content BEGIN
+            INSERT INTO api_search_fts (api_search_fts, rowid, title, description, content)
+            SELECT 'delete', id, title, description, old.content FROM api_project WHERE id = old.project_id;
+            INSERT INTO api_search_fts (rowid, title, description, content)
+            SELECT id, title, description, new.content FROM api_project WHERE id = new.project_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_document_delete AFTER DELETE ON api_document BEGIN
+            INSERT INTO api_search_fts (api_search_fts, rowid, title, description, content)
+            SELECT 'delete', id, title, description, old.content FROM api_project WHERE id = old.project_id;
+            INSERT INTO api_search_fts (rowid, title, description, content)
+            SELECT id, title, description, NULL FROM api_project WHERE id = old.project_id;
+        END
+        """,
+        # Index the projects and documents that exist already.
+        "INSERT INTO api_search_fts (api_search_fts) VALUES ('rebuild')",
+        "INSERT INTO api_search_fts (api_search_fts) VALUES ('optimize')",
+    ],
+    'postgresql': [
+        """
+        CREATE TABLE IF NOT EXISTS api_search_index (
+            project_id bigint PRIMARY KEY REFERENCES api_project (id) ON DELETE CASCADE,
+            meta tsvector NOT NULL,
+            body tsvector
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS api_search_meta_idx ON api_search_index USING gin (meta)',
+        'CREATE INDEX IF NOT EXISTS api_search_body_idx ON api_search_index USING gin (body)',
+        """
+        CREATE OR REPLACE FUNCTION api_search_meta(title text, description text) RETURNS tsvector AS $$
+            SELECT setweight(to_tsvector('simple', coalesce(title, '')), 'A')
+                || setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+        $$ LANGUAGE sql IMMUTABLE
+        """,
+        """
+        CREATE OR REPLACE FUNCTION api_search_body(content text) RETURNS tsvector AS $$
+            SELECT to_tsvector('simple', left(content, 1000000))
+        $$ LANGUAGE sql IMMUTABLE
+        """,
+        """
+        CREATE OR REPLACE FUNCTION api_search_project_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' AND NEW.title IS NOT DISTINCT FROM OLD.title
+                    AND NEW.description IS NOT DISTINCT FROM OLD.description THEN
+                RETURN NULL;
+            END IF;
+            INSERT INTO api_search_index (project_id, meta)
+            VALUES (NEW.id, api_search_meta(NEW.title, NEW.description))
+            ON CONFLICT (project_id) DO UPDATE SET meta = EXCLUDED.meta;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION api_search_document_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                UPDATE api_search_index SET body = NULL WHERE project_id = OLD.project_id;
+            ELSIF TG_OP = 'INSERT' OR NEW.content IS DISTINCT FROM OLD.content THEN
+                UPDATE api_search_index SET body = api_search_body(NEW.content)
+                WHERE project_id = NEW.project_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        'DROP TRIGGER IF EXISTS api_search_project ON api_project',
+        """
+        CREATE TRIGGER api_search_project AFTER INSERT OR UPDATE OF title, description ON api_project
+        FOR EACH ROW EXECUTE FUNCTION api_search_project_changed()
+        """,
+        'DROP TRIGGER IF EXISTS api_search_document ON api_document',
+        """
+        CREATE TRIGGER api_search_document AFTER INSERT OR UPDATE OF content OR DELETE ON api_document
+        FOR EACH ROW EXECUTE FUNCTION api_search_document_changed()
+        """,
+        # Index the projects and documents that exist already.
+        'TRUNCATE api_search_index',
+        """
+        INSERT INTO api_search_index (project_id, meta, body)
+        SELECT p.id, api_search_meta(p.title, p.description), api_search_body(d.content)
+        FROM api_project p LEFT JOIN api_document d ON d.project_id = p.id
+        """,
+        'ANALYZE api_search_index',
+    ],
+}
+
+UNINSTALL_SQL = {
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS api_search_document_delete',
+        'DROP TRIGGER IF EXISTS api_search_document_update',
+        'DROP TRIGGER IF EXISTS api_search_document_insert',
+        'DROP TRIGGER IF EXISTS api_search_project_delete',
+        'DROP TRIGGER IF EXISTS api_search_project_update',
+        'DROP TRIGGER IF EXISTS api_search_project_insert',
+        'DROP TABLE IF EXISTS api_search_fts',
+        'DROP VIEW IF EXISTS api_search_source',
+    ],
+    'postgresql': [
+        'DROP TRIGGER IF EXISTS api_search_document ON api_document',
+        'DROP TRIGGER IF EXISTS api_search_project ON api_project',
+        'DROP FUNCTION IF EXISTS api_search_document_changed()',
+        'DROP FUNCTION IF EXISTS api_search_project_changed()',
+        'DROP FUNCTION IF EXISTS api_search_body(text)',
+        'DROP FUNCTION IF EXISTS api_search_meta(text, text)',
+        'DROP TABLE IF EXISTS api_search_index',
+    ],
+}
+
+
+def execute(schema_editor, statements):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for sql in statements.get(connection.vendor, []):
+            cursor.execute(sql)
+
+
+def install_search_index(apps, schema_editor):
+    execute(schema_editor, INSTALL_SQL)
+
+
+def uninstall_search_index(apps, schema_editor):
+    execute(schema_editor, UNINSTALL_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_project_owner_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
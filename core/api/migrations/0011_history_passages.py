@@ -0,0 +1,160 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:54
+
+import hashlib
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# The full-text index DDL as api.search had it when this migration was
+# written, so that later changes to search.py do not change what it does.
+INSTALL_SQL = {
+    'sqlite': [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS api_passage_fts USING fts5(
+            text, content='api_passage', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_passage_fts_insert AFTER INSERT ON api_passage BEGIN
+            INSERT INTO api_passage_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_passage_fts_delete AFTER DELETE ON api_passage BEGIN
+            INSERT INTO api_passage_fts (api_passage_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END
+        """,
+    ],
+    'postgresql': [
+        """
+        ALTER TABLE api_passage ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', left(text, 1000000))) STORED
+        """,
+        'CREATE INDEX IF NOT EXISTS api_passage_search_idx ON api_passage USING gin (search_vector)',
+    ],
+}
+
+UNINSTALL_SQL = {
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS api_passage_fts_delete',
+        'DROP TRIGGER IF EXISTS api_passage_fts_insert',
+        'DROP TABLE IF EXISTS api_passage_fts',
+    ],
+    'postgresql': [
+        'DROP INDEX IF EXISTS api_passage_search_idx',
+        'ALTER TABLE api_passage DROP COLUMN IF EXISTS search_vector',
+    ],
+}
+
+
+def execute(schema_editor, statements):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for sql in statements.get(connection.vendor, []):
+            cursor.execute(sql)
+
+
+def install_passage_index(apps, schema_editor):
+    execute(schema_editor, INSTALL_SQL)
+
+
+def uninstall_passage_index(apps, schema_editor):
+    execute(schema_editor, UNINSTALL_SQL)
+
+
+# Copied from api/versioning.py and api/history_index.py as they were when
+# this migration was written.
+def apply_delta(old, delta):
+    lines = old.splitlines(keepends=True)
+    pos = 0
+    out = []
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.extend(lines[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return ''.join(out)
+
+
+def passages(text):
+    return {line.strip() for line in (text or '').splitlines()} - {''}
+
+
+def passage_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def index_existing_history(apps, schema_editor, batch_size=1000):
+    """Replay each document's history once, as reindex_document() does."""
+    History = apps.get_model('api', 'History')
+    Passage = apps.get_model('api', 'Passage')
+    PassageSpan = apps.get_model('api', 'PassageSpan')
+    document_ids = list(History.objects.order_by('document_id').values_list('document_id', flat=True).distinct())
+    for document_id in document_ids:
+        known = {}       # text -> Passage
+        open_runs = {}   # text -> id of the first History row of its run
+        spans = []
+        content = ''
+        lines = set()
+        previous_id = None
+        rows = (
+            History.objects.filter(document_id=document_id).order_by('id')
+            .only('id', 'is_keyframe', 'content_snapshot', 'delta')
+        )
+        for row in rows.iterator(chunk_size=batch_size):
+            content = row.content_snapshot if row.is_keyframe else apply_delta(content, row.delta)
+            new_lines = passages(content)
+            for text in lines - new_lines:
+                spans.append((text, open_runs.pop(text), previous_id))
+            for text in new_lines - lines:
+                if text not in known:
+                    known[text] = Passage(document_id=document_id, text=text, text_hash=passage_hash(text))
+                open_runs[text] = row.id
+            lines, previous_id = new_lines, row.id
+        spans.extend((text, first_id, None) for text, first_id in open_runs.items())
+
+        Passage.objects.bulk_create(known.values(), batch_size=batch_size)
+        PassageSpan.objects.bulk_create([
+            PassageSpan(passage=known[text], first_id=first_id, last_id=last_id)
+            for text, first_id, last_id in spans
+        ], batch_size=batch_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Passage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField()),
+                ('text_hash', models.CharField(max_length=64)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='passages', to='api.document')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PassageSpan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.history')),
+                ('last', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.history')),
+                ('passage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spans', to='api.passage')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='passage',
+            constraint=models.UniqueConstraint(fields=('document', 'text_hash'), name='api_passage_doc_hash_uniq'),
+        ),
+        migrations.RunPython(install_passage_index, uninstall_passage_index),
+        # After the index, so that its triggers see the passages.
+        migrations.RunPython(index_existing_history, migrations.RunPython.noop),
+    ]
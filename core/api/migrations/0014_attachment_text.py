@@ -0,0 +1,95 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# The full-text index DDL as api.search had it when this migration was
+# written, so that later changes to search.py do not change what it does.
+INSTALL_SQL = {
+    'sqlite': [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS api_attachment_fts USING fts5(
+            text, content='api_attachmenttext', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_attachment_fts_insert AFTER INSERT ON api_attachmenttext BEGIN
+            INSERT INTO api_attachment_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_attachment_fts_update AFTER UPDATE OF text ON api_attachmenttext
+        WHEN old.text IS NOT new.text BEGIN
+            INSERT INTO api_attachment_fts (api_attachment_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO api_attachment_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_attachment_fts_delete AFTER DELETE ON api_attachmenttext BEGIN
+            INSERT INTO api_attachment_fts (api_attachment_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END
+        """,
+    ],
+    'postgresql': [
+        """
+        ALTER TABLE api_attachmenttext ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', left(text, 1000000))) STORED
+        """,
+        'CREATE INDEX IF NOT EXISTS api_attachmenttext_search_idx ON api_attachmenttext USING gin (search_vector)',
+    ],
+}
+
+UNINSTALL_SQL = {
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS api_attachment_fts_delete',
+        'DROP TRIGGER IF EXISTS api_attachment_fts_update',
+        'DROP TRIGGER IF EXISTS api_attachment_fts_insert',
+        'DROP TABLE IF EXISTS api_attachment_fts',
+    ],
+    'postgresql': [
+        'DROP INDEX IF EXISTS api_attachmenttext_search_idx',
+        'ALTER TABLE api_attachmenttext DROP COLUMN IF EXISTS search_vector',
+    ],
+}
+
+
+def execute(schema_editor, statements):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for sql in statements.get(connection.vendor, []):
+            cursor.execute(sql)
+
+
+def install_attachment_index(apps, schema_editor):
+    execute(schema_editor, INSTALL_SQL)
+
+
+def uninstall_attachment_index(apps, schema_editor):
+    execute(schema_editor, UNINSTALL_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(blank=True, max_length=64)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('done', 'Done'), ('failed', 'Failed'), ('unsupported', 'Unsupported')], default='queued', max_length=12)),
+                ('text', models.TextField(blank=True)),
+                ('word_count', models.PositiveIntegerField(default=0)),
+                ('char_count', models.PositiveIntegerField(default=0)),
+                ('line_count', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document_file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='text', to='api.documentfile')),
+            ],
+        ),
+        migrations.RunPython(install_attachment_index, uninstall_attachment_index),
+    ]
@@ -1,7 +1,10 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from django.contrib.auth.models import BaseUserManager
+from .textstats import STAT_FIELDS, text_stats
 
 class UserManager(BaseUserManager):
     def create_user(self, email, username, password=None, **extra_fields):
@@ -36,9 +39,16 @@ class Project(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serve an owner's project list, date range filters and keyset
+            # pages in either supported ordering straight from the index.
+            models.Index(fields=['owner', 'created_at'], name='api_project_owner_created_idx'),
+            models.Index(fields=['owner', 'title'], name='api_project_owner_title_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -47,26 +57,207 @@ class Document(models.Model):
     project = models.OneToOneField(Project, on_delete=models.CASCADE, related_name='document')
     content = models.TextField(blank=True)
     last_modified = models.DateTimeField(auto_now=True)
+    # Bumped on every content save; clients send it back as base_version.
+    version = models.PositiveIntegerField(default=0)
+    # Maintained on save (see textstats.py) so reads never rescan the text.
+    word_count = models.PositiveIntegerField(default=0)
+    char_count = models.PositiveIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
     
     def __str__(self):
         return f"Document for {self.project.title}"
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            for field, value in text_stats(self.content).items():
+                setattr(self, field, value)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, *STAT_FIELDS}
+        super().save(*args, **kwargs)
+
+class FileBlob(models.Model):
+    """
+    The stored bytes of uploaded files, kept once per SHA-256 however many
+    DocumentFiles refer to them; removed when the last one goes (see
+    uploads.py).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.sha256
 
-# Add file upload endpoints
 class DocumentFile(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='files')
     file = models.FileField(upload_to='documents/%Y/%m/%d/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
     filename = models.CharField(max_length=255)
+    # Set for files uploaded through upload sessions; `file` then names the blob.
+    blob = models.ForeignKey(FileBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='files')
+    size = models.BigIntegerField(default=0)
+    content_type = models.CharField(max_length=100, blank=True)
+
+class AttachmentText(models.Model):
+    """
+    Plain text extracted from a DocumentFile, for search and statistics
+    (see attachment_index.py). `sha256` is the hash of the bytes the text
+    came from, so a file that has not changed is not extracted again.
+    """
+    QUEUED = 'queued'
+    DONE = 'done'
+    FAILED = 'failed'
+    UNSUPPORTED = 'unsupported'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (DONE, 'Done'), (FAILED, 'Failed'), (UNSUPPORTED, 'Unsupported')]
+
+    document_file = models.OneToOneField(DocumentFile, on_delete=models.CASCADE, related_name='text')
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default=QUEUED)
+    text = models.TextField(blank=True)
+    word_count = models.PositiveIntegerField(default=0)
+    char_count = models.PositiveIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class UploadSession(models.Model):
+    """
+    A resumable upload in progress. Chunks are appended at `received`,
+    the count of bytes already written and verified; `lease_until` marks
+    a chunk being written.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)
+    received = models.BigIntegerField(default=0)
+    lease_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
+    def __str__(self):
+        return f"{self.filename}: {self.received}/{self.size}"
+    
+
 # Add file upload endpoints
 class History(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='history')
-    content_snapshot = models.TextField()
+    # Keyframes keep the full text in content_snapshot; other rows store a
+    # delta against the previous row of the same document (see versioning.py).
+    content_snapshot = models.TextField(blank=True)
+    delta = models.TextField(blank=True)
+    is_keyframe = models.BooleanField(default=True)
+    chain_depth = models.PositiveIntegerField(default=0)
+    # Stored so timelines can be listed without touching the text columns.
+    preview = models.CharField(max_length=103, blank=True)
+    size = models.PositiveIntegerField(default=0)
+    content_hash = models.CharField(max_length=64, blank=True)
     timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-timestamp']
         verbose_name_plural = 'Histories'
+        indexes = [
+            models.Index(fields=['document', 'timestamp'], name='api_history_doc_ts_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Snapshot at {self.timestamp}"
+    
+    def get_content(self):
+        if not hasattr(self, '_content'):
+            from .versioning import get_content
+            self._content = get_content(self)
+        return self._content
+
+
+class Passage(models.Model):
+    """
+    A distinct line of text from a document's history, stored once no matter
+    how many snapshots contain it (see history_index.py).
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='passages')
+    text = models.TextField()
+    text_hash = models.CharField(max_length=64)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'text_hash'], name='api_passage_doc_hash_uniq'),
+        ]
+    
+    def __str__(self):
+        return self.text[:50]
+
+
+class PassageSpan(models.Model):
+    """
+    A run of consecutive snapshots of the passage's document that all
+    contain it. `last` is empty while the newest snapshot still does.
+    """
+    passage = models.ForeignKey(Passage, on_delete=models.CASCADE, related_name='spans')
+    first = models.ForeignKey(History, on_delete=models.CASCADE, related_name='+')
+    last = models.ForeignKey(History, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    
+    def __str__(self):
+        return f"{self.passage_id}: {self.first_id}-{self.last_id or ''}"
+
+
+class ExportJob(models.Model):
+    """
+    One rendering of a document's text into an export format. Jobs are
+    unique per document, content hash and format, and their output files
+    are shared by content hash (see export_jobs.py).
+    """
+    QUEUED = 'queued'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='export_jobs')
+    format = models.CharField(max_length=8)
+    content_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=QUEUED)
+    size = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'content_hash', 'format'], name='api_exportjob_doc_hash_fmt_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.format} export of document {self.document_id}: {self.status}"
+
+
+class WritingActivity(models.Model):
+    """
+    Daily rollup of a user's writing on one document. Rows are only ever
+    created or incremented as saves come in, never rebuilt from History.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='writing_activity')
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='writing_activity')
+    day = models.DateField()
+    words_added = models.PositiveIntegerField(default=0)
+    words_removed = models.PositiveIntegerField(default=0)
+    saves = models.PositiveIntegerField(default=0)
+    active_seconds = models.PositiveIntegerField(default=0)
+    last_saved_at = models.DateTimeField()
+    
+    class Meta:
+        verbose_name_plural = 'Writing activity'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'document', 'day'], name='api_activity_user_doc_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'day'], name='api_activity_user_day_idx'),
+        ]
     
     def __str__(self):
-        return f"Snapshot at {self.timestamp}"
\ No newline at end of file
+        return f"{self.user} on {self.day}"
@@ -0,0 +1,39 @@
+"""
+Incremental Markdown rendering, for live previews and HTML exports.
+
+Documents are rendered block by block (see markdown_blocks.py), and each
+block's HTML is cached in-process by the hash of its source, which
+includes the document's link reference definitions, in a cache bounded
+by PREVIEW_CACHE_BYTES. After an edit only the blocks it touched are
+parsed again. Block ids are 128-bit BLAKE2b digests, short enough for
+clients to send back the ids they already have.
+"""
+import hashlib
+
+from django.conf import settings
+
+from .caching import SizedLRUCache
+from .markdown_blocks import block_sources, join_html, render_block
+
+_cache = SizedLRUCache(maxbytes=getattr(settings, 'PREVIEW_CACHE_BYTES', 32 * 1024 * 1024))
+
+
+def _render(text):
+    """Yield (block id, html) for `text`, rendering only blocks not already cached."""
+    for source in block_sources(text):
+        block_id = hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+        html = _cache.get(block_id)
+        if html is None:
+            html = render_block(source)
+            _cache.set(block_id, html)
+        yield block_id, html
+
+
+def render_blocks(text):
+    """Return [(block id, html)] for `text`, rendering only blocks not already cached."""
+    return [(block_id, html.rstrip('\n')) for block_id, html in _render(text)]
+
+
+def render_html(text):
+    """The HTML of a whole document, assembled from its cached blocks."""
+    return join_html(html for _, html in _render(text))
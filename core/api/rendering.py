@@ -0,0 +1,157 @@
+"""
+Document renderers for export jobs (see export_jobs.py).
+
+Nothing here imports Django, so the functions can run in worker processes
+started with any multiprocessing start method. Rendering is deterministic:
+the same text always produces the same bytes, which is what lets output
+files be shared by content hash.
+
+PDFs are written directly, without a PDF library: Markdown is laid out as
+wrapped lines of the standard Courier fonts, which every PDF reader has
+built in, so nothing is embedded or fetched.
+"""
+import os
+import re
+import textwrap
+import uuid
+import zlib
+
+from .markdown_blocks import render_html
+
+# Points; A4 with 2 cm margins.
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 56
+BODY_SIZE = 10
+HEADING_SIZES = {1: 18, 2: 15, 3: 12}
+# Courier is monospaced: every glyph is 0.6 em wide.
+CHAR_WIDTH = 0.6
+
+_HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+_BULLET_RE = re.compile(r'^(\s*)[-*+]\s+(.*)$')
+_INLINE = [
+    (re.compile(r'!?\[([^\]]*)\]\([^)]*\)'), r'\1'),     # links and images -> their text
+    (re.compile(r'(\*\*|__)(?=\S)(.+?)(?<=\S)\1'), r'\2'),  # strong
+    (re.compile(r'(?<![\w*])\*(?=\S)(.+?)(?<=\S)\*'), r'\1'),  # emphasis
+    (re.compile(r'`([^`]*)`'), r'\1'),                  # inline code
+]
+
+
+def render(content, format):
+    """Return `content` exported as `format` ('md', 'html' or 'pdf') in bytes."""
+    if format == 'md':
+        return content.encode()
+    if format == 'html':
+        return render_html(content).encode()
+    if format == 'pdf':
+        return pdf(content)
+    raise ValueError(f'Unknown export format: {format}')
+
+
+def write(content, format, path):
+    """Render to `path` atomically and return the file size."""
+    body = render(content, format)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(body)
+    os.replace(temporary, path)
+    return len(body)
+
+
+def _plain(text):
+    for pattern, replacement in _INLINE:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _layout(content):
+    """Yield (font, size, text) lines, with None for vertical space."""
+    width = int((PAGE_WIDTH - 2 * MARGIN) / (BODY_SIZE * CHAR_WIDTH))
+    in_code = False
+    for line in content.splitlines():
+        if line.lstrip().startswith('```'):
+            in_code = not in_code
+            continue
+        if in_code:
+            line = line.expandtabs(4)
+            for start in range(0, max(len(line), 1), width):
+                yield 'F1', BODY_SIZE, line[start:start + width]
+            continue
+        if not line.strip():
+            yield None
+            continue
+        heading = _HEADING_RE.match(line)
+        if heading:
+            size = HEADING_SIZES.get(len(heading.group(1)), BODY_SIZE)
+            yield None
+            for part in textwrap.wrap(_plain(heading.group(2)), int(width * BODY_SIZE / size)) or ['']:
+                yield 'F2', size, part
+            continue
+        bullet = _BULLET_RE.match(line)
+        if bullet:
+            indent = ' ' * len(bullet.group(1).expandtabs(4))
+            parts = textwrap.wrap(
+                _plain(bullet.group(2)), width,
+                initial_indent=f'{indent}• ', subsequent_indent=f'{indent}  ',
+            )
+        else:
+            parts = textwrap.wrap(_plain(line), width)
+        for part in parts:
+            yield 'F1', BODY_SIZE, part
+
+
+def _escape(text):
+    data = text.encode('cp1252', errors='replace')
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _pages(content):
+    """Yield the content stream of each page."""
+    top, bottom = PAGE_HEIGHT - MARGIN, MARGIN
+    commands, y = [], top
+    for item in _layout(content):
+        if item is None:
+            if y < top:
+                y -= BODY_SIZE * 0.6
+            continue
+        font, size, text = item
+        leading = size * 1.3
+        if y - leading < bottom:
+            yield b'\n'.join(commands)
+            commands, y = [], top
+        y -= leading
+        commands.append(b'BT /%s %d Tf %d %.1f Td (%s) Tj ET' % (font.encode(), size, MARGIN, y, _escape(text)))
+    yield b'\n'.join(commands)
+
+
+def pdf(content):
+    """Lay `content` (Markdown) out as a text PDF and return its bytes."""
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # the page tree, once the pages are known
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier-Bold /Encoding /WinAnsiEncoding >>',
+    ]
+    page_ids = []
+    for stream in _pages(content):
+        stream = zlib.compress(stream, 6)
+        objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(stream), stream))
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>'
+            % (PAGE_WIDTH, PAGE_HEIGHT, len(objects))
+        )
+        page_ids.append(len(objects))
+    kids = b' '.join(b'%d 0 R' % number for number in page_ids)
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_ids))
+
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
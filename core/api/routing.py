@@ -0,0 +1,7 @@
+from django.urls import path
+
+from . import consumers
+
+websocket_urlpatterns = [
+    path('ws/documents/<int:document_id>/', consumers.DocumentConsumer.as_asgi()),
+]
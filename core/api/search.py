@@ -0,0 +1,856 @@
+"""
+Full-text search over project titles, descriptions and document text.
+
+There is one index entry per project. On SQLite it is an FTS5 table that
+reads its text from a view over api_project and api_document, so document
+text is not stored a second time. On PostgreSQL it is a table of weighted
+tsvectors with GIN indexes. Either way, database triggers keep the index
+current on every insert, update and delete, including queryset updates
+and bulk_create, which skip Django signals.
+
+Tokens are case-folded but not stemmed, so a prefix query like "draf*"
+finds "drafting" on both backends. Results carry short highlighted
+snippets that the database cuts out of the text itself (FTS5 snippet(),
+ts_headline). Other databases fall back to an unranked icontains filter
+with snippets built in Python.
+
+The 'history' schema indexes the passage table kept by history_index.py
+the same way, for ?mode=history searches over text that has since been
+deleted.
+
+The 'attachments' schema indexes the text extracted from attachments
+(attachment_index.py), one entry per file. A document also matches when
+every term matches one of its attachments; it then scores as the better
+of the two matches, and a snippet of its best attachment joins the others.
+
+Schema changes that rebuild api_project or api_document on SQLite drop
+their triggers, so after every migrate (post_migrate, see signals.py)
+ensure_installed() puts back whatever is missing and reindexes that
+schema. `manage.py rebuild_search_index` installs anything missing and
+reindexes everything from scratch.
+"""
+import html
+import re
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connection as default_connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Q
+
+from .history_index import version_ranges
+
+# A double-quoted phrase, optionally followed by *, or a bare word.
+_TERM_RE = re.compile(r'"([^"]*)"(\*?)|(\S+)')
+# Runs of letters and digits, the same tokens FTS5's unicode61 sees.
+_WORD_RE = re.compile(r'[^\W_]+')
+
+# Indexes installed by install(): one entry per project for current text,
+# one per distinct passage of the version history and one per attachment.
+SCHEMAS = ('documents', 'history', 'attachments')
+# The api migration that installs each of them.
+MIGRATIONS = {'documents': '0010_search_index', 'history': '0011_history_passages', 'attachments': '0014_attachment_text'}
+# Names of the views, tables, triggers, indexes and functions in install_sql.
+_CREATED_RE = re.compile(
+    r'CREATE (?:OR REPLACE )?(?:VIEW|VIRTUAL TABLE|TABLE|TRIGGER|INDEX|FUNCTION) (?:IF NOT EXISTS )?(\w+)'
+)
+
+# Private-use characters that mark hits in raw snippets. They are swapped
+# for <mark> tags only after the snippet text has been HTML-escaped.
+MARK_START, MARK_END, FRAGMENT_BREAK = '\ue000', '\ue001', '\ue002'
+ELLIPSIS = '\u2026'
+
+
+@dataclass(frozen=True)
+class Term:
+    """One query term: a single word or a phrase, optionally a prefix."""
+    words: tuple
+    prefix: bool = False
+
+
+def parse_query(text):
+    """
+    Split a search box string into terms. Every term has to match. Quoted
+    text is a phrase, and a trailing * turns the last word into a prefix.
+    """
+    terms = []
+    for match in _TERM_RE.finditer(text or ''):
+        phrase, phrase_star, word = match.groups()
+        if phrase is not None:
+            words, prefix = _WORD_RE.findall(phrase), phrase_star == '*'
+        else:
+            words, prefix = _WORD_RE.findall(word), word.endswith('*')
+        if words:
+            terms.append(Term(tuple(word.lower() for word in words), prefix))
+    return terms
+
+
+def snippet_count():
+    return getattr(settings, 'SEARCH_SNIPPETS', 3)
+
+
+def snippet_words():
+    return getattr(settings, 'SEARCH_SNIPPET_WORDS', 16)
+
+
+def render_snippet(raw):
+    text = html.escape(' '.join(raw.split()), quote=False)
+    return text.replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def result_row(document_id, project_id, title, score, fragments):
+    # Fragments without a hit are just the start of a column; leave them out.
+    snippets = [render_snippet(raw) for raw in fragments if raw and MARK_START in raw]
+    return {
+        'id': document_id,
+        'project': project_id,
+        'title': title,
+        'score': score,
+        'snippets': snippets[:snippet_count()],
+    }
+
+
+def text_snippets(text, terms):
+    """Raw snippets around the first hits in `text`, for backends without snippet support."""
+    pattern = re.compile('|'.join(re.escape(' '.join(term.words)) for term in terms), re.IGNORECASE)
+    radius = snippet_words() * 3
+    fragments, covered = [], 0
+    for match in pattern.finditer(text):
+        if match.start() < covered:
+            continue
+        start, end = max(0, match.start() - radius), min(len(text), match.end() + radius)
+        fragments.append(''.join([
+            ELLIPSIS if start else '', text[start:match.start()],
+            MARK_START, match.group(), MARK_END,
+            text[match.end():end], ELLIPSIS if end < len(text) else '',
+        ]))
+        covered = end
+        if len(fragments) == snippet_count():
+            break
+    return fragments
+
+
+class SQLiteIndex:
+    tokenize = 'unicode61 remove_diacritics 2'
+    # bm25 weights of title, description and content.
+    weights = (10.0, 4.0, 1.0)
+
+    install_sql = {'documents': [
+        """
+        CREATE VIEW IF NOT EXISTS api_search_source AS
+        SELECT p.id AS project_id, p.title AS title, p.description AS description, d.content AS content
+        FROM api_project p LEFT JOIN api_document d ON d.project_id = p.id
+        """,
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS api_search_fts USING fts5(
+            title, description, content,
+            content='api_search_source', content_rowid='project_id',
+            tokenize='{tokenize}', prefix='2 3'
+        )
+        """,
+        # An external-content FTS5 table removes a row by being handed the
+        # exact values it indexed, so every trigger deletes the old values
+        # before inserting the new ones.
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_project_insert AFTER INSERT ON api_project BEGIN
+            INSERT INTO api_search_fts (rowid, title, description, content)
+            VALUES (new.id, new.title, new.description, NULL);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_project_update AFTER UPDATE OF title, description ON api_project
+        WHEN old.title IS NOT new.title OR old.description IS NOT new.description BEGIN
+            INSERT INTO api_search_fts (api_search_fts, rowid, title, description, content)
+            VALUES ('delete', old.id, old.title, old.description,
+                    (SELECT content FROM api_document WHERE project_id = old.id));
+            INSERT INTO api_search_fts (rowid, title, description, content)
+            VALUES (new.id, new.title, new.description,
+                    (SELECT content FROM api_document WHERE project_id = new.id));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_project_delete AFTER DELETE ON api_project BEGIN
+            INSERT INTO api_search_fts (api_search_fts, rowid, title, description, content)
+            VALUES ('delete', old.id, old.title, old.description,
+                    (SELECT content FROM api_document WHERE project_id = old.id));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_document_insert AFTER INSERT ON api_document BEGIN
+            INSERT INTO api_search_fts (api_search_fts, rowid, title, description, content)
+            SELECT 'delete', id, title, description, NULL FROM api_project WHERE id = new.project_id;
+            INSERT INTO api_search_fts (rowid, title, description, content)
+            SELECT id, title, description, new.content FROM api_project WHERE id = new.project_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_document_update AFTER UPDATE OF content ON api_document
+        WHEN old.content IS NOT new.content BEGIN
+            INSERT INTO api_search_fts (api_search_fts, rowid, title, description, content)
+            SELECT 'delete', id, title, description, old.content FROM api_project WHERE id = old.project_id;
+            INSERT INTO api_search_fts (rowid, title, description, content)
+            SELECT id, title, description, new.content FROM api_project WHERE id = new.project_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_search_document_delete AFTER DELETE ON api_document BEGIN
+            INSERT INTO api_search_fts (api_search_fts, rowid, title, description, content)
+            SELECT 'delete', id, title, description, old.content FROM api_project WHERE id = old.project_id;
+            INSERT INTO api_search_fts (rowid, title, description, content)
+            SELECT id, title, description, NULL FROM api_project WHERE id = old.project_id;
+        END
+        """,
+    ], 'history': [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS api_passage_fts USING fts5(
+            text, content='api_passage', content_rowid='id', tokenize='{tokenize}', prefix='2 3'
+        )
+        """,
+        # Passages are only ever inserted and deleted, never edited.
+        """
+        CREATE TRIGGER IF NOT EXISTS api_passage_fts_insert AFTER INSERT ON api_passage BEGIN
+            INSERT INTO api_passage_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_passage_fts_delete AFTER DELETE ON api_passage BEGIN
+            INSERT INTO api_passage_fts (api_passage_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END
+        """,
+    ], 'attachments': [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS api_attachment_fts USING fts5(
+            text, content='api_attachmenttext', content_rowid='id', tokenize='{tokenize}', prefix='2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_attachment_fts_insert AFTER INSERT ON api_attachmenttext BEGIN
+            INSERT INTO api_attachment_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_attachment_fts_update AFTER UPDATE OF text ON api_attachmenttext
+        WHEN old.text IS NOT new.text BEGIN
+            INSERT INTO api_attachment_fts (api_attachment_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO api_attachment_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS api_attachment_fts_delete AFTER DELETE ON api_attachmenttext BEGIN
+            INSERT INTO api_attachment_fts (api_attachment_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END
+        """,
+    ]}
+
+    uninstall_sql = {'documents': [
+        'DROP TRIGGER IF EXISTS api_search_document_delete',
+        'DROP TRIGGER IF EXISTS api_search_document_update',
+        'DROP TRIGGER IF EXISTS api_search_document_insert',
+        'DROP TRIGGER IF EXISTS api_search_project_delete',
+        'DROP TRIGGER IF EXISTS api_search_project_update',
+        'DROP TRIGGER IF EXISTS api_search_project_insert',
+        'DROP TABLE IF EXISTS api_search_fts',
+        'DROP VIEW IF EXISTS api_search_source',
+    ], 'history': [
+        'DROP TRIGGER IF EXISTS api_passage_fts_delete',
+        'DROP TRIGGER IF EXISTS api_passage_fts_insert',
+        'DROP TABLE IF EXISTS api_passage_fts',
+    ], 'attachments': [
+        'DROP TRIGGER IF EXISTS api_attachment_fts_delete',
+        'DROP TRIGGER IF EXISTS api_attachment_fts_update',
+        'DROP TRIGGER IF EXISTS api_attachment_fts_insert',
+        'DROP TABLE IF EXISTS api_attachment_fts',
+    ]}
+
+    def installed(self, cursor):
+        cursor.execute('SELECT name FROM sqlite_master')
+        return {name for name, in cursor.fetchall()}
+
+    def render(self, terms):
+        parts = []
+        for term in terms:
+            # Words never contain quotes, so wrapping them is enough to keep
+            # FTS5 operators and column names in user input inert.
+            parts.append('"%s"%s' % (' '.join(term.words), '*' if term.prefix else ''))
+        return ' '.join(parts)
+
+    def rebuild(self, cursor, schema):
+        table = {'documents': 'api_search_fts', 'history': 'api_passage_fts', 'attachments': 'api_attachment_fts'}[schema]
+        cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+
+    # Projects matching a query, with their scores, once through their own
+    # text and once per matching attachment. CROSS JOIN pins the full-text
+    # match as the outer loop. Left to itself SQLite walks the owner's
+    # projects and reruns the match for each one, which is thousands of
+    # times slower for an owner with many projects.
+    def matches(self):
+        weights = ', '.join(str(weight) for weight in self.weights)
+        return f"""
+            SELECT api_search_fts.rowid AS project_id, -bm25(api_search_fts, {weights}) AS score
+            FROM api_search_fts
+            CROSS JOIN api_project ON api_project.id = api_search_fts.rowid
+            CROSS JOIN api_document ON api_document.project_id = api_project.id
+            WHERE api_search_fts MATCH %s AND api_project.owner_id = %s
+            UNION ALL
+            SELECT api_project.id, -bm25(api_attachment_fts) * {self.weights[2]}
+            FROM api_attachment_fts
+            CROSS JOIN api_attachmenttext ON api_attachmenttext.id = api_attachment_fts.rowid
+            CROSS JOIN api_documentfile ON api_documentfile.id = api_attachmenttext.document_file_id
+            CROSS JOIN api_document ON api_document.id = api_documentfile.document_id
+            CROSS JOIN api_project ON api_project.id = api_document.project_id
+            WHERE api_attachment_fts MATCH %s AND api_project.owner_id = %s
+        """
+
+    def count(self, cursor, owner_id, terms):
+        expression = self.render(terms)
+        cursor.execute(
+            f'SELECT COUNT(DISTINCT project_id) FROM ({self.matches()})',
+            [expression, owner_id, expression, owner_id],
+        )
+        return cursor.fetchone()[0]
+
+    def page(self, cursor, owner_id, terms, offset, limit):
+        expression = self.render(terms)
+        snippet = [MARK_START, MARK_END, ELLIPSIS, snippet_words()]
+        # The page is ranked first and snippets are cut afterwards, for its
+        # rows only. snippet() reads the text inside SQLite and returns just
+        # the fragment, so documents never reach Python. The fragments come
+        # from the content, the best matching attachment and the
+        # description, in that order; a row that did not match one of them
+        # gets NULL there.
+        cursor.execute(
+            f"""
+            WITH page AS (
+                SELECT project_id, MAX(score) AS score
+                FROM ({self.matches()})
+                GROUP BY project_id
+                ORDER BY score DESC, project_id
+                LIMIT %s OFFSET %s
+            )
+            SELECT api_document.id, page.project_id, api_project.title, page.score,
+                   (SELECT snippet(api_search_fts, 2, %s, %s, %s, %s) FROM api_search_fts
+                    WHERE api_search_fts MATCH %s AND api_search_fts.rowid = page.project_id),
+                   (SELECT snippet(api_attachment_fts, 0, %s, %s, %s, %s) FROM api_attachment_fts
+                    CROSS JOIN api_attachmenttext ON api_attachmenttext.id = api_attachment_fts.rowid
+                    CROSS JOIN api_documentfile ON api_documentfile.id = api_attachmenttext.document_file_id
+                    WHERE api_attachment_fts MATCH %s AND api_documentfile.document_id = api_document.id
+                    ORDER BY bm25(api_attachment_fts), api_attachment_fts.rowid LIMIT 1),
+                   (SELECT snippet(api_search_fts, 1, %s, %s, %s, %s) FROM api_search_fts
+                    WHERE api_search_fts MATCH %s AND api_search_fts.rowid = page.project_id)
+            FROM page
+            JOIN api_project ON api_project.id = page.project_id
+            JOIN api_document ON api_document.project_id = page.project_id
+            ORDER BY page.score DESC, page.project_id
+            """,
+            [expression, owner_id, expression, owner_id, limit, offset,
+             *snippet, expression, *snippet, expression, *snippet, expression],
+        )
+        return [
+            result_row(document_id, project_id, title, score, fragments)
+            for document_id, project_id, title, score, *fragments in cursor.fetchall()
+        ]
+
+    def history_count(self, cursor, owner_id, terms):
+        cursor.execute(
+            """
+            SELECT COUNT(*)
+            FROM api_passage_fts
+            CROSS JOIN api_passage ON api_passage.id = api_passage_fts.rowid
+            CROSS JOIN api_document ON api_document.id = api_passage.document_id
+            CROSS JOIN api_project ON api_project.id = api_document.project_id
+            WHERE api_passage_fts MATCH %s AND api_project.owner_id = %s
+            """,
+            [self.render(terms), owner_id],
+        )
+        return cursor.fetchone()[0]
+
+    def history_page(self, cursor, owner_id, terms, offset, limit):
+        expression = self.render(terms)
+        cursor.execute(
+            """
+            WITH page AS (
+                SELECT api_passage_fts.rowid AS passage_id, -bm25(api_passage_fts) AS score
+                FROM api_passage_fts
+                CROSS JOIN api_passage ON api_passage.id = api_passage_fts.rowid
+                CROSS JOIN api_document ON api_document.id = api_passage.document_id
+                CROSS JOIN api_project ON api_project.id = api_document.project_id
+                WHERE api_passage_fts MATCH %s AND api_project.owner_id = %s
+                ORDER BY score DESC, api_passage_fts.rowid
+                LIMIT %s OFFSET %s
+            )
+            SELECT page.passage_id, api_document.id, api_project.id, api_project.title, page.score,
+                   snippet(api_passage_fts, 0, %s, %s, %s, %s)
+            FROM page
+            CROSS JOIN api_passage_fts ON api_passage_fts.rowid = page.passage_id
+            JOIN api_passage ON api_passage.id = page.passage_id
+            JOIN api_document ON api_document.id = api_passage.document_id
+            JOIN api_project ON api_project.id = api_document.project_id
+            WHERE api_passage_fts MATCH %s
+            ORDER BY page.score DESC, page.passage_id
+            """,
+            [expression, owner_id, limit, offset, MARK_START, MARK_END, ELLIPSIS, snippet_words(), expression],
+        )
+        return [
+            {'passage': passage_id, **result_row(document_id, project_id, title, score, [fragment])}
+            for passage_id, document_id, project_id, title, score, fragment in cursor.fetchall()
+        ]
+
+
+class PostgresIndex:
+    # Case folding without stemming; see the module docstring.
+    config = 'simple'
+    # Large documents are indexed up to this many characters, which keeps
+    # the tsvector under PostgreSQL's 1 MB limit.
+    max_chars = 1_000_000
+
+    install_sql = {'documents': [
+        """
+        CREATE TABLE IF NOT EXISTS api_search_index (
+            project_id bigint PRIMARY KEY REFERENCES api_project (id) ON DELETE CASCADE,
+            meta tsvector NOT NULL,
+            body tsvector
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS api_search_meta_idx ON api_search_index USING gin (meta)',
+        'CREATE INDEX IF NOT EXISTS api_search_body_idx ON api_search_index USING gin (body)',
+        f"""
+        CREATE OR REPLACE FUNCTION api_search_meta(title text, description text) RETURNS tsvector AS $$
+            SELECT setweight(to_tsvector('{config}', coalesce(title, '')), 'A')
+                || setweight(to_tsvector('{config}', coalesce(description, '')), 'B')
+        $$ LANGUAGE sql IMMUTABLE
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION api_search_body(content text) RETURNS tsvector AS $$
+            SELECT to_tsvector('{config}', left(content, {max_chars}))
+        $$ LANGUAGE sql IMMUTABLE
+        """,
+        """
+        CREATE OR REPLACE FUNCTION api_search_project_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' AND NEW.title IS NOT DISTINCT FROM OLD.title
+                    AND NEW.description IS NOT DISTINCT FROM OLD.description THEN
+                RETURN NULL;
+            END IF;
+            INSERT INTO api_search_index (project_id, meta)
+            VALUES (NEW.id, api_search_meta(NEW.title, NEW.description))
+            ON CONFLICT (project_id) DO UPDATE SET meta = EXCLUDED.meta;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION api_search_document_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                UPDATE api_search_index SET body = NULL WHERE project_id = OLD.project_id;
+            ELSIF TG_OP = 'INSERT' OR NEW.content IS DISTINCT FROM OLD.content THEN
+                UPDATE api_search_index SET body = api_search_body(NEW.content)
+                WHERE project_id = NEW.project_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        'DROP TRIGGER IF EXISTS api_search_project ON api_project',
+        """
+        CREATE TRIGGER api_search_project AFTER INSERT OR UPDATE OF title, description ON api_project
+        FOR EACH ROW EXECUTE FUNCTION api_search_project_changed()
+        """,
+        'DROP TRIGGER IF EXISTS api_search_document ON api_document',
+        """
+        CREATE TRIGGER api_search_document AFTER INSERT OR UPDATE OF content OR DELETE ON api_document
+        FOR EACH ROW EXECUTE FUNCTION api_search_document_changed()
+        """,
+    ], 'history': [
+        f"""
+        ALTER TABLE api_passage ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('{config}', left(text, {max_chars}))) STORED
+        """,
+        'CREATE INDEX IF NOT EXISTS api_passage_search_idx ON api_passage USING gin (search_vector)',
+    ], 'attachments': [
+        f"""
+        ALTER TABLE api_attachmenttext ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('{config}', left(text, {max_chars}))) STORED
+        """,
+        'CREATE INDEX IF NOT EXISTS api_attachmenttext_search_idx ON api_attachmenttext USING gin (search_vector)',
+    ]}
+
+    uninstall_sql = {'documents': [
+        'DROP TRIGGER IF EXISTS api_search_document ON api_document',
+        'DROP TRIGGER IF EXISTS api_search_project ON api_project',
+        'DROP FUNCTION IF EXISTS api_search_document_changed()',
+        'DROP FUNCTION IF EXISTS api_search_project_changed()',
+        'DROP FUNCTION IF EXISTS api_search_body(text)',
+        'DROP FUNCTION IF EXISTS api_search_meta(text, text)',
+        'DROP TABLE IF EXISTS api_search_index',
+    ], 'history': [
+        'DROP INDEX IF EXISTS api_passage_search_idx',
+        'ALTER TABLE api_passage DROP COLUMN IF EXISTS search_vector',
+    ], 'attachments': [
+        'DROP INDEX IF EXISTS api_attachmenttext_search_idx',
+        'ALTER TABLE api_attachmenttext DROP COLUMN IF EXISTS search_vector',
+    ]}
+
+    def installed(self, cursor):
+        cursor.execute(
+            """
+            SELECT relname FROM pg_class WHERE relnamespace = to_regnamespace(current_schema())::oid
+            UNION ALL SELECT tgname FROM pg_trigger
+            UNION ALL SELECT proname FROM pg_proc WHERE pronamespace = to_regnamespace(current_schema())::oid
+            """
+        )
+        return {name for name, in cursor.fetchall()}
+
+    def render(self, terms):
+        parts = []
+        for term in terms:
+            lexemes = [f"'{word}'" for word in term.words]
+            if term.prefix:
+                lexemes[-1] += ':*'
+            parts.append('(%s)' % ' <-> '.join(lexemes))
+        return ' & '.join(parts)
+
+    def rebuild(self, cursor, schema):
+        if schema in ('history', 'attachments'):
+            # Their vectors are generated columns; nothing to redo.
+            cursor.execute('ANALYZE api_passage' if schema == 'history' else 'ANALYZE api_attachmenttext')
+            return
+        cursor.execute('TRUNCATE api_search_index')
+        cursor.execute(
+            """
+            INSERT INTO api_search_index (project_id, meta, body)
+            SELECT p.id, api_search_meta(p.title, p.description), api_search_body(d.content)
+            FROM api_project p LEFT JOIN api_document d ON d.project_id = p.id
+            """
+        )
+        cursor.execute('ANALYZE api_search_index')
+
+    def conditions(self, terms):
+        """
+        One GIN-indexable condition per term: each term has to match the
+        title and description or the document text.
+        """
+        sql, params = [], []
+        for term in terms:
+            sql.append('(s.meta @@ to_tsquery(%s, %s) OR s.body @@ to_tsquery(%s, %s))')
+            params += [self.config, self.render([term])] * 2
+        return ' AND '.join(sql), params
+
+    def matches(self, owner_id, terms, rank_query):
+        """
+        SQL and parameters of the projects matching `terms`, scored against
+        `rank_query`: once through their own text and once per attachment
+        whose text matches every term.
+        """
+        conditions, params = self.conditions(terms)
+        sql = f"""
+            SELECT s.project_id, ts_rank_cd(s.meta, q) + ts_rank_cd(coalesce(s.body, ''), q) AS score
+            FROM api_search_index s
+            JOIN api_project p ON p.id = s.project_id
+            JOIN api_document d ON d.project_id = p.id,
+            to_tsquery(%s, %s) q
+            WHERE p.owner_id = %s AND {conditions}
+            UNION ALL
+            SELECT p.id, ts_rank_cd(a.search_vector, q)
+            FROM api_attachmenttext a
+            JOIN api_documentfile f ON f.id = a.document_file_id
+            JOIN api_document d ON d.id = f.document_id
+            JOIN api_project p ON p.id = d.project_id,
+            to_tsquery(%s, %s) q
+            WHERE p.owner_id = %s AND a.search_vector @@ to_tsquery(%s, %s)
+        """
+        return sql, [
+            self.config, rank_query, owner_id, *params,
+            self.config, rank_query, owner_id, self.config, self.render(terms),
+        ]
+
+    def count(self, cursor, owner_id, terms):
+        matches, params = self.matches(owner_id, terms, self.render(terms))
+        cursor.execute(f'SELECT COUNT(DISTINCT project_id) FROM ({matches}) hits', params)
+        return cursor.fetchone()[0]
+
+    def page(self, cursor, owner_id, terms, offset, limit):
+        # Rank and headline against any of the terms.
+        any_term = ' | '.join(self.render([term]) for term in terms)
+        matches, params = self.matches(owner_id, terms, any_term)
+        words = snippet_words()
+        options = (
+            f'StartSel={MARK_START}, StopSel={MARK_END}, FragmentDelimiter={FRAGMENT_BREAK}, '
+            f'MaxFragments={snippet_count()}, MaxWords={words}, MinWords={max(1, words // 2)}'
+        )
+        # ts_headline runs only for the rows of the page, inside the
+        # database: on the content and on the best matching attachment.
+        cursor.execute(
+            f"""
+            WITH page AS (
+                SELECT project_id, MAX(score) AS score
+                FROM ({matches}) hits
+                GROUP BY project_id
+                ORDER BY score DESC, project_id
+                LIMIT %s OFFSET %s
+            )
+            SELECT d.id, page.project_id, p.title, page.score,
+                   ts_headline(%s, left(d.content, {self.max_chars}), to_tsquery(%s, %s), %s),
+                   (SELECT ts_headline(%s, left(a.text, {self.max_chars}), to_tsquery(%s, %s), %s)
+                    FROM api_attachmenttext a
+                    JOIN api_documentfile f ON f.id = a.document_file_id
+                    WHERE f.document_id = d.id AND a.search_vector @@ to_tsquery(%s, %s)
+                    ORDER BY ts_rank_cd(a.search_vector, to_tsquery(%s, %s)) DESC, a.id
+                    LIMIT 1)
+            FROM page
+            JOIN api_project p ON p.id = page.project_id
+            JOIN api_document d ON d.project_id = page.project_id
+            ORDER BY page.score DESC, page.project_id
+            """,
+            [*params, limit, offset,
+             self.config, self.config, any_term, options,
+             self.config, self.config, any_term, options,
+             self.config, self.render(terms), self.config, any_term],
+        )
+        return [
+            result_row(
+                document_id, project_id, title, score,
+                [*headline.split(FRAGMENT_BREAK), *(attachment or '').split(FRAGMENT_BREAK)],
+            )
+            for document_id, project_id, title, score, headline, attachment in cursor.fetchall()
+        ]
+
+    def history_count(self, cursor, owner_id, terms):
+        cursor.execute(
+            """
+            SELECT COUNT(*)
+            FROM api_passage s
+            JOIN api_document d ON d.id = s.document_id
+            JOIN api_project p ON p.id = d.project_id
+            WHERE p.owner_id = %s AND s.search_vector @@ to_tsquery(%s, %s)
+            """,
+            [owner_id, self.config, self.render(terms)],
+        )
+        return cursor.fetchone()[0]
+
+    def history_page(self, cursor, owner_id, terms, offset, limit):
+        query = self.render(terms)
+        words = snippet_words()
+        options = (
+            f'StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={words}, MinWords={max(1, words // 2)}'
+        )
+        cursor.execute(
+            """
+            WITH page AS (
+                SELECT s.id AS passage_id, ts_rank_cd(s.search_vector, q) AS score
+                FROM api_passage s
+                JOIN api_document d ON d.id = s.document_id
+                JOIN api_project p ON p.id = d.project_id,
+                to_tsquery(%s, %s) q
+                WHERE p.owner_id = %s AND s.search_vector @@ q
+                ORDER BY score DESC, s.id
+                LIMIT %s OFFSET %s
+            )
+            SELECT page.passage_id, d.id, p.id, p.title, page.score,
+                   ts_headline(%s, s.text, to_tsquery(%s, %s), %s)
+            FROM page
+            JOIN api_passage s ON s.id = page.passage_id
+            JOIN api_document d ON d.id = s.document_id
+            JOIN api_project p ON p.id = d.project_id
+            ORDER BY page.score DESC, page.passage_id
+            """,
+            [self.config, query, owner_id, limit, offset, self.config, self.config, query, options],
+        )
+        return [
+            {'passage': passage_id, **result_row(document_id, project_id, title, score, [headline])}
+            for passage_id, document_id, project_id, title, score, headline in cursor.fetchall()
+        ]
+
+
+class FallbackIndex:
+    """Unranked substring matching for databases without a full-text engine."""
+    install_sql = {}
+    uninstall_sql = {}
+
+    def installed(self, cursor):
+        return set()
+
+    def rebuild(self, cursor, schema):
+        pass
+
+    def documents(self, owner_id, terms):
+        from .models import Document
+
+        own, attached = Q(), Q()
+        for term in terms:
+            text = ' '.join(term.words)
+            own &= (
+                Q(project__title__icontains=text) | Q(project__description__icontains=text)
+                | Q(content__icontains=text)
+            )
+            # Conditions in one filter() share the join, so every term has
+            # to match the same attachment.
+            attached &= Q(files__text__text__icontains=text)
+        return Document.objects.filter(project__owner_id=owner_id).filter(own | attached).distinct().order_by(
+            'project_id'
+        )
+
+    def count(self, cursor, owner_id, terms):
+        return self.documents(owner_id, terms).count()
+
+    def page(self, cursor, owner_id, terms, offset, limit):
+        from .models import AttachmentText
+
+        rows = self.documents(owner_id, terms).values_list('id', 'project_id', 'project__title', 'content')
+        rows = list(rows[offset:offset + limit])
+        attachments = {}
+        texts = AttachmentText.objects.filter(
+            document_file__document_id__in=[row[0] for row in rows], status=AttachmentText.DONE
+        ).order_by('id').values_list('document_file__document_id', 'text')
+        for document_id, text in texts:
+            if not attachments.get(document_id):
+                attachments[document_id] = text_snippets(text, terms)
+        return [
+            result_row(
+                document_id, project_id, title, 0.0,
+                text_snippets(content, terms) + attachments.get(document_id, []),
+            )
+            for document_id, project_id, title, content in rows
+        ]
+
+    def passages(self, owner_id, terms):
+        from .models import Passage
+
+        passages = Passage.objects.filter(document__project__owner_id=owner_id)
+        for term in terms:
+            passages = passages.filter(text__icontains=' '.join(term.words))
+        return passages.order_by('id')
+
+    def history_count(self, cursor, owner_id, terms):
+        return self.passages(owner_id, terms).count()
+
+    def history_page(self, cursor, owner_id, terms, offset, limit):
+        rows = self.passages(owner_id, terms).values_list(
+            'id', 'document_id', 'document__project_id', 'document__project__title', 'text'
+        )
+        return [
+            {'passage': passage_id, **result_row(document_id, project_id, title, 0.0, text_snippets(text, terms))}
+            for passage_id, document_id, project_id, title, text in rows[offset:offset + limit]
+        ]
+
+
+INDEXES = {
+    'sqlite': SQLiteIndex(),
+    'postgresql': PostgresIndex(),
+}
+
+
+def search_index(connection=None):
+    connection = connection or default_connection
+    return INDEXES.get(connection.vendor, FallbackIndex())
+
+
+def install(connection=None, schemas=SCHEMAS):
+    """Create the indexes and their triggers; safe to run on an installed database."""
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        for schema in schemas:
+            for sql in search_index(connection).install_sql.get(schema, []):
+                cursor.execute(sql)
+
+
+def uninstall(connection=None, schemas=SCHEMAS):
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        for schema in schemas:
+            for sql in search_index(connection).uninstall_sql.get(schema, []):
+                cursor.execute(sql)
+
+
+def rebuild(connection=None, schemas=SCHEMAS):
+    """
+    Reindex from the indexed tables. For 'history' that is the passage
+    table, which history_index.reindex_document() fills from History.
+    """
+    connection = connection or default_connection
+    install(connection, schemas)
+    with connection.cursor() as cursor:
+        for schema in schemas:
+            search_index(connection).rebuild(cursor, schema)
+
+
+def missing(connection=None, schemas=SCHEMAS):
+    """The schemas some of whose views, tables, triggers or functions are not in the database."""
+    connection = connection or default_connection
+    index = search_index(connection)
+    with connection.cursor() as cursor:
+        installed = index.installed(cursor)
+    return [
+        schema for schema in schemas
+        if any(name not in installed for sql in index.install_sql.get(schema, []) for name in _CREATED_RE.findall(sql))
+    ]
+
+
+def ensure_installed(connection=None):
+    """
+    Reinstall and reindex the schemas whose migration has run but part of
+    which is missing, such as triggers dropped when SQLite remade a table.
+    Returns the schemas it repaired.
+    """
+    connection = connection or default_connection
+    applied = MigrationRecorder(connection).applied_migrations()
+    broken = missing(connection, [schema for schema, name in MIGRATIONS.items() if ('api', name) in applied])
+    if broken:
+        rebuild(connection, broken)
+    return broken
+
+
+class SearchResults:
+    """
+    The owner's documents matching `terms`, best first, as a lazy sequence
+    that Django's Paginator can count and slice. Each item is a dict of
+    the document id, project id, project title, score and snippets. Scores
+    are higher for better matches and only compare within one backend.
+    """
+
+    def __init__(self, owner_id, terms, connection=None):
+        self.owner_id = owner_id
+        self.terms = terms
+        self.connection = connection or default_connection
+
+    def _count(self, index, cursor):
+        return index.count(cursor, self.owner_id, self.terms)
+
+    def _page(self, index, cursor, offset, limit):
+        return index.page(cursor, self.owner_id, self.terms, offset, limit)
+
+    def count(self):
+        if not self.terms:
+            return 0
+        with self.connection.cursor() as cursor:
+            return self._count(search_index(self.connection), cursor)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError('Search results can only be sliced.')
+        offset, stop = key.start or 0, key.stop
+        if not self.terms or stop is None or stop <= offset:
+            return []
+        with self.connection.cursor() as cursor:
+            return self._page(search_index(self.connection), cursor, offset, stop - offset)
+
+
+class HistorySearchResults(SearchResults):
+    """
+    Passages of the owner's document history matching `terms`. Each item
+    also carries the passage id and the version ranges it existed in.
+    """
+
+    def _count(self, index, cursor):
+        return index.history_count(cursor, self.owner_id, self.terms)
+
+    def _page(self, index, cursor, offset, limit):
+        results = index.history_page(cursor, self.owner_id, self.terms, offset, limit)
+        ranges = version_ranges([result['passage'] for result in results])
+        for result in results:
+            result['versions'] = ranges.get(result['passage'], [])
+        return results
@@ -1,6 +1,10 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Project, Document, History
+from django.urls import reverse
+from .models import Project, Document, History, ExportJob, DocumentFile, UploadSession
+from . import ai_services
+from .textops import OperationError, validate_ops
 from django.contrib.auth.password_validation import validate_password
 import re
 
@@ -63,11 +67,16 @@ class ProjectSerializer(serializers.ModelSerializer):
         fields = ('id', 'owner', 'title', 'description', 'created_at', 'document_count', 'last_modified')
         read_only_fields = ('owner', 'created_at')
     
+    # Both read the document loaded by select_related('document') in the
+    # views, with its content deferred.
     def get_document_count(self, obj):
-        return obj.document.content.count('\n') + 1 if obj.document.content else 0
+        document = getattr(obj, 'document', None)
+        # An empty document has one line in its stats but counts none here.
+        return document.line_count if document and document.char_count else 0
     
     def get_last_modified(self, obj):
-        return obj.document.last_modified if hasattr(obj, 'document') and obj.document else None
+        document = getattr(obj, 'document', None)
+        return document.last_modified if document else None
     
     def validate_title(self, value):
         if len(value) < 3:
@@ -78,35 +87,151 @@ class ProjectSerializer(serializers.ModelSerializer):
 
 class DocumentSerializer(serializers.ModelSerializer):
     project_title = serializers.ReadOnlyField(source='project.title')
-    word_count = serializers.SerializerMethodField()
-    character_count = serializers.SerializerMethodField()
+    word_count = serializers.ReadOnlyField()
+    character_count = serializers.ReadOnlyField(source='char_count')
     
     class Meta:
         model = Document
-        fields = ('id', 'project', 'project_title', 'content', 'last_modified', 'word_count', 'character_count')
-        read_only_fields = ('project', 'last_modified', 'word_count', 'character_count')
+        fields = ('id', 'project', 'project_title', 'content', 'version', 'last_modified', 'word_count', 'character_count')
+        read_only_fields = ('project', 'version', 'last_modified', 'word_count', 'character_count')
+
+class DocumentPatchSerializer(serializers.Serializer):
+    base_version = serializers.IntegerField(min_value=0)
+    ops = serializers.ListField(child=serializers.DictField(), allow_empty=True)
+    
+    def validate_ops(self, value):
+        try:
+            return validate_ops(value, max_ops=getattr(settings, 'DOCUMENT_PATCH_MAX_OPS', None))
+        except OperationError as exc:
+            raise serializers.ValidationError(str(exc))
+
+class PreviewSerializer(serializers.Serializer):
+    """Unsaved edit ops to preview on top of base_version, and the block ids the client already has."""
+    base_version = serializers.IntegerField(min_value=0, required=False)
+    ops = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    known = serializers.ListField(child=serializers.CharField(max_length=64), required=False, default=list)
+    
+    def validate_ops(self, value):
+        try:
+            return validate_ops(value, max_ops=getattr(settings, 'DOCUMENT_PATCH_MAX_OPS', None))
+        except OperationError as exc:
+            raise serializers.ValidationError(str(exc))
     
-    def get_word_count(self, obj):
-        return len(obj.content.split()) if obj.content else 0
+    def validate(self, attrs):
+        if attrs['ops'] and 'base_version' not in attrs:
+            raise serializers.ValidationError({'base_version': 'Required when ops are given.'})
+        return attrs
+
+class AIRequestSerializer(serializers.Serializer):
+    """Text to work on: given as `content`, or the current content of the owned `document`."""
+    content = serializers.CharField(required=False, allow_blank=False, trim_whitespace=False)
+    document = serializers.IntegerField(required=False, min_value=1)
     
-    def get_character_count(self, obj):
-        return len(obj.content) if obj.content else 0
+    def validate(self, attrs):
+        if ('content' in attrs) == ('document' in attrs):
+            raise serializers.ValidationError('Give either content or document.')
+        if 'document' in attrs:
+            document = Document.objects.filter(
+                id=attrs.pop('document'), project__owner=self.context['request'].user
+            ).only('content').first()
+            if document is None:
+                raise serializers.ValidationError({'document': 'Not found.'})
+            attrs['content'] = document.content
+        if len(attrs['content']) > settings.AI_MAX_CONTENT_CHARS:
+            raise serializers.ValidationError(
+                {'content': f'At most {settings.AI_MAX_CONTENT_CHARS} characters are accepted.'}
+            )
+        return attrs
+
+class AISummarizeSerializer(AIRequestSerializer):
+    max_sentences = serializers.IntegerField(min_value=1, max_value=20, default=3)
 
-class HistorySerializer(serializers.ModelSerializer):
+class AIRewriteSerializer(AIRequestSerializer):
+    style = serializers.ChoiceField(choices=ai_services.REWRITE_STYLES, default='concise')
+
+class AIIdeasSerializer(AIRequestSerializer):
+    count = serializers.IntegerField(min_value=1, max_value=20, default=5)
+
+class HistoryListSerializer(serializers.ModelSerializer):
+    """Timeline entry built from the stored preview; never loads the snapshot text."""
     formatted_time = serializers.SerializerMethodField()
-    preview = serializers.SerializerMethodField()
     
     class Meta:
         model = History
-        fields = ('id', 'document', 'content_snapshot', 'timestamp', 'formatted_time', 'preview')
-        read_only_fields = ('timestamp', 'formatted_time', 'preview')
+        fields = ('id', 'document', 'timestamp', 'formatted_time', 'preview', 'size', 'content_hash')
+        read_only_fields = fields
     
     def get_formatted_time(self, obj):
         from django.utils.timesince import timesince
         return f"{timesince(obj.timestamp)} ago"
+
+class HistorySerializer(HistoryListSerializer):
+    content_snapshot = serializers.SerializerMethodField()
+    
+    class Meta(HistoryListSerializer.Meta):
+        fields = HistoryListSerializer.Meta.fields + ('content_snapshot',)
+        read_only_fields = fields
+    
+    def get_content_snapshot(self, obj):
+        return obj.get_content()
+
+class SearchResultSerializer(serializers.Serializer):
+    """One search hit: the document, its project title and highlighted snippets (HTML, <mark> around hits)."""
+    id = serializers.IntegerField(read_only=True)
+    project = serializers.IntegerField(read_only=True)
+    title = serializers.CharField(read_only=True)
+    score = serializers.FloatField(read_only=True)
+    snippets = serializers.ListField(child=serializers.CharField(), read_only=True)
+
+class SnapshotRefSerializer(serializers.Serializer):
+    id = serializers.IntegerField(read_only=True)
+    timestamp = serializers.DateTimeField(read_only=True)
+
+class VersionRangeSerializer(serializers.Serializer):
+    """History rows a passage first and last appeared in; `last` is null while the newest snapshot still has it."""
+    first = SnapshotRefSerializer(read_only=True)
+    last = SnapshotRefSerializer(read_only=True, allow_null=True)
+
+class HistorySearchResultSerializer(SearchResultSerializer):
+    passage = serializers.IntegerField(read_only=True)
+    versions = VersionRangeSerializer(many=True, read_only=True)
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ExportJob
+        fields = ('id', 'document', 'format', 'status', 'size', 'error', 'created_at', 'finished_at', 'download_url')
+        read_only_fields = fields
+    
+    def get_download_url(self, obj):
+        if obj.status != ExportJob.DONE:
+            return None
+        return self.context['request'].build_absolute_uri(reverse('export-job-download', args=[obj.id]))
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    offset = serializers.IntegerField(source='received', read_only=True)
     
-    def get_preview(self, obj):
-        preview = obj.content_snapshot[:100]
-        if len(obj.content_snapshot) > 100:
-            preview += "..."
-        return preview
\ No newline at end of file
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'document', 'filename', 'content_type', 'size', 'sha256', 'offset', 'created_at')
+        read_only_fields = ('id', 'document', 'offset', 'created_at')
+    
+    def validate_size(self, value):
+        if not 0 < value <= settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"Size must be between 1 and {settings.UPLOAD_MAX_SIZE} bytes.")
+        return value
+    
+    def validate_sha256(self, value):
+        value = value.lower()
+        if value and not re.fullmatch(r'[0-9a-f]{64}', value):
+            raise serializers.ValidationError("Must be a hex SHA-256 digest.")
+        return value
+
+class DocumentFileSerializer(serializers.ModelSerializer):
+    sha256 = serializers.CharField(source='blob.sha256', read_only=True, default=None)
+    
+    class Meta:
+        model = DocumentFile
+        fields = ('id', 'document', 'filename', 'content_type', 'size', 'sha256', 'uploaded_at')
+        read_only_fields = fields
@@ -0,0 +1,55 @@
+from functools import partial
+
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import analytics, attachment_index, search, uploads
+from .models import Document, DocumentFile, History, Project, UploadSession, User
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    analytics.invalidate(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Project)
+def project_changed(sender, instance, **kwargs):
+    analytics.invalidate(instance.owner_id)
+
+
+@receiver(post_save, sender=Document)
+def document_saved(sender, instance, **kwargs):
+    analytics.invalidate_document(instance)
+
+
+@receiver(post_save, sender=History)
+def history_saved(sender, instance, created, **kwargs):
+    # Re-encoding a row during compaction changes nothing the dashboard shows.
+    if created:
+        analytics.invalidate_document(instance.document)
+
+
+@receiver(post_save, sender=DocumentFile)
+def document_file_saved(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(partial(attachment_index.submit, instance))
+
+
+@receiver(post_delete, sender=DocumentFile)
+def document_file_deleted(sender, instance, **kwargs):
+    if instance.blob_id:
+        uploads.release_blob(instance.blob_id)
+    analytics.invalidate_document_id(instance.document_id)
+
+
+@receiver(post_delete, sender=UploadSession)
+def upload_session_deleted(sender, instance, **kwargs):
+    uploads.remove_part(instance)
+
+
+@receiver(post_migrate)
+def search_index_migrated(sender, using, **kwargs):
+    # Remaking a table on SQLite drops its triggers; put them back.
+    if sender.label == 'api':
+        search.ensure_installed(connections[using])
@@ -0,0 +1,154 @@
+"""
+Extractive summaries with TextRank, in-process and without a network.
+
+A document is split into paragraphs at blank lines, and paragraphs into
+sentences; headings are left out. Each sentence becomes a TF-IDF vector of
+its content words, and sentences are ranked by PageRank over the graph
+whose edges are the cosine similarities between those vectors. The
+summary is the best `max_sentences` sentences, in document order.
+
+The similarity matrix of n sentences has n² entries, which is too many
+for a long document. Since the vectors are unit length, the similarity
+matrix is X·Xᵀ for the sparse sentence-term matrix X, so each power
+iteration step multiplies by X and Xᵀ instead, in time proportional to
+the number of (sentence, term) pairs. Terms are hashed, so a paragraph's
+term counts do not depend on the rest of the document: they are cached
+by the hash of the paragraph text, in a cache bounded by
+AI_SUMMARY_CACHE_BYTES, and summarizing an edited document only
+tokenizes the paragraphs that changed. IDF weights, which do depend on
+the whole document, are applied afterwards with NumPy.
+"""
+import hashlib
+import re
+import zlib
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+from .caching import SizedLRUCache
+
+_cache = SizedLRUCache(maxbytes=getattr(settings, 'AI_SUMMARY_CACHE_BYTES', 32 * 1024 * 1024))
+
+DAMPING = 0.85
+TOLERANCE = 1e-6
+MAX_ITERATIONS = 100
+
+_PARAGRAPH_RE = re.compile(r'\n[ \t]*\n\s*')
+_HEADING_RE = re.compile(r'^ {0,3}#{1,6}(?:\s.*)?$', re.MULTILINE)
+_BLOCK_START_RE = re.compile(r'\n(?= {0,3}(?:[-*+>]|\d+[.)])\s)')
+_MARKER_RE = re.compile(r'^\s*(?:[-*+>]\s+|\d+[.)]\s+)+')
+_SENTENCE_RE = re.compile(r'(?:(?<=[.!?])|(?<=[.!?]["\')\]]))\s+')
+_WORD_RE = re.compile(r"[^\W_]+(?:'[^\W_]+)?")
+STOPWORDS = frozenset('''
+    a about above after again against all also am an and any are as at be because been before being below
+    between both but by can could did do does doing down during each few for from further had has have having
+    he her here hers herself him himself his how i if in into is it its itself just me more most my myself no
+    nor not now of off on once only or other our ours ourselves out over own same she should so some such than
+    that the their theirs them themselves then there these they this those through to too under until up very
+    was we were what when where which while who whom why will with would you your yours yourself yourselves
+'''.split())
+
+
+def paragraphs(text):
+    return [paragraph for paragraph in _PARAGRAPH_RE.split(text or '') if paragraph.strip()]
+
+
+def sentences(paragraph):
+    """The sentences of a paragraph, with list and quote markers removed and headings left out."""
+    found = []
+    for block in _BLOCK_START_RE.split(_HEADING_RE.sub('', paragraph)):
+        block = ' '.join(_MARKER_RE.sub('', block).split())
+        found.extend(sentence for sentence in _SENTENCE_RE.split(block) if sentence)
+    return found
+
+
+def words(text):
+    """Lower-cased content words: no stopwords, numbers or words under three letters."""
+    return [word for word in (match.lower() for match in _WORD_RE.findall(text))
+            if word not in STOPWORDS and len(word) > 2 and not word.isdigit()]
+
+
+@lru_cache(maxsize=65536)
+def _term(word):
+    return zlib.crc32(word.encode())
+
+
+class _Paragraph:
+    """A paragraph's sentences and their (sentence, term, weight) entries."""
+
+    def __init__(self, text):
+        self.sentences = sentences(text)
+        rows, terms, counts = [], [], []
+        for index, sentence in enumerate(self.sentences):
+            frequency = Counter(_term(word) for word in words(sentence))
+            rows.extend([index] * len(frequency))
+            terms.extend(frequency)
+            counts.extend(frequency.values())
+        self.rows = np.array(rows, dtype=np.int32)
+        self.terms = np.array(terms, dtype=np.uint32)
+        # Sublinear term frequency, so that repeating a word adds less and less.
+        self.weights = 1 + np.log(np.array(counts, dtype=np.float64))
+
+    def __len__(self):
+        # Approximate size, for the cache bound.
+        text = sum(len(sentence) for sentence in self.sentences)
+        return text + self.rows.nbytes + self.terms.nbytes + self.weights.nbytes + 64 * len(self.sentences)
+
+
+def _paragraph(text):
+    key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    paragraph = _cache.get(key)
+    if paragraph is None:
+        paragraph = _Paragraph(text)
+        _cache.set(key, paragraph)
+    return paragraph
+
+
+def rank(text):
+    """Return (sentences, TextRank scores) of `text`; the scores sum to 1."""
+    parts = [_paragraph(paragraph) for paragraph in paragraphs(text)]
+    found = [sentence for part in parts for sentence in part.sentences]
+    count = len(found)
+    if not count:
+        return [], np.zeros(0)
+    offsets = np.cumsum([0] + [len(part.sentences) for part in parts[:-1]])
+    rows = np.concatenate([part.rows + offset for part, offset in zip(parts, offsets)])
+    terms, cols = np.unique(np.concatenate([part.terms for part in parts]), return_inverse=True)
+    vocabulary = len(terms)
+
+    # TF-IDF with smoothed IDF, then unit-length rows.
+    frequency = np.bincount(cols, minlength=vocabulary)
+    values = np.concatenate([part.weights for part in parts]) * (np.log((1 + count) / (1 + frequency)) + 1)[cols]
+    norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=count))
+    values /= norms[rows]
+    has_terms = norms > 0
+
+    def similarity(vector):
+        # (X·Xᵀ - I)·vector, leaving out each sentence's similarity to itself.
+        by_term = np.bincount(cols, weights=values * vector[rows], minlength=vocabulary)
+        return np.bincount(rows, weights=values * by_term[cols], minlength=count) - has_terms * vector
+
+    degree = similarity(np.ones(count))
+    linked = degree > 1e-9
+    scores = np.full(count, 1 / count)
+    for _ in range(MAX_ITERATIONS):
+        spread = np.divide(scores, degree, out=np.zeros(count), where=linked)
+        # Sentences sharing no words with any other pass their score to all.
+        stranded = scores[~linked].sum()
+        updated = (1 - DAMPING) / count + DAMPING * (similarity(spread) + stranded / count)
+        converged = np.abs(updated - scores).sum() < TOLERANCE
+        scores = updated
+        if converged:
+            break
+    return found, scores
+
+
+def summarize(text, max_sentences=3):
+    found, scores = rank(text)
+    if len(found) <= max_sentences:
+        return ' '.join(found)
+    # Best first; a stable sort keeps earlier sentences ahead on ties.
+    best = np.argsort(-scores, kind='stable')[:max_sentences]
+    return ' '.join(found[index] for index in sorted(best))
@@ -1,3 +1,2298 @@
-from django.test import TestCase
+import datetime
+import difflib
+import gzip
+import hashlib
+import importlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import markdown
+import numpy as np
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection
+from django.db.models import F, QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api import (
+    ai_services, analytics, attachment_index, collab, consumers, diffing, export_jobs, exporting, extraction, markdown_blocks,
+    preview, rendering, search, summarizer, uploads, urls, views,
+)
+from api.middleware import JWTAuthMiddleware
+from api.caching import TTLCache
+from api.history_index import reindex_document
+from api.models import (
+    AttachmentText, Document, DocumentFile, ExportJob, FileBlob, History, Passage, PassageSpan, Project,
+    UploadSession, User, WritingActivity,
+)
+from api.routing import websocket_urlpatterns
+from api.serializers import DocumentSerializer, HistoryListSerializer, ProjectSerializer
+from api import versioning
+from api.versioning import commit_content, compact_history
+
+
+def use_export_root(test, workers=0):
+    root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, root, ignore_errors=True)
+    overrides = override_settings(EXPORT_ROOT=root, EXPORT_WORKERS=workers)
+    overrides.enable()
+    test.addCleanup(overrides.disable)
+
+
+def use_worker_pool(test, module):
+    """Shut the module's worker pool down after the test, so that every test starts with a new one."""
+    def stop():
+        executor, module._executor = module._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+    test.addCleanup(stop)
+
+
+def use_media_root(test):
+    root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, root, ignore_errors=True)
+    overrides = override_settings(MEDIA_ROOT=root)
+    overrides.enable()
+    test.addCleanup(overrides.disable)
+    return root
+
+
+class APITestBase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('writer@example.com', 'writer', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.project = Project.objects.create(owner=self.user, title='Draft')
+        self.document = Document.objects.create(project=self.project, content='Hello world')
+
+
+def versions_of(base, count):
+    """`count` successive versions of a multi-line text, each changing one line."""
+    lines = [f'{base} line {number}\n' for number in range(12)]
+    versions = []
+    for number in range(count):
+        lines[number % len(lines)] = f'{base} edit {number}\n'
+        versions.append(''.join(lines))
+    return versions
+
+
+@override_settings(HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=0, HISTORY_KEYFRAME_INTERVAL=3)
+class HistoryStorageTests(APITestBase):
+    def test_delta_round_trip(self):
+        pairs = [
+            ('', ''), ('', 'new\n'), ('old\n', ''), ('a\nb\nc', 'a\nB\nc'), ('a\nb\n', 'a\nb\nc'),
+            ('one\ntwo\nthree\n', 'zero\none\nthree\nfour\n'), ('no newline', 'no newline at all'),
+            ('x\r\ny\r\n', 'x\r\nz\r\n'),
+        ]
+        for old, new in pairs:
+            with self.subTest(old=old, new=new):
+                self.assertEqual(versioning.apply_delta(old, versioning.make_delta(old, new)), new)
+        # Unchanged lines are copied by count, not stored.
+        self.assertEqual(json.loads(versioning.make_delta('a\nb\nc\n', 'a\nB\nc\n')), [1, -1, 'B\n', 1])
+
+    def test_small_changes_are_deltas_and_rewrites_are_keyframes(self):
+        previous = versioning.record_snapshot(self.document, 'intro\n' * 50)
+        encoded = versioning.encode_snapshot('intro\n' * 49 + 'outro\n', previous, 'intro\n' * 50)
+        self.assertFalse(encoded['is_keyframe'])
+        self.assertEqual(encoded['content_snapshot'], '')
+        self.assertEqual(encoded['chain_depth'], 1)
+        # A delta no smaller than the text is not worth storing.
+        self.assertTrue(versioning.encode_snapshot('x', previous, 'intro\n' * 50)['is_keyframe'])
+
+    def test_chains_restart_at_the_keyframe_interval(self):
+        versions = versions_of('doc', 8)
+        rows = [versioning.record_snapshot(self.document, content) for content in versions]
+        self.assertEqual([row.chain_depth for row in rows], [0, 1, 2, 0, 1, 2, 0, 1])
+        self.assertEqual([row.is_keyframe for row in rows], [True, False, False] * 2 + [True, False])
+        for row, content in zip(rows, versions):
+            # Fresh rows, so nothing is read from the instance cache.
+            self.assertEqual(versioning.get_content(History.objects.get(id=row.id)), content)
+
+    def test_get_content_reads_only_its_own_document(self):
+        other = Document.objects.create(project=Project.objects.create(owner=self.user, title='Other'))
+        mine, theirs = versions_of('mine', 5), versions_of('theirs', 5)
+        rows = []
+        for a, b in zip(mine, theirs):
+            rows.append(versioning.record_snapshot(self.document, a))
+            versioning.record_snapshot(other, b)
+        middle = History.objects.get(id=rows[2].id)
+        self.assertEqual(middle.chain_depth, 2)
+        self.assertEqual(versioning.get_content(middle), mine[2])
+
+    def test_broken_chain_is_reported(self):
+        rows = [versioning.record_snapshot(self.document, content) for content in versions_of('doc', 3)]
+        History.objects.filter(id=rows[0].id).delete()
+        with self.assertRaises(ValueError):
+            versioning.get_content(History.objects.get(id=rows[2].id))
+
+    def test_migration_encodes_existing_snapshots_and_reverses(self):
+        migration = importlib.import_module('api.migrations.0003_history_delta_chain')
+        other = Document.objects.create(project=Project.objects.create(owner=self.user, title='Other'))
+        versions = {self.document.id: versions_of('mine', 7), other.id: versions_of('theirs', 4)}
+        # Rows as they were before the migration: every one a full snapshot.
+        History.objects.bulk_create([
+            History(document_id=document_id, content_snapshot=content)
+            for document_id, contents in versions.items() for content in contents
+        ])
+        migration.encode_existing_history(apps, None)
+        rows = list(History.objects.filter(document=self.document).order_by('id'))
+        self.assertEqual([row.chain_depth for row in rows], [0, 1, 2, 0, 1, 2, 0])
+        self.assertEqual([row.content_snapshot == '' for row in rows], [not row.is_keyframe for row in rows])
+        for document_id, contents in versions.items():
+            stored = History.objects.filter(document_id=document_id).order_by('id')
+            self.assertEqual([versioning.get_content(row) for row in stored], contents)
+
+        migration.decode_history(apps, None)
+        for document_id, contents in versions.items():
+            stored = History.objects.filter(document_id=document_id).order_by('id')
+            self.assertEqual([(row.content_snapshot, row.delta, row.is_keyframe, row.chain_depth) for row in stored],
+                             [(content, '', True, 0) for content in contents])
+
+
+class HistoryRetentionTests(APITestBase):
+    def snapshot(self, content, timestamp):
+        with override_settings(HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=0):
+            return versioning.record_snapshot(self.document, content, now=timestamp)
+
+    @override_settings(HISTORY_COALESCE_WINDOW=120, HISTORY_COALESCE_MAX_SPAN=600, HISTORY_COALESCE_MIN_CHANGE=0)
+    def test_coalescing_within_the_window(self):
+        now = timezone.now()
+        self.assertFalse(versioning.should_coalesce(self.document, None, 'text', now))
+        previous = self.snapshot('first draft', now - datetime.timedelta(seconds=300))
+        self.document.last_modified = now - datetime.timedelta(seconds=30)
+        self.assertTrue(versioning.should_coalesce(self.document, previous, 'second draft', now))
+        self.assertIsNone(versioning.record_snapshot(self.document, 'second draft', now=now))
+        # The previous save was too long ago.
+        self.document.last_modified = now - datetime.timedelta(seconds=121)
+        self.assertFalse(versioning.should_coalesce(self.document, previous, 'second draft', now))
+        # Saves kept arriving, but the pending snapshot is older than the maximum span.
+        self.document.last_modified = now - datetime.timedelta(seconds=30)
+        previous.timestamp = now - datetime.timedelta(seconds=601)
+        self.assertFalse(versioning.should_coalesce(self.document, previous, 'second draft', now))
+
+    @override_settings(HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=20)
+    def test_coalescing_small_changes(self):
+        now = timezone.now()
+        previous = self.snapshot('The quick brown fox.', now - datetime.timedelta(days=1))
+        self.assertTrue(versioning.should_coalesce(self.document, previous, 'The quick brown cat.', now))
+        self.assertFalse(versioning.should_coalesce(
+            self.document, previous, 'The quick brown fox jumps over the lazy dog.', now
+        ))
+
+    @override_settings(HISTORY_RETENTION=[(3600, 60), (86400, 3600)])
+    def test_thinning_keeps_the_newest_row_per_bucket(self):
+        now = timezone.now().replace(minute=30, second=30, microsecond=0)
+        minute, hour = datetime.timedelta(minutes=1), datetime.timedelta(hours=1)
+        ages = {
+            'recent, alone in its minute': datetime.timedelta(seconds=5),
+            'older in a shared minute': minute + datetime.timedelta(seconds=20),
+            'newer in a shared minute': minute + datetime.timedelta(seconds=5),
+            'older in a shared hour': 3 * hour + 20 * minute,
+            'newer in a shared hour': 3 * hour + 10 * minute,
+            'beyond every tier': datetime.timedelta(days=2),
+        }
+        rows = {label: self.snapshot(f'{label}\n', now - age).id for label, age in ages.items()}
+        keep = versioning.retention_keep_ids(self.document.id, now)
+        self.assertEqual(keep, {
+            rows['recent, alone in its minute'], rows['newer in a shared minute'], rows['newer in a shared hour'],
+        })
+        with override_settings(HISTORY_RETENTION=[(3600, 60), (None, 86400)]):
+            self.assertIn(rows['beyond every tier'], versioning.retention_keep_ids(self.document.id, now))
+
+    def test_compaction_leaves_a_readable_chain_after_every_batch(self):
+        start = timezone.now() - datetime.timedelta(days=1)
+        versions = versions_of('doc', 8)
+        rows = [self.snapshot(content, start + datetime.timedelta(minutes=index))
+                for index, content in enumerate(versions)]
+        self.assertEqual([row.is_keyframe for row in rows], [True] + [False] * 7)
+        doomed = {rows[1].id, rows[2].id, rows[5].id}
+        keep = {row.id for row in rows} - doomed
+
+        # The first batch ends on a deleted row; stop before the second one
+        # re-encodes anything, as if the command had been interrupted.
+        with mock.patch.object(versioning, 'encode_snapshot', side_effect=RuntimeError('interrupted')):
+            with self.assertRaises(RuntimeError):
+                compact_history(self.document.id, keep, batch_size=3)
+        self.assertFalse(History.objects.filter(id__in={rows[1].id, rows[2].id}).exists())
+        following = History.objects.get(id=rows[3].id)
+        self.assertTrue(following.is_keyframe)
+        self.assertEqual(following.content_snapshot, versions[3])
+        for row in History.objects.filter(document=self.document):
+            self.assertEqual(versioning.get_content(row), versions[[r.id for r in rows].index(row.id)])
+
+        self.assertEqual(compact_history(self.document.id, keep, batch_size=3), 1)
+        stored = list(History.objects.filter(document=self.document).order_by('id'))
+        self.assertEqual([row.id for row in stored], sorted(keep))
+        expected = [content for row, content in zip(rows, versions) if row.id in keep]
+        self.assertEqual([versioning.get_content(row) for row in stored], expected)
+
+    @override_settings(HISTORY_RETENTION=[(3600, 3600)])
+    def test_command(self):
+        # Buckets are aligned to the hour, so pin the clock to keep the snapshots in one.
+        now = timezone.now().replace(minute=50, second=0, microsecond=0)
+        for index, content in enumerate(versions_of('doc', 4)):
+            self.snapshot(content, now - datetime.timedelta(minutes=40 - index))
+        out = io.StringIO()
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            call_command('compact_history', '--dry-run', stdout=out)
+            self.assertIn('3 snapshots would be removed', out.getvalue())
+            self.assertEqual(History.objects.count(), 4)
+            call_command('compact_history', stdout=io.StringIO())
+        self.assertEqual(History.objects.count(), 1)
+
+
+@override_settings(HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=0)
+class HistoryListingTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.versions = versions_of('doc', 25)
+        # Shared timestamps, so pages must break ties on id.
+        start = timezone.now() - datetime.timedelta(hours=1)
+        self.rows = [
+            versioning.record_snapshot(self.document, content, now=start + datetime.timedelta(minutes=index // 3))
+            for index, content in enumerate(self.versions)
+        ]
+        self.url = f'/api/documents/{self.document.id}/history/'
+
+    def test_cursor_pages_cover_every_row_once(self):
+        ids, url, pages = [], f'{self.url}?page_size=10', 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(entry['id'] for entry in response.data['results'])
+            url = response.data['next']
+            pages += 1
+        self.assertEqual(pages, 3)
+        self.assertEqual(ids, [row.id for row in sorted(self.rows, key=lambda row: (row.timestamp, row.id), reverse=True)])
+
+        first = self.client.get(f'{self.url}?page_size=10').data
+        second = self.client.get(first['next']).data
+        self.assertEqual(self.client.get(second['previous']).data['results'], first['results'])
+
+    def test_listing_never_loads_the_text(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+            self.client.get(f'{self.url}recent/')
+        self.assertEqual(response.status_code, 200)
+        for query in queries:
+            self.assertNotIn('"content_snapshot"', query['sql'])
+            self.assertNotIn('"delta"', query['sql'])
+        newest = response.data['results'][0]
+        self.assertEqual(newest['preview'], self.versions[-1][:100] + '...')
+        self.assertEqual(newest['size'], len(self.versions[-1]))
+        self.assertEqual(newest['content_hash'], hashlib.sha256(self.versions[-1].encode()).hexdigest())
+        self.assertNotIn('content_snapshot', newest)
+
+    def test_recent(self):
+        response = self.client.get(f'{self.url}recent/')
+        self.assertEqual([entry['id'] for entry in response.data], [row.id for row in self.rows[:-6:-1]])
+
+    def test_detail_rebuilds_the_text(self):
+        row = self.rows[12]
+        self.assertFalse(History.objects.get(id=row.id).is_keyframe)
+        response = self.client.get(f'{self.url}{row.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['content_snapshot'], self.versions[12])
+        self.assertEqual(response.data['size'], len(self.versions[12]))
+
+        other = User.objects.create_user('other@example.com', 'other', 'secret-pass-123')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(f'{self.url}{row.id}/').status_code, 404)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class DiffTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        diffing._cache.clear()
+
+    def apply(self, a, b, opcodes):
+        out = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal':
+                self.assertEqual(a[i1:i2], b[j1:j2])
+                out.extend(a[i1:i2])
+            else:
+                out.extend(b[j1:j2])
+        return out
+
+    def test_myers_finds_a_shortest_edit_script(self):
+        rng = random.Random(4)
+        for _ in range(200):
+            a = [rng.choice('abc') for _ in range(rng.randint(0, 12))]
+            b = [rng.choice('abc') for _ in range(rng.randint(0, 12))]
+            opcodes = diffing.myers(a, b)
+            self.assertEqual(self.apply(a, b, opcodes), b)
+            edits = sum(i2 - i1 + j2 - j1 for tag, i1, i2, j1, j2 in opcodes if tag != 'equal')
+            # Longest common subsequence by dynamic programming.
+            lcs = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+            for i, x in enumerate(a):
+                for j, y in enumerate(b):
+                    lcs[i + 1][j + 1] = lcs[i][j] + 1 if x == y else max(lcs[i][j + 1], lcs[i + 1][j])
+            self.assertEqual(edits, len(a) + len(b) - 2 * lcs[-1][-1])
+
+    def test_gives_up_past_max_edits(self):
+        a, b = list('abcdefgh'), list('stuvwxyz')
+        self.assertIsNone(diffing.myers(a, b, max_edits=5))
+        opcodes, complete = diffing.diff_sequences(['same'] + a, ['same'] + b, max_edits=5)
+        self.assertFalse(complete)
+        self.assertEqual(opcodes, [('equal', 0, 1, 0, 1), ('replace', 1, 9, 1, 9)])
+
+    def test_outputs(self):
+        old = 'one\ntwo\nthree\nfour\n'
+        new = 'one\n2\nthree\nfour\nfive'
+        self.assertEqual(diffing.diff_ops(old, new), {
+            'ops': [['=', 1], ['~', [['-', 'two'], ['+', '2'], ['=', '\n']]], ['=', 2], ['+', ['five']]],
+            'stats': {'added': 2, 'removed': 1},
+            'complete': True,
+        })
+        text, complete = diffing.unified_diff(old, new, 'a', 'b', context=1)
+        expected = ''.join(difflib.unified_diff(old.splitlines(True), new.splitlines(True), 'a', 'b', n=1))
+        self.assertEqual(text, expected.replace('+five', '+five\n\\ No newline at end of file\n'))
+        self.assertTrue(complete)
+
+    @override_settings(HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=0)
+    def test_endpoint(self):
+        rows = [versioning.record_snapshot(self.document, content) for content in ('a\nb\n', 'a\nc\n')]
+        url = f'/api/documents/{self.document.id}/history/{rows[0].id}/diff/{rows[1].id}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['ops'], [['=', 1], ['~', [['-', 'b'], ['+', 'c'], ['=', '\n']]]])
+        response = self.client.get(url, {'output': 'unified', 'context': 0})
+        self.assertIn('-b\n+c\n', response.data['diff'])
+        self.assertEqual(self.client.get(url, {'output': 'html'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'context': 'x'}).status_code, 400)
+        missing = f'/api/documents/{self.document.id}/history/{rows[0].id}/diff/{rows[1].id + 100}/'
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    def test_cache(self):
+        old, new = mock.Mock(return_value='a\n'), mock.Mock(return_value='b\n')
+        first = diffing.compare_versions(old, new, 'h1', 'h2')
+        self.assertIs(diffing.compare_versions(old, new, 'h1', 'h2'), first)
+        self.assertEqual((old.call_count, new.call_count), (1, 1))
+
+    @override_settings(HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=0)
+    def test_rows_without_a_hash_do_not_share_cache_entries(self):
+        rows = [versioning.record_snapshot(self.document, content) for content in ('a\n', 'b\n', 'c\n', 'd\n')]
+        History.objects.update(content_hash='')
+        base = f'/api/documents/{self.document.id}/history/'
+        first = self.client.get(f'{base}{rows[0].id}/diff/{rows[1].id}/').data['ops']
+        second = self.client.get(f'{base}{rows[2].id}/diff/{rows[3].id}/').data['ops']
+        self.assertEqual(first, [['~', [['-', 'a'], ['+', 'b'], ['=', '\n']]]])
+        self.assertEqual(second, [['~', [['-', 'c'], ['+', 'd'], ['=', '\n']]]])
+
+
+@override_settings(HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=0)
+class DocumentVersionTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/projects/{self.project.id}/document/'
+
+    def test_put_bumps_the_version_and_snapshots(self):
+        response = self.client.put(self.url, {'content': 'Second draft', 'base_version': 0}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 1)
+        response = self.client.put(f'/api/documents/{self.document.id}/', {'content': 'Third draft'}, format='json')
+        self.assertEqual(response.data['version'], 2)
+        # Saving the same text again changes nothing.
+        self.assertEqual(self.client.put(self.url, {'content': 'Third draft'}, format='json').data['version'], 2)
+        history = History.objects.filter(document=self.document).order_by('id')
+        self.assertEqual([row.get_content() for row in history], ['Hello world', 'Second draft'])
+
+    def test_stale_base_version_is_a_conflict(self):
+        self.client.put(self.url, {'content': 'Second draft'}, format='json')
+        for url in (self.url, f'/api/documents/{self.document.id}/'):
+            response = self.client.put(url, {'content': 'Lost edit', 'base_version': 0}, format='json')
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.data, {'error': 'The document was changed by another save.', 'version': 1})
+        self.assertEqual(self.client.put(self.url, {'content': 'x', 'base_version': 'one'}, format='json').status_code, 409)
+        self.document.refresh_from_db()
+        self.assertEqual((self.document.content, self.document.version), ('Second draft', 1))
+
+    def concurrent_save(self):
+        """Another save lands after the base_version check, before the write."""
+        real = commit_content
+
+        def racing(document, content, *args, **kwargs):
+            if not Document.objects.filter(pk=document.pk, content='Concurrent').exists():
+                Document.objects.filter(pk=document.pk).update(content='Concurrent', version=F('version') + 1)
+            return real(document, content, *args, **kwargs)
+        return mock.patch('api.views.commit_content', side_effect=racing)
+
+    def test_concurrent_put_with_base_version_is_a_conflict(self):
+        with self.concurrent_save():
+            response = self.client.put(self.url, {'content': 'Mine', 'base_version': 0}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['version'], 1)
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.content, 'Concurrent')
+
+    def test_concurrent_put_without_base_version_saves_on_top(self):
+        with self.concurrent_save():
+            response = self.client.put(self.url, {'content': 'Mine'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 2)
+        self.assertEqual(History.objects.filter(document=self.document).get().get_content(), 'Concurrent')
+
+    def test_patch_applies_ops_on_top_of_base_version(self):
+        response = self.client.patch(self.url, {
+            'base_version': 0, 'ops': [{'offset': 6, 'delete': 5, 'insert': 'there'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 1)
+        self.assertEqual(response.data['character_count'], len('Hello there'))
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.content, 'Hello there')
+
+        response = self.client.patch(self.url, {'base_version': 0, 'ops': [{'offset': 0, 'insert': 'Oh, '}]}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['version'], 1)
+        response = self.client.patch(self.url, {'base_version': 1, 'ops': [{'offset': 50, 'delete': 1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.patch(self.url, {'ops': []}, format='json').status_code, 400)
+
+
+class ConditionalRequestTests(APITestBase):
+    def get_etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        return response['ETag']
+
+    def assert_not_modified(self, url, etag, serializer):
+        # A 304 costs the single ETag query and never reaches the serializer.
+        with mock.patch.object(serializer, 'to_representation') as to_representation:
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        to_representation.assert_not_called()
+
+    def test_project_document_not_modified(self):
+        url = f'/api/projects/{self.project.id}/document/'
+        etag = self.get_etag(url)
+        self.assertFalse(etag.startswith('W/'))
+        self.assert_not_modified(url, etag, DocumentSerializer)
+
+    def test_project_detail_not_modified(self):
+        url = f'/api/projects/{self.project.id}/'
+        self.assert_not_modified(url, self.get_etag(url), ProjectSerializer)
+
+    def test_project_list_uses_weak_etag(self):
+        url = '/api/projects/'
+        etag = self.get_etag(url)
+        self.assertTrue(etag.startswith('W/'))
+        self.assert_not_modified(url, etag, ProjectSerializer)
+
+    def test_document_detail_not_modified(self):
+        url = f'/api/documents/{self.document.id}/'
+        self.assert_not_modified(url, self.get_etag(url), DocumentSerializer)
+
+    def test_history_list_not_modified(self):
+        History.objects.create(document=self.document, content_snapshot='Hello')
+        url = f'/api/documents/{self.document.id}/history/'
+        self.assert_not_modified(url, self.get_etag(url), HistoryListSerializer)
+
+    def test_etag_changes_after_save(self):
+        url = f'/api/projects/{self.project.id}/document/'
+        etag = self.get_etag(url)
+        self.client.put(url, {'content': 'Hello again'}, format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_project_list_etag_changes_when_title_changes(self):
+        etag = self.get_etag('/api/projects/')
+        self.client.patch(f'/api/projects/{self.project.id}/', {'title': 'Renamed'}, format='json')
+        response = self.client.get('/api/projects/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_put_with_stale_if_match_is_rejected(self):
+        url = f'/api/projects/{self.project.id}/document/'
+        etag = self.get_etag(url)
+        self.client.put(url, {'content': 'First'}, format='json')
+
+        response = self.client.put(url, {'content': 'Second'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.content, 'First')
+
+    def test_put_with_current_if_match_returns_new_etag(self):
+        url = f'/api/projects/{self.project.id}/document/'
+        etag = self.get_etag(url)
+
+        response = self.client.put(url, {'content': 'Updated'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.get_etag(url), response['ETag'])
+
+    def test_foreign_document_still_404s(self):
+        other = User.objects.create_user('other@example.com', 'other', 'secret-pass-123')
+        client = APIClient()
+        client.force_authenticate(other)
+        response = client.get(f'/api/projects/{self.project.id}/document/', HTTP_IF_NONE_MATCH='"x"')
+        self.assertEqual(response.status_code, 404)
+
+
+class DocumentStatsTests(APITestBase):
+    def test_counts_are_stored_on_save(self):
+        url = f'/api/projects/{self.project.id}/document/'
+        self.client.put(url, {'content': 'One two\nthree'}, format='json')
+        self.document.refresh_from_db()
+        self.assertEqual((self.document.word_count, self.document.char_count, self.document.line_count), (3, 13, 2))
+
+    def test_patch_updates_counts_incrementally(self):
+        url = f'/api/projects/{self.project.id}/document/'
+        response = self.client.patch(url, {'base_version': 0, 'ops': [
+            {'offset': 5, 'delete': 6, 'insert': ' there,\nbig world'},
+            {'offset': 0, 'delete': 1, 'insert': 'J'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.content, 'Jello there,\nbig world')
+        self.assertEqual((self.document.word_count, self.document.char_count, self.document.line_count), (4, 22, 2))
+        self.assertEqual(response.data['character_count'], 22)
+
+    def test_an_empty_document_has_one_line(self):
+        url = f'/api/projects/{self.project.id}/document/'
+        self.client.patch(url, {'base_version': 0, 'ops': [{'offset': 0, 'delete': 11}]}, format='json')
+        self.document.refresh_from_db()
+        self.assertEqual((self.document.word_count, self.document.char_count, self.document.line_count), (0, 0, 1))
+        self.assertEqual(self.client.get(f'/api/projects/{self.project.id}/stats/').data['stats']['lines'], 1)
+        self.assertEqual(self.client.get(f'/api/projects/{self.project.id}/').data['document_count'], 0)
+
+        self.client.put(url, {'content': 'Back\nagain'}, format='json')
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.line_count, 2)
+        self.client.put(url, {'content': ''}, format='json')
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.line_count, 1)
+
+
+class AnalyticsTests(APITestBase):
+    def test_totals_take_one_query(self):
+        with self.assertNumQueries(1):
+            totals = analytics.totals(self.user)
+        self.assertEqual(totals['total_projects'], 1)
+        self.assertEqual(totals['total_words'], 2)
+        self.assertEqual(totals['total_characters'], 11)
+
+    def test_cached_until_a_document_is_saved(self):
+        self.client.get('/api/analytics/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/analytics/')
+        self.assertEqual(response.data['stats']['total_words'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(f'/api/projects/{self.project.id}/document/', {'content': 'One two three'}, format='json')
+        response = self.client.get('/api/analytics/')
+        self.assertEqual(response.data['stats']['total_words'], 3)
+        self.assertEqual(response.data['stats']['total_history_versions'], 1)
+
+    def test_new_project_invalidates(self):
+        self.client.get('/api/analytics/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/projects/', {'title': 'Second'}, format='json')
+        response = self.client.get('/api/analytics/')
+        self.assertEqual(response.data['stats']['total_projects'], 2)
+        self.assertEqual(response.data['stats']['total_documents'], 2)
+
+
+class WritingActivityTests(APITestBase):
+    def test_saves_roll_up_per_day(self):
+        url = f'/api/projects/{self.project.id}/document/'
+        self.client.put(url, {'content': 'Hello brave new world'}, format='json')
+        self.client.patch(url, {'base_version': 1, 'ops': [{'offset': 0, 'delete': 5, 'insert': 'Goodbye'}]},
+                          format='json')
+        self.client.put(f'/api/documents/{self.document.id}/', {'content': 'Goodbye brave new world again'},
+                        format='json')
+
+        activity = WritingActivity.objects.get()
+        self.assertEqual((activity.words_added, activity.words_removed, activity.saves), (4, 1, 3))
+
+        response = self.client.get('/api/analytics/timeline/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['days']), 1)
+        self.assertEqual(response.data['totals']['saves'], 3)
+
+    def test_timeline_only_reads_the_requested_range(self):
+        WritingActivity.objects.create(
+            user=self.user, document=self.document, day=datetime.date(2024, 1, 1),
+            words_added=10, saves=1, last_saved_at=timezone.now()
+        )
+        response = self.client.get('/api/analytics/timeline/?date_from=2024-01-02&date_to=2024-12-31')
+        self.assertEqual(response.data['days'], [])
+        response = self.client.get('/api/analytics/timeline/?date_from=2024-01-01&date_to=2024-01-01')
+        self.assertEqual(response.data['totals']['words_added'], 10)
+        response = self.client.get('/api/analytics/timeline/?date_from=2024-13-01')
+        self.assertEqual(response.status_code, 400)
+
+    def test_timeline_at_the_calendar_limits(self):
+        response = self.client.get('/api/analytics/timeline/?date_to=0001-01-10')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/analytics/timeline/?date_from=0001-01-01&date_to=0001-01-10')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/analytics/timeline/?date_to=9999-12-31')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['date_from'], datetime.date(9999, 12, 2))
+
+
+class QueryBudgetTests(APITestBase):
+    """The most queries each route in api/urls.py may run, whatever the data size."""
+    BUDGETS = {
+        ('register', 'post'): 6,
+        ('token_obtain_pair', 'post'): 1,
+        ('token_refresh', 'post'): 0,
+        ('api-root', 'get'): 0,
+        ('project-list', 'get'): 3,
+        ('project-list', 'post'): 2,
+        ('project-detail', 'get'): 2,
+        ('project-detail', 'patch'): 2,
+        ('project-detail', 'delete'): 14,
+        ('project-stats', 'get'): 3,
+        ('project-document', 'get'): 3,
+        ('project-document', 'put'): 12,
+        ('project-document', 'patch'): 11,
+        ('document-list', 'get'): 2,
+        ('document-detail', 'get'): 2,
+        ('document-detail', 'patch'): 12,
+        ('analytics', 'get'): 3,
+        ('analytics-timeline', 'get'): 1,
+        ('search', 'get'): 3,
+        ('document-history', 'get'): 3,
+        ('recent-history', 'get'): 3,
+        ('history-detail', 'get'): 3,
+        ('history-diff', 'get'): 3,
+        ('document-preview', 'post'): 1,
+        ('document-export', 'get'): 2,
+        ('export-job-list', 'post'): 7,
+        ('export-job-detail', 'get'): 1,
+        ('export-job-download', 'get'): 1,
+        ('export-archive', 'get'): 1,
+        ('upload-list', 'post'): 2,
+        ('upload-detail', 'get'): 1,
+        ('upload-detail', 'put'): 3,
+        ('upload-detail', 'delete'): 2,
+        ('upload-complete', 'post'): 12,
+        ('document-file-list', 'get'): 2,
+        ('document-file-detail', 'get'): 1,
+        ('document-file-detail', 'delete'): 9,
+        ('document-file-download', 'get'): 1,
+        ('ai-summarize', 'post'): 1,
+        ('ai-rewrite', 'post'): 0,
+        ('ai-ideas', 'post'): 0,
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.add_projects(12)
+        self.client.put(self.document_url, {'content': 'Hello there world'}, format='json')
+        self.client.put(self.document_url, {'content': 'Hello again, world'}, format='json')
+        self.versions = list(History.objects.filter(document=self.document).order_by('id').values_list('id', flat=True))
+
+    @property
+    def document_url(self):
+        return f'/api/projects/{self.project.id}/document/'
+
+    def add_projects(self, count):
+        for number in range(count):
+            project = Project.objects.create(owner=self.user, title=f'Project {number}')
+            document = Document.objects.create(project=project, content=f'Draft {number}\nwith two lines')
+            History.objects.create(document=document, content_snapshot='Draft')
+
+    def assert_budget(self, name, method, url, data=None, client=None, status=200):
+        client = client or self.client
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status, getattr(response, 'data', None))
+        self.assertLessEqual(
+            len(queries), self.BUDGETS[name, method],
+            f'{method.upper()} {url} ran {len(queries)} queries:\n' + '\n'.join(q['sql'] for q in queries)
+        )
+        return len(queries)
+
+    def test_every_route_has_a_budget(self):
+        def names(patterns):
+            for pattern in patterns:
+                if hasattr(pattern, 'url_patterns'):
+                    yield from names(pattern.url_patterns)
+                elif pattern.name:
+                    yield pattern.name
+        self.assertEqual(set(names(urls.urlpatterns)), {name for name, _ in self.BUDGETS})
+
+    def test_auth(self):
+        anonymous = APIClient()
+        password = 'Very-secret-pass-99'
+        self.assert_budget('register', 'post', '/api/auth/register/', {
+            'email': 'new@example.com', 'username': 'new', 'password': password, 'confirm_password': password
+        }, anonymous, status=201)
+        tokens = anonymous.post('/api/auth/login/', {'email': 'new@example.com', 'password': password}, format='json')
+        self.assert_budget('token_obtain_pair', 'post', '/api/auth/login/',
+                           {'email': 'new@example.com', 'password': password}, anonymous)
+        self.assert_budget('token_refresh', 'post', '/api/auth/refresh/', {'refresh': tokens.data['refresh']}, anonymous)
+        self.assert_budget('api-root', 'get', '/api/')
+
+    def test_list_endpoints_do_not_grow_with_data(self):
+        endpoints = [
+            ('project-list', '/api/projects/'),
+            ('project-list', '/api/projects/?search=Project&ordering=title'),
+            ('document-list', '/api/documents/'),
+            ('search', '/api/search/?q=Project'),
+            ('search', '/api/search/?q=Draft&mode=history'),
+            ('analytics', '/api/analytics/'),
+            ('analytics-timeline', '/api/analytics/timeline/'),
+            ('document-history', f'/api/documents/{self.document.id}/history/'),
+        ]
+        before = [self.assert_budget(name, 'get', url) for name, url in endpoints]
+        self.add_projects(20)
+        self.client.put(self.document_url, {'content': 'More text'}, format='json')
+        cache.clear()
+        after = [self.assert_budget(name, 'get', url) for name, url in endpoints]
+        self.assertEqual(before, after)
+
+    def test_projects(self):
+        url = f'/api/projects/{self.project.id}/'
+        self.assert_budget('project-list', 'post', '/api/projects/', {'title': 'Another'}, status=201)
+        self.assert_budget('project-detail', 'get', url)
+        self.assert_budget('project-detail', 'patch', url, {'title': 'Renamed'})
+        self.assert_budget('project-stats', 'get', f'{url}stats/')
+        self.assert_budget('project-detail', 'delete', url)
+
+    def test_project_document(self):
+        self.assert_budget('project-document', 'get', self.document_url)
+        self.assert_budget('project-document', 'put', self.document_url, {'content': 'Rewritten'})
+        self.document.refresh_from_db()
+        self.assert_budget('project-document', 'patch', self.document_url, {
+            'base_version': self.document.version, 'ops': [{'offset': 0, 'insert': 'Fully '}]
+        })
+
+    def test_documents(self):
+        url = f'/api/documents/{self.document.id}/'
+        self.assert_budget('document-detail', 'get', url)
+        self.assert_budget('document-detail', 'patch', url, {'content': 'Patched through the viewset'})
+
+    def test_history(self):
+        base = f'/api/documents/{self.document.id}/history/'
+        first, last = self.versions[0], self.versions[-1]
+        self.assert_budget('recent-history', 'get', f'{base}recent/')
+        self.assert_budget('history-detail', 'get', f'{base}{last}/')
+        self.assert_budget('history-diff', 'get', f'{base}{first}/diff/{last}/')
+
+    def test_preview(self):
+        self.document.refresh_from_db()
+        self.assert_budget('document-preview', 'post', f'/api/documents/{self.document.id}/preview/', {
+            'base_version': self.document.version, 'ops': [{'offset': 0, 'insert': '# '}]
+        })
+
+    def test_export(self):
+        use_export_root(self)
+        self.assert_budget('document-export', 'get', f'/api/documents/{self.document.id}/export/?format=html')
+        url = f'/api/documents/{self.document.id}/exports/'
+        self.assert_budget('export-job-list', 'post', url, {'format': 'pdf'})
+        job = ExportJob.objects.get()
+        self.assert_budget('export-job-list', 'post', url, {'format': 'pdf'})
+        self.assert_budget('export-job-detail', 'get', f'/api/exports/{job.id}/')
+        self.assert_budget('export-job-download', 'get', f'/api/exports/{job.id}/download/')
+
+    def test_uploads(self):
+        use_media_root(self)
+        data = b'attachment'
+        response = self.client.post(f'/api/documents/{self.document.id}/uploads/',
+                                    {'filename': 'a.txt', 'size': len(data)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        url = f'/api/uploads/{response.data["id"]}/'
+        self.assert_budget('upload-list', 'post', f'/api/documents/{self.document.id}/uploads/',
+                           {'filename': 'b.txt', 'size': 1}, status=201)
+        self.assert_budget('upload-detail', 'get', url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.generic('PUT', f'{url}?offset=0', data, content_type='application/octet-stream',
+                                           HTTP_X_CHUNK_SHA256=hashlib.sha256(data).hexdigest())
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), self.BUDGETS['upload-detail', 'put'])
+        response = self.assert_budget('upload-complete', 'post', f'{url}complete/', status=201)
+        file_id = DocumentFile.objects.get().id
+        self.assert_budget('document-file-list', 'get', f'/api/documents/{self.document.id}/files/')
+        self.assert_budget('document-file-detail', 'get', f'/api/files/{file_id}/')
+        self.assert_budget('document-file-download', 'get', f'/api/files/{file_id}/download/')
+        self.assert_budget('document-file-detail', 'delete', f'/api/files/{file_id}/', status=204)
+        self.assert_budget('upload-detail', 'delete', f'/api/uploads/{UploadSession.objects.get().id}/', status=204)
+
+    def test_archive_does_not_grow_with_data(self):
+        self.assert_budget('export-archive', 'get', '/api/export/archive/')
+        self.add_projects(30)
+        self.assert_budget('export-archive', 'get', '/api/export/archive/')
+
+    def test_ai(self):
+        self.assert_budget('ai-summarize', 'post', '/api/ai/summarize/', {'document': self.document.id})
+        self.assert_budget('ai-rewrite', 'post', '/api/ai/rewrite/', {'content': 'It is really short.'})
+        self.assert_budget('ai-ideas', 'post', '/api/ai/ideas/', {'content': 'Gardens and bees.'})
+
+
+class ProjectListingTests(APITestBase):
+    def create_project(self, title, created_at):
+        project = Project.objects.create(owner=self.user, title=title, created_at=created_at)
+        Document.objects.create(project=project)
+        return project
+
+    def titles(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [project['title'] for project in response.data['results']], response.data
+
+    def test_date_range_includes_whole_days(self):
+        midnight = timezone.make_aware(datetime.datetime(2025, 3, 10))
+        self.create_project('Before', midnight - datetime.timedelta(microseconds=1))
+        self.create_project('First', midnight)
+        self.create_project('Last', midnight + datetime.timedelta(days=2) - datetime.timedelta(microseconds=1))
+        self.create_project('After', midnight + datetime.timedelta(days=2))
+
+        titles, _ = self.titles('/api/projects/?date_from=2025-03-10&date_to=2025-03-11')
+        self.assertEqual(titles, ['Last', 'First'])
+
+    def test_date_range_at_the_calendar_limits(self):
+        self.create_project('Only', timezone.make_aware(datetime.datetime(2025, 3, 10)))
+        titles, _ = self.titles('/api/projects/?date_from=0001-01-01&date_to=9999-12-31')
+        self.assertEqual(titles, ['Draft', 'Only'])
+
+    def test_cursor_pages_by_title(self):
+        for number in range(25):
+            self.create_project(f'Project {number:02}', timezone.now())
+        url = '/api/projects/?pagination=cursor&ordering=title&page_size=10'
+        seen = []
+        while url:
+            titles, data = self.titles(url)
+            self.assertNotIn('count', data)
+            seen += titles
+            url = data['next']
+        self.assertEqual(seen, sorted(project.title for project in Project.objects.filter(owner=self.user)))
+
+    def test_cursor_rejects_unsupported_ordering(self):
+        response = self.client.get('/api/projects/?pagination=cursor&ordering=created_at')
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(connection.vendor == 'sqlite', 'Query plans are checked on SQLite.')
+    def test_date_filtered_pages_use_owner_index(self):
+        self.create_project('Indexed', timezone.make_aware(datetime.datetime(2025, 2, 1)))
+        urls = [
+            '/api/projects/?date_from=2025-01-01&date_to=2025-06-30',
+            '/api/projects/?pagination=cursor&date_from=2025-01-01',
+            '/api/projects/?pagination=cursor&ordering=title',
+        ]
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            page_query = next(q['sql'] for q in queries if 'LIMIT' in q['sql'] and 'api_project' in q['sql'])
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + page_query)
+                plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+            self.assertRegex(plan, r'api_project_owner_(created|title)_idx', f'{url}: {plan}')
+            self.assertNotIn('TEMP B-TREE', plan, f'{url}: {plan}')
+
+
+class SearchTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.climate = self.create_project('Climate notes', 'Field research', 'The climate change effects on coastal towns.')
+        self.weather = self.create_project('Weather log', '', 'Change of climate is slow. Climate data, climate models.')
+
+    def create_project(self, title, description, content, owner=None):
+        project = Project.objects.create(owner=owner or self.user, title=title, description=description)
+        Document.objects.create(project=project, content=content)
+        return project
+
+    def search(self, q, **params):
+        response = self.client.get('/api/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def projects(self, q):
+        return [result['project'] for result in self.search(q)['results']]
+
+    def assert_index_consistent(self):
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO api_search_fts (api_search_fts, rank) VALUES ('integrity-check', 1)")
+
+    def test_ranks_matches(self):
+        self.assertEqual(self.projects('climate'), [self.climate.id, self.weather.id])
+        self.assertEqual(self.projects('models'), [self.weather.id])
+
+    def test_results_carry_snippets_not_content(self):
+        self.create_project('Long', '', 'filler ' * 5000 + 'needle <b>here</b> ' + 'filler ' * 5000)
+        data = self.search('needle')
+        self.assertEqual(data['count'], 1)
+        result, = data['results']
+        self.assertEqual(set(result), {'id', 'project', 'title', 'score', 'snippets'})
+        self.assertEqual(result['title'], 'Long')
+        self.assertEqual(result['id'], Document.objects.get(project__title='Long').id)
+        snippet, = result['snippets']
+        self.assertIn('<mark>needle</mark> &lt;b&gt;here&lt;/b&gt;', snippet)
+        self.assertLess(len(snippet), 300)
+
+    def test_results_are_paginated(self):
+        for number in range(12):
+            self.create_project(f'Climate {number}', '', 'climate')
+        first = self.search('climate')
+        self.assertEqual(first['count'], 14)
+        self.assertEqual(len(first['results']), 10)
+        second = self.search('climate', page=2)
+        self.assertEqual(len(second['results']), 4)
+        self.assertIsNone(second['next'])
+        ids = [result['project'] for result in first['results'] + second['results']]
+        self.assertEqual(len(set(ids)), 14)
+
+    def test_phrase_and_prefix_queries(self):
+        self.assertEqual(self.projects('"climate change"'), [self.climate.id])
+        self.assertEqual(self.projects('coast*'), [self.climate.id])
+        self.assertEqual(self.projects('"climate mod"*'), [self.weather.id])
+        self.assertEqual(self.projects('research'), [self.climate.id])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.projects('climate towns'), [self.climate.id])
+        self.assertEqual(self.projects('weather models'), [self.weather.id])
+        self.assertEqual(self.projects('climate nowhere'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        for q in ['title:climate', 'climate OR nowhere', 'NEAR(climate', '"unbalanced', '-climate', '*']:
+            self.search(q)
+        self.assertEqual(self.projects('"unbalanced climate'), [])
+
+    def test_empty_query_returns_nothing(self):
+        for q in ['', '   ', '"" * ---']:
+            with self.assertNumQueries(0):
+                data = self.search(q)
+            self.assertEqual((data['count'], data['results']), (0, []))
+
+    def test_other_users_projects_are_hidden(self):
+        other = User.objects.create_user('other@example.com', 'other', 'secret-pass-123')
+        self.create_project('Climate secrets', '', 'climate climate', owner=other)
+        self.assertEqual(self.projects('climate'), [self.climate.id, self.weather.id])
+
+    def test_index_follows_saves(self):
+        url = f'/api/projects/{self.weather.id}/document/'
+        self.client.put(url, {'content': 'Rainfall totals'}, format='json')
+        self.assertEqual(self.projects('rainfall'), [self.weather.id])
+        self.assertEqual(self.projects('models'), [])
+
+        document = Document.objects.get(project=self.weather)
+        self.client.patch(url, {
+            'base_version': document.version, 'ops': [{'offset': 0, 'insert': 'Monsoon '}]
+        }, format='json')
+        self.assertEqual(self.projects('monsoon rainfall'), [self.weather.id])
+
+        self.client.patch(f'/api/projects/{self.weather.id}/', {'title': 'Rain diary'}, format='json')
+        self.assertEqual(self.projects('diary'), [self.weather.id])
+        self.assertEqual(self.projects('weather'), [])
+
+        self.client.delete(f'/api/projects/{self.climate.id}/')
+        self.assertEqual(self.projects('climate'), [])
+        self.assert_index_consistent()
+
+    def test_fallback_builds_snippets_in_python(self):
+        results = search.FallbackIndex().page(None, self.user.id, search.parse_query('coastal'), 0, 10)
+        self.assertEqual([result['project'] for result in results], [self.climate.id])
+        self.assertEqual(results[0]['snippets'], ['The climate change effects on <mark>coastal</mark> towns.'])
+
+    def test_rebuild_command(self):
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.projects('climate'), [self.climate.id, self.weather.id])
+        self.assert_index_consistent()
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite drops triggers when it remakes a table.')
+    def test_missing_triggers_are_reinstalled_after_migrate(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER api_search_document_update')
+        self.assertEqual(search.missing(), ['documents'])
+        Document.objects.filter(project=self.weather).update(content='Monsoon rainfall.')
+
+        emit_post_migrate_signal(verbosity=0, interactive=False, db='default')
+        self.assertEqual(search.missing(), [])
+        self.assertEqual(self.projects('monsoon'), [self.weather.id])
+        self.assertEqual(self.projects('climate'), [self.climate.id])
+        self.assert_index_consistent()
+
+
+@override_settings(HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=0)
+class HistorySearchTests(APITestBase):
+    VERSIONS = [
+        'The lighthouse keeper\nsalt and rope',
+        'The lighthouse keeper\nwind',
+        'salt and rope\nwind',
+        'final words',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        for content in self.VERSIONS:
+            self.save(content)
+        self.rows = list(History.objects.filter(document=self.document).order_by('id').values_list('id', flat=True))
+
+    def save(self, content):
+        response = self.client.put(f'/api/projects/{self.project.id}/document/', {'content': content}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def search(self, q, mode='history'):
+        response = self.client.get('/api/search/', {'q': q, 'mode': mode})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def ranges(self, q):
+        result, = self.search(q)
+        return [
+            (versions['first']['id'], versions['last'] and versions['last']['id'])
+            for versions in result['versions']
+        ]
+
+    def spans(self):
+        return sorted(
+            PassageSpan.objects.filter(passage__document=self.document)
+            .values_list('passage__text', 'first_id', 'last_id')
+        )
+
+    def test_finds_deleted_text_with_version_ranges(self):
+        # Snapshots hold the text each save replaced: Hello, A, B, C.
+        hello, a, b, c = self.rows
+        self.assertEqual(self.search('lighthouse', mode='current'), [])
+        self.assertEqual(self.ranges('lighthouse'), [(a, b)])
+        self.assertEqual(self.ranges('salt rope'), [(a, a), (c, None)])
+        result, = self.search('keeper')
+        self.assertEqual(result['snippets'], ['The lighthouse <mark>keeper</mark>'])
+        self.assertEqual(result['title'], 'Draft')
+
+    def test_passages_are_stored_once(self):
+        for _ in range(5):
+            self.save(self.VERSIONS[0])
+            self.save(self.VERSIONS[2])
+        self.assertEqual(Passage.objects.filter(document=self.document, text='salt and rope').count(), 1)
+        self.assertEqual(len(self.ranges('salt')), 3)
+        self.assertEqual(len(self.ranges('lighthouse')), 6)
+
+    def test_reindex_matches_incremental_index(self):
+        spans = self.spans()
+        reindex_document(self.document.id)
+        self.assertEqual(self.spans(), spans)
+
+    def test_migration_indexes_existing_history(self):
+        migration = importlib.import_module('api.migrations.0011_history_passages')
+        hello, a, b, c = self.rows
+        spans = self.spans()
+        # History saved before the migration has no passages.
+        Passage.objects.all().delete()
+        migration.index_existing_history(apps, None)
+        self.assertEqual(self.spans(), spans)
+        self.assertEqual(self.ranges('lighthouse'), [(a, b)])
+
+    def test_compaction_reindexes(self):
+        hello, a, b, c = self.rows
+        compact_history(self.document.id, {hello, b, c})
+        self.assertEqual(self.ranges('lighthouse'), [(b, b)])
+        self.assertEqual(self.ranges('salt'), [(c, None)])
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO api_passage_fts (api_passage_fts, rank) VALUES ('integrity-check', 1)")
+
+    def test_rejects_unknown_mode(self):
+        response = self.client.get('/api/search/', {'q': 'salt', 'mode': 'everything'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PreviewTests(APITestBase):
+    DOCUMENT = """# Title
+
+A paragraph with a [reference link][ref] and *emphasis*.
+
+- tight
+- list
+
+- loose item
+
+    continued in the same item
+
+```
+fenced code
+
+with a blank line
+```
+
+    indented code
+
+1. one
+2. two
+
+> quote
+> more
+
+> a
+
+> b
+
+<div>
+
+foo
+
+</div>
+
+Setext heading
+--------------
+
+[ref]: https://example.com "Example"
+"""
+
+    def setUp(self):
+        super().setUp()
+        preview._cache.clear()
+        self.document.content = self.DOCUMENT
+        self.document.save()
+        self.url = f'/api/documents/{self.document.id}/preview/'
+
+    def test_blocks_render_like_the_whole_document(self):
+        self.assertEqual(preview.render_html(self.DOCUMENT), markdown.markdown(self.DOCUMENT))
+        blocks, definitions = markdown_blocks.split_blocks(self.DOCUMENT)
+        # The blockquote runs and the raw HTML block each stay in one block,
+        # and the reference definition, which adds no element, joins the
+        # block before it.
+        self.assertEqual(len(blocks), 8)
+        self.assertIn('> quote\n> more\n\n> a\n\n> b', blocks)
+        self.assertIn('<div>\n\nfoo\n\n</div>', blocks)
+        self.assertEqual(definitions, '[ref]: https://example.com "Example"')
+
+    def test_blocks_continue_after_a_heading_or_paragraph_line(self):
+        for text in [
+            '# T\n1. one\n\n2. two',
+            '# Shopping\n- milk\n\n- eggs',
+            'Intro:\n> quoted line\n\n> second quoted para',
+            '# Code\n<pre>\nline\n\nline2\n</pre>',
+            '<p>para</p>\n+ plus\n\n1. one\n\nplain text here',
+            '<hr>\n- milk\n\n- eggs',
+            '- milk\n\n[ref]: https://example.com\n    more milk',
+            '# T\n[ref]: https://example.com\n---\n\nsee [it][ref]',
+            'Text\n<div>\n\n</div>\n\nMore',
+        ]:
+            with self.subTest(text=text):
+                self.assertEqual(preview.render_html(text), markdown.markdown(text))
+
+    def test_only_changed_blocks_are_rendered(self):
+        preview.render_html(self.DOCUMENT)
+        edited = self.DOCUMENT.replace('1. one', '1. first')
+        with mock.patch('api.preview.render_block', wraps=markdown_blocks.render_block) as converter:
+            self.assertEqual(preview.render_html(edited), markdown.markdown(edited))
+            self.assertEqual(converter.call_count, 1)
+            # Reference definitions can change any block.
+            preview.render_html(edited.replace('example.com', 'example.org'))
+            self.assertEqual(converter.call_count, 9)
+
+    def test_preview_endpoint(self):
+        response = self.client.post(self.url, {}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], self.document.version)
+        self.assertEqual([block['html'] for block in response.data['blocks']],
+                         [html for _, html in preview.render_blocks(self.DOCUMENT)])
+
+        known = [block['id'] for block in response.data['blocks']]
+        response = self.client.post(self.url, {
+            'base_version': self.document.version,
+            'ops': [{'offset': 2, 'delete': 5, 'insert': 'Heading'}],
+            'known': known,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        changed = [block for block in response.data['blocks'] if 'html' in block]
+        self.assertEqual(changed, [{'id': response.data['blocks'][0]['id'], 'html': '<h1>Heading</h1>'}])
+        self.assertEqual([block['id'] for block in response.data['blocks'][1:]], known[1:])
+        # Previews never save.
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.content, self.DOCUMENT)
+
+    def test_preview_errors(self):
+        ops = [{'offset': 0, 'insert': 'x'}]
+        self.assertEqual(self.client.post(self.url, {'ops': ops}, format='json').status_code, 400)
+        response = self.client.post(self.url, {'base_version': self.document.version + 1, 'ops': ops}, format='json')
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(self.url, {
+            'base_version': self.document.version, 'ops': [{'offset': 10 ** 6, 'insert': 'x'}]
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        other = User.objects.create_user('other@example.com', 'other', 'secret-pass-123')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.post(self.url, {}, format='json').status_code, 404)
+
+
+class ExportTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        exporting._cache.clear()
+        preview._cache.clear()
+        self.url = f'/api/documents/{self.document.id}/export/'
+        self.content = '# Title\n\n' + '\n'.join(['Some *markdown* text.'] * 200)
+        self.client.put(f'/api/projects/{self.project.id}/document/', {'content': self.content}, format='json')
+
+    def get(self, format='txt', **headers):
+        return self.client.get(self.url, {'format': format}, **headers)
+
+    def body(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_exports_text(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content.encode())
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="Draft.txt"')
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_html_is_rendered_once_per_content(self):
+        with mock.patch('api.exporting.render_html', wraps=preview.render_html) as render:
+            first = self.body(self.get('html'))
+            self.assertEqual(self.body(self.get('html')), first)
+            self.assertEqual(render.call_count, 1)
+            self.client.put(f'/api/projects/{self.project.id}/document/', {'content': 'Changed'}, format='json')
+            self.assertEqual(self.body(self.get('html')), b'<p>Changed</p>')
+            self.assertEqual(render.call_count, 2)
+        self.assertEqual(first, markdown.markdown(self.content).encode())
+
+    def test_gzip_when_accepted(self):
+        response = self.get('html', HTTP_ACCEPT_ENCODING='br, gzip;q=0.8')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        compressed = self.body(response)
+        self.assertEqual(gzip.decompress(compressed), self.body(self.get('html')))
+        self.assertLess(len(compressed), len(self.content) // 4)
+        self.assertNotIn('Content-Encoding', self.get('html', HTTP_ACCEPT_ENCODING='gzip;q=0'))
+        self.assertNotEqual(response['ETag'], self.get('html')['ETag'])
+
+    def test_byte_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=2-6')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), self.content.encode()[2:7])
+        self.assertEqual(response['Content-Range'], f'bytes 2-6/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '5')
+
+        self.assertEqual(self.body(self.get(HTTP_RANGE='bytes=-5')), self.content.encode()[-5:])
+        self.assertEqual(self.body(self.get(HTTP_RANGE='bytes=10-')), self.content.encode()[10:])
+
+        response = self.get(HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+        # Multiple ranges are not supported; the whole body is sent instead.
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+
+    def test_range_of_compressed_body(self):
+        whole = self.body(self.get('html', HTTP_ACCEPT_ENCODING='gzip'))
+        response = self.get('html', HTTP_ACCEPT_ENCODING='gzip', HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), whole[100:])
+
+    def test_if_range_and_if_none_match(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-4', HTTP_IF_RANGE=etag).status_code, 206)
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-4', HTTP_IF_RANGE='"stale"').status_code, 200)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_rejects_unknown_format_and_foreign_documents(self):
+        self.assertEqual(self.get('docx').status_code, 400)
+        other = User.objects.create_user('other@example.com', 'other', 'secret-pass-123')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.get().status_code, 404)
+
+
+class ExportJobTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        use_export_root(self)
+        self.content = '# Title\n\nSome **bold** (and escaped \\) text.\n\n- one\n- two'
+        self.client.put(f'/api/projects/{self.project.id}/document/', {'content': self.content}, format='json')
+        self.url = f'/api/documents/{self.document.id}/exports/'
+
+    def submit(self, format='pdf', document=None):
+        url = f'/api/documents/{document.id}/exports/' if document else self.url
+        return self.client.post(url, {'format': format}, format='json')
+
+    def download(self, job_id):
+        response = self.client.get(f'/api/exports/{job_id}/download/')
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_pdf_export(self):
+        response = self.submit()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'done')
+        self.assertTrue(response['Location'].endswith(f'/api/exports/{response.data["id"]}/'))
+        self.assertTrue(response.data['download_url'].endswith(f'/api/exports/{response.data["id"]}/download/'))
+
+        download, body = self.download(response.data['id'])
+        self.assertEqual(download['Content-Type'], 'application/pdf')
+        self.assertEqual(download['Content-Disposition'], 'attachment; filename="Draft.pdf"')
+        self.assertTrue(body.startswith(b'%PDF-1.4'))
+        self.assertTrue(body.endswith(b'%EOF\n'))
+        self.assertEqual(response.data['size'], len(body))
+
+    def test_html_and_markdown_exports(self):
+        _, html = self.download(self.submit('html').data['id'])
+        self.assertIn(b'<h1>Title</h1>', html)
+        _, md = self.download(self.submit('md').data['id'])
+        self.assertEqual(md, self.content.encode())
+
+    def test_html_jobs_match_the_synchronous_export(self):
+        content = '# Shopping\n- milk\n\n- eggs\n\n<div>\n\nraw\n\n</div>\n\nDone.'
+        self.client.put(f'/api/projects/{self.project.id}/document/', {'content': content}, format='json')
+        _, html = self.download(self.submit('html').data['id'])
+        self.assertEqual(html, exporting.render(content, 'html'))
+        self.assertEqual(html, markdown.markdown(content).encode())
+
+    def test_repeat_requests_share_a_job_and_its_rendering(self):
+        with mock.patch('api.export_jobs.rendering.write', wraps=rendering.write) as write:
+            first = self.submit().data['id']
+            self.assertEqual(self.submit().data['id'], first)
+            self.assertEqual(write.call_count, 1)
+
+            # The same text in another document reuses the rendered file.
+            project = Project.objects.create(owner=self.user, title='Copy')
+            copy = Document.objects.create(project=project, content=self.content)
+            response = self.submit(document=copy)
+            self.assertNotEqual(response.data['id'], first)
+            self.assertEqual(response.data['status'], 'done')
+            self.assertEqual(write.call_count, 1)
+
+            self.client.put(f'/api/projects/{self.project.id}/document/', {'content': 'Changed'}, format='json')
+            self.assertNotEqual(self.submit().data['id'], first)
+            self.assertEqual(write.call_count, 2)
+
+    def test_failed_jobs_are_retried(self):
+        with mock.patch('api.export_jobs.rendering.write', side_effect=ValueError('boom')), \
+                self.assertLogs('api.export_jobs', 'ERROR'):
+            response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertEqual(response.data['error'], 'boom')
+        self.assertEqual(self.client.get(f'/api/exports/{response.data["id"]}/download/').status_code, 409)
+
+        retry = self.submit()
+        self.assertEqual(retry.data['id'], response.data['id'])
+        self.assertEqual(retry.data['status'], 'done')
+
+    def test_polling_a_queued_job(self):
+        job = ExportJob.objects.create(document=self.document, format='pdf', content_hash='0' * 64)
+        response = self.client.get(f'/api/exports/{job.id}/')
+        self.assertEqual(response.data['status'], 'queued')
+        self.assertIsNone(response.data['download_url'])
+        self.assertEqual(self.client.get(f'/api/exports/{job.id}/download/').status_code, 409)
+
+    def test_missing_output_is_rendered_again(self):
+        job_id = self.submit().data['id']
+        shutil.rmtree(export_jobs.settings.EXPORT_ROOT)
+        self.assertEqual(self.client.get(f'/api/exports/{job_id}/download/').status_code, 410)
+        self.assertEqual(self.submit().data['status'], 'done')
+        self.download(job_id)
+
+    def test_rejects_unknown_formats_and_other_users(self):
+        self.assertEqual(self.submit('docx').status_code, 400)
+        response = self.client.get(f'/api/documents/{self.document.id}/export/?format=pdf')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('/exports/', response.data['error'])
+
+        job_id = self.submit().data['id']
+        other = User.objects.create_user('other@example.com', 'other', 'secret-pass-123')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.submit().status_code, 404)
+        self.assertEqual(self.client.get(f'/api/exports/{job_id}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/exports/{job_id}/download/').status_code, 404)
+
+
+class ArchiveExportTests(APITestBase):
+    url = '/api/export/archive/'
+
+    def setUp(self):
+        super().setUp()
+        for content in ['First draft', 'First draft\nwith more', 'Final text']:
+            self.client.put(f'/api/projects/{self.project.id}/document/', {'content': content}, format='json')
+        other = User.objects.create_user('other@example.com', 'other', 'secret-pass-123')
+        Project.objects.create(owner=other, title='Not mine')
+        Project.objects.create(owner=self.user, title='')  # no document
+
+    def archive(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertTrue(response.streaming)
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_projects_and_documents(self):
+        archive = self.archive(self.client.get(self.url))
+        self.assertIsNone(archive.testzip())
+        empty = Project.objects.get(title='')
+        self.assertEqual(archive.namelist(), [
+            f'{self.project.id}-draft/project.json',
+            f'{self.project.id}-draft/document.md',
+            f'{empty.id}-untitled/project.json',
+        ])
+        self.assertEqual(archive.read(f'{self.project.id}-draft/document.md'), b'Final text')
+        meta = json.loads(archive.read(f'{self.project.id}-draft/project.json'))
+        self.assertEqual(meta['title'], 'Draft')
+        self.assertEqual(meta['document']['version'], self.document.__class__.objects.get().version)
+        self.assertIsNone(json.loads(archive.read(f'{empty.id}-untitled/project.json'))['document'])
+        self.assertIn('attachment; filename="writer-', self.client.get(self.url)['Content-Disposition'])
+
+    @override_settings(HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=0, HISTORY_KEYFRAME_INTERVAL=2)
+    def test_history(self):
+        for content in ['One\ntwo', 'One\ntwo\nthree', 'Two\nthree']:
+            self.client.put(f'/api/projects/{self.project.id}/document/', {'content': content}, format='json')
+        archive = self.archive(self.client.get(self.url, {'history': '1'}))
+        names = [name for name in archive.namelist() if '/history/' in name]
+        rows = History.objects.filter(document=self.document).order_by('id')
+        self.assertEqual(len(names), rows.count())
+        for name, row in zip(names, rows):
+            self.assertTrue(name.endswith(f'-{row.id}.md'))
+            self.assertEqual(archive.read(name).decode(), row.get_content())
+
+    @override_settings(EXPORT_ARCHIVE_BATCH=2, EXPORT_CHUNK_SIZE=1024)
+    def test_streams_before_reading_everything(self):
+        for number in range(10):
+            project = Project.objects.create(owner=self.user, title=f'Project {number}')
+            Document.objects.create(project=project, content=f'Chapter {number}\n' * 5000)
+        response = self.client.get(self.url)
+        chunks = iter(response.streaming_content)
+        next(chunks)
+        self.assertGreater(sum(1 for _ in chunks), 10)
+
+    async def test_streams_under_asgi(self):
+        token = await sync_to_async(AccessToken.for_user)(self.user)
+        response = await self.async_client.get(self.url, headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        self.assertEqual(archive.read(f'{self.project.id}-draft/document.md'), b'Final text')
+
+
+class UploadTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = use_media_root(self)
+        self.data = bytes(range(256)) * 40  # 10 KB
+
+    def start(self, data=None, **extra):
+        data = self.data if data is None else data
+        response = self.client.post(f'/api/documents/{self.document.id}/uploads/', {
+            'filename': 'notes.bin', 'size': len(data), 'content_type': 'application/octet-stream', **extra
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def put(self, session_id, offset, chunk, checksum=None):
+        return self.client.generic(
+            'PUT', f'/api/uploads/{session_id}/?offset={offset}', chunk, content_type='application/octet-stream',
+            HTTP_X_CHUNK_SHA256=checksum or hashlib.sha256(chunk).hexdigest(),
+        )
+
+    def upload(self, data=None, chunk_size=4096):
+        data = self.data if data is None else data
+        session_id = self.start(data)
+        for offset in range(0, len(data), chunk_size):
+            response = self.put(session_id, offset, data[offset:offset + chunk_size])
+            self.assertEqual(response.data, {'offset': min(offset + chunk_size, len(data))})
+        response = self.client.post(f'/api/uploads/{session_id}/complete/')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data
+
+    def test_chunked_upload(self):
+        result = self.upload()
+        self.assertEqual(result['size'], len(self.data))
+        self.assertEqual(result['sha256'], hashlib.sha256(self.data).hexdigest())
+        document_file = DocumentFile.objects.get(id=result['id'])
+        with document_file.file.open('rb') as file:
+            self.assertEqual(file.read(), self.data)
+        self.assertEqual(UploadSession.objects.count(), 0)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [])
+        listing = self.client.get(f'/api/documents/{self.document.id}/files/')
+        self.assertEqual([item['id'] for item in listing.data['results']], [result['id']])
+
+    def test_resuming_after_failures(self):
+        session_id = self.start()
+        self.assertEqual(self.put(session_id, 0, self.data[:4096]).data['offset'], 4096)
+
+        # A corrupted chunk is rejected and leaves the offset where it was.
+        response = self.put(session_id, 4096, self.data[4096:8192], checksum=hashlib.sha256(b'x').hexdigest())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(f'/api/uploads/{session_id}/').data['offset'], 4096)
+        self.assertEqual(os.path.getsize(uploads.part_path(UploadSession.objects.get())), 4096)
+
+        # So does a connection that drops mid-chunk.
+        session = UploadSession.objects.get()
+        with self.assertRaises(uploads.IncompleteChunk):
+            uploads.write_chunk(session, 4096, io.BytesIO(self.data[4096:5000]), 4096,
+                                hashlib.sha256(self.data[4096:8192]).hexdigest())
+        self.assertEqual(os.path.getsize(uploads.part_path(session)), 4096)
+
+        # Repeating a stored chunk, or skipping ahead, says where to resume.
+        for offset in [0, 8192]:
+            response = self.put(session_id, offset, self.data[offset:offset + 100])
+            self.assertEqual((response.status_code, response.data['offset']), (409, 4096))
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/complete/').status_code, 409)
+
+        self.put(session_id, 4096, self.data[4096:])
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/complete/').status_code, 201)
+
+    def test_a_chunk_being_written_blocks_others(self):
+        session_id = self.start()
+        UploadSession.objects.update(lease_until=timezone.now() + datetime.timedelta(minutes=1))
+        self.assertEqual(self.put(session_id, 0, self.data[:10]).status_code, 409)
+        UploadSession.objects.update(lease_until=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(self.put(session_id, 0, self.data[:10]).status_code, 200)
+
+    def test_a_writer_past_its_lease_does_not_advance_the_offset(self):
+        self.start()
+        session = UploadSession.objects.get()
+
+        class SlowStream(io.BytesIO):
+            def read(self, size=-1):
+                # Another writer claims the session once this lease has run out.
+                UploadSession.objects.update(lease_until=timezone.now() + datetime.timedelta(minutes=1))
+                return super().read(size)
+        with self.assertRaises(uploads.OffsetConflict):
+            uploads.write_chunk(session, 0, SlowStream(self.data[:10]), 10, hashlib.sha256(self.data[:10]).hexdigest())
+        self.assertEqual(UploadSession.objects.get().received, 0)
+
+    def test_concurrent_completes_store_the_file_once(self):
+        session_id = self.start()
+        self.put(session_id, 0, self.data)
+        UploadSession.objects.update(lease_until=timezone.now() + datetime.timedelta(minutes=1))
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/complete/').status_code, 409)
+        UploadSession.objects.update(lease_until=None)
+
+        file_sha256 = uploads.file_sha256
+
+        def racing(path):
+            response = self.client.post(f'/api/uploads/{session_id}/complete/')
+            self.assertEqual((response.status_code, response.data['offset']), (409, len(self.data)))
+            return file_sha256(path)
+        with mock.patch.object(uploads, 'file_sha256', racing):
+            self.assertEqual(self.client.post(f'/api/uploads/{session_id}/complete/').status_code, 201)
+        self.assertEqual(DocumentFile.objects.count(), 1)
+        self.assertEqual(FileBlob.objects.get().ref_count, 1)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_identical_files_are_stored_once(self):
+        first = self.upload()
+        second = self.upload(chunk_size=1000)
+        blob = FileBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        path = DocumentFile.objects.get(id=first['id']).file.path
+        self.assertEqual(DocumentFile.objects.get(id=second['id']).file.path, path)
+
+        self.assertEqual(self.client.delete(f'/api/files/{first["id"]}/').status_code, 204)
+        self.assertEqual(FileBlob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+        self.client.delete(f'/api/projects/{self.project.id}/')
+        self.assertFalse(FileBlob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_a_blob_created_by_a_concurrent_complete_is_reused(self):
+        sha256 = hashlib.sha256(self.data).hexdigest()
+        get = QuerySet.get
+
+        def racing(queryset, *args, **kwargs):
+            # Another upload of the same bytes inserts its blob between our
+            # lookup and our insert.
+            if queryset.model is FileBlob and not FileBlob.objects.exists():
+                FileBlob.objects.create(sha256=sha256, size=len(self.data), ref_count=1)
+                raise FileBlob.DoesNotExist
+            return get(queryset, *args, **kwargs)
+        with mock.patch.object(QuerySet, 'get', racing):
+            result = self.upload()
+        self.assertEqual(result['sha256'], sha256)
+        self.assertEqual(FileBlob.objects.get().ref_count, 2)
+
+    def test_whole_file_checksum(self):
+        session_id = self.start(sha256=hashlib.sha256(b'something else').hexdigest())
+        self.put(session_id, 0, self.data)
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/complete/').status_code, 400)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(FileBlob.objects.exists())
+
+    @override_settings(UPLOAD_CHUNK_MAX_SIZE=1024, UPLOAD_MAX_SIZE=20000)
+    def test_limits_and_validation(self):
+        session_id = self.start()
+        self.assertEqual(self.put(session_id, 0, self.data[:2048]).status_code, 413)
+        self.assertEqual(self.put(session_id, 0, self.data[:10], checksum='abc').status_code, 400)
+        self.assertEqual(self.put(session_id, len(self.data) - 5, self.data[:10]).status_code, 400)
+        response = self.client.post(f'/api/documents/{self.document.id}/uploads/',
+                                     {'filename': 'big.bin', 'size': 20001}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.delete(f'/api/uploads/{session_id}/').status_code, 204)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [])
+
+    def test_other_users_cannot_see_uploads(self):
+        session_id = self.start()
+        file_id = self.upload()['id']
+        other = User.objects.create_user('other@example.com', 'other', 'secret-pass-123')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.put(session_id, 0, self.data[:10]).status_code, 404)
+        self.assertEqual(self.client.get(f'/api/uploads/{session_id}/').status_code, 404)
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/complete/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/files/{file_id}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/documents/{self.document.id}/files/').data['count'], 0)
+
+    def test_purge_idle_sessions(self):
+        self.start()
+        UploadSession.objects.update(updated_at=timezone.now() - datetime.timedelta(days=30))
+        call_command('purge_uploads', stdout=io.StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [])
+
+
+class AttachmentDownloadTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        use_media_root(self)
+        self.data = bytes(range(256)) * 40
+        sha256 = hashlib.sha256(self.data).hexdigest()
+        session = uploads.start(self.document, 'notes.bin', len(self.data), 'application/octet-stream')
+        uploads.write_chunk(session, 0, io.BytesIO(self.data), len(self.data), sha256)
+        self.file_id = uploads.complete(session).id
+        self.url = f'/api/files/{self.file_id}/download/'
+        self.etag = f'"{sha256}"'
+
+    def body(self, response):
+        content = b''.join(response.streaming_content)
+        response.close()
+        return content
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(response['Content-Type'], 'application/octet-stream')
+        self.assertIn('attachment; filename="notes.bin"', response['Content-Disposition'])
+        self.assertEqual(self.body(response), self.data)
+
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(self.body(response), self.data[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(self.body(response), self.data[-10:])
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_conditional_requests(self):
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag).status_code, 304)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=self.etag)
+        self.assertEqual(self.body(response), self.data[:10])
+        # A stale validator gets the whole file instead of a range of something else.
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, self.body(response)), (200, self.data))
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 206)
+        response.close()
+
+    def test_file_range_can_be_sent_with_sendfile(self):
+        # A WSGI file wrapper sends from the file's position for Content-Length bytes.
+        request = APIRequestFactory().get(self.url, HTTP_RANGE='bytes=100-199')
+        force_authenticate(request, self.user)
+        response = views.DocumentFileDownloadView.as_view()(request, pk=self.file_id)
+        body = response.file_to_stream
+        self.assertEqual(body.fileno(), body.file.fileno())
+        self.assertEqual(body.file.tell(), 100)
+        self.assertEqual(body.read(), self.data[100:200])
+        response.close()
+        self.assertTrue(body.file.closed)
+
+    @override_settings(ATTACHMENT_SENDFILE='x-accel-redirect')
+    def test_x_accel_redirect(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        sha256 = hashlib.sha256(self.data).hexdigest()
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/blobs/{sha256[:2]}/{sha256}')
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertIn('attachment', response['Content-Disposition'])
+
+    @override_settings(ATTACHMENT_SENDFILE='x-sendfile')
+    def test_x_sendfile(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Sendfile'], DocumentFile.objects.get().file.path)
+
+    def test_other_users_cannot_download(self):
+        other = User.objects.create_user('other@example.com', 'other', 'secret-pass-123')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    async def test_streams_under_asgi(self):
+        token = await sync_to_async(AccessToken.for_user)(self.user)
+        response = await self.async_client.get(
+            self.url, headers={'Authorization': f'Bearer {token}', 'Range': 'bytes=10-'}
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.is_async)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.data[10:])
+
+
+class ExtractionTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def extract(self, data, kind, max_chars=10_000):
+        path = os.path.join(self.root, 'file')
+        with open(path, 'wb') as file:
+            file.write(data)
+        return extraction.extract(path, kind, max_chars)
+
+    def test_kinds(self):
+        self.assertEqual(extraction.kind('notes.MD'), 'text')
+        self.assertEqual(extraction.kind('notes.bin', 'text/html; charset=utf-8'), 'html')
+        self.assertEqual(extraction.kind('scan.pdf', 'application/octet-stream'), 'pdf')
+        self.assertIsNone(extraction.kind('photo.jpg', 'image/jpeg'))
+
+    def test_text_is_decoded_across_pieces(self):
+        text = 'caf\u00e9 ' * 300_000
+        with mock.patch.object(extraction, 'READ_SIZE', 1001):
+            self.assertEqual(self.extract(text.encode(), 'text', len(text)), text)
+        self.assertEqual(self.extract(b'\xef\xbb\xbfabc \xff', 'text'), 'abc \ufffd')
+
+    def test_html(self):
+        html = (
+            b'<html><head><title>Page</title><style>p { color: red }</style></head><body>'
+            b'<h1>Title &amp; more</h1><p>Some\ntext <b>bold</b></p><script>var hidden;</script>'
+            b'<ul><li>one</li><li>two</li></ul></body></html>'
+        )
+        self.assertEqual(self.extract(html, 'html'), 'Title & more\n\nSome text bold\n\none\n\ntwo')
+
+    def test_pdf(self):
+        content = '# Heading\n\nText with (parens) and caf\u00e9.\n\n- item\n\n' + 'filler line\n\n' * 200
+        text = self.extract(rendering.pdf(content), 'pdf', 1_000_000)
+        lines = text.split('\n')
+        self.assertEqual(lines[:3], ['Heading', 'Text with (parens) and caf\u00e9.', '\u2022 item'])
+        self.assertEqual(lines.count('filler line'), 200)
+
+    def test_pdf_skips_other_streams(self):
+        image = zlib.compress(b'BT (not text) Tj ET')
+        content = b'BT [(Hel) -50 (lo) -400 (world)] TJ ET'
+        pdf = (
+            b'%%PDF-1.4\n1 0 obj\n<< /Type /XObject /Subtype /Image /Length %d /Filter /FlateDecode >>\n'
+            b'stream\n%s\nendstream\nendobj\n2 0 obj\n<< /Length 3 0 R >>\nstream\n%s\nendstream\nendobj\n'
+            % (len(image), image, content)
+        )
+        with mock.patch.object(extraction, 'READ_SIZE', 7):
+            self.assertEqual(self.extract(pdf, 'pdf'), 'Hello world')
+
+    def test_output_is_capped(self):
+        self.assertEqual(self.extract(b'x' * 5000, 'text', 100), 'x' * 100)
+        self.assertLessEqual(len(self.extract(rendering.pdf('words ' * 5000), 'pdf', 50)), 50)
+
+
+@override_settings(ATTACHMENT_TEXT_WORKERS=0)
+class AttachmentTextTests(APITestBase):
+    def setUp(self):
+        super().setUp()
+        use_media_root(self)
+
+    def attach(self, data, filename='notes.md', content_type='text/markdown', document=None):
+        session = uploads.start(document or self.document, filename, len(data), content_type)
+        uploads.write_chunk(session, 0, io.BytesIO(data), len(data), hashlib.sha256(data).hexdigest())
+        with self.captureOnCommitCallbacks(execute=True):
+            return uploads.complete(session)
+
+    def projects(self, q):
+        response = self.client.get('/api/search/', {'q': q})
+        return [(result['project'], result['snippets']) for result in response.data['results']]
+
+    def test_text_is_searchable(self):
+        document_file = self.attach(b'# Field notes\n\nThe lighthouse keeper logged the storm.')
+        text = AttachmentText.objects.get(document_file=document_file)
+        self.assertEqual(text.status, AttachmentText.DONE)
+        self.assertEqual((text.word_count, text.line_count), (9, 3))
+
+        (project_id, snippets), = self.projects('lighthouse keeper')
+        self.assertEqual(project_id, self.project.id)
+        self.assertEqual(snippets, ['# Field notes The <mark>lighthouse</mark> <mark>keeper</mark> logged the storm.'])
+        # Every term has to match the document's own text or one attachment.
+        self.assertEqual(self.projects('lighthouse draft'), [])
+
+        self.client.delete(f'/api/files/{document_file.id}/')
+        self.assertEqual(self.projects('lighthouse'), [])
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute("INSERT INTO api_attachment_fts (api_attachment_fts, rank) VALUES ('integrity-check', 1)")
+
+    def test_own_text_and_attachments_rank_together(self):
+        other = Project.objects.create(owner=self.user, title='Storms')
+        Document.objects.create(project=other, content='storm storm storm')
+        self.attach(b'one storm')
+        self.assertEqual([project for project, _ in self.projects('storm')], [other.id, self.project.id])
+        self.assertEqual(self.client.get('/api/search/', {'q': 'storm'}).data['count'], 2)
+
+    def test_fallback_search(self):
+        self.attach(b'The lighthouse keeper.')
+        results = search.FallbackIndex().page(None, self.user.id, search.parse_query('lighthouse keeper'), 0, 10)
+        self.assertEqual([result['project'] for result in results], [self.project.id])
+        self.assertEqual(results[0]['snippets'], ['The <mark>lighthouse</mark> keeper.'])
+
+    def test_stats(self):
+        self.attach(b'one two three')
+        self.attach(b'<p>four five</p>', 'page.html', 'text/html')
+        response = self.client.get(f'/api/projects/{self.project.id}/stats/')
+        self.assertEqual(response.data['stats']['attachments'], {'files': 2, 'words': 5, 'characters': 22, 'lines': 2})
+        self.assertEqual(response.data['stats']['words'], 2)
+        totals = analytics.totals(self.user)
+        self.assertEqual((totals['total_attachment_words'], totals['total_attachment_characters']), (5, 22))
+        self.assertEqual(totals['total_words'], 2)
+
+    def test_unchanged_files_are_not_extracted_again(self):
+        first = self.attach(b'Same bytes.')
+        with mock.patch.object(extraction, 'extract', wraps=extraction.extract) as extract:
+            attachment_index.submit(first)
+            # The same bytes under another document reuse the text.
+            project = Project.objects.create(owner=self.user, title='Copy')
+            second = self.attach(b'Same bytes.', document=Document.objects.create(project=project))
+        extract.assert_not_called()
+        self.assertEqual(AttachmentText.objects.get(document_file=second).text, 'Same bytes.')
+
+    def test_files_without_a_blob_are_hashed_first(self):
+        name = default_storage.save('documents/legacy.txt', io.BytesIO(b'Old attachment'))
+        with self.captureOnCommitCallbacks(execute=True):
+            document_file = DocumentFile.objects.create(document=self.document, file=name, filename='legacy.txt')
+        text = AttachmentText.objects.get(document_file=document_file)
+        self.assertEqual((text.status, text.sha256), (AttachmentText.DONE, hashlib.sha256(b'Old attachment').hexdigest()))
+        with mock.patch.object(extraction, 'extract') as extract:
+            attachment_index.submit(document_file)
+        extract.assert_not_called()
+        self.assertEqual(AttachmentText.objects.get(document_file=document_file).text, 'Old attachment')
+
+    def test_unsupported_and_failed_files(self):
+        document_file = self.attach(b'\x89PNG', 'photo.png', 'image/png')
+        self.assertEqual(AttachmentText.objects.get(document_file=document_file).status, AttachmentText.UNSUPPORTED)
+
+        with mock.patch.object(extraction, 'extract', side_effect=OSError('unreadable')):
+            document_file = self.attach(b'text', 'broken.txt', 'text/plain')
+        text = AttachmentText.objects.get(document_file=document_file)
+        self.assertEqual((text.status, text.error), (AttachmentText.FAILED, 'unreadable'))
+        call_command('index_attachments', '--failed', stdout=io.StringIO())
+        self.assertEqual(AttachmentText.objects.get(document_file=document_file).status, AttachmentText.DONE)
+
+
+class AttachmentWorkerPoolTests(TransactionTestCase):
+    def setUp(self):
+        use_media_root(self)
+        overrides = override_settings(ATTACHMENT_TEXT_WORKERS=2)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        use_worker_pool(self, attachment_index)
+        user = User.objects.create_user('writer@example.com', 'writer', 'secret-pass-123')
+        project = Project.objects.create(owner=user, title='Draft')
+        self.document = Document.objects.create(project=project, content='')
+
+    def test_text_is_extracted_in_worker_processes(self):
+        for number in range(3):
+            data = f'Attachment number {number}'.encode()
+            session = uploads.start(self.document, f'{number}.txt', len(data), 'text/plain')
+            uploads.write_chunk(session, 0, io.BytesIO(data), len(data), hashlib.sha256(data).hexdigest())
+            uploads.complete(session)
+
+        deadline = time.monotonic() + 60
+        while AttachmentText.objects.exclude(status=AttachmentText.DONE).exists() or AttachmentText.objects.count() < 3:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        self.assertEqual(
+            sorted(AttachmentText.objects.values_list('text', flat=True)),
+            [f'Attachment number {number}' for number in range(3)],
+        )
+        self.assertLessEqual(len(attachment_index.get_executor()._processes), 2)
+
+    def upload(self, name, data):
+        session = uploads.start(self.document, name, len(data), 'text/plain')
+        uploads.write_chunk(session, 0, io.BytesIO(data), len(data), hashlib.sha256(data).hexdigest())
+        return uploads.complete(session)
+
+    def test_a_dead_worker_does_not_break_later_uploads(self):
+        broken = attachment_index.get_executor()
+        self.assertIsInstance(broken.submit(os._exit, 1).exception(timeout=60), BrokenProcessPool)
+
+        self.upload('notes.txt', b'Still extracted')
+        deadline = time.monotonic() + 60
+        while not AttachmentText.objects.filter(status=AttachmentText.DONE).exists():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        self.assertEqual(AttachmentText.objects.get().text, 'Still extracted')
+        self.assertIsNot(attachment_index.get_executor(), broken)
+
+    def test_upload_completes_when_no_pool_can_be_started(self):
+        pool = mock.Mock(**{'submit.side_effect': BrokenProcessPool('worker died')})
+        with mock.patch.object(attachment_index, 'get_executor', return_value=pool):
+            document_file = self.upload('notes.txt', b'Text')
+        self.assertTrue(DocumentFile.objects.filter(id=document_file.id).exists())
+        self.assertEqual(AttachmentText.objects.get().status, AttachmentText.FAILED)
+
+
+class RecordingProvider(ai_services.AIProvider):
+    """Upper-cases its input and records every batch it is given."""
+    name = 'recording'
+
+    def __init__(self, delay=0.0):
+        self.batches = []
+        self.delay = delay
+
+    def run_batch(self, operation, contents, params):
+        self.batches.append(list(contents))
+        time.sleep(self.delay)
+        return [content.upper() for content in contents]
+
+
+class AIServiceTests(APITestBase):
+    TEXT = (
+        'Bees pollinate the garden every morning. The weather was grey. '
+        'Garden bees need flowers, and flowers need bees. Nothing else happened.'
+    )
+
+    def run_together(self, service, contents, **params):
+        results, errors = {}, []
+
+        def call(content):
+            try:
+                results[content] = service.run('summarize', content, **params)
+            except Exception as exc:
+                errors.append(exc)
+        threads = [threading.Thread(target=call, args=(content,)) for content in contents]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_local_provider_is_deterministic(self):
+        provider = ai_services.LocalProvider()
+        summary = provider.summarize(self.TEXT, max_sentences=2)
+        self.assertEqual(summary, 'Bees pollinate the garden every morning. Garden bees need flowers, and flowers need bees.')
+        self.assertEqual(provider.summarize(self.TEXT, max_sentences=2), summary)
+        self.assertEqual(provider.rewrite("It's really done, isn't it?", style='formal'), 'It is really done, is not it?')
+        self.assertEqual(provider.rewrite('We are not sure it is done.', style='casual'), "We aren't sure it's done.")
+        self.assertEqual(provider.rewrite('It is really just very good.'), 'It is good.')
+        ideas = provider.ideas(self.TEXT, count=3)
+        self.assertEqual(ideas[0], 'Expand on bees.')
+        self.assertEqual(len(ideas), 3)
+
+    def test_results_are_cached_by_content_and_params(self):
+        provider = RecordingProvider()
+        service = ai_services.AIService(provider, batch_window=0)
+        self.assertEqual(service.run('summarize', 'one', max_sentences=2), 'ONE')
+        self.assertEqual(service.run('summarize', 'one', max_sentences=2), 'ONE')
+        service.run('summarize', 'one', max_sentences=3)
+        service.run('ideas', 'one', max_sentences=2)
+        self.assertEqual(provider.batches, [['one'], ['one'], ['one']])
+
+    def test_ttl_cache_expires_entries(self):
+        now = [0.0]
+        cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 9
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 11
+        self.assertIsNone(cache.get('a'))
+        self.assertNotIn('a', cache)
+        for key in 'bcd':
+            cache.set(key, key)
+        self.assertNotIn('b', cache)
+
+    def test_concurrent_requests_share_one_provider_call(self):
+        provider = RecordingProvider()
+        service = ai_services.AIService(provider, batch_window=0.5, batch_size=8)
+        results, errors = self.run_together(service, ['a', 'b', 'c', 'd', 'a'])
+        self.assertEqual(errors, [])
+        self.assertEqual(results, {'a': 'A', 'b': 'B', 'c': 'C', 'd': 'D'})
+        self.assertEqual(provider.batches, [['a', 'b', 'c', 'd']])
+
+        # A full batch goes to the provider without waiting out the window.
+        service = ai_services.AIService(provider, batch_window=60, batch_size=2)
+        start = time.monotonic()
+        results, errors = self.run_together(service, ['e', 'f'])
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(provider.batches[-1], ['e', 'f'])
+
+    def test_requests_beyond_the_limits_are_turned_away(self):
+        provider = RecordingProvider(delay=0.3)
+        service = ai_services.AIService(provider, batch_window=0, max_pending=1)
+        results, errors = self.run_together(service, ['a', 'b'])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], ai_services.AIUnavailable)
+
+        service = ai_services.AIService(provider, batch_window=0, max_concurrency=1, queue_timeout=0.05)
+        results, errors = self.run_together(service, ['c', 'd'])
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(errors[0], ai_services.AIUnavailable)
+
+    def test_views(self):
+        self.document.content = self.TEXT
+        self.document.save()
+        response = self.client.post('/api/ai/summarize/', {'document': self.document.id, 'max_sentences': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'summary': 'Bees pollinate the garden every morning.', 'provider': 'local'})
+        response = self.client.post('/api/ai/rewrite/', {'content': "I'm here", 'style': 'formal'}, format='json')
+        self.assertEqual(response.data['text'], 'I am here')
+        response = self.client.post('/api/ai/ideas/', {'content': self.TEXT, 'count': 2}, format='json')
+        self.assertEqual(len(response.data['ideas']), 2)
+
+        self.assertEqual(self.client.post('/api/ai/rewrite/', {}, format='json').status_code, 400)
+        other = User.objects.create_user('other@example.com', 'other', 'pass-12345')
+        foreign = Document.objects.create(project=Project.objects.create(owner=other, title='Theirs'))
+        response = self.client.post('/api/ai/summarize/', {'document': foreign.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        with override_settings(AI_MAX_CONTENT_CHARS=5):
+            response = self.client.post('/api/ai/ideas/', {'content': 'Too long'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        with mock.patch.object(ai_services.AIService, 'run', side_effect=ai_services.AIUnavailable('Busy.')):
+            response = self.client.post('/api/ai/ideas/', {'content': 'Bees'}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+
+    def test_provider_failures_are_bad_gateway(self):
+        with mock.patch.object(ai_services.AIService, 'run', side_effect=ai_services.AIError('Bad reply.')):
+            response = self.client.post('/api/ai/summarize/', {'content': 'Bees'}, format='json')
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.data, {'error': 'Bad reply.'})
+        with mock.patch.object(ai_services.AIService, 'run', side_effect=RuntimeError('Connection reset')), \
+                self.assertLogs('api.views', 'ERROR'):
+            response = self.client.post('/api/ai/rewrite/', {'content': 'Bees'}, format='json')
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.data, {'error': 'The AI provider failed.'})
+        response = self.client.post('/api/ai/rewrite/', {'content': 'Bees', 'style': 'loud'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class SummarizerTests(TestCase):
+    TEXT = (
+        '# Bees\n\n'
+        'Bees visit flowers for nectar. Flowers need bees to carry pollen. The weather was grey.\n\n'
+        '- Pollen sticks to bees as they visit flowers.\n'
+        '- Nectar is sugar water.\n\n'
+        'Nothing else happened that day.'
+    )
+
+    def setUp(self):
+        summarizer._cache.clear()
+
+    def test_splits_paragraphs_into_sentences_without_headings(self):
+        found, scores = summarizer.rank(self.TEXT)
+        self.assertEqual(found, [
+            'Bees visit flowers for nectar.', 'Flowers need bees to carry pollen.', 'The weather was grey.',
+            'Pollen sticks to bees as they visit flowers.', 'Nectar is sugar water.', 'Nothing else happened that day.',
+        ])
+        self.assertAlmostEqual(scores.sum(), 1)
+
+    def test_scores_match_textrank_on_the_dense_similarity_matrix(self):
+        found, scores = summarizer.rank(self.TEXT)
+        vocabulary = sorted({word for sentence in found for word in summarizer.words(sentence)})
+        counts = np.array([[summarizer.words(sentence).count(word) for word in vocabulary] for sentence in found])
+        tf = np.where(counts > 0, 1 + np.log(np.maximum(counts, 1)), 0)
+        idf = np.log((1 + len(found)) / (1 + (counts > 0).sum(axis=0))) + 1
+        vectors = tf * idf
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        similarity = vectors @ vectors.T
+        np.fill_diagonal(similarity, 0)
+        degree = similarity.sum(axis=1)
+        transition = np.where(degree[:, None] > 0, similarity / np.where(degree > 0, degree, 1)[:, None], 1 / len(found))
+        expected = np.full(len(found), 1 / len(found))
+        for _ in range(200):
+            expected = 0.15 / len(found) + 0.85 * transition.T @ expected
+        np.testing.assert_allclose(scores, expected, atol=1e-6)
+
+        self.assertEqual(
+            summarizer.summarize(self.TEXT, 2),
+            'Bees visit flowers for nectar. Pollen sticks to bees as they visit flowers.',
+        )
+
+    def test_only_changed_paragraphs_are_tokenized_again(self):
+        summarizer.summarize(self.TEXT)
+        with mock.patch.object(summarizer, '_Paragraph', wraps=summarizer._Paragraph) as tokenize:
+            summarizer.summarize(self.TEXT.replace('grey', 'warm'))
+        self.assertEqual(tokenize.call_count, 1)
+
+    def test_short_and_empty_text(self):
+        self.assertEqual(summarizer.summarize('', 3), '')
+        self.assertEqual(summarizer.summarize('# Only a heading', 3), '')
+        self.assertEqual(summarizer.summarize('One. Two. Three. Four.', 2), 'One. Two.')
+
+
+class PdfRenderingTests(TestCase):
+    def pages(self, body):
+        return re.findall(rb'/Type /Page\b(?!s)', body)
+
+    def test_structure(self):
+        body = rendering.pdf('# Heading\n\nText with (parens), \\ and \u00e9 \u4e2d.')
+        offset = int(re.search(rb'startxref\n(\d+)', body).group(1))
+        self.assertTrue(body[offset:].startswith(b'xref\n0 7\n'))
+        # Every xref entry points at its object.
+        for number, entry in enumerate(re.findall(rb'(\d{10}) 00000 n', body[offset:]), 1):
+            self.assertTrue(body[int(entry):].startswith(b'%d 0 obj' % number))
+        self.assertEqual(len(self.pages(body)), 1)
+        self.assertEqual(rendering.pdf('same text'), rendering.pdf('same text'))
+
+    def test_long_documents_span_pages(self):
+        self.assertEqual(len(self.pages(rendering.pdf(''))), 1)
+        self.assertGreater(len(self.pages(rendering.pdf('word ' * 20000))), 10)
+
+
+class ExportWorkerPoolTests(TransactionTestCase):
+    def setUp(self):
+        use_export_root(self, workers=2)
+        use_worker_pool(self, export_jobs)
+        self.user = User.objects.create_user('writer@example.com', 'writer', 'secret-pass-123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_jobs_render_in_worker_processes(self):
+        jobs = []
+        for number in range(4):
+            project = Project.objects.create(owner=self.user, title=f'Draft {number}')
+            document = Document.objects.create(project=project, content=f'# Draft {number}\n\nText.')
+            response = self.client.post(f'/api/documents/{document.id}/exports/', {'format': 'pdf'}, format='json')
+            self.assertEqual(response.status_code, 202)
+            jobs.append(response.data['id'])
+
+        deadline = time.monotonic() + 60
+        while ExportJob.objects.filter(id__in=jobs, status=ExportJob.QUEUED).exists():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        self.assertEqual(ExportJob.objects.filter(id__in=jobs, status=ExportJob.DONE).count(), 4)
+        self.assertLessEqual(len(export_jobs.get_executor()._processes), 2)
+
+    def wait_for(self, job_id):
+        deadline = time.monotonic() + 60
+        while ExportJob.objects.filter(id=job_id, status=ExportJob.QUEUED).exists():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        return ExportJob.objects.get(id=job_id)
+
+    def test_a_dead_worker_does_not_break_later_jobs(self):
+        broken = export_jobs.get_executor()
+        self.assertIsInstance(broken.submit(os._exit, 1).exception(timeout=60), BrokenProcessPool)
+
+        project = Project.objects.create(owner=self.user, title='Draft')
+        document = Document.objects.create(project=project, content='# Draft\n\nText.')
+        response = self.client.post(f'/api/documents/{document.id}/exports/', {'format': 'html'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.wait_for(response.data['id']).status, ExportJob.DONE)
+        self.assertIsNot(export_jobs.get_executor(), broken)
+
+    def test_job_fails_when_no_pool_can_be_started(self):
+        project = Project.objects.create(owner=self.user, title='Draft')
+        document = Document.objects.create(project=project, content='Text.')
+        pool = mock.Mock(**{'submit.side_effect': BrokenProcessPool('worker died')})
+        with mock.patch.object(export_jobs, 'get_executor', return_value=pool):
+            response = self.client.post(f'/api/documents/{document.id}/exports/', {'format': 'html'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], ExportJob.FAILED)
+        self.assertEqual(pool.submit.call_count, 2)
+
+
+class CollaborativeEditingTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer@example.com', 'writer', 'secret-pass-123')
+        self.project = Project.objects.create(owner=self.user, title='Draft')
+        self.document = Document.objects.create(project=self.project, content='Hello world')
+        self.application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    async def connect(self, user=None):
+        token = AccessToken.for_user(user or self.user)
+        communicator = WebsocketCommunicator(
+            self.application, f'/ws/documents/{self.document.id}/?token={token}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_concurrent_edits_converge_and_persist_on_leave(self):
+        alice = await self.connect()
+        bob = await self.connect()
+        init = await alice.receive_json_from()
+        await bob.receive_json_from()
+        self.assertEqual(init, {'type': 'init', 'version': 0, 'content': 'Hello world'})
+
+        # Bob edits version 0 without having seen Alice's change.
+        await alice.send_json_to({'type': 'ops', 'base_version': 0, 'ref': 'a',
+                                  'ops': [{'offset': 5, 'insert': ','}]})
+        self.assertEqual(await alice.receive_json_from(), {'type': 'ack', 'version': 1, 'ref': 'a'})
+        await bob.send_json_to({'type': 'ops', 'base_version': 0, 'ref': 'b',
+                                'ops': [{'offset': 11, 'insert': '!'}]})
+
+        self.assertEqual(await bob.receive_json_from(),
+                         {'type': 'ops', 'version': 1, 'ops': [{'offset': 5, 'delete': 0, 'insert': ','}]})
+        self.assertEqual(await bob.receive_json_from(), {'type': 'ack', 'version': 2, 'ref': 'b'})
+        self.assertEqual(await alice.receive_json_from(),
+                         {'type': 'ops', 'version': 2, 'ops': [{'offset': 12, 'delete': 0, 'insert': '!'}]})
+
+        await alice.disconnect()
+        await bob.disconnect()
+        document = await Document.objects.aget(pk=self.document.pk)
+        self.assertEqual(document.content, 'Hello, world!')
+        self.assertEqual(document.version, 2)
+
+    async def test_other_users_are_rejected(self):
+        other = await User.objects.acreate(email='other@example.com', username='other')
+        token = AccessToken.for_user(other)
+        communicator = WebsocketCommunicator(
+            self.application, f'/ws/documents/{self.document.id}/?token={token}'
+        )
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4403)
+
+    async def test_flush_after_an_outside_save_rebases_the_session(self):
+        alice = await self.connect()
+        await alice.receive_json_from()
+        await alice.send_json_to({'type': 'ops', 'base_version': 0, 'ref': 'a',
+                                  'ops': [{'offset': 11, 'insert': '!'}]})
+        self.assertEqual(await alice.receive_json_from(), {'type': 'ack', 'version': 1, 'ref': 'a'})
+        await sync_to_async(commit_content)(self.document, 'Hi world')
+
+        session = collab._sessions[self.document.id]
+        async with session.lock:
+            self.assertFalse(await session.flush())
+        self.assertEqual((session.content, session.version), ('Hi world!', 2))
+        await consumers.broadcast_resync(session)
+        self.assertEqual(await alice.receive_json_from(), {'type': 'resync', 'version': 2, 'content': 'Hi world!'})
+
+        await alice.disconnect()
+        document = await Document.objects.aget(pk=self.document.pk)
+        self.assertEqual((document.content, document.version), ('Hi world!', 2))
+
+    def test_rebase_keeps_edits_on_other_lines(self):
+        session = collab.DocumentSession(self.document.id, 'one\ntwo\nthree\n', 3)
+        session.apply(3, [{'offset': 0, 'delete': 0, 'insert': 'ONE '}])
+        session.apply(4, [{'offset': 12, 'delete': 6, 'insert': ''}])
+        session.rebase('one\nTWO\nthree\nfour\n', 4)
+        self.assertEqual(session.content, 'ONE one\nTWO\nfour\n')
+        self.assertEqual((session.version, session.persisted_version), (5, 4))
+        self.assertTrue(session.dirty)
@@ -0,0 +1,307 @@
+"""
+Text edit operations used by incremental document saves.
+
+An edit is a dict {'offset': int, 'delete': int, 'insert': str}. A list of
+edits is applied in order, each offset counting Unicode code points in the
+text produced by the edits before it.
+"""
+
+
+class OperationError(ValueError):
+    pass
+
+
+def validate_ops(ops, max_ops=None):
+    """Normalise a list of edits, raising OperationError if it is malformed."""
+    if not isinstance(ops, list):
+        raise OperationError('ops must be a list.')
+    if max_ops is not None and len(ops) > max_ops:
+        raise OperationError(f'At most {max_ops} ops are allowed per request.')
+
+    cleaned = []
+    for index, op in enumerate(ops):
+        if not isinstance(op, dict):
+            raise OperationError(f'op {index} must be an object.')
+        offset = op.get('offset')
+        delete = op.get('delete', 0)
+        insert = op.get('insert', '')
+        if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+            raise OperationError(f'op {index}: offset must be a non-negative integer.')
+        if not isinstance(delete, int) or isinstance(delete, bool) or delete < 0:
+            raise OperationError(f'op {index}: delete must be a non-negative integer.')
+        if not isinstance(insert, str):
+            raise OperationError(f'op {index}: insert must be a string.')
+        if delete or insert:
+            cleaned.append({'offset': offset, 'delete': delete, 'insert': insert})
+    return cleaned
+
+
+def apply_ops(text, ops):
+    """Apply validated edits to `text` and return the new text."""
+    # Edits that move forward through the document (the common case for a
+    # batch of autosaved keystrokes) are stitched together in one pass;
+    # anything else falls back to slicing per edit.
+    parts = []
+    position = 0
+    shift = 0
+    for op in ops:
+        start = op['offset'] - shift
+        if start < position:
+            return _apply_sequentially(text, ops)
+        end = start + op['delete']
+        if end > len(text):
+            raise OperationError(f'Edit at {op["offset"]} runs past the end of the document.')
+        parts.append(text[position:start])
+        parts.append(op['insert'])
+        position = end
+        shift += len(op['insert']) - op['delete']
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
+def _apply_sequentially(text, ops):
+    for op in ops:
+        start = op['offset']
+        end = start + op['delete']
+        if end > len(text):
+            raise OperationError(f'Edit at {start} runs past the end of the document.')
+        text = text[:start] + op['insert'] + text[end:]
+    return text
+
+
+def common_affixes(a, b):
+    """Return the lengths of the common prefix and suffix of two strings."""
+    def longest(match, limit):
+        # Binary search on slice equality keeps the comparisons in C.
+        lo, hi = 0, limit
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if match(mid):
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    limit = min(len(a), len(b))
+    prefix = longest(lambda n: a[:n] == b[:n], limit)
+    suffix = longest(lambda n: a[len(a) - n:] == b[len(b) - n:], limit - prefix)
+    return prefix, suffix
+
+
+# Operational transformation.
+#
+# For transforming concurrent edits, a batch of edits is turned into a single
+# component operation in the ot.js format: a positive int retains that many
+# characters, a negative int deletes that many and a string is inserted.
+# A component operation spans the whole document it applies to.
+
+class _Builder:
+    def __init__(self):
+        self.ops = []
+
+    def retain(self, n):
+        if n <= 0:
+            return
+        if self.ops and _is_retain(self.ops[-1]):
+            self.ops[-1] += n
+        else:
+            self.ops.append(n)
+
+    def insert(self, text):
+        if not text:
+            return
+        ops = self.ops
+        if ops and isinstance(ops[-1], str):
+            ops[-1] += text
+        elif ops and _is_delete(ops[-1]):
+            # Keep inserts ahead of deletes so equal operations compare equal.
+            if len(ops) > 1 and isinstance(ops[-2], str):
+                ops[-2] += text
+            else:
+                ops.insert(len(ops) - 1, text)
+        else:
+            ops.append(text)
+
+    def delete(self, n):
+        if n <= 0:
+            return
+        if self.ops and _is_delete(self.ops[-1]):
+            self.ops[-1] -= n
+        else:
+            self.ops.append(-n)
+
+
+def _is_retain(op):
+    return isinstance(op, int) and op > 0
+
+
+def _is_delete(op):
+    return isinstance(op, int) and op < 0
+
+
+def base_length(op):
+    return sum(abs(c) for c in op if isinstance(c, int))
+
+
+def target_length(op):
+    return sum(c if isinstance(c, int) else len(c) for c in op if not _is_delete(c))
+
+
+def edits_to_components(edits, length):
+    """Turn a batch of sequential edits on a text of `length` characters into one operation."""
+    builder = _Builder()
+    position = 0
+    shift = 0
+    for edit in edits:
+        start = edit['offset'] - shift
+        if start < position:
+            break
+        end = start + edit['delete']
+        if end > length:
+            raise OperationError(f'Edit at {edit["offset"]} runs past the end of the document.')
+        builder.retain(start - position)
+        builder.delete(edit['delete'])
+        builder.insert(edit['insert'])
+        position = end
+        shift += len(edit['insert']) - edit['delete']
+    else:
+        builder.retain(length - position)
+        return builder.ops
+
+    # Edits that jump backwards are composed one at a time.
+    op = [length] if length else []
+    for edit in edits:
+        current = target_length(op)
+        end = edit['offset'] + edit['delete']
+        if end > current:
+            raise OperationError(f'Edit at {edit["offset"]} runs past the end of the document.')
+        step = _Builder()
+        step.retain(edit['offset'])
+        step.delete(edit['delete'])
+        step.insert(edit['insert'])
+        step.retain(current - end)
+        op = compose(op, step.ops)
+    return op
+
+
+def components_to_edits(op):
+    """Express an operation as forward-moving sequential edits."""
+    edits = []
+    position = 0
+    for component in op:
+        if isinstance(component, str):
+            edits.append({'offset': position, 'delete': 0, 'insert': component})
+            position += len(component)
+        elif component > 0:
+            position += component
+        else:
+            last = edits[-1] if edits else None
+            if last and not last['delete'] and last['offset'] + len(last['insert']) == position:
+                last['delete'] = -component
+            else:
+                edits.append({'offset': position, 'delete': -component, 'insert': ''})
+    return edits
+
+
+def apply_components(text, op):
+    if base_length(op) != len(text):
+        raise OperationError('Operation does not match the document length.')
+    parts = []
+    position = 0
+    for component in op:
+        if isinstance(component, str):
+            parts.append(component)
+        elif component > 0:
+            parts.append(text[position:position + component])
+            position += component
+        else:
+            position -= component
+    return ''.join(parts)
+
+
+def compose(a, b):
+    """Combine `a` followed by `b` into a single operation."""
+    if target_length(a) != base_length(b):
+        raise OperationError('Cannot compose operations of mismatched length.')
+    result = _Builder()
+    ops1, ops2 = iter(a), iter(b)
+    op1, op2 = next(ops1, None), next(ops2, None)
+    while op1 is not None or op2 is not None:
+        if _is_delete(op1):
+            result.delete(-op1)
+            op1 = next(ops1, None)
+            continue
+        if isinstance(op2, str):
+            result.insert(op2)
+            op2 = next(ops2, None)
+            continue
+        if op1 is None or op2 is None:
+            raise OperationError('Cannot compose operations of mismatched length.')
+
+        if _is_retain(op1) and _is_retain(op2):
+            step = min(op1, op2)
+            result.retain(step)
+            op1, op2 = op1 - step, op2 - step
+        elif isinstance(op1, str) and _is_delete(op2):
+            step = min(len(op1), -op2)
+            op1, op2 = op1[step:], op2 + step
+        elif isinstance(op1, str) and _is_retain(op2):
+            step = min(len(op1), op2)
+            result.insert(op1[:step])
+            op1, op2 = op1[step:], op2 - step
+        else:
+            # op1 retains, op2 deletes.
+            step = min(op1, -op2)
+            result.delete(step)
+            op1, op2 = op1 - step, op2 + step
+
+        if op1 == 0 or op1 == '':
+            op1 = next(ops1, None)
+        if op2 == 0:
+            op2 = next(ops2, None)
+    return result.ops
+
+
+def transform(a, b):
+    """
+    Transform two concurrent operations on the same text.
+
+    Returns (a', b') such that applying a then b' equals applying b then a'.
+    When both insert at the same position, a's text comes first.
+    """
+    if base_length(a) != base_length(b):
+        raise OperationError('Cannot transform operations of mismatched length.')
+    a_prime, b_prime = _Builder(), _Builder()
+    ops1, ops2 = iter(a), iter(b)
+    op1, op2 = next(ops1, None), next(ops2, None)
+    while op1 is not None or op2 is not None:
+        if isinstance(op1, str):
+            a_prime.insert(op1)
+            b_prime.retain(len(op1))
+            op1 = next(ops1, None)
+            continue
+        if isinstance(op2, str):
+            a_prime.retain(len(op2))
+            b_prime.insert(op2)
+            op2 = next(ops2, None)
+            continue
+        if op1 is None or op2 is None:
+            raise OperationError('Cannot transform operations of mismatched length.')
+
+        step = min(abs(op1), abs(op2))
+        if _is_retain(op1) and _is_retain(op2):
+            a_prime.retain(step)
+            b_prime.retain(step)
+        elif _is_delete(op1) and _is_retain(op2):
+            a_prime.delete(step)
+        elif _is_retain(op1) and _is_delete(op2):
+            b_prime.delete(step)
+        # Both deleting the same text: nothing left for either side to do.
+
+        op1 = op1 - step if op1 > 0 else op1 + step
+        op2 = op2 - step if op2 > 0 else op2 + step
+        if op1 == 0:
+            op1 = next(ops1, None)
+        if op2 == 0:
+            op2 = next(ops2, None)
+    return a_prime.ops, b_prime.ops
@@ -0,0 +1,128 @@
+"""
+Word, character and line counts stored on Document.
+
+Counts follow str.split() for words, len() for characters and
+count('\\n') + 1 for lines, so an empty document has one line, as the
+stats endpoint has always reported. Full saves recount the text once; the
+patch path only rescans the words touched by each edit.
+"""
+from .textops import common_affixes, edits_to_components
+
+STAT_FIELDS = ('word_count', 'char_count', 'line_count')
+
+
+def text_stats(text):
+    text = text or ''
+    return {
+        'word_count': len(text.split()),
+        'char_count': len(text),
+        'line_count': text.count('\n') + 1,
+    }
+
+
+def document_stats(document):
+    return {field: getattr(document, field) for field in STAT_FIELDS}
+
+
+def _changed_regions(op):
+    """Yield (start, end, inserted) spans of the old text touched by an operation."""
+    position = 0
+    start, inserted = None, []
+    for component in op:
+        if isinstance(component, int) and component > 0:
+            if start is not None:
+                yield start, position, ''.join(inserted)
+                start, inserted = None, []
+            position += component
+            continue
+        if start is None:
+            start = position
+        if isinstance(component, str):
+            inserted.append(component)
+        else:
+            position -= component
+    if start is not None:
+        yield start, position, ''.join(inserted)
+
+
+def _windows(text, regions):
+    """
+    Widen every changed region to the whitespace around it, so each word is
+    either entirely inside a window or untouched, merging windows that meet.
+    Yields (text of the window before, text of the window after).
+    """
+    windows = []
+    for start, end, inserted in regions:
+        left = start
+        while left > 0 and not text[left - 1].isspace():
+            left -= 1
+        right = end
+        while right < len(text) and not text[right].isspace():
+            right += 1
+        if windows and left <= windows[-1][1]:
+            windows[-1][1] = right
+            windows[-1][2].append((start, end, inserted))
+        else:
+            windows.append([left, right, [(start, end, inserted)]])
+
+    for left, right, changes in windows:
+        parts = []
+        position = left
+        for start, end, inserted in changes:
+            parts.append(text[position:start])
+            parts.append(inserted)
+            position = end
+        parts.append(text[position:right])
+        yield text[left:right], ''.join(parts)
+
+
+def patched_stats(text, stats, edits):
+    """
+    Return the counts of `text` after applying `edits`, given the current
+    counts in `stats`, without rescanning the unchanged parts of the text.
+    """
+    regions = list(_changed_regions(edits_to_components(edits, len(text))))
+    words = stats['word_count']
+    chars = stats['char_count']
+    newlines = stats['line_count'] - 1
+
+    for start, end, inserted in regions:
+        chars += len(inserted) - (end - start)
+        newlines += inserted.count('\n') - text.count('\n', start, end)
+    for before, after in _windows(text, regions):
+        words += len(after.split()) - len(before.split())
+
+    return {
+        'word_count': words,
+        'char_count': chars,
+        'line_count': newlines + 1,
+    }
+
+
+def _word_changes(text, regions):
+    added = removed = 0
+    for before, after in _windows(text, regions):
+        old, new = before.split(), after.split()
+        # Words kept at either end of the window were not really rewritten.
+        same = 0
+        while same < min(len(old), len(new)) and old[same] == new[same]:
+            same += 1
+        while same < min(len(old), len(new)) and old[-1] == new[-1]:
+            old.pop()
+            new.pop()
+        added += len(new) - same
+        removed += len(old) - same
+    return added, removed
+
+
+def word_changes(old, new):
+    """Return (words added, words removed) between two versions of a text."""
+    prefix, suffix = common_affixes(old, new)
+    if prefix == len(old) == len(new):
+        return 0, 0
+    return _word_changes(old, [(prefix, len(old) - suffix, new[prefix:len(new) - suffix])])
+
+
+def patched_word_changes(text, edits):
+    """Return (words added, words removed) by applying `edits` to `text`."""
+    return _word_changes(text, _changed_regions(edits_to_components(edits, len(text))))
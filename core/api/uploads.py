@@ -0,0 +1,187 @@
+"""
+Resumable chunked uploads, stored once per SHA-256.
+
+An UploadSession owns a part file under MEDIA_ROOT/uploads/. Each chunk
+is PUT at the session's `received` offset together with its SHA-256, and
+streamed from the request onto the part file in COPY_BUFFER pieces while
+it is hashed, so no chunk is ever held in memory. Only a chunk whose
+checksum matches advances `received`; a failed or interrupted chunk is
+truncated away, so the bytes before `received` are always verified and a
+client that lost its connection asks for the offset and carries on.
+
+A chunk holds a short lease on its session (a conditional UPDATE, not a
+transaction) so that two writers cannot interleave, and only advances
+`received` if it still holds the lease when it is done. Completing the
+upload takes the same lease, hashes the part file and moves it to
+blobs/<aa>/<sha256>, unless a FileBlob with that hash exists already, in
+which case the part file is dropped and the blob gains a reference. Blobs
+are deleted with their last DocumentFile.
+"""
+import datetime
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import DocumentFile, FileBlob, UploadSession
+
+COPY_BUFFER = 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetConflict(UploadError):
+    """The chunk does not start at the session's offset, or another chunk is being written."""
+
+
+class ChecksumMismatch(UploadError):
+    pass
+
+
+class IncompleteChunk(UploadError):
+    pass
+
+
+def part_path(session):
+    return os.path.join(settings.MEDIA_ROOT, 'uploads', f'{session.id}.part')
+
+
+def blob_name(sha256):
+    return f'blobs/{sha256[:2]}/{sha256}'
+
+
+def start(document, filename, size, content_type='', sha256=''):
+    session = UploadSession.objects.create(
+        document=document, filename=filename, size=size, content_type=content_type, sha256=sha256
+    )
+    os.makedirs(os.path.dirname(part_path(session)), exist_ok=True)
+    open(part_path(session), 'wb').close()
+    return session
+
+
+def _claim(session, received):
+    """
+    Take the lease on `session` if it has `received` bytes and nobody else
+    holds it; returns the lease, which releasing or advancing must match.
+    """
+    now = timezone.now()
+    lease = now + datetime.timedelta(seconds=settings.UPLOAD_CHUNK_TIMEOUT)
+    claimed = UploadSession.objects.filter(id=session.id, received=received).filter(
+        Q(lease_until__isnull=True) | Q(lease_until__lt=now)
+    ).update(lease_until=lease)
+    if not claimed:
+        session.refresh_from_db(fields=['received', 'lease_until'])
+        raise OffsetConflict(session.received)
+    return lease
+
+
+def write_chunk(session, offset, stream, length, sha256):
+    """
+    Append `length` bytes read from `stream` at `offset`, which must be
+    the session's current offset, and return the new offset.
+    """
+    lease = _claim(session, offset)
+    held = UploadSession.objects.filter(id=session.id, lease_until=lease)
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with open(part_path(session), 'r+b') as part:
+            part.seek(offset)
+            while written < length:
+                data = stream.read(min(COPY_BUFFER, length - written))
+                if not data:
+                    break
+                digest.update(data)
+                part.write(data)
+                written += len(data)
+            if written < length:
+                raise IncompleteChunk(f'Received {written} of {length} bytes.')
+            if digest.hexdigest() != sha256:
+                raise ChecksumMismatch('The chunk does not match its SHA-256.')
+    except BaseException:
+        # Past its lease the part file belongs to whoever claimed it next.
+        if held.exists():
+            with open(part_path(session), 'r+b') as part:
+                part.truncate(offset)
+            held.update(lease_until=None)
+        raise
+
+    # A writer slower than UPLOAD_CHUNK_TIMEOUT has lost its lease and must
+    # not move the offset under the writer that took over.
+    if not held.update(received=offset + length, lease_until=None, updated_at=timezone.now()):
+        session.refresh_from_db(fields=['received', 'lease_until'])
+        raise OffsetConflict(session.received)
+    session.received = offset + length
+    return session.received
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while data := file.read(COPY_BUFFER):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def complete(session):
+    """Turn a fully received session into a DocumentFile, storing its bytes once."""
+    if session.received != session.size:
+        raise IncompleteChunk(f'Received {session.received} of {session.size} bytes.')
+    # The lease keeps a second complete (or a chunk) away from the part file.
+    lease = _claim(session, session.size)
+    held = UploadSession.objects.filter(id=session.id, lease_until=lease)
+    path = part_path(session)
+    sha256 = file_sha256(path)
+    if session.sha256 and sha256 != session.sha256:
+        held.delete()
+        raise ChecksumMismatch('The uploaded file does not match its SHA-256.')
+
+    name = blob_name(sha256)
+    with transaction.atomic():
+        # Updating the session locks it until the commit, and a lease that
+        # ran out while hashing may have been claimed by somebody else.
+        if not held.update(updated_at=timezone.now()):
+            raise OffsetConflict(session.size)
+        # get_or_create inserts in a savepoint and, when a concurrent complete
+        # of the same bytes wins the insert, reads (and locks) its row instead.
+        blob, _ = FileBlob.objects.select_for_update().get_or_create(
+            sha256=sha256, defaults={'size': session.size},
+        )
+        if not default_storage.exists(name):
+            os.makedirs(os.path.dirname(default_storage.path(name)), exist_ok=True)
+            os.replace(path, default_storage.path(name))
+        FileBlob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + 1)
+        document_file = DocumentFile.objects.create(
+            document_id=session.document_id, file=name, blob=blob, filename=session.filename,
+            size=session.size, content_type=session.content_type,
+        )
+        session.delete()
+    return document_file
+
+
+def release_blob(blob_id):
+    """Drop one reference to a blob, deleting it and its file with the last."""
+    with transaction.atomic():
+        blob = FileBlob.objects.select_for_update().filter(id=blob_id).first()
+        if blob is None:
+            return
+        if blob.ref_count > 1:
+            FileBlob.objects.filter(id=blob.id).update(ref_count=F('ref_count') - 1)
+            return
+        blob.delete()
+        # Inside the transaction, so a concurrent upload of the same bytes
+        # (waiting on the row lock) stores the file again after this.
+        default_storage.delete(blob_name(blob.sha256))
+
+
+def remove_part(session):
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
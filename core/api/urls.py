@@ -12,5 +12,26 @@ urlpatterns = [
     path('auth/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('', include(router.urls)),
+    path('analytics/', views.AnalyticsView.as_view(), name='analytics'),
+    path('analytics/timeline/', views.AnalyticsTimelineView.as_view(), name='analytics-timeline'),
+    path('search/', views.SearchView.as_view(), name='search'),
     path('documents/<int:document_id>/history/', views.HistoryViewSet.as_view({'get': 'list'}), name='document-history'),
+    path('documents/<int:document_id>/history/recent/', views.HistoryViewSet.as_view({'get': 'recent'}), name='recent-history'),
+    path('documents/<int:document_id>/history/<int:pk>/', views.HistoryViewSet.as_view({'get': 'retrieve'}), name='history-detail'),
+    path('documents/<int:document_id>/history/<int:a>/diff/<int:b>/', views.HistoryDiffView.as_view(), name='history-diff'),
+    path('documents/<int:document_id>/preview/', views.PreviewView.as_view(), name='document-preview'),
+    path('documents/<int:document_id>/export/', views.ExportView.as_view(), name='document-export'),
+    path('documents/<int:document_id>/exports/', views.ExportJobCreateView.as_view(), name='export-job-list'),
+    path('documents/<int:document_id>/uploads/', views.UploadCreateView.as_view(), name='upload-list'),
+    path('documents/<int:document_id>/files/', views.DocumentFileListView.as_view(), name='document-file-list'),
+    path('uploads/<uuid:pk>/', views.UploadDetailView.as_view(), name='upload-detail'),
+    path('uploads/<uuid:pk>/complete/', views.UploadCompleteView.as_view(), name='upload-complete'),
+    path('files/<int:pk>/', views.DocumentFileDetailView.as_view(), name='document-file-detail'),
+    path('files/<int:pk>/download/', views.DocumentFileDownloadView.as_view(), name='document-file-download'),
+    path('ai/summarize/', views.AISummarizeView.as_view(), name='ai-summarize'),
+    path('ai/rewrite/', views.AIRewriteView.as_view(), name='ai-rewrite'),
+    path('ai/ideas/', views.AIIdeasView.as_view(), name='ai-ideas'),
+    path('export/archive/', views.ArchiveExportView.as_view(), name='export-archive'),
+    path('exports/<int:pk>/', views.ExportJobDetailView.as_view(), name='export-job-detail'),
+    path('exports/<int:pk>/download/', views.ExportJobDownloadView.as_view(), name='export-job-download'),
 ]
\ No newline at end of file
@@ -0,0 +1,314 @@
+import difflib
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Subquery
+from django.utils import timezone
+
+from .activity import record_activity
+from .analytics import invalidate_document, invalidate_document_id
+from .history_index import index_snapshot, reindex_document
+from .models import Document, History
+from .textops import common_affixes
+from .textstats import document_stats, patched_stats, text_stats
+
+DEFAULT_KEYFRAME_INTERVAL = 20
+
+
+def keyframe_interval():
+    return max(1, getattr(settings, 'HISTORY_KEYFRAME_INTERVAL', DEFAULT_KEYFRAME_INTERVAL))
+
+
+def make_delta(old, new):
+    """
+    Encode `new` as a line-based delta against `old`.
+
+    The delta is a JSON list where a positive int copies that many lines
+    from `old`, a negative int skips that many lines and a string is
+    inserted verbatim.
+    """
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+
+    # Autosaves usually touch a small region, so trim the common head and
+    # tail before handing the middle to SequenceMatcher.
+    head = 0
+    limit = min(len(a), len(b))
+    while head < limit and a[head] == b[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and a[-1 - tail] == b[-1 - tail]:
+        tail += 1
+
+    ops = []
+    if head:
+        ops.append(head)
+    a_mid = a[head:len(a) - tail]
+    b_mid = b[head:len(b) - tail]
+    matcher = difflib.SequenceMatcher(None, a_mid, b_mid, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append(''.join(b_mid[j1:j2]))
+    if tail:
+        ops.append(tail)
+    return json.dumps(ops, separators=(',', ':'))
+
+
+def apply_delta(old, delta):
+    lines = old.splitlines(keepends=True)
+    pos = 0
+    out = []
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.extend(lines[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return ''.join(out)
+
+
+def get_content(history):
+    """Rebuild the full text of a History row from its nearest keyframe."""
+    if history.is_keyframe:
+        return history.content_snapshot
+
+    keyframe = (
+        History.objects.filter(document_id=history.document_id, is_keyframe=True, id__lte=history.id)
+        .order_by('-id').values('id')[:1]
+    )
+    chain = list(
+        History.objects.filter(
+            document_id=history.document_id, id__lte=history.id, id__gte=Subquery(keyframe)
+        ).order_by('id').only('is_keyframe', 'content_snapshot', 'delta')
+    )
+    if not chain or not chain[0].is_keyframe:
+        raise ValueError(f'History {history.id} has a broken delta chain.')
+
+    content = chain[0].content_snapshot
+    for row in chain[1:]:
+        content = apply_delta(content, row.delta)
+    return content
+
+
+def summarize_snapshot(content):
+    """Return the stored preview, size and hash describing a snapshot."""
+    preview = content[:100]
+    if len(content) > 100:
+        preview += '...'
+    return {
+        'preview': preview,
+        'size': len(content),
+        'content_hash': hashlib.sha256(content.encode()).hexdigest(),
+    }
+
+
+def encode_snapshot(content, previous=None, previous_content=None):
+    """
+    Return the field values for a snapshot following `previous` in the chain.
+
+    A keyframe is written when the chain reaches the configured interval or
+    when the delta would not be smaller than the text itself.
+    """
+    if previous is not None and previous.chain_depth + 1 < keyframe_interval():
+        if previous_content is None:
+            previous_content = get_content(previous)
+        delta = make_delta(previous_content, content)
+        if len(delta) < len(content):
+            return {
+                'content_snapshot': '',
+                'delta': delta,
+                'is_keyframe': False,
+                'chain_depth': previous.chain_depth + 1,
+            }
+    return {
+        'content_snapshot': content,
+        'delta': '',
+        'is_keyframe': True,
+        'chain_depth': 0,
+    }
+
+
+def change_size(a, b):
+    """Cheap upper bound on the edit distance between two texts."""
+    prefix, suffix = common_affixes(a, b)
+    return max(len(a), len(b)) - prefix - suffix
+
+
+def should_coalesce(document, previous, content, now):
+    """
+    Decide whether the text being superseded can be folded into the newest
+    pending snapshot instead of getting a row of its own.
+
+    The newest snapshot stays pending while saves keep arriving within the
+    rolling window (measured from the previous save) and it is younger than
+    the maximum span, or while the superseded text differs from it by fewer
+    than the minimum number of changed characters.
+    """
+    if previous is None:
+        return False
+
+    window = timedelta(seconds=getattr(settings, 'HISTORY_COALESCE_WINDOW', 0))
+    max_span = timedelta(seconds=getattr(settings, 'HISTORY_COALESCE_MAX_SPAN', 0))
+    if (
+        window
+        and document.last_modified
+        and now - document.last_modified < window
+        and now - previous.timestamp < max_span
+    ):
+        return True
+
+    min_change = getattr(settings, 'HISTORY_COALESCE_MIN_CHANGE', 0)
+    return bool(min_change) and change_size(previous.get_content(), content) < min_change
+
+
+def record_snapshot(document, content, now=None):
+    """
+    Snapshot `content` (the text a save is about to replace) for `document`.
+
+    Returns the new History row, or None when the save was coalesced into
+    the newest pending snapshot.
+    """
+    now = now or timezone.now()
+    previous = History.objects.filter(document=document).order_by('-id').first()
+    if should_coalesce(document, previous, content, now):
+        return None
+    previous_content = previous and previous.get_content()
+    row = History.objects.create(
+        document=document,
+        timestamp=now,
+        **encode_snapshot(content, previous, previous_content),
+        **summarize_snapshot(content),
+    )
+    index_snapshot(row, content, previous, previous_content)
+    return row
+
+
+def commit_content(document, content, version=None, edits=None):
+    """
+    Write new content on top of `document.version`, snapshotting the old text.
+
+    The update only applies if nobody else saved since `document` was read;
+    returns False (and rolls back the snapshot) when that check fails.
+    Passing the `edits` that produced `content` lets the stored counts and
+    activity be updated without rescanning the whole text.
+    """
+    base_version = document.version
+    version = base_version + 1 if version is None else version
+    if edits is not None:
+        stats = patched_stats(document.content, document_stats(document), edits)
+    else:
+        stats = text_stats(content)
+    with transaction.atomic():
+        record_snapshot(document, document.content)
+        saved_at = timezone.now()
+        updated = Document.objects.filter(pk=document.pk, version=base_version).update(
+            content=content, version=version, last_modified=saved_at, **stats
+        )
+        if not updated:
+            transaction.set_rollback(True)
+            return False
+        record_activity(document, document.content, content, saved_at, edits)
+        # Queryset updates send no post_save signal.
+        invalidate_document(document)
+    document.content = content
+    document.version = version
+    document.last_modified = saved_at
+    for field, value in stats.items():
+        setattr(document, field, value)
+    return True
+
+
+def retention_keep_ids(document_id, now=None):
+    """
+    Pick the History rows of a document that survive progressive thinning.
+
+    HISTORY_RETENTION is a list of (max_age_seconds, bucket_seconds) tiers;
+    within each tier only the newest snapshot of every bucket is kept. A
+    max_age of None makes the tier open-ended.
+    """
+    now = now or timezone.now()
+    tiers = getattr(settings, 'HISTORY_RETENTION', [])
+    newest = {}
+    rows = History.objects.filter(document_id=document_id).values_list('id', 'timestamp')
+    for row_id, timestamp in rows.iterator():
+        age = (now - timestamp).total_seconds()
+        for index, (max_age, bucket) in enumerate(tiers):
+            if max_age is None or age <= max_age:
+                key = (index, int(timestamp.timestamp()) // bucket)
+                break
+        else:
+            # Older than every bounded tier: drop it.
+            continue
+        if key not in newest or (timestamp, row_id) > newest[key]:
+            newest[key] = (timestamp, row_id)
+    return {row_id for _, row_id in newest.values()}
+
+
+def compact_history(document_id, keep_ids, batch_size=500):
+    """
+    Delete the History rows of a document not in `keep_ids` and re-encode
+    the survivors so the delta chain stays valid.
+
+    Rows are processed in id order, `batch_size` at a time, each batch in
+    its own transaction. Every committed batch leaves a readable chain: if a
+    batch ends on a deleted row, the next row is rewritten as a keyframe
+    before the transaction commits. Returns the number of deleted rows.
+    """
+    fields = ['content_snapshot', 'delta', 'is_keyframe', 'chain_depth']
+    deleted = 0
+    last_id = 0
+    content = None
+    kept = kept_content = None
+    changed = False
+    while True:
+        with transaction.atomic():
+            batch = list(
+                History.objects.filter(document_id=document_id, id__gt=last_id).order_by('id')[:batch_size]
+            )
+            if not batch:
+                break
+
+            doomed = []
+            for row in batch:
+                content = row.content_snapshot if row.is_keyframe else apply_delta(content, row.delta)
+                if row.id not in keep_ids:
+                    doomed.append(row.id)
+                    changed = True
+                    continue
+                if changed:
+                    encoded = encode_snapshot(content, kept, kept_content)
+                    if any(getattr(row, field) != value for field, value in encoded.items()):
+                        for field, value in encoded.items():
+                            setattr(row, field, value)
+                        row.save(update_fields=fields)
+                kept, kept_content = row, content
+            last_id = batch[-1].id
+
+            if doomed:
+                History.objects.filter(id__in=doomed).delete()
+                deleted += len(doomed)
+            if doomed and doomed[-1] == last_id:
+                following = (
+                    History.objects.filter(document_id=document_id, id__gt=last_id).order_by('id').first()
+                )
+                if following is not None and not following.is_keyframe:
+                    following.content_snapshot = apply_delta(content, following.delta)
+                    following.delta = ''
+                    following.is_keyframe = True
+                    following.chain_depth = 0
+                    following.save(update_fields=fields)
+    if deleted:
+        invalidate_document_id(document_id)
+        # Deleting rows cascaded to the passage runs that touched them.
+        reindex_document(document_id)
+    return deleted
@@ -3,26 +3,108 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.views import APIView
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from django.db.models import Q
-from .models import Project, Document, History, User
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.utils.http import content_disposition_header
+from django.views.decorators.http import condition
+from django.db.models import Count, Sum
+from .models import Project, Document, History, User, ExportJob, DocumentFile, UploadSession
 from .serializers import (
     UserSerializer, ProjectSerializer, 
-    DocumentSerializer, HistorySerializer
+    DocumentSerializer, DocumentPatchSerializer, HistorySerializer, HistoryListSerializer,
+    HistorySearchResultSerializer, SearchResultSerializer, ExportJobSerializer, PreviewSerializer,
+    UploadSessionSerializer, DocumentFileSerializer, AISummarizeSerializer, AIRewriteSerializer,
+    AIIdeasSerializer
 )
+from .activity import timeline
+from .analytics import get_analytics
+from .diffing import compare_versions
+from .etags import (
+    document_detail_etag, document_etag, export_etag, export_tag, history_etag, history_list_etag,
+    project_document_etag, project_etag, project_list_etag
+)
+from . import ai_services, export_jobs, uploads
+from .attachments import download_response
+from .archive import archive_chunks, streaming_content
+from .exporting import FORMATS, content_coding, export_response, render
+from .preview import render_blocks
+from .search import HistorySearchResults, SearchResults, parse_query
+from .textops import OperationError, apply_ops
+from .versioning import commit_content
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import BasePermission
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 import datetime
-from django.http import HttpResponse
-import markdown
+import logging
+import re
+from django.http import FileResponse, Http404, StreamingHttpResponse
+
+logger = logging.getLogger(__name__)
 
 class StandardPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+def base_version_mismatch(document, data):
+    """True if the request names a base_version other than the stored one"""
+    base_version = data.get('base_version')
+    if base_version is None:
+        return False
+    try:
+        return int(base_version) != document.version
+    except (TypeError, ValueError):
+        return True
+
+def version_conflict(document):
+    return Response({
+        'error': 'The document was changed by another save.',
+        'version': document.version
+    }, status=status.HTTP_409_CONFLICT)
+
+def save_document(serializer, base_version=None):
+    """
+    Save a DocumentSerializer through commit_content, which snapshots the old
+    text and bumps the version only if nobody saved since the document was
+    read. Returns False when that fails and the client named a base_version;
+    without one the save is applied on top of the newer version instead.
+    """
+    document = serializer.instance
+    content = serializer.validated_data.get('content')
+    while content is not None and content != document.content:
+        if commit_content(document, content):
+            break
+        if base_version is not None:
+            return False
+        document.refresh_from_db(fields=['content', 'version'])
+    return True
+
+def start_of_day(date):
+    """The first instant of `date` in the current time zone"""
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+class ProjectCursorPagination(CursorPagination):
+    """Keyset pagination over a user's projects, newest first or by title."""
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    orderings = {
+        '-created_at': ('-created_at', '-id'),
+        'title': ('title', 'id'),
+    }
+    
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get('ordering', '-created_at')
+        if ordering not in self.orderings:
+            raise ValidationError({
+                'ordering': 'Cursor pagination supports ordering by -created_at or title.'
+            })
+        return self.orderings[ordering]
+
 class IsOwner(BasePermission):
     def has_object_permission(self, request, view, obj):
         if hasattr(obj, 'owner'):
@@ -63,28 +145,53 @@ class ProjectViewSet(viewsets.ModelViewSet):
     ordering = ['-created_at']
     
     def get_queryset(self):
-        queryset = Project.objects.filter(owner=self.request.user)
+        queryset = Project.objects.filter(owner=self.request.user).select_related(
+            'owner', 'document'
+        ).defer('document__content')
         
-        # Filter by date
+        # Filter by date. Both dates are inclusive; they are compared as a
+        # half-open timestamp range so the (owner, created_at) index applies.
         date_from = self.request.query_params.get('date_from')
         date_to = self.request.query_params.get('date_to')
         
         if date_from:
             try:
                 date_from = datetime.datetime.strptime(date_from, '%Y-%m-%d').date()
-                queryset = queryset.filter(created_at__date__gte=date_from)
+                queryset = queryset.filter(created_at__gte=start_of_day(date_from))
             except ValueError:
                 pass
         
         if date_to:
             try:
                 date_to = datetime.datetime.strptime(date_to, '%Y-%m-%d').date()
-                queryset = queryset.filter(created_at__date__lte=date_to)
+                queryset = queryset.filter(created_at__lt=start_of_day(date_to + datetime.timedelta(days=1)))
             except ValueError:
                 pass
+            except OverflowError:
+                # date_to is the last representable day: nothing comes after it.
+                pass
         
         return queryset
     
+    @property
+    def paginator(self):
+        # ?pagination=cursor switches to keyset pages, which stay fast however
+        # deep the client scrolls but have no page count.
+        if not hasattr(self, '_paginator'):
+            if self.request is not None and self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = ProjectCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+    
+    @method_decorator(condition(etag_func=project_list_etag))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @method_decorator(condition(etag_func=project_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+    
     def perform_create(self, serializer):
         project = serializer.save(owner=self.request.user)
         # Create a document automatically when project is created
@@ -102,61 +209,103 @@ class ProjectViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def stats(self, request, pk=None):
         project = self.get_object()
-        document = get_object_or_404(Document, project=project)
-        
-        content = document.content or ""
-        words = len(content.split())
-        characters = len(content)
-        lines = content.count('\n') + 1
+        document = getattr(project, 'document', None)
+        if document is None:
+            raise Http404
         history_count = History.objects.filter(document=document).count()
+        # Text extracted from attachments counts separately from the document's own.
+        attachments = DocumentFile.objects.filter(document=document).aggregate(
+            files=Count('id'),
+            words=Sum('text__word_count', default=0),
+            characters=Sum('text__char_count', default=0),
+            lines=Sum('text__line_count', default=0),
+        )
         
         return Response({
             'project_id': project.id,
             'title': project.title,
             'stats': {
-                'words': words,
-                'characters': characters,
-                'lines': lines,
+                'words': document.word_count,
+                'characters': document.char_count,
+                'lines': document.line_count,
                 'history_versions': history_count,
-                'last_modified': document.last_modified
+                'last_modified': document.last_modified,
+                'attachments': attachments,
             }
         })
     
+    def get_document(self, project, default_content=""):
+        # get_queryset already joined the document (with its content deferred),
+        # so this only costs a query when the document is missing.
+        try:
+            return project.document
+        except Document.DoesNotExist:
+            return Document.objects.create(project=project, content=default_content)
+    
     @action(detail=True, methods=['get'])
+    @method_decorator(condition(etag_func=project_document_etag))
     def document(self, request, pk=None):
         project = self.get_object()
-        try:
-            document = Document.objects.get(project=project)
-        except Document.DoesNotExist:
-            document = Document.objects.create(project=project, content="# New Document\n\nStart writing here...")
+        document = self.get_document(project, "# New Document\n\nStart writing here...")
         
         serializer = DocumentSerializer(document)
         return Response(serializer.data)
     
     @document.mapping.put
+    @method_decorator(condition(etag_func=project_document_etag))
     def update_document(self, request, pk=None):
         project = self.get_object()
-        try:
-            document = Document.objects.get(project=project)
-        except Document.DoesNotExist:
-            document = Document.objects.create(project=project, content="")
+        document = self.get_document(project)
         
-        # Save current content to history before updating (if content changed)
-        if document.content != request.data.get('content', ''):
-            History.objects.create(
-                document=document,
-                content_snapshot=document.content
-            )
+        if base_version_mismatch(document, request.data):
+            return version_conflict(document)
         
         serializer = DocumentSerializer(document, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            if not save_document(serializer, request.data.get('base_version')):
+                document.refresh_from_db(fields=['version'])
+                return version_conflict(document)
             return Response({
                 **serializer.data,
                 'message': 'Document saved successfully!',
                 'saved_at': timezone.now()
-            })
+            }, headers={'ETag': document_etag(document)})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    @document.mapping.patch
+    @method_decorator(condition(etag_func=project_document_etag))
+    def patch_document(self, request, pk=None):
+        """Apply a list of edit ops on top of base_version"""
+        project = self.get_object()
+        serializer = DocumentPatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        base_version = serializer.validated_data['base_version']
+        
+        document = getattr(project, 'document', None)
+        if document is None:
+            raise Http404
+        if document.version != base_version:
+            return version_conflict(document)
+        ops = serializer.validated_data['ops']
+        try:
+            content = apply_ops(document.content, ops)
+        except OperationError as exc:
+            return Response({'ops': [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # commit_content only writes if the row is still at base_version.
+        if content != document.content and not commit_content(document, content, edits=ops):
+            document.refresh_from_db(fields=['version'])
+            return version_conflict(document)
+        
+        return Response({
+            'id': document.id,
+            'version': document.version,
+            'character_count': document.char_count,
+            'last_modified': document.last_modified,
+            'message': 'Document saved successfully!',
+            'saved_at': document.last_modified
+        }, headers={'ETag': document_etag(document)})
 
 class DocumentViewSet(viewsets.ModelViewSet):
     queryset = Document.objects.all()
@@ -165,38 +314,98 @@ class DocumentViewSet(viewsets.ModelViewSet):
     pagination_class = StandardPagination
     
     def get_queryset(self):
-        return Document.objects.filter(project__owner=self.request.user)
+        return Document.objects.filter(project__owner=self.request.user).select_related('project').order_by('id')
+    
+    @method_decorator(condition(etag_func=document_detail_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
+    @method_decorator(condition(etag_func=document_detail_etag))
     def update(self, request, *args, **kwargs):
         document = self.get_object()
-        
-        # Save to history before updating (only if content changed)
-        if document.content != request.data.get('content', ''):
-            History.objects.create(
-                document=document,
-                content_snapshot=document.content
-            )
-        
-        return super().update(request, *args, **kwargs)
+        if base_version_mismatch(document, request.data):
+            return version_conflict(document)
+        serializer = self.get_serializer(document, data=request.data, partial=kwargs.get('partial', False))
+        serializer.is_valid(raise_exception=True)
+        if not save_document(serializer, request.data.get('base_version')):
+            document.refresh_from_db(fields=['version'])
+            return version_conflict(document)
+        return Response(serializer.data, headers={'ETag': document_etag(document)})
+
+class HistoryCursorPagination(CursorPagination):
+    """Keyset pagination over a document's timeline, newest first."""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-timestamp', '-id')
 
 class HistoryViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = HistorySerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = StandardPagination
+    pagination_class = HistoryCursorPagination
     
     def get_queryset(self):
         document_id = self.kwargs.get('document_id')
-        document = get_object_or_404(Document, id=document_id, project__owner=self.request.user)
-        return History.objects.filter(document=document).order_by('-timestamp')
+        document = get_object_or_404(Document.objects.only('id'), id=document_id, project__owner=self.request.user)
+        queryset = History.objects.filter(document=document).order_by('-timestamp', '-id')
+        if self.action != 'retrieve':
+            queryset = queryset.defer('content_snapshot', 'delta')
+        return queryset
+    
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return HistorySerializer
+        return HistoryListSerializer
+    
+    @method_decorator(condition(etag_func=history_list_etag))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+    
+    @method_decorator(condition(etag_func=history_etag))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     @action(detail=False, methods=['get'])
+    @method_decorator(condition(etag_func=history_list_etag))
     def recent(self, request, document_id=None):
         """Get recent history (last 5 entries)"""
-        document = get_object_or_404(Document, id=document_id, project__owner=self.request.user)
-        recent_history = History.objects.filter(document=document).order_by('-timestamp')[:5]
+        recent_history = self.get_queryset()[:5]
         serializer = self.get_serializer(recent_history, many=True)
         return Response(serializer.data)
 
+class HistoryDiffView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, document_id, a, b):
+        """Compare two versions as JSON ops (default) or ?output=unified text"""
+        output = request.query_params.get('output', 'json')
+        if output not in ('json', 'unified'):
+            return Response({'error': 'output must be "json" or "unified".'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            context = min(max(int(request.query_params.get('context', 3)), 0), 100)
+        except ValueError:
+            return Response({'error': 'context must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        versions = History.objects.filter(
+            document_id=document_id, document__project__owner=request.user, id__in=[a, b]
+        ).only('id', 'document_id', 'is_keyframe', 'chain_depth', 'content_hash')
+        versions = {version.id: version for version in versions}
+        if a not in versions or b not in versions:
+            return Response({'error': 'Version not found.'}, status=status.HTTP_404_NOT_FOUND)
+        old, new = versions[a], versions[b]
+        
+        result = compare_versions(
+            old.get_content, new.get_content, old.content_hash, new.content_hash,
+            output=output, context=context
+        )
+        return Response({
+            'document': document_id,
+            'from': a,
+            'to': b,
+            'output': output,
+            **result
+        })
+
 class UserProfileView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
@@ -216,78 +425,335 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
 # search endpoints
 class SearchView(APIView):
     def get(self, request):
-        query = request.GET.get('q', '')
-        
-        # Search in projects
-        projects = Project.objects.filter(
-            Q(title__icontains=query) | Q(description__icontains=query),
-            owner=request.user
-        )
-        
-        # Search in documents
-        documents = Document.objects.filter(
-            Q(content__icontains=query),
-            project__owner=request.user
-        )
+        # Results are ranked by the full-text index and carry snippets
+        # instead of document text (see search.py); an empty query has none.
+        # ?mode=history searches every passage the documents ever contained.
+        mode = request.GET.get('mode', 'current')
+        if mode not in ('current', 'history'):
+            raise ValidationError({'mode': 'Use "current" or "history".'})
+        terms = parse_query(request.GET.get('q', ''))
+        if mode == 'history':
+            results, serializer_class = HistorySearchResults(request.user.id, terms), HistorySearchResultSerializer
+        else:
+            results, serializer_class = SearchResults(request.user.id, terms), SearchResultSerializer
+        paginator = StandardPagination()
+        page = paginator.paginate_queryset(results, request, view=self)
+        return paginator.get_paginated_response(serializer_class(page, many=True).data)
+    
+class PreviewView(APIView):
+    """
+    HTML preview of a document, optionally with unsaved edit ops applied,
+    as a list of blocks. Blocks whose id is in `known` are sent without
+    their HTML, so a client that keeps its previous preview only receives
+    what an edit changed.
+    """
+    def post(self, request, document_id):
+        serializer = PreviewSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        document = get_object_or_404(Document, id=document_id, project__owner=request.user)
+        content = document.content
+        ops = serializer.validated_data['ops']
+        if ops:
+            if document.version != serializer.validated_data['base_version']:
+                return version_conflict(document)
+            try:
+                content = apply_ops(content, ops)
+            except OperationError as exc:
+                return Response({'ops': [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
         
+        known = set(serializer.validated_data['known'])
         return Response({
-            'projects': ProjectSerializer(projects, many=True).data,
-            'documents': DocumentSerializer(documents, many=True).data
+            'version': document.version,
+            'blocks': [
+                {'id': block_id} if block_id in known else {'id': block_id, 'html': html}
+                for block_id, html in render_blocks(content)
+            ],
         })
+
+class AIView(APIView):
+    """
+    Runs one AI operation (see api/ai_services.py) on the posted content or
+    document. When too many AI requests are already in flight the answer
+    is 503 with Retry-After, rather than waiting on a worker; when the
+    provider fails it is 502.
+    """
+    serializer_class = None
+    result_key = None
     
-# Add export functionality
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = self.run(**serializer.validated_data)
+        except ai_services.AIUnavailable as exc:
+            return Response(
+                {'error': str(exc)}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(max(1, round(settings.AI_QUEUE_TIMEOUT)))}
+            )
+        except ai_services.AIError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_502_BAD_GATEWAY)
+        except Exception:
+            logger.exception('AI provider failed')
+            return Response({'error': 'The AI provider failed.'}, status=status.HTTP_502_BAD_GATEWAY)
+        return Response({self.result_key: result, 'provider': ai_services.get_service().provider.name})
+
+class AISummarizeView(AIView):
+    serializer_class = AISummarizeSerializer
+    result_key = 'summary'
+    run = staticmethod(ai_services.summarize)
+
+class AIRewriteView(AIView):
+    serializer_class = AIRewriteSerializer
+    result_key = 'text'
+    run = staticmethod(ai_services.rewrite)
+
+class AIIdeasView(AIView):
+    serializer_class = AIIdeasSerializer
+    result_key = 'ideas'
+    run = staticmethod(ai_services.ideas)
+
 class ExportView(APIView):
+    def perform_content_negotiation(self, request, force=False):
+        # ?format= names the export format here, not a DRF renderer.
+        return super().perform_content_negotiation(request, force=True)
+    
+    @method_decorator(condition(etag_func=export_etag))
     def get(self, request, document_id):
-        document = get_object_or_404(Document, id=document_id)
         format = request.GET.get('format', 'txt')
-        
-        if format == 'html':
-            html_content = markdown.markdown(document.content)
-            response = HttpResponse(html_content, content_type='text/html')
-            response['Content-Disposition'] = f'attachment; filename="{document.project.title}.html"'
-        elif format == 'pdf':
-            # Use reportlab or weasyprint
-            pass
-        else:
-            response = HttpResponse(document.content, content_type='text/plain')
-            response['Content-Disposition'] = f'attachment; filename="{document.project.title}.txt"'
-        
+        if format in export_jobs.FORMATS and format not in FORMATS:
+            return Response(
+                {'error': f'{format} exports are rendered by export jobs: POST /api/documents/{document_id}/exports/.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if format not in FORMATS:
+            return Response(
+                {'error': f'Unsupported format. Use one of: {", ".join(FORMATS)}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        document = get_object_or_404(
+            Document.objects.select_related('project'), id=document_id, project__owner=request.user
+        )
+        coding = content_coding(request, document.char_count)
+        content_type, extension = FORMATS[format]
+        return export_response(
+            request,
+            render(document.content, format, coding),
+            content_type,
+            f'{document.project.title}.{extension}',
+            coding,
+            export_tag(document.id, document.version, document.last_modified, format, coding),
+        )
+
+class ExportJobCreateView(APIView):
+    """POST {"format": "pdf"|"html"|"md"}: 202 while the export renders, 200 once it is ready."""
+    def post(self, request, document_id):
+        format = request.data.get('format')
+        if format not in export_jobs.FORMATS:
+            return Response(
+                {'error': f'Unsupported format. Use one of: {", ".join(export_jobs.FORMATS)}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        document = get_object_or_404(Document, id=document_id, project__owner=request.user)
+        job = export_jobs.submit(document, format)
+        serializer = ExportJobSerializer(job, context={'request': request})
+        return Response(
+            serializer.data,
+            status=status.HTTP_200_OK if job.status == ExportJob.DONE else status.HTTP_202_ACCEPTED,
+            headers={'Location': request.build_absolute_uri(reverse('export-job-detail', args=[job.id]))},
+        )
+
+class ExportJobDetailView(APIView):
+    def get(self, request, pk):
+        job = get_object_or_404(ExportJob, id=pk, document__project__owner=request.user)
+        return Response(ExportJobSerializer(job, context={'request': request}).data)
+
+class ExportJobDownloadView(APIView):
+    def get(self, request, pk):
+        job = get_object_or_404(
+            ExportJob.objects.select_related('document__project'), id=pk, document__project__owner=request.user
+        )
+        if job.status != ExportJob.DONE:
+            return Response(
+                {'error': 'The export is not ready.', 'status': job.status},
+                status=status.HTTP_409_CONFLICT
+            )
+        try:
+            file = open(export_jobs.output_path(job.content_hash, job.format), 'rb')
+        except FileNotFoundError:
+            return Response(
+                {'error': 'The export file is gone; submit the export again.'},
+                status=status.HTTP_410_GONE
+            )
+        content_type, extension = export_jobs.FORMATS[job.format]
+        return FileResponse(
+            file, as_attachment=True, filename=f'{job.document.project.title}.{extension}', content_type=content_type
+        )
+
+class ArchiveExportView(APIView):
+    """A ZIP of every project and its document, streamed as it is built; ?history=1 adds every version."""
+    def get(self, request):
+        include_history = request.query_params.get('history') in ('1', 'true')
+        response = StreamingHttpResponse(
+            streaming_content(request._request, archive_chunks(request.user, include_history)),
+            content_type='application/zip'
+        )
+        response['Content-Disposition'] = content_disposition_header(
+            True, f'{request.user.username}-{timezone.now():%Y-%m-%d}.zip'
+        )
         return response
+
+class UploadCreateView(APIView):
+    """POST {"filename", "size", "content_type"?, "sha256"?} starts a resumable upload to the document."""
+    def post(self, request, document_id):
+        document = get_object_or_404(Document, id=document_id, project__owner=request.user)
+        serializer = UploadSessionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        session = uploads.start(document, **serializer.validated_data)
+        return Response({
+            **UploadSessionSerializer(session).data,
+            'chunk_size': settings.UPLOAD_CHUNK_MAX_SIZE,
+        }, status=status.HTTP_201_CREATED)
+
+class UploadDetailView(APIView):
+    """
+    GET reports the offset to resume from. PUT ?offset=N writes one chunk
+    (raw body, X-Chunk-SHA256 header); it must start at the current
+    offset. DELETE abandons the upload.
+    """
+    def get_session(self, request, pk):
+        return get_object_or_404(UploadSession, id=pk, document__project__owner=request.user)
+    
+    def get(self, request, pk):
+        return Response(UploadSessionSerializer(self.get_session(request, pk)).data)
+    
+    def put(self, request, pk):
+        session = self.get_session(request, pk)
+        try:
+            offset = int(request.query_params['offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response({'error': 'offset must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        checksum = request.META.get('HTTP_X_CHUNK_SHA256', '').lower()
+        if not re.fullmatch(r'[0-9a-f]{64}', checksum):
+            return Response({'error': 'X-Chunk-SHA256 must be the hex SHA-256 of the chunk.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            return Response({'error': f'Chunks may be at most {settings.UPLOAD_CHUNK_MAX_SIZE} bytes.'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if length <= 0 or offset + length > session.size:
+            return Response({'error': 'The chunk must be non-empty and end within the file.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            received = uploads.write_chunk(session, offset, request.stream, length, checksum)
+        except uploads.OffsetConflict as exc:
+            return Response({'error': 'Resume from the current offset.', 'offset': exc.args[0]},
+                            status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as exc:
+            return Response({'error': str(exc), 'offset': offset}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'offset': received})
+    
+    def delete(self, request, pk):
+        self.get_session(request, pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class UploadCompleteView(APIView):
+    def post(self, request, pk):
+        session = get_object_or_404(UploadSession, id=pk, document__project__owner=request.user)
+        try:
+            document_file = uploads.complete(session)
+        except uploads.IncompleteChunk as exc:
+            return Response({'error': str(exc), 'offset': session.received}, status=status.HTTP_409_CONFLICT)
+        except uploads.OffsetConflict as exc:
+            return Response({'error': 'The upload is being written or completed already.', 'offset': exc.args[0]},
+                            status=status.HTTP_409_CONFLICT)
+        except uploads.ChecksumMismatch as exc:
+            return Response({'error': f'{exc} Start the upload again.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(DocumentFileSerializer(document_file).data, status=status.HTTP_201_CREATED)
+
+class DocumentFileListView(generics.ListAPIView):
+    serializer_class = DocumentFileSerializer
+    pagination_class = StandardPagination
+    
+    def get_queryset(self):
+        return DocumentFile.objects.filter(
+            document_id=self.kwargs['document_id'], document__project__owner=self.request.user
+        ).select_related('blob').order_by('-uploaded_at', '-id')
+
+class DocumentFileDetailView(generics.RetrieveDestroyAPIView):
+    serializer_class = DocumentFileSerializer
+    
+    def get_queryset(self):
+        return DocumentFile.objects.filter(document__project__owner=self.request.user).select_related('blob')
+
+class DocumentFileDownloadView(APIView):
+    """The attachment's bytes, with Range support; see api/attachments.py."""
+    def get(self, request, pk):
+        # One query checks ownership and fetches everything the response needs.
+        file = DocumentFile.objects.filter(id=pk, document__project__owner=request.user).values(
+            'id', 'file', 'filename', 'content_type', 'size', 'uploaded_at', 'blob__sha256'
+        ).first()
+        if file is None:
+            raise Http404
+        return download_response(request._request, file)
+
 class AnalyticsView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        user = request.user
-        
-        # Basic analytics
-        total_projects = Project.objects.filter(owner=user).count()
-        total_documents = Document.objects.filter(project__owner=user).count()
-        total_history = History.objects.filter(document__project__owner=user).count()
-        
-        # Recent activity
-        recent_projects = Project.objects.filter(owner=user).order_by('-created_at')[:5]
-        recent_history = History.objects.filter(
-            document__project__owner=user
-        ).order_by('-timestamp')[:10]
-        
-        # Document stats
-        documents = Document.objects.filter(project__owner=user)
-        total_words = sum(len(doc.content.split()) for doc in documents)
-        total_chars = sum(len(doc.content) for doc in documents)
+        return Response(get_analytics(request.user))
+
+class AnalyticsTimelineView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        """Daily writing activity between ?date_from and ?date_to (inclusive, default last 30 days)"""
+        today = timezone.localdate()
+        try:
+            date_to = self.parse_date(request.query_params.get('date_to'), today)
+            date_from = self.parse_date(request.query_params.get('date_from'), None)
+            document_id = request.query_params.get('document')
+            document_id = int(document_id) if document_id else None
+        except ValueError:
+            return Response(
+                {'error': 'Dates must be YYYY-MM-DD and document an integer.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if date_from is None:
+            try:
+                date_from = date_to - datetime.timedelta(days=29)
+            except OverflowError:
+                return Response(
+                    {'error': 'date_from is required when date_to is within 30 days of 0001-01-01.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        if date_from > date_to:
+            return Response({'error': 'date_from must not be after date_to.'}, status=status.HTTP_400_BAD_REQUEST)
         
+        days = timeline(request.user, date_from, date_to, document_id)
+        totals = {field: sum(day[field] for day in days) for field in ('words_added', 'words_removed', 'saves')}
         return Response({
-            'user': {
-                'email': user.email,
-                'username': user.username,
-                'joined': user.created_at
-            },
-            'stats': {
-                'total_projects': total_projects,
-                'total_documents': total_documents,
-                'total_history_versions': total_history,
-                'total_words': total_words,
-                'total_characters': total_chars
-            },
-            'recent_projects': ProjectSerializer(recent_projects, many=True).data,
-            'recent_activity': HistorySerializer(recent_history, many=True).data
-        })
\ No newline at end of file
+            'date_from': date_from,
+            'date_to': date_to,
+            'document': document_id,
+            'days': [{
+                'date': day['day'],
+                'words_added': day['words_added'],
+                'words_removed': day['words_removed'],
+                'saves': day['saves'],
+                'active_minutes': round(day['active_seconds'] / 60, 1)
+            } for day in days],
+            'totals': {
+                **totals,
+                'active_minutes': round(sum(day['active_seconds'] for day in days) / 60, 1)
+            }
+        })
+    
+    @staticmethod
+    def parse_date(value, default):
+        if not value:
+            return default
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
@@ -0,0 +1,100 @@
+"""
+AI service: what caching, micro-batching and the concurrency limit buy.
+
+A provider that sleeps --latency seconds per call plus a little per item
+stands in for a remote model. --requests distinct texts are sent from as
+many threads at once:
+
+- with batching off (AI_BATCH_SIZE = 1), each request is its own call,
+  at most AI_MAX_CONCURRENCY at a time;
+- with the default batching, requests that arrive together share calls;
+- the same texts again, answered from the cache.
+
+Then the LocalProvider's summary of a 100 KB document, cold and cached.
+
+    python -m benchmarks.bench_ai [--requests 64] [--latency 0.2]
+"""
+import argparse
+import threading
+import time
+
+from benchmarks.common import make_text, report
+
+
+class SlowProvider:
+    name = 'slow'
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def run_batch(self, operation, contents, params):
+        self.calls += 1
+        time.sleep(self.latency + 0.002 * len(contents))
+        return [content[:40] for content in contents]
+
+
+def burst(service, texts):
+    errors = []
+
+    def call(text):
+        try:
+            service.run('summarize', text, max_sentences=3)
+        except Exception as exc:
+            errors.append(exc)
+    threads = [threading.Thread(target=call, args=(text,)) for text in texts]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, len(errors)
+
+
+def run(requests, latency):
+    from django.conf import settings
+
+    from api.ai_services import AIService, LocalProvider
+
+    texts = [make_text(2000, seed=seed) for seed in range(requests)]
+    options = dict(
+        max_concurrency=settings.AI_MAX_CONCURRENCY, max_pending=max(requests, settings.AI_MAX_PENDING),
+        queue_timeout=60,
+    )
+    rows = []
+    for label, batch_size in (('no batching', 1), (f'batches of {settings.AI_BATCH_SIZE}', settings.AI_BATCH_SIZE)):
+        provider = SlowProvider(latency)
+        service = AIService(provider, batch_size=batch_size, batch_window=settings.AI_BATCH_WINDOW, **options)
+        seconds, errors = burst(service, texts)
+        rows.append((label, f'{seconds * 1000:,.0f} ms, {provider.calls} provider calls, {errors} errors'))
+    seconds, errors = burst(service, texts)
+    rows.append(('cached', f'{seconds * 1000:,.1f} ms, {provider.calls} provider calls in total'))
+    report(
+        f'{requests} concurrent requests, {latency * 1000:.0f} ms per provider call, '
+        f'AI_MAX_CONCURRENCY = {settings.AI_MAX_CONCURRENCY}', rows
+    )
+
+    document = make_text(100_000)
+    service = AIService(LocalProvider(), batch_window=0)
+    start = time.perf_counter()
+    service.run('summarize', document, max_sentences=5)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    service.run('summarize', document, max_sentences=5)
+    cached = time.perf_counter() - start
+    report('LocalProvider summary of 100 KB', [
+        ('cold', f'{cold * 1000:,.1f} ms'),
+        ('cached', f'{cached * 1000:,.3f} ms (hashing the content)'),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+    run(args.requests, args.latency)
+
+
+if __name__ == '__main__':
+    main()
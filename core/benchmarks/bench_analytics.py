@@ -0,0 +1,96 @@
+"""
+Memory and latency of the analytics dashboard for users with many projects.
+
+For each project count, compares the old approach (load every document and
+split its text in Python) with the aggregate query behind /api/analytics/,
+cold and cached. Peak memory is measured with tracemalloc and should stay
+flat as the number of projects grows.
+
+    python -m benchmarks.bench_analytics [--projects 1000 10000] [--size 2000]
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.common import make_text, report, test_database
+
+
+def measure(func):
+    """Return (seconds, peak traced bytes, result) of one call."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def populate(user, count, size):
+    from api.models import Document, Project
+    from api.textstats import text_stats
+
+    texts = [make_text(size, seed=seed) for seed in range(20)]
+    batch = 1000
+    for start in range(0, count, batch):
+        projects = Project.objects.bulk_create(
+            Project(owner=user, title=f'Project {number}') for number in range(start, min(start + batch, count))
+        )
+        Document.objects.bulk_create(
+            Document(project=project, content=texts[project.id % len(texts)], **text_stats(texts[project.id % len(texts)]))
+            for project in projects
+        )
+
+
+def run(counts, size):
+    from django.core.cache import cache
+    from django.db import connection
+    from rest_framework.test import APIClient
+
+    from api.models import Document, User
+
+    for count in counts:
+        user = User.objects.create_user(f'bench{count}@example.com', f'bench{count}', 'bench-pass-123')
+        populate(user, count, size)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        def legacy():
+            documents = Document.objects.filter(project__owner=user)
+            return sum(len(doc.content.split()) for doc in documents)
+
+        def dashboard():
+            return client.get('/api/analytics/').data['stats']['total_words']
+
+        legacy_time, legacy_peak, legacy_words = measure(legacy)
+        # One untimed request so lazy imports do not count as request memory.
+        dashboard()
+        cache.clear()
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            cold_time, cold_peak, words = measure(dashboard)
+        warm_time, warm_peak, _ = measure(dashboard)
+        assert words == legacy_words
+
+        report(f'{count:,} projects ({size:,} chars each)', [
+            ('legacy time', f'{legacy_time * 1000:.1f} ms'),
+            ('legacy peak memory', f'{legacy_peak / 1024:,.0f} KiB'),
+            ('cold time', f'{cold_time * 1000:.1f} ms'),
+            ('cold queries', len(queries)),
+            ('cold peak memory', f'{cold_peak / 1024:,.0f} KiB'),
+            ('cached time', f'{warm_time * 1000:.2f} ms'),
+            ('cached peak memory', f'{warm_peak / 1024:,.0f} KiB'),
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--projects', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--size', type=int, default=2000)
+    args = parser.parse_args()
+    with test_database():
+        run(args.projects, args.size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,431 @@
+"""
+End-to-end latency of every API route.
+
+Seeds a throwaway database with `manage.py seed_data`, then drives each
+route in api/urls.py through the test client from --concurrency threads.
+Reports p50/p95/p99 latency, queries per request and peak RSS, and can
+save the results as JSON to compare against a run from another commit:
+
+    python -m benchmarks.bench_api --output before.json
+    git checkout my-branch
+    python -m benchmarks.bench_api --output after.json --compare before.json
+
+Uploads, attachments and export files go to a temporary MEDIA_ROOT and
+EXPORT_ROOT, and exports and attachment text are rendered inline, so no
+worker pool writes to the database behind the measured requests.
+
+The database is a temporary SQLite file rather than memory, so threads
+really share it. SQLite allows one writer at a time and fails rather than
+waits when two transactions upgrade to writing together, so on SQLite
+write requests take turns; their latency is measured once they run.
+"""
+import argparse
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import test_database
+
+PASSWORD = 'bench-pass-123'
+CHUNK = bytes(range(256)) * 256  # 64 KB
+CHUNK_HEADERS = {'HTTP_X_CHUNK_SHA256': hashlib.sha256(CHUNK).hexdigest()}
+
+
+class Worker:
+    """Per-thread client state; each worker edits its own project."""
+
+    def __init__(self, index, user, project, history_ids, file_id, export_job_id):
+        from rest_framework.test import APIClient
+
+        self.index = index
+        # Server errors are counted in the results instead of raised.
+        self.client = APIClient(raise_request_exception=False)
+        self.client.force_authenticate(user)
+        self.anonymous = APIClient(raise_request_exception=False)
+        self.email = user.email
+        self.project = project
+        self.document_id = project.document.id
+        self.version = project.document.version
+        self.text = project.document.content
+        self.history_ids = history_ids
+        self.file_id = file_id
+        self.export_job_id = export_job_id
+        self.refresh = None
+        self.upload_id = None
+        self.upload_offset = 0
+        self.completable = []
+        self.counter = 0
+
+    def next(self):
+        self.counter += 1
+        return self.counter
+
+    def track_version(self, response):
+        if response.status_code == 200 and 'version' in getattr(response, 'data', {}):
+            self.version = response.data['version']
+
+
+class Scenario:
+    def __init__(self, route, method, path, data=None, anonymous=False, after=None, setup=None, variant='',
+                 content_type=None, headers=None):
+        self.route = route
+        self.method = method
+        self.path = path
+        self.data = data
+        self.anonymous = anonymous
+        self.after = after
+        # Called as setup(worker, count) before the worker's `count` requests.
+        self.setup = setup
+        # A content type sends `data` as the raw body instead of JSON.
+        self.content_type = content_type
+        self.headers = headers or {}
+        # Labels leave out object ids so runs on different data compare.
+        self.label = f'{method.upper()} {route}{variant}'
+
+    def request(self, worker):
+        client = worker.anonymous if self.anonymous else worker.client
+        data = self.data(worker) if self.data else None
+        if self.content_type:
+            response = client.generic(
+                self.method.upper(), self.path(worker), data, content_type=self.content_type, **self.headers
+            )
+        else:
+            response = getattr(client, self.method)(self.path(worker), data, format='json')
+        if self.after:
+            self.after(worker, response)
+        return response
+
+
+def project_url(worker, suffix=''):
+    return f'/api/projects/{worker.project.id}/{suffix}'
+
+
+def document_history_url(worker, suffix=''):
+    return f'/api/documents/{worker.document_id}/history/{suffix}'
+
+
+def store_refresh(worker, response):
+    worker.refresh = response.data.get('refresh')
+
+
+def login(worker, count):
+    store_refresh(worker, worker.anonymous.post(
+        '/api/auth/login/', {'email': worker.email, 'password': PASSWORD}, format='json'
+    ))
+
+
+def drain(worker, response):
+    # Streamed bodies are produced as they are read, so reading is part of the request.
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+        response.close()
+
+
+def start_upload(worker, count):
+    from api import uploads
+    from api.models import Document
+
+    document = Document.objects.get(id=worker.document_id)
+    worker.upload_id = uploads.start(document, 'bench.bin', len(CHUNK) * max(count, 1)).id
+    worker.upload_offset = 0
+
+
+def next_chunk(worker, response):
+    if response.status_code == 200:
+        worker.upload_offset = response.data['offset']
+
+
+def prepare_uploads(worker, count):
+    """Fully written sessions, one per request, each with different bytes."""
+    from api import uploads
+    from api.models import Document
+
+    document = Document.objects.get(id=worker.document_id)
+    for _ in range(count):
+        data = f'worker {worker.index} upload {worker.next()} {time.time_ns()}\n'.encode() + CHUNK
+        session = uploads.start(document, 'bench.bin', len(data))
+        uploads.write_chunk(session, 0, io.BytesIO(data), len(data), hashlib.sha256(data).hexdigest())
+        worker.completable.append(session.id)
+
+
+SCENARIOS = [
+    Scenario('api-root', 'get', lambda w: '/api/'),
+    Scenario('register', 'post', lambda w: '/api/auth/register/', anonymous=True, data=lambda w: {
+        'email': f'load{w.index}-{w.next()}-{time.time_ns()}@example.com',
+        'username': f'load{w.index}-{w.next()}-{time.time_ns()}',
+        'password': 'Load-test-pass-99', 'confirm_password': 'Load-test-pass-99',
+    }),
+    Scenario('token_obtain_pair', 'post', lambda w: '/api/auth/login/', anonymous=True,
+             data=lambda w: {'email': w.email, 'password': PASSWORD}, after=store_refresh),
+    Scenario('token_refresh', 'post', lambda w: '/api/auth/refresh/', anonymous=True,
+             data=lambda w: {'refresh': w.refresh}, after=store_refresh, setup=login),
+    Scenario('project-list', 'get', lambda w: '/api/projects/'),
+    Scenario('project-list', 'get', lambda w: '/api/projects/?search=draft&ordering=title', variant=' ?search'),
+    Scenario('project-list', 'post', lambda w: '/api/projects/', data=lambda w: {'title': f'Load test {w.next()}'}),
+    Scenario('project-detail', 'get', project_url),
+    Scenario('project-detail', 'patch', project_url, data=lambda w: {'title': f'Renamed {w.next()}'}),
+    Scenario('project-stats', 'get', lambda w: project_url(w, 'stats/')),
+    Scenario('project-document', 'get', lambda w: project_url(w, 'document/')),
+    Scenario('project-document', 'put', lambda w: project_url(w, 'document/'),
+             data=lambda w: {'content': f'Rewritten by worker {w.index}, save {w.next()}.\n' * 50},
+             after=Worker.track_version),
+    Scenario('project-document', 'patch', lambda w: project_url(w, 'document/'),
+             data=lambda w: {'base_version': w.version, 'ops': [{'offset': 0, 'insert': 'More words. '}]},
+             after=Worker.track_version),
+    Scenario('document-list', 'get', lambda w: '/api/documents/'),
+    Scenario('document-detail', 'get', lambda w: f'/api/documents/{w.document_id}/'),
+    Scenario('document-detail', 'patch', lambda w: f'/api/documents/{w.document_id}/',
+             data=lambda w: {'content': f'Patched by worker {w.index}, save {w.next()}.\n' * 50},
+             after=Worker.track_version),
+    Scenario('analytics', 'get', lambda w: '/api/analytics/'),
+    Scenario('analytics-timeline', 'get', lambda w: '/api/analytics/timeline/'),
+    Scenario('search', 'get', lambda w: '/api/search/?q=chapter'),
+    Scenario('document-history', 'get', document_history_url),
+    Scenario('recent-history', 'get', lambda w: document_history_url(w, 'recent/')),
+    Scenario('history-detail', 'get', lambda w: document_history_url(w, f'{w.history_ids[0]}/')),
+    Scenario('history-diff', 'get', lambda w: document_history_url(
+        w, f'{w.history_ids[0]}/diff/{w.history_ids[-1]}/'
+    )),
+    Scenario('document-preview', 'post', lambda w: f'/api/documents/{w.document_id}/preview/', data=lambda w: {}),
+    Scenario('document-preview', 'post', lambda w: f'/api/documents/{w.document_id}/preview/',
+             data=lambda w: {'base_version': w.version, 'ops': [{'offset': 0, 'insert': 'Unsaved words. '}]},
+             variant=' ops'),
+    Scenario('document-export', 'get', lambda w: f'/api/documents/{w.document_id}/export/?format=html',
+             after=drain),
+    Scenario('export-job-list', 'post', lambda w: f'/api/documents/{w.document_id}/exports/',
+             data=lambda w: {'format': 'md'}),
+    Scenario('export-job-detail', 'get', lambda w: f'/api/exports/{w.export_job_id}/'),
+    Scenario('export-job-download', 'get', lambda w: f'/api/exports/{w.export_job_id}/download/', after=drain),
+    Scenario('export-archive', 'get', lambda w: '/api/export/archive/', after=drain),
+    Scenario('upload-list', 'post', lambda w: f'/api/documents/{w.document_id}/uploads/',
+             data=lambda w: {'filename': f'bench-{w.next()}.bin', 'size': len(CHUNK)}),
+    Scenario('upload-detail', 'get', lambda w: f'/api/uploads/{w.upload_id}/', setup=start_upload),
+    Scenario('upload-detail', 'put', lambda w: f'/api/uploads/{w.upload_id}/?offset={w.upload_offset}',
+             data=lambda w: CHUNK, content_type='application/octet-stream', headers=CHUNK_HEADERS,
+             setup=start_upload, after=next_chunk),
+    Scenario('upload-complete', 'post', lambda w: f'/api/uploads/{w.completable.pop()}/complete/',
+             setup=prepare_uploads),
+    Scenario('document-file-list', 'get', lambda w: f'/api/documents/{w.document_id}/files/'),
+    Scenario('document-file-detail', 'get', lambda w: f'/api/files/{w.file_id}/'),
+    Scenario('document-file-download', 'get', lambda w: f'/api/files/{w.file_id}/download/', after=drain),
+    # Documents are unchanged between requests, so these are answered from the AI cache.
+    Scenario('ai-summarize', 'post', lambda w: '/api/ai/summarize/', data=lambda w: {'document': w.document_id}),
+    Scenario('ai-summarize', 'post', lambda w: '/api/ai/summarize/', variant=' uncached',
+             data=lambda w: {'content': f'Draft {w.index}-{w.next()}-{time.time_ns()}.\n\n{w.text}'}),
+    Scenario('ai-rewrite', 'post', lambda w: '/api/ai/rewrite/',
+             data=lambda w: {'document': w.document_id, 'style': 'formal'}),
+    Scenario('ai-ideas', 'post', lambda w: '/api/ai/ideas/', data=lambda w: {'document': w.document_id}),
+]
+
+
+def route_names():
+    from api import urls
+
+    def names(patterns):
+        for pattern in patterns:
+            if hasattr(pattern, 'url_patterns'):
+                yield from names(pattern.url_patterns)
+            elif pattern.name:
+                yield pattern.name
+    return set(names(urls.urlpatterns))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_scenario(scenario, workers, requests):
+    from django.db import connection, connections
+
+    results = []
+    lock = threading.Lock()
+    if scenario.method != 'get' and connection.vendor == 'sqlite':
+        turn = threading.Lock()
+    else:
+        turn = contextlib.nullcontext()
+
+    def one(worker):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with turn, connection.execute_wrapper(count):
+            start = time.perf_counter()
+            response = scenario.request(worker)
+            elapsed = time.perf_counter() - start
+        with lock:
+            results.append((elapsed, queries, response.status_code))
+
+    def thread_main(index):
+        # Each thread plays one worker and sends its share of the requests.
+        worker = workers[index]
+        count = len(range(index, requests, len(workers)))
+        try:
+            if scenario.setup:
+                scenario.setup(worker, count)
+            for _ in range(count):
+                one(worker)
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+        list(pool.map(thread_main, range(len(workers))))
+    wall = time.perf_counter() - started
+
+    latencies = [elapsed for elapsed, _, _ in results]
+    errors = sum(1 for _, _, code in results if code >= 400)
+    return {
+        'route': scenario.route,
+        'method': scenario.method.upper(),
+        'requests': len(results),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'queries_per_request': round(statistics.mean(q for _, q, _ in results), 2),
+        'throughput_rps': round(len(results) / wall, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def setup_workers(args):
+    from django.core.management import call_command
+
+    from api import export_jobs, uploads
+    from api.models import History, Project, User
+
+    call_command(
+        'seed_data', users=args.users, projects=args.projects, size=args.size,
+        history=args.history, prefix='bench', password=PASSWORD, stdout=open(os.devnull, 'w'),
+    )
+    user = User.objects.get(username='bench0')
+    projects = list(Project.objects.filter(owner=user).select_related('document').order_by('id'))
+    if len(projects) < args.concurrency:
+        print(f'Only {len(projects)} projects for {args.concurrency} workers; some workers will share one.')
+    workers = []
+    for index in range(args.concurrency):
+        project = projects[index % len(projects)]
+        document = project.document
+        history_ids = list(History.objects.filter(document=document).order_by('id').values_list('id', flat=True))
+        data = os.urandom(args.attachment_kb * 1024)
+        session = uploads.start(document, f'attachment-{index}.bin', len(data))
+        uploads.write_chunk(session, 0, io.BytesIO(data), len(data), hashlib.sha256(data).hexdigest())
+        file_id = uploads.complete(session).id
+        export_job_id = export_jobs.submit(document, 'html').id
+        workers.append(Worker(index, user, project, history_ids, file_id, export_job_id))
+    return workers
+
+
+def print_results(results, baseline=None):
+    header = f'{"route":<58} {"p50":>9} {"p95":>9} {"p99":>9} {"q/req":>6} {"rps":>7} {"err":>4}'
+    print(header)
+    print('-' * len(header))
+    for label, row in results.items():
+        line = (
+            f'{label[:58]:<58} {row["p50_ms"]:>7.2f}ms {row["p95_ms"]:>7.2f}ms {row["p99_ms"]:>7.2f}ms '
+            f'{row["queries_per_request"]:>6.1f} {row["throughput_rps"]:>7.1f} {row["errors"]:>4}'
+        )
+        old = (baseline or {}).get(label)
+        if old:
+            change = (row['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0
+            queries = row['queries_per_request'] - old['queries_per_request']
+            line += f'   p50 {change:+.0f}%  queries {queries:+.1f}'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--projects', type=int, default=25, help='Projects per seeded user.')
+    parser.add_argument('--size', type=int, default=5000, help='Document size in characters.')
+    parser.add_argument('--history', type=int, default=20, help='History versions per document.')
+    parser.add_argument('--attachment-kb', type=int, default=256, help='Size of the attachment each worker downloads.')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per route.')
+    parser.add_argument('--concurrency', type=int, default=4, help='Client threads.')
+    parser.add_argument('--routes', nargs='*', help='Only run routes whose name contains one of these.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against.')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)['routes']
+
+    from django.test import override_settings
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = override_settings(
+            MEDIA_ROOT=os.path.join(directory, 'media'), EXPORT_ROOT=os.path.join(directory, 'exports'),
+            EXPORT_WORKERS=0, ATTACHMENT_TEXT_WORKERS=0,
+        )
+        with files, test_database(os.path.join(directory, 'bench.sqlite3')):
+            workers = setup_workers(args)
+            # DELETE is left out so every scenario runs on the same data.
+            missing = route_names() - {scenario.route for scenario in SCENARIOS}
+            if missing:
+                print(f'No scenario for: {", ".join(sorted(missing))}', file=sys.stderr)
+
+            results = {}
+            for scenario in SCENARIOS:
+                if args.routes and not any(part in scenario.route for part in args.routes):
+                    continue
+                print(f'  {scenario.label}', file=sys.stderr)
+                results[scenario.label] = run_scenario(scenario, workers, args.requests)
+
+    print()
+    print_results(results, baseline)
+    print(f'\npeak RSS {peak_rss_mb():.1f} MB')
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump({
+                'meta': {
+                    'commit': git_commit(),
+                    'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    'python': platform.python_version(),
+                    'args': vars(args),
+                },
+                'peak_rss_mb': round(peak_rss_mb(), 1),
+                'routes': results,
+            }, handle, indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Account archive: memory while streaming a ZIP of every project.
+
+Creates --documents documents of --document-kb each, with --versions
+history rows apiece, then streams /api/export/archive/ (with and without
+history) and reports throughput, archive size and the peak Python
+allocation while the archive was produced, against the total text size.
+
+    python -m benchmarks.bench_archive [--documents 500] [--document-kb 100] [--versions 5]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import make_text, mutate, report, test_database
+
+
+def populate(user, documents, document_kb, versions):
+    from django.test import override_settings
+
+    from api.models import Document, Project
+    from api.versioning import record_snapshot
+
+    rng = random.Random(0)
+    base = make_text(document_kb * 1024)
+    with override_settings(HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=0):
+        for number in range(documents):
+            project = Project.objects.create(owner=user, title=f'Project {number}')
+            document = Document.objects.create(project=project, content=mutate(base, rng, edits=20))
+            for _ in range(versions):
+                record_snapshot(document, document.content)
+                document.content = mutate(document.content, rng, edits=3)
+            document.save(update_fields=['content'])
+
+
+def stream(client, params):
+    """Download the archive once for time and again under tracemalloc for memory."""
+    def download():
+        response = client.get('/api/export/archive/', params)
+        size = chunks = 0
+        for chunk in response.streaming_content:
+            size += len(chunk)
+            chunks += 1
+        return size, chunks
+
+    start = time.perf_counter()
+    size, chunks = download()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    download()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, size, chunks, peak
+
+
+def run(documents, document_kb, versions):
+    from django.db.models import Sum
+    from django.db.models.functions import Length
+    from rest_framework.test import APIClient
+
+    from api.models import Document, User
+
+    user = User.objects.create_user('bench@example.com', 'bench', 'bench-pass-123')
+    populate(user, documents, document_kb, versions)
+    text = Document.objects.aggregate(total=Sum(Length('content')))['total']
+    client = APIClient()
+    client.force_authenticate(user)
+
+    rows = [('account', f'{documents:,} documents, {text / 2 ** 20:,.0f} MB of current text, '
+                        f'{versions} versions each')]
+    for label, params in [('documents', {}), ('with history', {'history': '1'})]:
+        seconds, size, chunks, peak = stream(client, params)
+        rows.append((label, (
+            f'{size / 2 ** 20:,.1f} MB zip in {seconds:.1f} s, '
+            f'{chunks:,} chunks, peak allocation {peak / 2 ** 20:.1f} MB'
+        )))
+    report('GET /api/export/archive/', rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--documents', type=int, default=500)
+    parser.add_argument('--document-kb', type=int, default=100)
+    parser.add_argument('--versions', type=int, default=5)
+    args = parser.parse_args()
+    path = os.path.join(tempfile.gettempdir(), 'bench_archive.sqlite3')
+    with test_database(path):
+        run(args.documents, args.document_kb, args.versions)
+
+
+if __name__ == '__main__':
+    main()
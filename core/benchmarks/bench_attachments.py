@@ -0,0 +1,121 @@
+"""
+Attachment text extraction: throughput and memory per file type, and what
+resubmitting an unchanged file costs.
+
+Writes a text file of --megabytes, an HTML page of the same text and a PDF
+rendered by the export renderer. Each one is extracted twice with the
+default output cap: once timed, and once under tracemalloc for the peak
+allocation. The peak includes the extracted text, which the cap bounds.
+Then every file is attached to a document, which extracts it inline
+once the upload completes, and submitted again, which finds the hash
+unchanged and reads nothing.
+
+    python -m benchmarks.bench_attachments [--megabytes 200]
+"""
+import argparse
+import html
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import make_text, report, test_database
+
+
+def write_files(directory, megabytes):
+    from api import rendering
+
+    paragraph = make_text(64 * 1024)
+    paths = {}
+    paths['text'] = os.path.join(directory, 'notes.md')
+    with open(paths['text'], 'w') as file:
+        for _ in range(megabytes * 16):
+            file.write(paragraph + '\n\n')
+    paths['html'] = os.path.join(directory, 'page.html')
+    with open(paths['html'], 'w') as file:
+        file.write('<html><head><style>p { margin: 0 }</style></head><body>\n')
+        for _ in range(megabytes * 16):
+            file.write(f'<p>{html.escape(paragraph)}</p>\n')
+        file.write('</body></html>\n')
+    # The renderer holds a whole PDF in memory, so this one stays smaller.
+    paths['pdf'] = os.path.join(directory, 'report.pdf')
+    with open(paths['pdf'], 'wb') as file:
+        file.write(rendering.pdf('\n\n'.join([paragraph] * min(megabytes, 64))))
+    return paths
+
+
+def measure(path, kind, max_chars):
+    from api import extraction
+
+    start = time.perf_counter()
+    text = extraction.extract(path, kind, max_chars)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    extraction.extract(path, kind, max_chars)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, len(text)
+
+
+def run(megabytes, directory):
+    from django.conf import settings
+    from django.db import connection
+    from django.test import override_settings
+    from django.test.utils import CaptureQueriesContext
+
+    from api import attachment_index, uploads
+    from api.models import AttachmentText, Document, Project, User
+
+    paths = write_files(directory, megabytes)
+    rows = []
+    for kind, path in paths.items():
+        size = os.path.getsize(path) / 2 ** 20
+        seconds, peak, chars = measure(path, kind, settings.ATTACHMENT_TEXT_MAX_CHARS)
+        rows.append((f'{kind} ({size:,.0f} MB)', (
+            f'{seconds * 1000:,.0f} ms, peak allocation {peak / 2 ** 20:.1f} MB, {chars:,} characters kept'
+        )))
+    uncapped, peak, chars = measure(paths['text'], 'text', 10 ** 12)
+    rows.append(('text, no cap', (
+        f'{uncapped * 1000:,.0f} ms ({os.path.getsize(paths["text"]) / 2 ** 20 / uncapped:,.0f} MB/s), '
+        f'peak allocation {peak / 2 ** 20:.1f} MB'
+    )))
+    report(f'Extraction, ATTACHMENT_TEXT_MAX_CHARS = {settings.ATTACHMENT_TEXT_MAX_CHARS:,}', rows)
+
+    user = User.objects.create_user('bench@example.com', 'bench', 'bench-pass-123')
+    project = Project.objects.create(owner=user, title='Attachments')
+    document = Document.objects.create(project=project, content='')
+    files = []
+    with override_settings(ATTACHMENT_TEXT_WORKERS=0):
+        start = time.perf_counter()
+        # Outside a test transaction, the on_commit hook runs as complete() returns.
+        for path in paths.values():
+            session = uploads.start(document, os.path.basename(path), os.path.getsize(path))
+            os.replace(path, uploads.part_path(session))
+            session.received = session.size
+            files.append(uploads.complete(session))
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            for document_file in files:
+                attachment_index.submit(document_file)
+        again = time.perf_counter() - start
+    done = AttachmentText.objects.filter(status=AttachmentText.DONE).count()
+    report('Submitting the attached files', [
+        ('attach', f'{first * 1000:,.0f} ms including hashing, {done} of {len(files)} extracted'),
+        ('unchanged', f'{again * 1000:,.1f} ms, {len(queries)} queries, no file read'),
+    ])
+
+
+def main():
+    from django.test import override_settings
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megabytes', type=int, default=200)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        with override_settings(MEDIA_ROOT=os.path.join(directory, 'media')), test_database():
+            run(args.megabytes, directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Fan-out latency of collaborative editing on one document.
+
+Connects N editors to the same document over the in-memory channel layer.
+Each editor sends a stream of small inserts, keeping one operation in
+flight at a time like a real client. Reports the time from sending an
+operation until every other editor has received it, and until the sender
+gets its ack.
+
+    python -m benchmarks.bench_collab [--editors 60] [--ops 20]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from benchmarks.common import report, test_database
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def editor(application, path, index, start, ops, sent, received, acks, total, initial_length):
+    from channels.testing import WebsocketCommunicator
+
+    rng = random.Random(index)
+    communicator = WebsocketCommunicator(application, path)
+    connected, _ = await communicator.connect()
+    assert connected
+    version = (await communicator.receive_json_from())['version']
+    await start.wait()
+
+    pending = None
+    remaining = ops
+    seen = 0
+    while seen < total:
+        if pending is None and remaining:
+            ref = f'{index}-{remaining}'
+            sent[ref] = time.perf_counter()
+            pending = ref
+            remaining -= 1
+            await communicator.send_json_to({
+                'type': 'ops', 'base_version': version, 'ref': ref,
+                'ops': [{'offset': rng.randint(0, initial_length), 'insert': 'word '}],
+            })
+        message = await communicator.receive_json_from(timeout=30)
+        now = time.perf_counter()
+        version = max(version, message['version'])
+        seen += 1
+        if message['type'] == 'ack':
+            acks[message['version']] = (message['ref'], now)
+            pending = None
+        else:
+            received.setdefault(message['version'], []).append(now)
+    await communicator.disconnect()
+
+
+async def run_editors(application, path, editors, ops, initial_length):
+    start = asyncio.Event()
+    sent, received, acks = {}, {}, {}
+    total = editors * ops
+    tasks = [
+        asyncio.create_task(
+            editor(application, path, i, start, ops, sent, received, acks, total, initial_length)
+        )
+        for i in range(editors)
+    ]
+    await asyncio.sleep(0.5)
+    began = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - began
+
+    fanout, ack_latency = [], []
+    for version, (ref, acked) in acks.items():
+        ack_latency.append(acked - sent[ref])
+        fanout.append(max(received.get(version, [acked])) - sent[ref])
+    return elapsed, fanout, ack_latency
+
+
+def run(editors, ops):
+    from channels.routing import URLRouter
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from api.middleware import JWTAuthMiddleware
+    from api.models import Document, Project, User
+    from api.routing import websocket_urlpatterns
+
+    user = User.objects.create_user('bench@example.com', 'bench', 'bench-pass-123')
+    project = Project.objects.create(owner=user, title='Shared document')
+    content = 'The quick brown fox jumps over the lazy dog. ' * 200
+    document = Document.objects.create(project=project, content=content)
+    application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+    path = f'/ws/documents/{document.id}/?token={AccessToken.for_user(user)}'
+
+    elapsed, fanout, ack_latency = asyncio.run(
+        run_editors(application, path, editors, ops, len(content))
+    )
+    document.refresh_from_db()
+
+    def ms(value):
+        return f'{value * 1000:.2f} ms'
+
+    report(f'{editors} editors x {ops} ops', [
+        ('operations', len(fanout)),
+        ('throughput', f'{len(fanout) / elapsed:.0f} ops/s'),
+        ('fan-out p50', ms(statistics.median(fanout))),
+        ('fan-out p95', ms(percentile(fanout, 0.95))),
+        ('fan-out p99', ms(percentile(fanout, 0.99))),
+        ('ack p50', ms(statistics.median(ack_latency))),
+        ('ack p95', ms(percentile(ack_latency, 0.95))),
+        ('persisted version', document.version),
+        ('persisted length', f'{len(document.content):,} chars'),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--editors', type=int, default=60)
+    parser.add_argument('--ops', type=int, default=20)
+    args = parser.parse_args()
+    with test_database():
+        run(args.editors, args.ops)
+
+
+if __name__ == '__main__':
+    main()
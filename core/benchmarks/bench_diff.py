@@ -0,0 +1,54 @@
+"""
+Version comparison on multi-megabyte documents.
+
+Times the Myers line/word diff used by the history diff endpoint against
+difflib, for a handful of scattered edits and for a heavy rewrite that
+trips the early-exit limit, plus the cost of a cached repeat.
+
+    python -m benchmarks.bench_diff [--sizes 1000000 4000000]
+"""
+import argparse
+import difflib
+import random
+
+from benchmarks.common import make_text, mutate, report, timed
+
+
+def run(sizes, edits):
+    from api import diffing
+
+    for size in sizes:
+        old = make_text(size, seed=size)
+        new = mutate(old, random.Random(size), edits=edits)
+        rewritten = make_text(size, seed=size + 1)
+
+        json_time, result = timed(diffing.diff_ops, old, new, max_edits=1000, repeat=3)
+        unified_time, _ = timed(diffing.unified_diff, old, new, max_edits=1000, repeat=3)
+        difflib_time, _ = timed(
+            lambda: list(difflib.unified_diff(old.splitlines(True), new.splitlines(True))), repeat=1
+        )
+        rewrite_time, rewrite = timed(diffing.diff_ops, old, rewritten, max_edits=1000, repeat=1)
+
+        diffing._cache.clear()
+        diffing.compare_versions(old, new, 'a', 'b')
+        cached_time, _ = timed(diffing.compare_versions, old, new, 'a', 'b', repeat=50)
+
+        report(f'{size / 1e6:.1f} MB document, {edits} edits', [
+            ('json ops', f'{json_time * 1000:.1f} ms ({len(result["ops"])} ops)'),
+            ('unified', f'{unified_time * 1000:.1f} ms'),
+            ('difflib unified', f'{difflib_time * 1000:.1f} ms'),
+            ('full rewrite', f'{rewrite_time * 1000:.1f} ms (complete={rewrite["complete"]})'),
+            ('cached repeat', f'{cached_time * 1e6:.1f} us'),
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000_000, 4_000_000])
+    parser.add_argument('--edits', type=int, default=20)
+    args = parser.parse_args()
+    run(args.sizes, args.edits)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Attachment downloads: what it costs Python to send a large file.
+
+Stores a --megabytes attachment, then downloads it through the WSGI
+handler, the way a server calls it:
+
+- with a wsgi.file_wrapper that uses os.sendfile(), as gunicorn and uWSGI
+  do, writing to /dev/null;
+- without one, so that the response is iterated in Python;
+- a 1 MB range from the middle of the file, with sendfile;
+- in x-accel-redirect mode, where the proxy sends the file.
+
+Reports time, peak Python allocation and queries for each; one query
+is the JWT user lookup.
+
+    python -m benchmarks.bench_downloads [--megabytes 1024]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import report, test_database
+
+
+class SendfileWrapper:
+    """A wsgi.file_wrapper like gunicorn's: sendfile() from the file's position for Content-Length bytes."""
+
+    def __init__(self, filelike, block_size=8192):
+        self.filelike = filelike
+
+    def send(self, out, length):
+        fileno = self.filelike.fileno()
+        offset = os.lseek(fileno, 0, os.SEEK_CUR)
+        while length:
+            sent = os.sendfile(out, fileno, offset, length)
+            offset += sent
+            length -= sent
+
+    def close(self):
+        self.filelike.close()
+
+
+def download(handler, environ, out):
+    """Run one request; return (status, bytes sent, seconds, peak allocation, queries)."""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    headers = {}
+
+    def start_response(status, response_headers):
+        headers.update(response_headers)
+        headers['status'] = status
+
+    sent = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    with CaptureQueriesContext(connection) as queries:
+        body = handler(dict(environ), start_response)
+        if isinstance(body, SendfileWrapper):
+            sent = int(headers['Content-Length'])
+            body.send(out, sent)
+        else:
+            for data in body:
+                os.write(out, data)
+                sent += len(data)
+        body.close()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return headers['status'], sent, seconds, peak, len(queries)
+
+
+def run(megabytes, directory):
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.test import RequestFactory, override_settings
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from api import uploads
+    from api.models import Document, Project, User
+
+    path = os.path.join(directory, 'attachment.bin')
+    with open(path, 'wb') as file:
+        for _ in range(megabytes):
+            file.write(os.urandom(2 ** 20))
+    size = megabytes * 2 ** 20
+
+    user = User.objects.create_user('bench@example.com', 'bench', 'bench-pass-123')
+    project = Project.objects.create(owner=user, title='Downloads')
+    document = Document.objects.create(project=project, content='')
+    session = uploads.start(document, 'attachment.bin', size)
+    os.replace(path, uploads.part_path(session))
+    session.received = size
+    document_file = uploads.complete(session)
+
+    url = f'/api/files/{document_file.id}/download/'
+    factory = RequestFactory(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+    whole = factory.get(url).environ
+    middle = factory.get(url, HTTP_RANGE=f'bytes={size // 2}-{size // 2 + 2 ** 20 - 1}').environ
+    handler = WSGIHandler()
+    out = os.open(os.devnull, os.O_WRONLY)
+    cases = [
+        ('sendfile', {**whole, 'wsgi.file_wrapper': SendfileWrapper}, {}),
+        ('python iteration', whole, {}),
+        ('1 MB range, sendfile', {**middle, 'wsgi.file_wrapper': SendfileWrapper}, {}),
+        ('x-accel-redirect', whole, {'ATTACHMENT_SENDFILE': 'x-accel-redirect'}),
+    ]
+    rows = []
+    try:
+        # The first request loads the URLconf and views.
+        download(handler, middle, out)
+        for label, environ, overrides in cases:
+            with override_settings(**overrides):
+                status, sent, seconds, peak, queries = download(handler, environ, out)
+            rate = f', {sent / 2 ** 20 / seconds:,.0f} MB/s' if sent > 2 ** 20 else ''
+            rows.append((label, (
+                f'{status.split()[0]}, {sent / 2 ** 20:,.1f} MB in {seconds * 1000:,.0f} ms{rate}, '
+                f'peak allocation {peak / 2 ** 20:.1f} MB, {queries} queries'
+            )))
+    finally:
+        os.close(out)
+    report(f'GET {url.replace(str(document_file.id), "{id}")} of a {megabytes:,} MB file', rows)
+
+
+def main():
+    from django.test import override_settings
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megabytes', type=int, default=1024)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        with override_settings(MEDIA_ROOT=os.path.join(directory, 'media')), test_database():
+            run(args.megabytes, directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Document export: rendering cost and bytes on the wire.
+
+Exports a --size byte Markdown document as HTML through the API, first
+with an empty render cache and then repeatedly with a warm one, with and
+without gzip, and times resuming an interrupted download with a Range
+request. Then renders the same document through export jobs (pdf, html,
+md) and times a repeat submit, which is deduplicated by content hash.
+
+    python -m benchmarks.bench_export [--size 5000000]
+"""
+import argparse
+
+from benchmarks.common import make_text, report, test_database, timed
+
+
+def download(client, url, **headers):
+    response = client.get(url, **headers)
+    return response, b''.join(response.streaming_content)
+
+
+def run(size):
+    from rest_framework.test import APIClient
+
+    from api import exporting
+    from api.models import Document, Project, User
+
+    user = User.objects.create_user('bench@example.com', 'bench', 'bench-pass-123')
+    project = Project.objects.create(owner=user, title='Export')
+    content = '# Export\n\n' + make_text(size)
+    document = Document.objects.create(project=project, content=content)
+    client = APIClient()
+    client.force_authenticate(user)
+    url = f'/api/documents/{document.id}/export/?format=html'
+
+    def cold(**headers):
+        exporting._cache.clear()
+        return download(client, url, **headers)
+
+    rows = [('document', f'{len(content) / 2 ** 20:.1f} MB of Markdown')]
+    for label, headers in [('identity', {}), ('gzip', {'HTTP_ACCEPT_ENCODING': 'gzip'})]:
+        cold_time, _ = timed(cold, repeat=3, **headers)
+        warm_time, (response, body) = timed(download, client, url, repeat=5, **headers)
+        rows.append((f'html {label}', (
+            f'{len(body) / 2 ** 20:.2f} MB, first render {cold_time * 1000:,.0f} ms, '
+            f'cached {warm_time * 1000:,.1f} ms'
+        )))
+
+    etag = response['ETag']
+    half = len(body) // 2
+    resume_time, (response, rest) = timed(
+        download, client, url, repeat=5,
+        HTTP_ACCEPT_ENCODING='gzip', HTTP_RANGE=f'bytes={half}-', HTTP_IF_RANGE=etag,
+    )
+    rows.append(('resume gzip at 50%', f'{response.status_code}, {len(rest) / 2 ** 20:.2f} MB in {resume_time * 1000:.1f} ms'))
+    not_modified, response = timed(client.get, url, repeat=5, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+    rows.append(('revalidate (If-None-Match)', f'{response.status_code} in {not_modified * 1000:.1f} ms'))
+    report('GET /api/documents/{id}/export/', rows)
+
+    rows = []
+    jobs_url = f'/api/documents/{document.id}/exports/'
+    for format in ['pdf', 'html', 'md']:
+        render_time, response = timed(client.post, jobs_url, {'format': format}, format='json', repeat=1)
+        repeat_time, _ = timed(client.post, jobs_url, {'format': format}, format='json', repeat=5)
+        rows.append((f'{format} job', (
+            f'{response.data["size"] / 2 ** 20:.2f} MB, rendered in {render_time * 1000:,.0f} ms, '
+            f'repeat submit {repeat_time * 1000:.1f} ms'
+        )))
+    report('POST /api/documents/{id}/exports/ (inline)', rows)
+
+
+def main():
+    import tempfile
+
+    from django.test import override_settings
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=5_000_000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as root, override_settings(EXPORT_ROOT=root, EXPORT_WORKERS=0):
+        with test_database():
+            run(args.size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Storage size and reconstruction latency of delta-encoded History.
+
+Simulates an hour of 30 s autosaves on a 200 KB document and compares the
+stored bytes and the cost of rebuilding versions for several keyframe
+intervals. An interval of 1 means every snapshot is a full copy.
+
+    python -m benchmarks.bench_history [--size 200000] [--saves 120]
+"""
+import argparse
+import random
+
+from benchmarks.common import make_text, mutate, report, test_database, timed
+
+
+def run(size, saves, intervals):
+    from django.db.models import Sum
+    from django.db.models.functions import Length
+    from django.test import override_settings
+
+    from api.models import Document, History, Project, User
+    from api.versioning import record_snapshot
+
+    user = User.objects.create_user('bench@example.com', 'bench', 'bench-pass-123')
+    for interval in intervals:
+        project = Project.objects.create(owner=user, title=f'Interval {interval}')
+        document = Document.objects.create(project=project, content=make_text(size))
+        rng = random.Random(interval)
+        with override_settings(
+            HISTORY_KEYFRAME_INTERVAL=interval, HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=0
+        ):
+            for _ in range(saves):
+                record_snapshot(document, document.content)
+                document.content = mutate(document.content, rng, edits=3)
+
+        rows = History.objects.filter(document=document)
+        stored = rows.aggregate(
+            total=Sum(Length('content_snapshot')) + Sum(Length('delta'))
+        )['total']
+        deepest = rows.order_by('-chain_depth', '-id').first()
+        newest = rows.order_by('-id').first()
+
+        def rebuild(row):
+            History.objects.get(pk=row.pk).get_content()
+
+        worst, _ = timed(rebuild, deepest)
+        latest, _ = timed(rebuild, newest)
+        full = size * saves
+        report(f'keyframe interval {interval}', [
+            ('snapshots', saves),
+            ('stored bytes', f'{stored:,}'),
+            ('vs full copies', f'{stored / full:.1%} of ~{full:,}'),
+            ('deepest chain', deepest.chain_depth),
+            ('rebuild deepest', f'{worst * 1000:.2f} ms'),
+            ('rebuild newest', f'{latest * 1000:.2f} ms'),
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=200_000)
+    parser.add_argument('--saves', type=int, default=120)
+    parser.add_argument('--intervals', type=int, nargs='+', default=[1, 10, 20, 50])
+    args = parser.parse_args()
+    with test_database():
+        run(args.size, args.saves, args.intervals)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+History search: index size against version count, and query latency.
+
+Autosaves a document --saves times with small edits, indexing each
+snapshot's passages as it is recorded, then compares what the passage
+index holds with what indexing every snapshot would hold. Also times the
+incremental indexing per save, a full reindex, and history queries for
+text that has since been deleted.
+
+    python -m benchmarks.bench_history_search [--size 50000] [--saves 2000]
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import make_text, mutate, report, test_database, timed
+
+
+def autosave(document, saves, seed, marker=None):
+    """Snapshot `saves` edits of `document`; returns (seconds, chars, lines) over all snapshots."""
+    from api.history_index import passages
+    from api.versioning import record_snapshot
+
+    rng = random.Random(seed)
+    chars = lines = 0
+    seconds = 0.0
+    for number in range(saves):
+        start = time.perf_counter()
+        record_snapshot(document, document.content)
+        seconds += time.perf_counter() - start
+        chars += len(document.content)
+        lines += len(passages(document.content))
+        if marker and number == saves // 2:
+            document.content = document.content.replace(marker, '', 1)
+        document.content = mutate(document.content, rng, edits=2)
+    return seconds, chars, lines
+
+
+def run(size, saves):
+    from unittest import mock
+
+    from django.db import connection
+    from django.db.models import Sum
+    from django.db.models.functions import Length
+    from django.test import override_settings
+
+    from api import history_index, search
+    from api.models import Document, History, Passage, PassageSpan, Project, User
+
+    user = User.objects.create_user('bench@example.com', 'bench', 'bench-pass-123')
+    deleted_marker = 'vanishedmarker'
+    text = f'{deleted_marker} was here once\n' + make_text(size)
+    with override_settings(HISTORY_COALESCE_WINDOW=0, HISTORY_COALESCE_MIN_CHANGE=0):
+        project = Project.objects.create(owner=user, title='Without index')
+        plain = Document.objects.create(project=project, content=text)
+        with mock.patch('api.versioning.index_snapshot'):
+            plain_seconds, _, _ = autosave(plain, saves, 0, deleted_marker)
+
+        project = Project.objects.create(owner=user, title='History')
+        document = Document.objects.create(project=project, content=text)
+        total_seconds, snapshot_chars, snapshot_lines = autosave(document, saves, 0, deleted_marker)
+
+    passages = Passage.objects.filter(document=document)
+    passage_chars = passages.aggregate(total=Sum(Length('text')))['total']
+    spans = PassageSpan.objects.filter(passage__document=document).count()
+    report(f'{saves:,} snapshots of a {size // 1000} KB document', [
+        ('text in all snapshots', f'{snapshot_chars / 2 ** 20:,.1f} MB, {snapshot_lines:,} lines'),
+        ('passage index', f'{passage_chars / 2 ** 20:,.2f} MB, {passages.count():,} passages, {spans:,} runs'),
+        ('stored history rows', f'{History.objects.filter(document=document).count():,}'),
+        ('snapshot per save', f'{total_seconds / saves * 1000:.2f} ms with the passage index, '
+                              f'{plain_seconds / saves * 1000:.2f} ms without'),
+    ])
+
+    reindex_time, count = timed(history_index.reindex_document, document.id, repeat=1)
+    search.rebuild(connection, ['history'])
+
+    rows = [('reindex from History', f'{reindex_time * 1000:,.0f} ms ({count:,} passages)')]
+    for label, q in [('deleted text', deleted_marker), ('common word', 'the'), ('phrase', '"lazy dog"')]:
+        results = search.HistorySearchResults(user.id, search.parse_query(q))
+        seconds, page = timed(lambda: (results.count(), results[0:10]), repeat=3)
+        ranges = sum(len(result['versions']) for result in page[1])
+        rows.append((f'{label} {q!r}', f'{seconds * 1000:.1f} ms, {page[0]:,} passages, {ranges} ranges on page 1'))
+    report('history search', rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=50_000)
+    parser.add_argument('--saves', type=int, default=2000)
+    args = parser.parse_args()
+    with test_database():
+        run(args.size, args.saves)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Live preview: latency after a one-line change to a large document.
+
+Renders a --size byte Markdown document once in full with markdown (what
+every HTML export used to do), then through the block cache cold and
+warm, and finally times POST /api/documents/{id}/preview/ with a
+one-line edit op, with and without the client's known block ids.
+
+    python -m benchmarks.bench_preview [--size 5000000]
+"""
+import argparse
+
+from benchmarks.common import make_text, report, test_database, timed
+
+
+def run(size):
+    import markdown
+    from rest_framework.test import APIClient
+
+    from api import markdown_blocks, preview
+    from api.models import Document, Project, User
+
+    content = make_text(size)
+    blocks, _ = markdown_blocks.split_blocks(content)
+    full_time, _ = timed(markdown.markdown, content, repeat=1)
+
+    def cold():
+        preview._cache.clear()
+        return preview.render_html(content)
+
+    cold_time, _ = timed(cold, repeat=1)
+    warm_time, _ = timed(preview.render_html, content, repeat=3)
+    offset = content.index('\n', len(content) // 2) + 1
+    edited = content[:offset] + 'A new line in the middle.\n' + content[offset:]
+    edit_time, _ = timed(lambda: preview.render_html(edited), repeat=1)
+    split_time, _ = timed(markdown_blocks.split_blocks, content, repeat=3)
+    report(f'{len(content) / 2 ** 20:.1f} MB document, {len(blocks):,} blocks', [
+        ('markdown.markdown, whole document', f'{full_time * 1000:,.0f} ms'),
+        ('block render, cold cache', f'{cold_time * 1000:,.0f} ms'),
+        ('block render, unchanged', f'{warm_time * 1000:,.0f} ms (split alone {split_time * 1000:,.0f} ms)'),
+        ('block render, one line inserted', f'{edit_time * 1000:,.0f} ms'),
+    ])
+
+    user = User.objects.create_user('bench@example.com', 'bench', 'bench-pass-123')
+    project = Project.objects.create(owner=user, title='Preview')
+    document = Document.objects.create(project=project, content=content)
+    client = APIClient()
+    client.force_authenticate(user)
+    url = f'/api/documents/{document.id}/preview/'
+    response = client.post(url, {}, format='json')
+    known = [block['id'] for block in response.data['blocks']]
+
+    rows = []
+    for number, (label, ids) in enumerate([('without known ids', []), ('with known ids', known)]):
+        ops = [{'offset': offset, 'insert': f'Edit number {number} on its own line.\n\n'}]
+        seconds, response = timed(
+            client.post, url, {'base_version': document.version, 'ops': ops, 'known': ids}, format='json', repeat=3
+        )
+        sent = sum(1 for block in response.data['blocks'] if 'html' in block)
+        rows.append((label, f'{seconds * 1000:,.0f} ms, {len(response.content) / 1024:,.0f} KB, {sent:,} blocks with HTML'))
+    report('POST /api/documents/{id}/preview/ after a one-line edit', rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=5_000_000)
+    args = parser.parse_args()
+    with test_database():
+        run(args.size)
+
+
+if __name__ == '__main__':
+    main()
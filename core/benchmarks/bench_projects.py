@@ -0,0 +1,127 @@
+"""
+Project listing for one owner with many projects.
+
+Compares the old created_at__date filters with the half-open timestamp
+range, and OFFSET pages with keyset (cursor) pages at increasing depth,
+both through the ORM queries the view runs and end to end through the API.
+
+    python -m benchmarks.bench_projects [--projects 100000]
+"""
+import argparse
+import datetime
+import random
+
+from benchmarks.common import report, test_database, timed
+
+
+def populate(user, count):
+    from django.utils import timezone
+
+    from api.models import Document, Project
+
+    rng = random.Random(0)
+    now = timezone.now()
+    batch = 5000
+    for start in range(0, count, batch):
+        projects = Project.objects.bulk_create(
+            Project(
+                owner=user,
+                title=f'Project {rng.randrange(count):06}',
+                created_at=now - datetime.timedelta(seconds=rng.randrange(365 * 86400)),
+            )
+            for _ in range(start, min(start + batch, count))
+        )
+        Document.objects.bulk_create(
+            Document(project=project, content='Draft', word_count=1, char_count=5, line_count=1)
+            for project in projects
+        )
+
+
+def run(count):
+    from django.db import connection
+    from django.utils import timezone
+    from django.test import RequestFactory
+    from rest_framework.test import APIClient
+
+    from api.etags import project_list_etag
+    from api.models import Project, User
+    from api.views import start_of_day
+
+    user = User.objects.create_user('bench@example.com', 'bench', 'bench-pass-123')
+    populate(user, count)
+    # Other users, so the planner statistics look like a shared database
+    # rather than one where every project has the same owner.
+    others = User.objects.bulk_create(
+        User(email=f'other{n}@example.com', username=f'other{n}') for n in range(1000)
+    )
+    Project.objects.bulk_create(Project(owner=other, title='Other') for other in others for _ in range(10))
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    projects = Project.objects.filter(owner=user).select_related('owner', 'document').defer('document__content')
+    today = timezone.localdate()
+    date_from, date_to = today - datetime.timedelta(days=90), today - datetime.timedelta(days=60)
+
+    def old_filter():
+        rows = projects.filter(created_at__date__gte=date_from, created_at__date__lte=date_to)
+        return rows.count(), list(rows.order_by('-created_at')[:10])
+
+    def new_filter():
+        rows = projects.filter(
+            created_at__gte=start_of_day(date_from),
+            created_at__lt=start_of_day(date_to + datetime.timedelta(days=1)),
+        )
+        return rows.count(), list(rows.order_by('-created_at')[:10])
+
+    old_time, (old_count, _) = timed(old_filter)
+    new_time, (new_count, _) = timed(new_filter)
+    assert old_count == new_count
+    report(f'30-day filter over {count:,} projects ({new_count:,} match)', [
+        ('created_at__date range', f'{old_time * 1000:.2f} ms'),
+        ('half-open range', f'{new_time * 1000:.2f} ms'),
+    ])
+
+    ordered = projects.order_by('-created_at', '-id')
+    rows = []
+    for depth in (10, 1_000, 10_000, count - 10):
+        anchor = ordered.values_list('created_at', 'id')[depth - 1]
+        offset_time, offset_page = timed(lambda: list(ordered[depth:depth + 10]))
+        keyset_time, keyset_page = timed(lambda: list(
+            ordered.filter(created_at__lte=anchor[0]).exclude(created_at=anchor[0], id__gte=anchor[1])[:10]
+        ))
+        assert [p.id for p in offset_page] == [p.id for p in keyset_page]
+        rows.append((f'depth {depth:,}', f'offset {offset_time * 1000:.2f} ms, keyset {keyset_time * 1000:.2f} ms'))
+    report('page of 10 at depth', rows)
+
+    client = APIClient()
+    client.force_authenticate(user)
+    request = RequestFactory().get('/api/projects/')
+    request.user = user
+    etag_time, _ = timed(lambda: project_list_etag(request))
+    last_page = (count + 9) // 10
+    first_time, _ = timed(lambda: client.get('/api/projects/'))
+    deep_time, _ = timed(lambda: client.get(f'/api/projects/?page={last_page}'))
+    cursor_first_time, response = timed(lambda: client.get('/api/projects/?pagination=cursor'))
+    next_url = response.data['next']
+    cursor_next_time, _ = timed(lambda: client.get(next_url))
+    title_time, _ = timed(lambda: client.get('/api/projects/?pagination=cursor&ordering=title'))
+    report('API', [
+        ('page 1', f'{first_time * 1000:.2f} ms'),
+        (f'page {last_page:,}', f'{deep_time * 1000:.2f} ms'),
+        ('cursor, first page', f'{cursor_first_time * 1000:.2f} ms'),
+        ('cursor, next page', f'{cursor_next_time * 1000:.2f} ms'),
+        ('cursor by title', f'{title_time * 1000:.2f} ms'),
+        ('of which list ETag', f'{etag_time * 1000:.2f} ms'),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--projects', type=int, default=100_000)
+    args = parser.parse_args()
+    with test_database():
+        run(args.projects)
+
+
+if __name__ == '__main__':
+    main()
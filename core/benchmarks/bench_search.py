@@ -0,0 +1,152 @@
+"""
+Full-text search over a large corpus.
+
+Loads --megabytes of synthetic prose (Zipf-distributed vocabulary, one
+unique marker word per document) with the index triggers active, then
+compares ranked index queries with the old icontains scan, and times a
+full rebuild and a single-document update.
+
+    python -m benchmarks.bench_search [--megabytes 1024] [--document-kb 100]
+"""
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import report, test_database, timed
+
+SYLLABLES = 'ka lo mi ne ru sa ti vo pe da fi gu ha jo ke li mo nu ra se ta vi we yo zu'.split()
+
+
+def make_pool(rng, paragraphs=4000, vocabulary=30000):
+    words = set()
+    while len(words) < vocabulary:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    pool = []
+    for _ in range(paragraphs):
+        sentence = rng.choices(words, cum_weights=cum_weights, k=rng.randint(40, 120))
+        pool.append(' '.join(sentence).capitalize() + '.\n\n')
+    return words, pool
+
+
+def make_document(rng, pool, size, marker):
+    parts = [f'{marker} ']
+    total = len(parts[0])
+    while total < size:
+        paragraph = rng.choice(pool)
+        parts.append(paragraph)
+        total += len(paragraph)
+    return ''.join(parts)
+
+
+def populate(user, rng, pool, megabytes, document_kb):
+    from api.models import Document, Project
+
+    count = megabytes * 1024 // document_kb
+    batch = max(1, 16 * 1024 // document_kb)
+    for start in range(0, count, batch):
+        projects = Project.objects.bulk_create(
+            Project(owner=user, title=f'Project {n}', description=rng.choice(pool)[:200])
+            for n in range(start, min(start + batch, count))
+        )
+        Document.objects.bulk_create(
+            Document(project=project, content=make_document(rng, pool, document_kb * 1024, f'marker{n}'))
+            for n, project in enumerate(projects, start)
+        )
+    return count
+
+
+def run(megabytes, document_kb):
+    from django.db import connection
+    from rest_framework.test import APIClient
+
+    from api import search
+    from api.models import Document, User
+
+    rng = random.Random(0)
+    words, pool = make_pool(rng)
+    user = User.objects.create_user('bench@example.com', 'bench', 'bench-pass-123')
+
+    start = time.perf_counter()
+    count = populate(user, rng, pool, megabytes, document_kb)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    search.rebuild(connection)
+    rebuild_time = time.perf_counter() - start
+
+    rows = [
+        ('documents', f'{count:,} x {document_kb} KB'),
+        ('load with triggers', f'{load_time:.1f} s ({megabytes / load_time:.1f} MB/s)'),
+        ('full rebuild', f'{rebuild_time:.1f} s ({megabytes / rebuild_time:.1f} MB/s)'),
+    ]
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT SUM(LENGTH(block)) FROM api_search_fts_data")
+            index_bytes = cursor.fetchone()[0] or 0
+        rows.append(('index size', f'{index_bytes / 2 ** 20:,.0f} MB'))
+    report(f'{megabytes:,} MB corpus ({connection.vendor})', rows)
+
+    phrase = ' '.join(rng.choice(pool).split()[10:12])
+    queries = [
+        ('common word', words[0]),
+        ('rare word', words[3000]),
+        ('unique marker', f'marker{count // 2}'),
+        ('prefix', words[1][:3] + '*'),
+        ('phrase', f'"{phrase}"'),
+        ('two words', f'{words[5]} {words[500]}'),
+    ]
+    rows = []
+    for label, q in queries:
+        results = search.SearchResults(user.id, search.parse_query(q))
+        count_time, total = timed(results.count, repeat=3)
+        page_time, _ = timed(lambda: results[0:10], repeat=3)
+        rows.append((f'{label} {q!r}', f'count {count_time * 1000:7.1f} ms, first page {page_time * 1000:6.1f} ms, {total:,} results'))
+
+    marker = f'marker{count // 2}'
+    seconds, found = timed(
+        lambda: list(Document.objects.filter(content__icontains=marker, project__owner=user).values_list('id', flat=True)),
+        repeat=1,
+    )
+    rows.append((f'icontains {marker!r} (old view)', f'{seconds * 1000:.1f} ms, {len(found)} results'))
+    report('document text queries', rows)
+
+    client = APIClient()
+    client.force_authenticate(user)
+    rows = []
+    for label, q in queries[:2]:
+        seconds, response = timed(lambda: client.get('/api/search/', {'q': q}), repeat=3)
+        matched = search.SearchResults(user.id, search.parse_query(q)).count()
+        # The old view serialized every matching document in full.
+        rows.append((f'GET /api/search/ {label}', (
+            f'{seconds * 1000:.1f} ms, {len(response.content) / 1024:.1f} KB '
+            f'(full documents: {matched * document_kb / 1024:,.0f} MB)'
+        )))
+    document = Document.objects.select_related('project').get(project__title=f'Project {count // 2}')
+    edits = itertools.count()
+    update_time, _ = timed(
+        lambda: Document.objects.filter(id=document.id).update(content=f'{document.content} edit{next(edits)}'),
+        repeat=3,
+    )
+    rows.append((f'reindex one {document_kb} KB document', f'{update_time * 1000:.1f} ms'))
+    report('API and writes', rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megabytes', type=int, default=1024)
+    parser.add_argument('--document-kb', type=int, default=100)
+    args = parser.parse_args()
+    # A corpus this size does not fit the default in-memory test database.
+    path = os.path.join(tempfile.gettempdir(), 'bench_search.sqlite3')
+    with test_database(path):
+        run(args.megabytes, args.document_kb)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+TextRank summaries of long documents (see api/summarizer.py).
+
+Summarizes a --megabytes document of generated prose:
+
+- cold, with an empty paragraph cache, so every paragraph is tokenized;
+- the same document again, with every paragraph cached;
+- after an edit to one paragraph, which is the only one tokenized again.
+
+With every paragraph cached, what is left is splitting and hashing the
+paragraphs and the NumPy part: TF-IDF weights and power iteration. The
+peak allocation is that of a cold run.
+
+    python -m benchmarks.bench_summarizer [--megabytes 1]
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.common import make_text, report, timed
+
+
+def run(megabytes):
+    from api import summarizer
+
+    text = make_text(megabytes * 2 ** 20)
+    pieces = summarizer.paragraphs(text)
+    middle = len(pieces) // 2
+    edited = text.replace(pieces[middle], pieces[middle] + ' An edited sentence about figures.', 1)
+
+    summarizer._cache.clear()
+    start = time.perf_counter()
+    found, _ = summarizer.rank(text)
+    cold = time.perf_counter() - start
+    cached, summary = timed(summarizer.summarize, text, 5)
+    start = time.perf_counter()
+    summarizer.summarize(edited, 5)
+    after_edit = time.perf_counter() - start
+
+    summarizer._cache.clear()
+    tracemalloc.start()
+    summarizer.summarize(text, 5)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    report(f'Summarizing {len(text) / 2 ** 20:.1f} MB: {len(pieces):,} paragraphs, {len(found):,} sentences', [
+        ('cold', f'{cold * 1000:,.0f} ms, peak allocation {peak / 2 ** 20:.1f} MB'),
+        ('all paragraphs cached', f'{cached * 1000:,.0f} ms'),
+        ('one paragraph edited', f'{after_edit * 1000:,.0f} ms'),
+        ('summary', f'{len(summary):,} characters'),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megabytes', type=int, default=1)
+    args = parser.parse_args()
+    run(args.megabytes)
+
+
+if __name__ == '__main__':
+    main()
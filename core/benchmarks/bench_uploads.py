@@ -0,0 +1,105 @@
+"""
+Resumable uploads: throughput and memory for a large attachment.
+
+Writes a --megabytes file of random data, then uploads it twice through
+the upload session code in --chunk-mb chunks, reading each chunk from the
+file the way a request body is read. Reports write throughput, peak
+Python allocation while a chunk streams to disk, the cost of completing
+(hashing the part file and storing the blob), and that the second upload
+is stored as a reference to the first blob.
+
+    python -m benchmarks.bench_uploads [--megabytes 1024] [--chunk-mb 64]
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import report, test_database
+
+
+class Window:
+    """A read-only view of `length` bytes of `file` from `offset`, like a request body."""
+
+    def __init__(self, file, offset, length):
+        self.file, self.remaining = file, length
+        file.seek(offset)
+
+    def read(self, size):
+        data = self.file.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+
+def chunk_sums(path, chunk_size):
+    sums = []
+    with open(path, 'rb') as file:
+        while data := file.read(chunk_size):
+            sums.append(hashlib.sha256(data).hexdigest())
+    return sums
+
+
+def upload(document, path, size, chunk_size, sums):
+    from api import uploads
+
+    session = uploads.start(document, os.path.basename(path), size)
+    peak = 0
+    start = time.perf_counter()
+    with open(path, 'rb') as file:
+        for number, checksum in enumerate(sums):
+            offset = number * chunk_size
+            length = min(chunk_size, size - offset)
+            tracemalloc.start()
+            uploads.write_chunk(session, offset, Window(file, offset, length), length, checksum)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    write_time = time.perf_counter() - start
+    start = time.perf_counter()
+    document_file = uploads.complete(session)
+    return write_time, time.perf_counter() - start, peak, document_file
+
+
+def run(megabytes, chunk_mb, directory):
+    from api.models import Document, FileBlob, Project, User
+
+    size = megabytes * 2 ** 20
+    chunk_size = chunk_mb * 2 ** 20
+    path = os.path.join(directory, 'attachment.bin')
+    with open(path, 'wb') as file:
+        for _ in range(megabytes):
+            file.write(os.urandom(2 ** 20))
+    sums = chunk_sums(path, chunk_size)
+
+    user = User.objects.create_user('bench@example.com', 'bench', 'bench-pass-123')
+    project = Project.objects.create(owner=user, title='Uploads')
+    document = Document.objects.create(project=project, content='')
+    rows = []
+    for label in ['first upload', 'same file again']:
+        write_time, complete_time, peak, _ = upload(document, path, size, chunk_size, sums)
+        rows.append((label, (
+            f'chunks {write_time:.1f} s ({megabytes / write_time:,.0f} MB/s), '
+            f'peak allocation per chunk {peak / 2 ** 20:.1f} MB, complete {complete_time:.1f} s'
+        )))
+    blob = FileBlob.objects.get()
+    blobs_dir = os.path.join(directory, 'media', 'blobs')
+    stored = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(blobs_dir) for name in names)
+    rows.append(('stored', f'{blob.ref_count} references, {stored / 2 ** 20:,.0f} MB on disk'))
+    report(f'{megabytes:,} MB file in {chunk_mb} MB chunks', rows)
+
+
+def main():
+    from django.test import override_settings
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megabytes', type=int, default=1024)
+    parser.add_argument('--chunk-mb', type=int, default=64)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        with override_settings(MEDIA_ROOT=os.path.join(directory, 'media')), test_database():
+            run(args.megabytes, args.chunk_mb, directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Shared setup for the benchmark scripts.
+
+Run benchmarks from the directory containing manage.py, e.g.
+    python -m benchmarks.bench_history
+"""
+import os
+import random
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (BASE_DIR, os.path.dirname(BASE_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+# The same generators as `manage.py seed_data`, so benchmarks and seeded data match.
+from api.management.commands.seed_data import edit_text, make_text as seed_text  # noqa: E402
+
+
+@contextmanager
+def test_database(path=None):
+    """
+    Run the block against a throwaway test database. SQLite test databases
+    live in memory unless `path` names a file, which concurrent writers need.
+    """
+    from django.db import connection
+    from django.test.utils import (
+        setup_databases, setup_test_environment, teardown_databases,
+        teardown_test_environment,
+    )
+    if path:
+        connection.settings_dict['TEST']['NAME'] = path
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def timed(func, *args, repeat=5, **kwargs):
+    """Call func `repeat` times and return (median seconds, last result)."""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+def make_text(size, seed=0):
+    """Generate roughly `size` characters of markdown-ish prose."""
+    return seed_text(random.Random(seed), size)
+
+
+def mutate(text, rng, edits=1):
+    """Apply a few small autosave-sized edits to `text`."""
+    return edit_text(rng, text, edits)
+
+
+def report(title, rows):
+    print(title)
+    width = max(len(label) for label, _ in rows)
+    for label, value in rows:
+        print(f'  {label.ljust(width)}  {value}')
+    print()
@@ -22,6 +22,7 @@ ALLOWED_HOSTS = ['*']
 
 # Application definition
 INSTALLED_APPS = [
+    'daphne',  # ASGI runserver, needed for WebSockets
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -33,6 +34,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework_simplejwt',
     'corsheaders',
+    'channels',
     
     # Local apps
     'api',
@@ -68,6 +70,54 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'core.wsgi.application'
+ASGI_APPLICATION = 'core.asgi.application'
+
+# Channel layer for collaborative editing. Without REDIS_URL the in-memory
+# layer is used, which only works within a single process.
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL], 'capacity': 1000},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {'capacity': 1000},
+        },
+    }
+
+# Shared cache; falls back to per-process memory without REDIS_URL.
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# Seconds a user's dashboard analytics stay cached; writes invalidate sooner.
+ANALYTICS_CACHE_TIMEOUT = 300
+
+# Writing-activity rollups: a pause longer than ACTIVITY_IDLE_GAP seconds
+# between saves ends a writing session; each session start counts as
+# ACTIVITY_SAVE_CREDIT seconds of activity.
+ACTIVITY_IDLE_GAP = 300
+ACTIVITY_SAVE_CREDIT = 60
+
+# Collaborative editing sessions keep this many recent operations for
+# transforming late edits, and save to the database every N seconds.
+COLLAB_LOG_SIZE = 500
+COLLAB_FLUSH_INTERVAL = 5
 
 # Database
 DATABASES = {
@@ -111,8 +161,105 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
+# Version history: every Nth snapshot of a document is stored in full, the
+# rows in between only keep a delta against their predecessor.
+HISTORY_KEYFRAME_INTERVAL = 20
+
+# Autosave coalescing: a save does not get its own snapshot while saves keep
+# arriving within HISTORY_COALESCE_WINDOW seconds of each other (for at most
+# HISTORY_COALESCE_MAX_SPAN seconds per snapshot), or when it changes fewer
+# than HISTORY_COALESCE_MIN_CHANGE characters. Set a value to 0 to disable.
+HISTORY_COALESCE_WINDOW = 120
+HISTORY_COALESCE_MAX_SPAN = 600
+HISTORY_COALESCE_MIN_CHANGE = 20
+
+# Progressive thinning applied by `manage.py compact_history`:
+# (max age in seconds, keep one snapshot per bucket of this many seconds).
+HISTORY_RETENTION = [
+    (60 * 60, 60),              # last hour: one per minute
+    (24 * 60 * 60, 60 * 60),    # last day: one per hour
+    (None, 24 * 60 * 60),       # older: one per day
+]
+
+# Version comparison: diffs are cached in-process by the pair of content
+# hashes; past DIFF_MAX_EDITS changed lines the diff gives up early and
+# reports the differing region as one replaced block.
+DIFF_CACHE_SIZE = 256
+DIFF_MAX_EDITS = 1000
+
+# Highlighted snippets per /api/search/ result, and their length in words.
+SEARCH_SNIPPETS = 3
+SEARCH_SNIPPET_WORDS = 16
+
+# Rendered HTML of Markdown blocks (see api/preview.py), cached
+# in-process up to PREVIEW_CACHE_BYTES in total.
+PREVIEW_CACHE_BYTES = 32 * 1024 * 1024
+
+# Document export: rendered (and compressed) bodies are cached in-process
+# by content hash up to EXPORT_CACHE_BYTES in total, and streamed in
+# EXPORT_CHUNK_SIZE pieces. Bodies smaller than EXPORT_GZIP_MIN_SIZE are
+# never compressed.
+EXPORT_CACHE_BYTES = 64 * 1024 * 1024
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_GZIP_MIN_SIZE = 1024
+
+# Export jobs (pdf, html, md): files rendered under EXPORT_ROOT by a pool of
+# EXPORT_WORKERS processes (0 renders inline). A job left queued for
+# EXPORT_JOB_TIMEOUT seconds by a process that went away is restarted.
+EXPORT_ROOT = BASE_DIR / 'exports'
+EXPORT_WORKERS = 2
+EXPORT_JOB_TIMEOUT = 600
+
+# Rows fetched per batch while streaming /api/export/archive/.
+EXPORT_ARCHIVE_BATCH = 20
+
+# Resumable uploads (see api/uploads.py): the largest file and chunk
+# accepted, how long a chunk write may hold its session, and how long an
+# idle session is kept before purge_uploads removes it.
+UPLOAD_MAX_SIZE = 20 * 1024 ** 3
+UPLOAD_CHUNK_MAX_SIZE = 64 * 1024 ** 2
+UPLOAD_CHUNK_TIMEOUT = 600
+UPLOAD_SESSION_TTL = 7 * 24 * 3600
+
+# Attachment downloads: None sends files from Django (with os.sendfile()
+# under WSGI servers that support it); 'x-accel-redirect' (nginx) or
+# 'x-sendfile' (Apache, lighttpd) hand them to the proxy in front.
+# ATTACHMENT_ACCEL_PREFIX is the nginx internal location for MEDIA_ROOT.
+ATTACHMENT_SENDFILE = None
+ATTACHMENT_ACCEL_PREFIX = '/protected-media/'
+
+# Text extraction from attachments, for search and statistics (see
+# api/attachment_index.py): a pool of ATTACHMENT_TEXT_WORKERS processes (0
+# extracts inline), the most text kept per file, and how long an
+# extraction may stay queued before a resubmit starts it again.
+ATTACHMENT_TEXT_WORKERS = 2
+ATTACHMENT_TEXT_MAX_CHARS = 1_000_000
+ATTACHMENT_TEXT_TIMEOUT = 600
+
+# AI assistance (see api/ai_services.py): the provider class and its
+# options, the in-process result cache, micro-batching of concurrent
+# requests, and the limits that keep AI calls from tying up the workers:
+# provider calls at once, requests waiting for a result, and seconds a
+# batch may wait for a call slot. Content is capped at AI_MAX_CONTENT_CHARS.
+AI_PROVIDER = 'api.ai_services.LocalProvider'
+AI_PROVIDER_OPTIONS = {}
+AI_CACHE_SIZE = 1024
+AI_CACHE_TTL = 3600
+AI_BATCH_SIZE = 16
+AI_BATCH_WINDOW = 0.01
+AI_MAX_CONCURRENCY = 2
+AI_MAX_PENDING = 32
+AI_QUEUE_TIMEOUT = 5.0
+AI_MAX_CONTENT_CHARS = 1_000_000
+# Tokenized paragraphs kept for the built-in TextRank summarizer (api/summarizer.py).
+AI_SUMMARY_CACHE_BYTES = 32 * 1024 * 1024
+
+# Largest number of edit ops accepted by one incremental document save.
+DOCUMENT_PATCH_MAX_OPS = 1000
+
 # CORS
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
+CORS_EXPOSE_HEADERS = ['ETag']
 
 # Internationalization
 LANGUAGE_CODE = 'en-us'
@@ -125,6 +272,9 @@ STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 